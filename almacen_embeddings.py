@@ -0,0 +1,150 @@
+"""
+Almacén binario de embeddings CLIP compartido por generar_embeddings.py y el bot.
+
+En el directorio de datos quedan dos piezas:
+- embeddings-<hash>.npy   → matriz (N, 512) float32 ya normalizada
+- embeddings_meta.json    → versión de esquema, hash, archivo .npy, modelos y filas por modelo
+
+El bot abre la matriz con np.load(mmap_mode="r"), así varios workers de uvicorn
+comparten la misma copia en la caché de páginas del sistema operativo.
+El sidecar se reemplaza de último (os.replace), de modo que un lector siempre
+ve un par .npy/meta consistente. Al guardar se conserva también la matriz de la
+versión anterior: un worker que leyó el meta viejo justo antes del cambio todavía
+la puede abrir. Se borra en el guardado siguiente.
+"""
+import os
+import json
+import glob
+import hashlib
+import logging
+
+import numpy as np
+
+ESQUEMA_VERSION = 1
+DIMENSION = 512
+META_NOMBRE = "embeddings_meta.json"
+
+
+def matriz_desde_dict(base: dict):
+    """
+    Valida {modelo: [[512 floats], …]} (o un único vector por modelo) y devuelve
+    (matriz float32 normalizada, ids por fila, modelos, corruptos).
+    Las filas de cada modelo quedan contiguas.
+    """
+    filas, ids, modelos, corruptos = [], [], [], []
+
+    for modelo, vecs in base.items():
+        if not isinstance(vecs, list):
+            corruptos.append((modelo, "no_lista"))
+            continue
+        if len(vecs) == DIMENSION and all(isinstance(x, (int, float)) for x in vecs):
+            vecs = [vecs]
+
+        limpios = [v for v in vecs if isinstance(v, list) and len(v) == DIMENSION]
+        if not limpios:
+            corruptos.append((modelo, "sin_vectores_validos"))
+            continue
+
+        bloque = np.asarray(limpios, dtype=np.float32)
+        normas = np.linalg.norm(bloque, axis=1)
+        bloque = bloque[normas > 0] / normas[normas > 0, None]
+        if not len(bloque):
+            corruptos.append((modelo, "norma_cero"))
+            continue
+
+        filas.append(bloque)
+        ids.extend([len(modelos)] * len(bloque))
+        modelos.append(modelo)
+
+    matriz = np.vstack(filas) if filas else np.zeros((0, DIMENSION), dtype=np.float32)
+    return matriz, np.asarray(ids, dtype=np.int32), modelos, corruptos
+
+
+def calcular_hash(matriz: np.ndarray, modelos: list[str], conteos: list[int]) -> str:
+    h = hashlib.sha256()
+    h.update(np.ascontiguousarray(matriz, dtype=np.float32).tobytes())
+    h.update(json.dumps([modelos, conteos], ensure_ascii=False).encode("utf-8"))
+    return h.hexdigest()
+
+
+def guardar_almacen(embeddings: dict, directorio: str) -> dict:
+    """Escribe la matriz .npy + sidecar de forma atómica. Devuelve el meta escrito."""
+    matriz, ids, modelos, corruptos = matriz_desde_dict(embeddings)
+    if corruptos:
+        logging.warning(f"[ALMACÉN] ⚠️ Modelos descartados: {corruptos[:5]} (total {len(corruptos)})")
+
+    conteos = np.bincount(ids, minlength=len(modelos)).tolist() if len(modelos) else []
+    firma = calcular_hash(matriz, modelos, conteos)
+    archivo_npy = f"embeddings-{firma[:16]}.npy"
+
+    os.makedirs(directorio, exist_ok=True)
+    ruta_npy = os.path.join(directorio, archivo_npy)
+    if not os.path.exists(ruta_npy):
+        tmp = f"{ruta_npy}.{os.getpid()}.tmp"
+        with open(tmp, "wb") as f:
+            np.save(f, matriz)
+        os.replace(tmp, ruta_npy)
+
+    meta = {
+        "esquema": ESQUEMA_VERSION,
+        "hash": firma,
+        "archivo": archivo_npy,
+        "dimension": DIMENSION,
+        "filas": int(matriz.shape[0]),
+        "modelos": modelos,
+        "conteos": conteos,
+    }
+    anterior = leer_meta(directorio)
+    conservar = {archivo_npy, anterior["archivo"]} if anterior else {archivo_npy}
+    ruta_meta = os.path.join(directorio, META_NOMBRE)
+    tmp = f"{ruta_meta}.{os.getpid()}.tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(meta, f, ensure_ascii=False)
+    os.replace(tmp, ruta_meta)
+
+    # 🧹 Matrices de hace más de una versión (un mmap abierto sigue siendo válido en Linux)
+    for viejo in glob.glob(os.path.join(directorio, "embeddings-*.npy")):
+        if os.path.basename(viejo) not in conservar:
+            try:
+                os.remove(viejo)
+            except OSError:
+                pass
+
+    logging.info(f"[ALMACÉN] ✅ {meta['filas']} vectores de {len(modelos)} modelos → {ruta_npy}")
+    return meta
+
+
+def leer_meta(directorio: str) -> dict | None:
+    ruta_meta = os.path.join(directorio, META_NOMBRE)
+    if not os.path.exists(ruta_meta):
+        return None
+    with open(ruta_meta, "r", encoding="utf-8") as f:
+        meta = json.load(f)
+    if meta.get("esquema") != ESQUEMA_VERSION:
+        logging.warning(f"[ALMACÉN] Esquema {meta.get('esquema')} ≠ {ESQUEMA_VERSION}; se ignora")
+        return None
+    return meta
+
+
+def almacen_vigente(directorio: str, ruta_json: str) -> bool:
+    """True si hay almacén binario y no es más viejo que embeddings.json."""
+    meta = leer_meta(directorio)
+    if meta is None or not os.path.exists(os.path.join(directorio, meta["archivo"])):
+        return False
+    if not os.path.exists(ruta_json):
+        return True
+    return os.path.getmtime(os.path.join(directorio, META_NOMBRE)) >= os.path.getmtime(ruta_json)
+
+
+def cargar_almacen(directorio: str):
+    """Abre la matriz mapeada en memoria. Devuelve (matriz, ids, modelos, meta)."""
+    meta = leer_meta(directorio)
+    if meta is None:
+        raise FileNotFoundError(f"No hay almacén de embeddings en {directorio}")
+
+    matriz = np.load(os.path.join(directorio, meta["archivo"]), mmap_mode="r")
+    if matriz.dtype != np.float32 or matriz.shape != (meta["filas"], meta["dimension"]):
+        raise ValueError(f"Almacén inconsistente: {matriz.dtype} {matriz.shape} vs meta {meta['filas']}")
+
+    ids = np.repeat(np.arange(len(meta["modelos"]), dtype=np.int32), meta["conteos"])
+    return matriz, ids, meta["modelos"], meta
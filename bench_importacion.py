@@ -0,0 +1,88 @@
+"""
+Mide cuánto cuesta `import lector` con `python -X importtime` y falla si se pasa del presupuesto.
+
+Uso:
+    python bench_importacion.py                  # presupuesto por defecto (IMPORT_PRESUPUESTO_MS o 1500 ms)
+    python bench_importacion.py --presupuesto 800 --top 15
+
+Sale con código 1 si el import total supera el presupuesto o si alguno de los módulos pesados
+(torch, transformers, Google Cloud, gspread, telegram, openai…) se importa en tiempo de carga.
+"""
+import os
+import re
+import sys
+import argparse
+import subprocess
+
+PRESUPUESTO_MS = float(os.getenv("IMPORT_PRESUPUESTO_MS", "1500"))
+
+# Estos solo deben cargarse en el primer uso (ver _ModuloDiferido en lector.py)
+PROHIBIDOS = (
+    "torch",
+    "torchvision",
+    "transformers",
+    "google.cloud.vision",
+    "gspread",
+    "oauth2client",
+    "telegram",
+    "openai",
+    "googleapiclient.discovery",
+)
+
+# import time: self [us] | cumulative | imported package
+_LINEA = re.compile(r"^import time:\s+(\d+)\s+\|\s+(\d+)\s+\|(\s*)(\S+)")
+
+
+def medir(modulo: str = "lector") -> list[tuple[int, int, int, str]]:
+    """Importa `modulo` en un proceso limpio y devuelve [(self_us, acumulado_us, nivel, nombre)]."""
+    proc = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {modulo}"],
+        capture_output=True,
+        text=True,
+        cwd=os.path.dirname(os.path.abspath(__file__)),
+        env={**os.environ, "PYTHONDONTWRITEBYTECODE": "1"},
+    )
+    if proc.returncode != 0:
+        ultimas = "\n".join(l for l in proc.stderr.splitlines() if not l.startswith("import time:"))
+        raise RuntimeError(f"`import {modulo}` falló:\n{ultimas[-2000:]}")
+
+    filas = []
+    for linea in proc.stderr.splitlines():
+        m = _LINEA.match(linea)
+        if m:
+            filas.append((int(m.group(1)), int(m.group(2)), len(m.group(3)) // 2, m.group(4)))
+    return filas
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--modulo", default="lector")
+    parser.add_argument("--presupuesto", type=float, default=PRESUPUESTO_MS, help="milisegundos")
+    parser.add_argument("--top", type=int, default=10)
+    args = parser.parse_args()
+
+    filas = medir(args.modulo)
+    total = next((acum for _, acum, _, nombre in filas if nombre == args.modulo), 0) / 1000
+    cargados = {nombre for *_, nombre in filas}
+    culpables = sorted(p for p in PROHIBIDOS if p in cargados)
+
+    print(f"[IMPORT] import {args.modulo}: {total:.0f} ms (presupuesto {args.presupuesto:.0f} ms)")
+    print("[IMPORT] Paquetes de primer nivel más caros:")
+    raiz = [f for f in filas if f[2] == 1]
+    for _, acum, _, nombre in sorted(raiz, key=lambda f: f[1], reverse=True)[: args.top]:
+        print(f"   {acum / 1000:8.1f} ms  {nombre}")
+
+    fallo = False
+    if culpables:
+        print(f"[IMPORT] ❌ Módulos pesados importados al cargar: {', '.join(culpables)}")
+        fallo = True
+    if total > args.presupuesto:
+        print(f"[IMPORT] ❌ Se pasó del presupuesto por {total - args.presupuesto:.0f} ms")
+        fallo = True
+    if not fallo:
+        print("[IMPORT] ✅ Dentro del presupuesto")
+    return 1 if fallo else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,131 @@
+"""
+Compara el motor de intenciones (una pasada de regex) con la cascada de
+`any(p in texto for p in (...))` que usaban procesar_wa y responder.
+
+Uso:
+    python bench_intenciones.py                         # corpus de ejemplo incluido
+    python bench_intenciones.py --corpus mensajes.jsonl # un mensaje por línea (texto plano o JSON con "body")
+    python bench_intenciones.py --repeticiones 2000
+
+Para cada mensaje verifica que ambos den las mismas intenciones y la misma
+principal, y mide el tiempo por mensaje de cada uno. El motor se mide sin su
+caché (_detectar), para no comparar contra un diccionario.
+"""
+import sys
+import json
+import time
+import argparse
+
+from intenciones import INTENCIONES, MotorIntenciones
+
+CORPUS_EJEMPLO = (
+    "hola buenas tardes",
+    "Buenas, cuanto demora el envio a medellin?",
+    "tienen pago contra entrega?",
+    "cuanto cuesta el envio a cali",
+    "el envio es gratis?",
+    "soy de bucaramanga, hacen envíos?",
+    "estoy en bucaramanga cuanto tarda",
+    "que metodos de pago manejan, aceptan nequi?",
+    "son originales o replica",
+    "de que calidad son",
+    "si compro 2 pares me hacen descuento",
+    "manejan precios para mayoristas",
+    "las tallas son normales o grandes",
+    "cual es la talla mas grande",
+    "donde estan ubicados",
+    "me gustan los negros en talla 40",
+    "si dale",
+    "quiero esos",
+    "cuanto valen",
+    "kuanto bale los blancos",
+    "no confio, ya me robaron una vez",
+    "mandame un audio que no se leer",
+    "ok listo",
+    "no gracias, cancelar",
+    "42",
+    "Juan Pérez, Cra 27 # 45-10, Floridablanca",
+    "ver catalogo",
+    "tienen garantia de fabrica?",
+    "ese mismo en blanco",
+    "quiero comprar unos tenis para mi hijo, talla 38, que precio tienen",
+)
+
+
+def leer_corpus(ruta: str | None) -> list[str]:
+    if not ruta:
+        return list(CORPUS_EJEMPLO)
+    mensajes = []
+    with open(ruta, "r", encoding="utf-8") as f:
+        for linea in f:
+            linea = linea.rstrip("\n")
+            if not linea:
+                continue
+            try:
+                dato = json.loads(linea)
+                linea = dato.get("body", "") if isinstance(dato, dict) else str(dato)
+            except json.JSONDecodeError:
+                pass
+            mensajes.append(linea)
+    return mensajes
+
+
+def cascada(texto: str) -> frozenset[str]:
+    """Lo que hacía el bot: una tupla tras otra con any(... in texto)."""
+    return frozenset(i.id for i in INTENCIONES if any(p in texto for p in i.frases))
+
+
+def cascada_principal(texto: str) -> str | None:
+    """La cascada de procesar_wa: se detiene en la primera que coincide."""
+    return next((i.id for i in INTENCIONES if any(p in texto for p in i.frases)), None)
+
+
+def cronometrar(fn, mensajes: list[str], repeticiones: int) -> float:
+    """Microsegundos por mensaje."""
+    inicio = time.perf_counter()
+    for _ in range(repeticiones):
+        for m in mensajes:
+            fn(m)
+    return (time.perf_counter() - inicio) / (repeticiones * len(mensajes)) * 1e6
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--corpus")
+    parser.add_argument("--repeticiones", type=int, default=500)
+    args = parser.parse_args()
+
+    inicio = time.perf_counter()
+    motor = MotorIntenciones(INTENCIONES)
+    compilacion_ms = (time.perf_counter() - inicio) * 1000
+
+    mensajes = [m.lower() for m in leer_corpus(args.corpus)]
+    if not mensajes:
+        print("[BENCH] ❌ Corpus vacío")
+        return 1
+
+    distintos = 0
+    for m in mensajes:
+        if motor._detectar(m) != cascada(m) or motor.principal(m) != cascada_principal(m):
+            distintos += 1
+            print(f"[BENCH] ❌ Difieren en {m!r}: motor={sorted(motor._detectar(m))} cascada={sorted(cascada(m))}")
+
+    frases = sum(len(i.frases) for i in INTENCIONES)
+    t_cascada = cronometrar(cascada, mensajes, args.repeticiones)
+    t_primera = cronometrar(cascada_principal, mensajes, args.repeticiones)
+    t_motor = cronometrar(motor._detectar, mensajes, args.repeticiones)
+
+    print(f"[BENCH] {len(mensajes)} mensajes, {len(INTENCIONES)} intenciones, {frases} frases "
+          f"(compilación {compilacion_ms:.1f} ms)")
+    print(f"   cascada completa     {t_cascada:8.2f} µs/mensaje")
+    print(f"   cascada hasta 1ª     {t_primera:8.2f} µs/mensaje")
+    print(f"   motor (una pasada)   {t_motor:8.2f} µs/mensaje  ({t_cascada / t_motor:.1f}x vs completa)")
+    if distintos:
+        print(f"[BENCH] ❌ {distintos} mensajes con resultado distinto")
+        return 1
+    print("[BENCH] ✅ Mismo resultado en todo el corpus")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
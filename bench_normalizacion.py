@@ -0,0 +1,132 @@
+"""
+Compara normalizacion.normalize (con caché) contra la normalización que hacía
+lector.py en cada llamada (NFKD + quitar marcas combinantes, sin caché).
+
+Uso:
+    python bench_normalizacion.py
+    python bench_normalizacion.py --inventario inventario.json --mensajes mensajes.jsonl
+
+La carga simula un pedido: cada mensaje normaliza el texto y recorre el
+inventario normalizando marca/modelo/color/talla/stock de cada fila, que es lo
+que hacen las búsquedas del bot. Sin --inventario se usa uno sintético; el
+snapshot que guarda el bot (/var/data/inventario.json) sirve tal cual.
+"""
+import sys
+import json
+import time
+import random
+import argparse
+import unicodedata
+
+import normalizacion
+from normalizacion import normalize
+
+CAMPOS = ("marca", "modelo", "color", "talla", "stock")
+
+
+def normalize_anterior(text) -> str:
+    """La versión de lector.py antes de normalizacion.py (la segunda definición, que era la vigente)."""
+    s = "" if text is None else str(text)
+    t = unicodedata.normalize('NFKD', s.strip().lower())
+    return "".join(ch for ch in t if not unicodedata.combining(ch))
+
+
+def inventario_sintetico(filas: int = 400) -> list[dict]:
+    random.seed(7)
+    marcas = ["DS", "Nike Air", "Adidas", "Pumá", "New Balance"]
+    colores = ["Negro", "Blanco", "Azul Cielo", "Café", "Neón", "Limón", "Rojo/Negro", "Fucsia"]
+    return [
+        {
+            "marca": random.choice(marcas),
+            "modelo": f"{random.randint(270, 320)}",
+            "color": random.choice(colores),
+            "talla": random.choice(["38", "39", "40", "41", "42", 43, 44.5]),
+            "stock": random.choice(["Sí", "si", "No"]),
+        }
+        for _ in range(filas)
+    ]
+
+
+MENSAJES_EJEMPLO = (
+    "Hola, ¿tienen los 305 en color café talla 42?",
+    "Quiero los Nike Air negros",
+    "cuánto valen los DS azul cielo",
+    "¿Hacen envíos a Medellín?",
+    "TALLA 40 EN NEÓN",
+)
+
+
+def leer_mensajes(ruta: str | None) -> list[str]:
+    if not ruta:
+        return list(MENSAJES_EJEMPLO)
+    mensajes = []
+    with open(ruta, "r", encoding="utf-8") as f:
+        for linea in f:
+            linea = linea.strip()
+            if not linea:
+                continue
+            try:
+                dato = json.loads(linea)
+                linea = dato.get("body", "") if isinstance(dato, dict) else str(dato)
+            except json.JSONDecodeError:
+                pass
+            mensajes.append(linea)
+    return mensajes
+
+
+def carga(fn, inventario: list[dict], mensajes: list[str]) -> int:
+    coincidencias = 0
+    for mensaje in mensajes:
+        texto = fn(mensaje)
+        for item in inventario:
+            if any(fn(item.get(c, "")) in texto for c in CAMPOS):
+                coincidencias += 1
+    return coincidencias
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--inventario")
+    parser.add_argument("--mensajes")
+    parser.add_argument("--repeticiones", type=int, default=20)
+    args = parser.parse_args()
+
+    if args.inventario:
+        with open(args.inventario, "r", encoding="utf-8") as f:
+            inventario = json.load(f)
+        if isinstance(inventario, dict):
+            inventario = inventario.get("inventario") or inventario.get("items") or []
+    else:
+        inventario = inventario_sintetico()
+    mensajes = leer_mensajes(args.mensajes)
+
+    valores = {m for m in mensajes} | {item.get(c, "") for item in inventario for c in CAMPOS}
+    distintos = [v for v in valores if normalize(v) != normalize_anterior(v)]
+    if distintos:
+        print(f"[BENCH] ❌ {len(distintos)} valores normalizan distinto, p. ej. {distintos[:3]!r}")
+        return 1
+
+    llamadas = args.repeticiones * len(mensajes) * (1 + len(inventario) * len(CAMPOS))
+    resultados = {}
+    for nombre, fn in (("anterior (sin caché)", normalize_anterior), ("normalizacion.normalize", normalize)):
+        inicio = time.perf_counter()
+        for _ in range(args.repeticiones):
+            resultado = carga(fn, inventario, mensajes)
+        resultados[nombre] = (time.perf_counter() - inicio, resultado)
+
+    print(f"[BENCH] {len(inventario)} filas × {len(mensajes)} mensajes × {args.repeticiones} "
+          f"(≈{llamadas:,} normalizaciones, {len(valores)} cadenas distintas)")
+    base = resultados["anterior (sin caché)"][0]
+    for nombre, (segundos, _) in resultados.items():
+        print(f"   {nombre:<26} {segundos * 1000:9.1f} ms  ({base / segundos:.1f}x)")
+    print(f"   caché: {normalizacion.estado_cache()['normalize']}")
+
+    if len({r for _, r in resultados.values()}) != 1:
+        print("[BENCH] ❌ Las dos versiones dieron resultados distintos")
+        return 1
+    print("[BENCH] ✅ Mismo resultado")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
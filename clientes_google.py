@@ -0,0 +1,164 @@
+"""
+Registro único de clientes de Google (Drive, Sheets, Vision) para el bot.
+
+Antes cada pedido volvía a leer GOOGLE_CREDS_JSON, firmaba un token nuevo y
+abría conexiones TLS nuevas. Aquí:
+- las credenciales se parsean una vez y se comparten por conjunto de scopes;
+- el documento de discovery de Drive se lee una vez (build_from_document);
+- Drive usa un servicio por hilo (httplib2 no es seguro entre hilos), así cada
+  hilo del pool de I/O reutiliza su conexión keep-alive;
+- gspread (requests) y Vision (gRPC) son seguros entre hilos: una sola instancia,
+  con el pool de conexiones HTTP ampliado para gspread;
+- refrescar_tokens() renueva los tokens antes de que venzan, para que ninguna
+  petición de un cliente pague el refresh.
+
+Las librerías de Google se importan en el primer uso (ver bench_importacion.py).
+"""
+import os
+import json
+import logging
+import threading
+from datetime import datetime, timedelta, timezone
+
+SCOPES_DRIVE  = ("https://www.googleapis.com/auth/drive",)
+SCOPES_SHEETS = ("https://www.googleapis.com/auth/spreadsheets", "https://www.googleapis.com/auth/drive")
+SCOPES_VISION = ("https://www.googleapis.com/auth/cloud-platform",)
+
+POOL_CONEXIONES     = int(os.environ.get("GOOGLE_POOL_CONEXIONES", 16))
+MARGEN_REFRESCO_SEG = int(os.environ.get("GOOGLE_MARGEN_REFRESCO_SEG", 600))   # refresca si vence en < 10 min
+
+
+class ClientesGoogle:
+    def __init__(self, variable_creds: str = "GOOGLE_CREDS_JSON"):
+        self.variable_creds = variable_creds
+        self._lock = threading.RLock()
+        self._local = threading.local()
+        self._info = None
+        self._credenciales: dict[tuple, object] = {}
+        self._discovery: dict[tuple, str] = {}
+        self._sheets = None
+        self._libros: dict[str, object] = {}
+        self._hojas: dict[tuple, object] = {}
+        self._vision = None
+        self._sesion_tokens = None
+
+    # ── Credenciales ─────────────────────────────────────────────────
+    def credenciales(self, scopes: tuple) -> object:
+        """Credenciales de la cuenta de servicio para `scopes`, compartidas por todos los clientes."""
+        creds = self._credenciales.get(scopes)
+        if creds is not None:
+            return creds
+        with self._lock:
+            if scopes not in self._credenciales:
+                from google.oauth2 import service_account
+
+                if self._info is None:
+                    crudo = os.environ.get(self.variable_creds)
+                    if not crudo:
+                        raise RuntimeError(f"{self.variable_creds} no está definido en las variables de entorno")
+                    self._info = json.loads(crudo)
+                self._credenciales[scopes] = service_account.Credentials.from_service_account_info(
+                    self._info, scopes=list(scopes)
+                )
+            return self._credenciales[scopes]
+
+    def _request_tokens(self):
+        """Transporte para refrescar tokens, sobre una sesión requests reutilizable."""
+        import google.auth.transport.requests
+
+        if self._sesion_tokens is None:
+            import requests
+
+            self._sesion_tokens = requests.Session()
+        return google.auth.transport.requests.Request(session=self._sesion_tokens)
+
+    def refrescar_tokens(self, margen_seg: int = MARGEN_REFRESCO_SEG) -> int:
+        """Renueva los tokens que vencen en menos de `margen_seg`. Devuelve cuántos renovó."""
+        limite = datetime.now(timezone.utc).replace(tzinfo=None) + timedelta(seconds=margen_seg)
+        renovados = 0
+        with self._lock:
+            for scopes, creds in list(self._credenciales.items()):
+                if creds.valid and creds.expiry is not None and creds.expiry > limite:
+                    continue
+                try:
+                    creds.refresh(self._request_tokens())
+                    renovados += 1
+                except Exception as e:
+                    logging.warning(f"[GOOGLE] ⚠️ No pude refrescar el token {scopes[0]}: {e}")
+        if renovados:
+            logging.info(f"[GOOGLE] 🔑 {renovados} token(s) renovados antes de vencer")
+        return renovados
+
+    # ── Drive ────────────────────────────────────────────────────────
+    def _documento(self, api: str, version: str) -> str | None:
+        clave = (api, version)
+        if clave not in self._discovery:
+            try:
+                from googleapiclient.discovery_cache import get_static_doc
+
+                self._discovery[clave] = get_static_doc(api, version)
+            except ImportError:
+                self._discovery[clave] = None
+        return self._discovery[clave]
+
+    def drive(self):
+        """Servicio de Drive del hilo actual; se construye una vez por hilo y reutiliza su conexión."""
+        servicio = getattr(self._local, "drive", None)
+        if servicio is None:
+            import httplib2
+            from google_auth_httplib2 import AuthorizedHttp
+            from googleapiclient.discovery import build, build_from_document
+
+            http = AuthorizedHttp(self.credenciales(SCOPES_DRIVE), http=httplib2.Http(timeout=60))
+            documento = self._documento("drive", "v3")
+            if documento:
+                servicio = build_from_document(documento, http=http)
+            else:
+                servicio = build("drive", "v3", http=http, cache_discovery=False)
+            self._local.drive = servicio
+        return servicio
+
+    # ── Sheets ───────────────────────────────────────────────────────
+    def sheets(self):
+        """Cliente gspread único, con el pool de conexiones de su sesión ampliado."""
+        if self._sheets is None:
+            with self._lock:
+                if self._sheets is None:
+                    import gspread
+                    from requests.adapters import HTTPAdapter
+
+                    cliente = gspread.authorize(self.credenciales(SCOPES_SHEETS))
+                    sesion = getattr(getattr(cliente, "http_client", cliente), "session", None)
+                    if sesion is not None:
+                        adaptador = HTTPAdapter(pool_connections=POOL_CONEXIONES, pool_maxsize=POOL_CONEXIONES)
+                        sesion.mount("https://", adaptador)
+                    self._sheets = cliente
+        return self._sheets
+
+    def hoja(self, libro: str, nombre: str):
+        """Worksheet `nombre` del libro `libro`, abiertos una sola vez (open() cuesta una búsqueda en Drive)."""
+        clave = (libro, nombre)
+        hoja = self._hojas.get(clave)
+        if hoja is None:
+            with self._lock:
+                if libro not in self._libros:
+                    self._libros[libro] = self.sheets().open(libro)
+                hoja = self._hojas[clave] = self._libros[libro].worksheet(nombre)
+        return hoja
+
+    def olvidar_hoja(self, libro: str, nombre: str):
+        """Descarta la worksheet cacheada (p. ej. si la renombraron o borraron)."""
+        with self._lock:
+            self._hojas.pop((libro, nombre), None)
+            self._libros.pop(libro, None)
+
+    # ── Vision ───────────────────────────────────────────────────────
+    def vision(self):
+        """ImageAnnotatorClient único; su canal gRPC es seguro entre hilos."""
+        if self._vision is None:
+            with self._lock:
+                if self._vision is None:
+                    from google.cloud import vision
+
+                    self._vision = vision.ImageAnnotatorClient(credentials=self.credenciales(SCOPES_VISION))
+        return self._vision
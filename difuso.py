@@ -0,0 +1,71 @@
+"""
+Coincidencia difusa contra vocabularios fijos, con las mismas decisiones que
+difflib.get_close_matches(texto, vocabulario, n=1, cutoff) pero sin construir
+un SequenceMatcher por frase.
+
+difflib acepta una frase si ratio() = 2·M/T ≥ cutoff (M = caracteres en los
+bloques comunes, T = suma de largos), y antes descarta con dos cotas:
+real_quick_ratio (solo largos) y quick_ratio (multiconjunto de caracteres).
+VocabularioDifuso precalcula ambas cosas por frase al construirse:
+- las frases agrupadas por largo, así la cota de largos descarta grupos enteros;
+- el conteo de caracteres de cada frase, para la cota de quick_ratio.
+Solo las pocas frases que pasan las dos cotas llegan a ratio(), con un único
+SequenceMatcher que ya tiene indexado el texto consultado. El resultado
+(incluido el desempate por la frase mayor) es el de difflib.
+
+No se usa distancia de edición: cambiaría qué frases pasan el umbral.
+"""
+import functools
+from collections import Counter, defaultdict
+from difflib import SequenceMatcher
+from typing import Iterable
+
+
+def _ratio(coincidencias: int, total: int) -> float:
+    # Igual que difflib._calculate_ratio
+    return 2.0 * coincidencias / total if total else 1.0
+
+
+class VocabularioDifuso:
+    def __init__(self, frases: Iterable[str]):
+        self.frases = tuple(dict.fromkeys(frases))
+        self._conjunto = frozenset(self.frases)
+        self._por_largo: dict[int, list[tuple[str, Counter]]] = defaultdict(list)
+        for frase in self.frases:
+            self._por_largo[len(frase)].append((frase, Counter(frase)))
+        self.mejor = functools.lru_cache(maxsize=1024)(self._mejor)
+
+    def _mejor(self, texto: str, cutoff: float = 0.6) -> str | None:
+        """La frase más parecida a `texto` con ratio ≥ cutoff, o None (como get_close_matches(n=1))."""
+        if texto in self._conjunto:
+            return texto                                   # ratio 1.0: ninguna otra puede empatar
+        largo = len(texto)
+        conteo = None
+        matcher = None
+        mejor = None
+        for largo_frase, grupo in self._por_largo.items():
+            total = largo + largo_frase
+            if _ratio(min(largo, largo_frase), total) < cutoff:
+                continue                                   # real_quick_ratio
+            if conteo is None:
+                conteo = Counter(texto)
+                matcher = SequenceMatcher()
+                matcher.set_seq2(texto)
+            for frase, conteo_frase in grupo:
+                comunes = sum(min(n, conteo[ch]) for ch, n in conteo_frase.items())
+                if _ratio(comunes, total) < cutoff:
+                    continue                               # quick_ratio
+                matcher.set_seq1(frase)
+                puntaje = matcher.ratio()
+                if puntaje >= cutoff and (mejor is None or (puntaje, frase) > mejor):
+                    mejor = (puntaje, frase)
+        return mejor[1] if mejor else None
+
+    def parecido(self, texto: str, cutoff: float = 0.6) -> bool:
+        return self.mejor(texto, cutoff) is not None
+
+
+@functools.lru_cache(maxsize=256)
+def vocabulario(frases: tuple[str, ...]) -> VocabularioDifuso:
+    """Vocabulario indexado para una tupla de frases; se construye una vez por tupla distinta."""
+    return VocabularioDifuso(frases)
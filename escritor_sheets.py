@@ -0,0 +1,229 @@
+"""
+Escritura diferida (write-behind) a las hojas de Google Sheets.
+
+Registrar un pedido o un lead ya no llama a la API en el camino del mensaje:
+la fila se escribe en un diario local (JSONL con fsync) y queda en la cola de
+su hoja. vaciar(), llamado cada pocos segundos, junta lo pendiente de cada hoja:
+- filas nuevas         → un solo append_rows,
+- filas por clave (upsert, p. ej. LEADS por teléfono) → batch_update para las
+  que ya existen y append_rows para las nuevas. El número de fila de cada clave
+  se lee al comienzo de cada lote (un col_values(1) por lote, no por fila): la
+  hoja se edita a mano y las filas pueden moverse entre un lote y otro.
+
+Si la API responde 429/5xx (o cualquier error), esa hoja espera con backoff
+exponencial y las filas siguen en la cola; las demás hojas no se bloquean.
+
+Con varios workers de uvicorn el diario es uno solo y es la cola: cada proceso
+agrega sus filas bajo un flock de `<diario>.lock`, pero solo envía el que tiene
+el flock de `<diario>.envio` (si ese proceso muere, el próximo vaciar() de otro
+lo toma y sigue desde el diario). Tras cada lote se quitan del diario solo las
+filas enviadas, releyéndolo bajo el lock, así no se pierden las que otro worker
+agregó mientras tanto. La entrega es "al menos una vez": si el proceso muere
+entre la respuesta de la API y la reescritura del diario, un append puede
+repetirse (los upserts son idempotentes).
+"""
+import os
+import json
+import time
+import uuid
+import fcntl
+import random
+import logging
+import threading
+from collections import OrderedDict
+from contextlib import contextmanager
+from typing import Callable
+
+BACKOFF_BASE_SEG = 1.0
+BACKOFF_MAX_SEG = 64.0
+
+
+def _columna(n: int) -> str:
+    """1 → A, 10 → J, 27 → AA."""
+    letras = ""
+    while n:
+        n, resto = divmod(n - 1, 26)
+        letras = chr(65 + resto) + letras
+    return letras
+
+
+def _codigo_http(error: Exception) -> int | None:
+    respuesta = getattr(error, "response", None)
+    return getattr(respuesta, "status_code", None) or getattr(error, "code", None)
+
+
+class EscritorSheets:
+    def __init__(self, abrir_hoja: Callable, diario: str, olvidar_hoja: Callable | None = None, max_lote: int = 500):
+        self.abrir_hoja = abrir_hoja                   # nombre → worksheet de gspread
+        self.olvidar_hoja = olvidar_hoja or (lambda nombre: None)
+        self.diario = diario
+        self.max_lote = max_lote
+        self._lock = threading.Lock()
+        self._lock_vaciado = threading.Lock()
+        self._fd_envio: int | None = None                              # flock de `<diario>.envio`
+        self._espera: dict[str, tuple[int, float]] = {}                # hoja → (fallos seguidos, próximo intento)
+
+    # ── Diario ───────────────────────────────────────────────────────
+    @contextmanager
+    def _diario_bloqueado(self):
+        """Exclusión sobre el diario entre hilos de este proceso y entre workers."""
+        with self._lock:
+            os.makedirs(os.path.dirname(self.diario) or ".", exist_ok=True)
+            with open(f"{self.diario}.lock", "a") as lock:
+                fcntl.flock(lock, fcntl.LOCK_EX)                       # se suelta al cerrar el archivo
+                yield
+
+    def _leer_diario(self) -> "OrderedDict[str, dict]":
+        pendientes: "OrderedDict[str, dict]" = OrderedDict()          # id → entrada, en orden de llegada
+        try:
+            with open(self.diario, "r", encoding="utf-8") as f:
+                for linea in f:
+                    try:
+                        entrada = json.loads(linea)
+                    except json.JSONDecodeError:
+                        continue                               # última línea cortada por un crash
+                    pendientes[entrada["id"]] = entrada
+        except FileNotFoundError:
+            pass
+        return pendientes
+
+    def _reescribir_diario(self, pendientes: "OrderedDict[str, dict]"):
+        tmp = f"{self.diario}.tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            for entrada in pendientes.values():
+                f.write(json.dumps(entrada, ensure_ascii=False) + "\n")
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, self.diario)
+
+    def _quitar_del_diario(self, ids: set[str]):
+        with self._diario_bloqueado():
+            pendientes = self._leer_diario()
+            for id_ in ids:
+                pendientes.pop(id_, None)
+            self._reescribir_diario(pendientes)
+
+    def _encolar(self, entrada: dict):
+        with self._diario_bloqueado():
+            with open(self.diario, "a", encoding="utf-8") as f:
+                f.write(json.dumps(entrada, ensure_ascii=False) + "\n")
+                f.flush()
+                os.fsync(f.fileno())
+
+    def _es_emisor(self) -> bool:
+        """True si este proceso es el que envía (tiene o acaba de tomar el flock de `<diario>.envio`)."""
+        if self._fd_envio is not None:
+            return True
+        os.makedirs(os.path.dirname(self.diario) or ".", exist_ok=True)
+        fd = os.open(f"{self.diario}.envio", os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            os.close(fd)
+            return False
+        self._fd_envio = fd
+        with self._diario_bloqueado():
+            pendientes = len(self._leer_diario())
+        if pendientes:
+            logging.info(f"[SHEETS] ♻️ {pendientes} filas pendientes recuperadas del diario")
+        return True
+
+    def cerrar(self):
+        """Deja de enviar: otro worker toma el envío en su próximo vaciar()."""
+        with self._lock_vaciado:
+            if self._fd_envio is not None:
+                os.close(self._fd_envio)                       # cerrar el fd suelta el flock
+                self._fd_envio = None
+
+    # ── API pública ──────────────────────────────────────────────────
+    def agregar(self, hoja: str, fila: list):
+        """Encola una fila para append en `hoja`. Vuelve en cuanto quedó en el diario."""
+        self._encolar({"id": uuid.uuid4().hex, "hoja": hoja, "fila": fila})
+
+    def actualizar(self, hoja: str, clave: str, fila: list):
+        """Encola un upsert: reemplaza la fila cuya columna A es `clave`, o la agrega si no existe."""
+        self._encolar({"id": uuid.uuid4().hex, "hoja": hoja, "fila": fila, "clave": clave})
+
+    def pendientes(self) -> int:
+        """Filas en el diario, de todos los workers."""
+        with self._diario_bloqueado():
+            return len(self._leer_diario())
+
+    def estado(self) -> dict:
+        with self._diario_bloqueado():
+            por_hoja: dict[str, int] = {}
+            for entrada in self._leer_diario().values():
+                por_hoja[entrada["hoja"]] = por_hoja.get(entrada["hoja"], 0) + 1
+            esperando = {h: round(max(0.0, t - time.time()), 1) for h, (_, t) in self._espera.items()}
+        return {"pendientes": por_hoja, "backoff_seg": esperando, "emisor": self._fd_envio is not None}
+
+    # ── Envío ────────────────────────────────────────────────────────
+    def vaciar(self, forzar: bool = False) -> int:
+        """
+        Envía lo pendiente, un lote por hoja. Devuelve cuántas entradas salieron.
+        `forzar` ignora el backoff (apagado). En un worker que no es el emisor no hace nada.
+        """
+        with self._lock_vaciado:
+            if not self._es_emisor():
+                return 0
+            with self._diario_bloqueado():
+                por_hoja: "OrderedDict[str, list[dict]]" = OrderedDict()
+                for entrada in self._leer_diario().values():
+                    lote = por_hoja.setdefault(entrada["hoja"], [])
+                    if len(lote) < self.max_lote:
+                        lote.append(entrada)
+
+            enviados = 0
+            ahora = time.time()
+            for hoja, lote in por_hoja.items():
+                fallos, proximo = self._espera.get(hoja, (0, 0.0))
+                if not forzar and proximo > ahora:
+                    continue
+                try:
+                    self._enviar_lote(hoja, lote)
+                except Exception as e:
+                    fallos += 1
+                    espera = min(BACKOFF_MAX_SEG, BACKOFF_BASE_SEG * 2 ** (fallos - 1)) * random.uniform(0.5, 1.0)
+                    self._espera[hoja] = (fallos, time.time() + espera)
+                    codigo = _codigo_http(e)
+                    nivel = logging.WARNING if codigo == 429 or (codigo or 0) >= 500 else logging.ERROR
+                    logging.log(nivel, f"[SHEETS] ⚠️ '{hoja}' ({len(lote)} filas) falló [{codigo or type(e).__name__}]; "
+                                       f"reintento en {espera:.1f}s: {e}")
+                    if codigo != 429:
+                        self.olvidar_hoja(hoja)
+                    continue
+
+                self._espera.pop(hoja, None)
+                self._quitar_del_diario({entrada["id"] for entrada in lote})
+                enviados += len(lote)
+                logging.info(f"[SHEETS] ✅ {len(lote)} filas escritas en '{hoja}'")
+            return enviados
+
+    def _enviar_lote(self, hoja: str, lote: list[dict]):
+        ws = self.abrir_hoja(hoja)
+        nuevas = [e["fila"] for e in lote if "clave" not in e]
+
+        # Upserts: la última versión de cada clave gana
+        ultimas: "OrderedDict[str, list]" = OrderedDict()
+        for e in lote:
+            if "clave" in e:
+                ultimas.pop(e["clave"], None)
+                ultimas[e["clave"]] = e["fila"]
+
+        if ultimas:
+            filas: dict[str, int] = {}                 # clave → nº de fila, leído en este lote
+            for i, valor in enumerate(ws.col_values(1), start=1):
+                filas.setdefault(valor, i)
+
+            cambios = [
+                {"range": f"A{filas[clave]}:{_columna(len(fila))}{filas[clave]}", "values": [fila]}
+                for clave, fila in ultimas.items() if clave in filas
+            ]
+            if cambios:
+                ws.batch_update(cambios)
+            claves_nuevas = [clave for clave in ultimas if clave not in filas]
+            if claves_nuevas:
+                ws.append_rows([ultimas[c] for c in claves_nuevas])
+
+        if nuevas:
+            ws.append_rows(nuevas)
@@ -0,0 +1,130 @@
+"""
+Máquina de estados de la conversación: qué se revisa en cada fase.
+
+Cada paso del flujo es una corrutina que recibe el turno (el mensaje en curso)
+y se registra en una MaquinaFases en el orden en que debe revisarse:
+- @maquina.interrupcion()       → corre en cualquier fase (saludo, precio,
+                                  foto, audio…).
+- @maquina.fase("a", "b")       → solo corre si la fase del turno es una de esas.
+Ambos aceptan destinos=(...): las fases a las que el paso puede llevar, para
+la tabla de transiciones.
+
+Un paso devuelve SIGUE cuando el mensaje no es para él; cualquier otro valor
+(None incluido) termina el turno y es lo que devuelve despachar().
+
+El plan de cada fase (sus pasos más las interrupciones, en orden de registro)
+se calcula la primera vez que aparece esa fase. despachar() lo busca en un
+dict y recorre solo esos pasos, en vez de comparar la fase contra cada bloque.
+Si un paso cambia la fase y deja seguir, se continúa con el plan de la fase
+nueva desde ese mismo punto, igual que cuando los bloques iban uno tras otro.
+
+tabla() y transiciones() describen el flujo registrado; estado() cuenta qué
+paso respondió en cada fase y qué cambios de fase hubo. Para esa cuenta la
+fase final se lee con fase_final_de (si se da): un paso puede reemplazar el
+estado del turno en vez de modificarlo.
+"""
+import bisect
+import threading
+from collections import Counter
+from typing import Any, Awaitable, Callable, Iterable, NamedTuple
+
+
+class _Sigue:
+    def __repr__(self) -> str:
+        return "SIGUE"
+
+
+SIGUE = _Sigue()
+
+
+class Paso(NamedTuple):
+    nombre: str
+    fn: Callable[[Any], Awaitable[Any]]
+    fases: frozenset[str] | None        # None: interrupción, corre en cualquier fase
+    destinos: tuple[str, ...]
+
+
+class MaquinaFases:
+    def __init__(self, fase_de: Callable[[Any], str], fase_final_de: Callable[[Any], str] | None = None):
+        self._fase_de = fase_de
+        self._fase_final_de = fase_final_de or fase_de
+        self.pasos: list[Paso] = []
+        self._planes: dict[str, tuple[int, ...]] = {}
+        self._lock = threading.Lock()
+        self._respuestas: Counter = Counter()     # (fase, paso que respondió)
+        self._cambios: Counter = Counter()        # (fase al llegar, fase al terminar)
+
+    # ── Registro ─────────────────────────────────────────────────────
+    def _registrar(self, fases: frozenset[str] | None, destinos: Iterable[str]):
+        def decorador(fn):
+            self.pasos.append(Paso(fn.__name__, fn, fases, tuple(destinos)))
+            self._planes.clear()
+            return fn
+        return decorador
+
+    def interrupcion(self, destinos: Iterable[str] = ()):
+        return self._registrar(None, destinos)
+
+    def fase(self, *fases: str, destinos: Iterable[str] = ()):
+        if not fases:
+            raise ValueError("fase() necesita al menos una fase")
+        return self._registrar(frozenset(fases), destinos)
+
+    # ── Despacho ─────────────────────────────────────────────────────
+    def plan(self, fase: str) -> tuple[int, ...]:
+        """Índices (en self.pasos) de los pasos que corren en `fase`, en orden."""
+        plan = self._planes.get(fase)
+        if plan is None:
+            plan = tuple(i for i, p in enumerate(self.pasos) if p.fases is None or fase in p.fases)
+            self._planes[fase] = plan
+        return plan
+
+    async def despachar(self, turno) -> Any:
+        llegada = fase = self._fase_de(turno)
+        plan = self.plan(fase)
+        pos = 0
+        respondio = None
+        resultado = None
+        while pos < len(plan):
+            indice = plan[pos]
+            paso = self.pasos[indice]
+            salida = await paso.fn(turno)
+            if salida is not SIGUE:
+                respondio, resultado = paso.nombre, salida
+                break
+            nueva = self._fase_de(turno)
+            if nueva != fase:
+                fase, plan = nueva, self.plan(nueva)
+                pos = bisect.bisect_right(plan, indice)
+            else:
+                pos += 1
+        final = self._fase_final_de(turno)
+        with self._lock:
+            self._respuestas[(llegada, respondio)] += 1
+            if final != llegada:
+                self._cambios[(llegada, final)] += 1
+        return resultado
+
+    # ── Introspección ────────────────────────────────────────────────
+    def tabla(self) -> dict[str, list[str]]:
+        """Para cada fase registrada, los pasos que revisa un mensaje en esa fase (en orden)."""
+        fases = sorted({f for p in self.pasos if p.fases for f in p.fases})
+        return {f: [self.pasos[i].nombre for i in self.plan(f)] for f in fases}
+
+    def interrupciones(self) -> list[str]:
+        return [p.nombre for p in self.pasos if p.fases is None]
+
+    def transiciones(self) -> dict[str, list[str]]:
+        """fase (o "*" para las interrupciones) → fases a las que pueden llevar sus pasos."""
+        tabla: dict[str, list[str]] = {}
+        for p in self.pasos:
+            for origen in (sorted(p.fases) if p.fases else ["*"]):
+                destinos = tabla.setdefault(origen, [])
+                destinos.extend(d for d in p.destinos if d not in destinos)
+        return tabla
+
+    def estado(self) -> dict:
+        with self._lock:
+            respuestas = {f"{fase or '-'} → {paso or '-'}": n for (fase, paso), n in self._respuestas.most_common()}
+            cambios = {f"{origen or '-'} → {destino or '-'}": n for (origen, destino), n in self._cambios.most_common()}
+        return {"respuestas": respuestas, "cambios_de_fase": cambios}
@@ -1,7 +1,12 @@
 import os
 import io
 import json
+import argparse
+import time
+import queue
 import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
 from PIL import Image
 from google.oauth2 import service_account
 from googleapiclient.discovery import build
@@ -11,10 +16,16 @@ import torch
 from transformers import CLIPProcessor, CLIPModel
 from torch.nn.functional import normalize
 
+from almacen_embeddings import cargar_almacen, guardar_almacen
+
 # Configuración
 logging.basicConfig(level=logging.INFO)
 SCOPES = ['https://www.googleapis.com/auth/drive.readonly']
 FOLDER_ID = '1OXHjSG82RO9KGkNIZIRVusFpFhZlujQE'  # ID de la carpeta raíz en Google Drive
+DESCARGAS_PARALELAS = int(os.environ.get("EMB_DESCARGAS_PARALELAS", 8))  # hilos de descarga de Drive
+LOTE_CLIP = int(os.environ.get("EMB_LOTE_CLIP", 16))                      # imágenes por pasada de CLIP
+DIRECTORIO_DATOS = "/var/data"
+MANIFEST_PATH = os.path.join(DIRECTORIO_DATOS, "embeddings_manifest.json")  # {file_id: md5, modifiedTime, vector_row}
 
 # 🔐 Cargar credenciales desde variable de entorno (Render)
 creds_info = json.loads(os.environ["GOOGLE_CREDS_JSON"])
@@ -25,27 +36,50 @@ clip_model = CLIPModel.from_pretrained("openai/clip-vit-base-patch32")
 clip_model.eval()
 clip_processor = CLIPProcessor.from_pretrained("openai/clip-vit-base-patch32")
 
-def generar_embedding(image: Image.Image):
-    inputs = clip_processor(images=image, return_tensors="pt")
-    with torch.no_grad():
+def generar_embeddings_lote(imagenes: list[Image.Image]) -> list[list[float]]:
+    inputs = clip_processor(images=imagenes, return_tensors="pt")
+    with torch.inference_mode():
         emb = clip_model.get_image_features(**inputs)
         emb = normalize(emb, dim=-1)  # ✅ Normalizar para usar similitud coseno correctamente
-    return emb[0].numpy().tolist()
+    return emb.numpy().tolist()
+
+def generar_embedding(image: Image.Image):
+    return generar_embeddings_lote([image])[0]
 
 def cargar_servicio_drive():
     return build('drive', 'v3', credentials=creds)
 
+# El cliente de googleapiclient (httplib2) no es thread-safe → uno por hilo de descarga
+_hilo_local = threading.local()
+
+def servicio_drive_del_hilo():
+    if not hasattr(_hilo_local, "service"):
+        _hilo_local.service = cargar_servicio_drive()
+    return _hilo_local.service
+
+def _listar_todo(service, q, fields):
+    """files().list paginado: un listado incompleto haría parecer borrados los archivos faltantes."""
+    archivos, token = [], None
+    while True:
+        resultados = service.files().list(
+            q=q, fields=f"nextPageToken, files({fields})",
+            pageSize=1000, pageToken=token).execute()
+        archivos.extend(resultados.get('files', []))
+        token = resultados.get('nextPageToken')
+        if not token:
+            return archivos
+
 def listar_carpetas(service, folder_id):
-    resultados = service.files().list(
-        q=f"'{folder_id}' in parents and mimeType='application/vnd.google-apps.folder' and trashed = false",
-        fields="files(id, name)").execute()
-    return resultados.get('files', [])
+    return _listar_todo(
+        service,
+        f"'{folder_id}' in parents and mimeType='application/vnd.google-apps.folder' and trashed = false",
+        "id, name")
 
 def listar_imagenes(service, folder_id):
-    resultados = service.files().list(
-        q=f"'{folder_id}' in parents and mimeType contains 'image/' and trashed = false",
-        fields="files(id, name)").execute()
-    return resultados.get('files', [])
+    return _listar_todo(
+        service,
+        f"'{folder_id}' in parents and mimeType contains 'image/' and trashed = false",
+        "id, name, md5Checksum, modifiedTime")
 
 def descargar_imagen(service, file_id):
     request = service.files().get_media(fileId=file_id)
@@ -57,38 +91,175 @@ def descargar_imagen(service, file_id):
     fh.seek(0)
     return Image.open(fh).convert("RGB")
 
-def main():
+def _descargar_a_cola(cola: queue.Queue, orden: int, modelo: str, img: dict):
+    """Hilo de descarga: deja (orden, modelo, nombre, imagen|None, error) en la cola acotada."""
+    try:
+        imagen = descargar_imagen(servicio_drive_del_hilo(), img["id"])
+        cola.put((orden, modelo, img["name"], imagen, None))
+    except Exception as e:
+        cola.put((orden, modelo, img["name"], None, e))
+
+def _procesar_lote(lote: list, vectores: dict):
+    imagenes = [item[3] for item in lote]
+    try:
+        embs = generar_embeddings_lote(imagenes)
+    except Exception as e:
+        # Un lote fallido se reintenta imagen por imagen para aislar la culpable
+        logging.warning(f"⚠️ Lote de {len(lote)} falló ({e}); procesando una a una")
+        embs = []
+        for orden, modelo, nombre, imagen, _ in lote:
+            try:
+                embs.append(generar_embedding(imagen))
+            except Exception as err:
+                logging.warning(f"⚠️ Error con {nombre}: {err}")
+                embs.append(None)
+
+    for (orden, *_), emb in zip(lote, embs):
+        if emb is not None:
+            vectores[orden] = emb
+
+def embeber_imagenes(tareas: list) -> dict[int, list[float]]:
+    """Descargas en paralelo → cola acotada → CLIP por lotes en este hilo. {orden: vector}"""
+    total = len(tareas)
+    vectores: dict[int, list[float]] = {}
+    if not total:
+        return vectores
+
+    logging.info(f"🖼️ {total} imágenes · {DESCARGAS_PARALELAS} descargas en paralelo · lotes CLIP de {LOTE_CLIP}")
+    cola: queue.Queue = queue.Queue(maxsize=max(2 * LOTE_CLIP, DESCARGAS_PARALELAS))
+    inicio = time.monotonic()
+    recibidas = 0
+    lote = []
+
+    with ThreadPoolExecutor(max_workers=DESCARGAS_PARALELAS, thread_name_prefix="drive") as pool:
+        for orden, modelo, img in tareas:
+            pool.submit(_descargar_a_cola, cola, orden, modelo, img)
+
+        while recibidas < total:
+            orden, modelo, nombre, imagen, error = cola.get()
+            recibidas += 1
+            if error is not None:
+                logging.warning(f"⚠️ Error con {nombre}: {error}")
+            else:
+                logging.info(f"   ⬇️ Procesando imagen: {nombre}")
+                lote.append((orden, modelo, nombre, imagen, None))
+
+            if len(lote) >= LOTE_CLIP or (lote and recibidas == total):
+                _procesar_lote(lote, vectores)
+                lote = []
+                transcurrido = time.monotonic() - inicio
+                logging.info(
+                    f"⏱️ {recibidas}/{total} imágenes · {len(vectores)} embeddings · "
+                    f"{recibidas / transcurrido if transcurrido else 0:.1f} img/s"
+                )
+
+    return vectores
+
+def cargar_manifest_previo():
+    """
+    (archivos, matriz) de la corrida anterior, o ({}, None) si no hay manifest
+    o no corresponde al almacén binario actual (entonces se reconstruye todo).
+    """
+    try:
+        with open(MANIFEST_PATH, "r") as f:
+            manifest = json.load(f)
+        matriz, _, _, meta = cargar_almacen(DIRECTORIO_DATOS)
+    except (FileNotFoundError, ValueError) as e:
+        logging.info(f"ℹ️ Sin manifest utilizable ({e}); reconstrucción completa")
+        return {}, None
+
+    if manifest.get("hash") != meta["hash"]:
+        logging.warning("⚠️ El manifest no corresponde al almacén actual; reconstrucción completa")
+        return {}, None
+    return manifest.get("archivos", {}), matriz
+
+def sin_cambios(previo: dict | None, img: dict) -> bool:
+    if not previo:
+        return False
+    if img.get("md5Checksum") and previo.get("md5Checksum"):
+        return img["md5Checksum"] == previo["md5Checksum"]
+    return bool(img.get("modifiedTime")) and img.get("modifiedTime") == previo.get("modifiedTime")
+
+def guardar_manifest(tareas: list, embeddings_ordenes: dict, meta: dict):
+    """Escribe {file_id: md5Checksum, modifiedTime, vector_row} ligado al hash del almacén."""
+    por_orden = {orden: img for orden, _, img in tareas}
+    archivos, fila = {}, 0
+    for modelo, ordenes in embeddings_ordenes.items():
+        for orden in ordenes:
+            img = por_orden[orden]
+            archivos[img["id"]] = {
+                "md5Checksum": img.get("md5Checksum"),
+                "modifiedTime": img.get("modifiedTime"),
+                "vector_row": fila,
+                "modelo": modelo,
+                "nombre": img["name"],
+            }
+            fila += 1
+
+    if fila != meta["filas"]:
+        logging.warning(f"⚠️ Filas del almacén ({meta['filas']}) ≠ manifest ({fila}); no se guarda manifest")
+        return
+
+    tmp = f"{MANIFEST_PATH}.tmp"
+    with open(tmp, "w") as f:
+        json.dump({"hash": meta["hash"], "archivos": archivos}, f)
+    os.replace(tmp, MANIFEST_PATH)
+
+def main(incremental: bool = False):
     service = cargar_servicio_drive()
     carpetas = listar_carpetas(service, FOLDER_ID)
     logging.info(f"📦 Se encontraron {len(carpetas)} carpetas de modelos.")
 
-    embeddings = {}
-
+    # 1️⃣ Listado: (orden global, modelo, imagen) respetando el orden de Drive
+    tareas = []
     for carpeta in carpetas:
         modelo = carpeta["name"]
-        carpeta_id = carpeta["id"]
         logging.info(f"📁 Modelo: {modelo}")
-        imagenes = listar_imagenes(service, carpeta_id)
+        for img in listar_imagenes(service, carpeta["id"]):
+            tareas.append((len(tareas), modelo, img))
 
-        modelo_embeddings = []
-        for img in imagenes:
-            try:
-                logging.info(f"   ⬇️ Procesando imagen: {img['name']}")
-                imagen = descargar_imagen(service, img["id"])
-                emb = generar_embedding(imagen)
-                modelo_embeddings.append(emb)
-            except Exception as e:
-                logging.warning(f"⚠️ Error con {img['name']}: {e}")
+    # 2️⃣ Modo incremental: reutilizar filas de archivos cuyo md5 no cambió
+    reutilizados: dict[int, list[float]] = {}
+    if incremental:
+        archivos_previos, matriz_previa = cargar_manifest_previo()
+        for orden, _, img in tareas:
+            previo = archivos_previos.get(img["id"])
+            if sin_cambios(previo, img):
+                reutilizados[orden] = matriz_previa[previo["vector_row"]].tolist()
+        vigentes = {img["id"] for _, _, img in tareas}
+        borrados = [fid for fid in archivos_previos if fid not in vigentes]
+        logging.info(
+            f"♻️ Incremental: {len(reutilizados)} sin cambios · "
+            f"{len(tareas) - len(reutilizados)} nuevos/cambiados · {len(borrados)} eliminados"
+        )
+
+    # 3️⃣ Descargar y embeber solo lo necesario
+    inicio = time.monotonic()
+    vectores = embeber_imagenes([t for t in tareas if t[0] not in reutilizados])
+    vectores.update(reutilizados)
 
-        if modelo_embeddings:
-            embeddings[modelo] = modelo_embeddings if len(modelo_embeddings) > 1 else [modelo_embeddings[0]]
+    # 4️⃣ Reagrupar por modelo en el mismo orden del listado
+    embeddings, embeddings_ordenes = {}, {}
+    for orden, modelo, _ in tareas:
+        if orden in vectores:
+            embeddings.setdefault(modelo, []).append(vectores[orden])
+            embeddings_ordenes.setdefault(modelo, []).append(orden)
 
     # ✅ Guardar como embeddings.json en disco de Render
-    os.makedirs("/var/data", exist_ok=True)
+    os.makedirs(DIRECTORIO_DATOS, exist_ok=True)
     with open("/var/data/embeddings.json", "w") as f:
         json.dump(embeddings, f)
 
-    logging.info("🎉 Archivo embeddings.json creado con éxito en /var/data/")
+    logging.info(f"🎉 Archivo embeddings.json creado con éxito en /var/data/ ({time.monotonic() - inicio:.1f}s)")
+
+    # ✅ Almacén binario (.npy + sidecar) que el bot abre con mmap + manifest para la próxima corrida
+    meta = guardar_almacen(embeddings, DIRECTORIO_DATOS)
+    guardar_manifest(tareas, embeddings_ordenes, meta)
 
 if __name__ == "__main__":
-    main()
+    parser = argparse.ArgumentParser(description="Genera embeddings CLIP del catálogo en Drive")
+    parser.add_argument(
+        "--incremental", action="store_true",
+        default=os.environ.get("EMB_INCREMENTAL", "").lower() in ("1", "true", "si"),
+        help="solo descarga imágenes nuevas o con md5Checksum distinto (usa embeddings_manifest.json)")
+    main(incremental=parser.parse_args().incremental)
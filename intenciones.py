@@ -0,0 +1,238 @@
+"""
+Detección de intenciones por frases clave, compilada una sola vez al importar.
+
+Antes procesar_wa y responder revisaban decenas de tuplas con
+`any(p in texto for p in (...))`, una tras otra, hasta que alguna coincidía.
+Aquí todas las frases de INTENCIONES quedan en un solo regex con forma de
+trie (un prefijo común se compara una vez) envuelto en un lookahead, así
+una pasada de finditer encuentra todas las frases presentes, aunque se
+solapen. detectar() devuelve el conjunto de intenciones del texto y los
+`if` del bot pasan a ser `"faq_garantia" in intenciones`.
+
+La semántica es la misma de antes: coincidencia de subcadena, sin tocar
+mayúsculas ni tildes (cada sitio detecta sobre el mismo texto que revisaba).
+El orden de INTENCIONES es la prioridad (el de la cascada original);
+principal() devuelve la primera que coincide.
+
+bench_intenciones.py compara el motor con la cascada sobre un corpus.
+"""
+import re
+import functools
+from typing import Iterable, NamedTuple
+
+
+class Intencion(NamedTuple):
+    id: str
+    frases: tuple[str, ...]
+
+
+def regex_trie(frases: Iterable[str]) -> str:
+    """Regex equivalente a `frase1|frase2|…` pero ramificado por prefijos; prefiere la frase más larga."""
+    trie: dict = {}
+    for frase in frases:
+        if not frase:
+            continue
+        nodo = trie
+        for ch in frase:
+            nodo = nodo.setdefault(ch, {})
+        nodo[""] = {}
+
+    def a_regex(nodo: dict) -> str:
+        ramas = [re.escape(ch) + a_regex(hijo) for ch, hijo in sorted(nodo.items()) if ch]
+        if not ramas:
+            return ""
+        cuerpo = ramas[0] if len(ramas) == 1 else "(?:" + "|".join(ramas) + ")"
+        if "" in nodo:
+            return f"(?:{cuerpo})?"
+        return cuerpo
+
+    return a_regex(trie)
+
+
+class MotorIntenciones:
+    def __init__(self, intenciones: Iterable[Intencion], cache: int = 2048):
+        self.intenciones = tuple(intenciones)
+        self.prioridad = {i.id: n for n, i in enumerate(self.intenciones)}
+
+        directas: dict[str, set[str]] = {}
+        for intencion in self.intenciones:
+            for frase in intencion.frases:
+                directas.setdefault(frase, set()).add(intencion.id)
+
+        # En cada posición el regex devuelve la frase más larga; las más cortas que
+        # empiezan ahí son prefijos suyos, así que se suman de una vez.
+        self._por_frase: dict[str, frozenset[str]] = {
+            frase: frozenset().union(*(ids for otra, ids in directas.items() if frase.startswith(otra)))
+            for frase in directas
+        }
+        self._patron = re.compile(f"(?=({regex_trie(directas)}))", re.DOTALL)
+        self.detectar = functools.lru_cache(maxsize=cache)(self._detectar)
+
+    def _detectar(self, texto: str) -> frozenset[str]:
+        if not texto:
+            return frozenset()
+        encontradas = {m.group(1) for m in self._patron.finditer(texto)}
+        return frozenset().union(*(self._por_frase[f] for f in encontradas))
+
+    def frases(self, id_intencion: str) -> tuple[str, ...]:
+        return self.intenciones[self.prioridad[id_intencion]].frases
+
+    def principal(self, texto: str, entre: Iterable[str] | None = None) -> str | None:
+        """La intención de mayor prioridad presente en `texto` (opcionalmente solo entre `entre`)."""
+        candidatas = self.detectar(texto)
+        if entre is not None:
+            candidatas = candidatas & frozenset(entre)
+        return min(candidatas, key=self.prioridad.__getitem__, default=None)
+
+
+INTENCIONES = (
+    # procesar_wa (sobre el texto en minúsculas), en el orden de la cascada
+    Intencion("faq_demora_envio", (
+        "cuanto demora", "cuanto tarda", "cuanto se demora", "en cuanto llega", "me llega rapido",
+        "llegan rapido", "cuántos días", "cuanto se demoran", "días en llegar", "si lo pido hoy",
+        "si hago el pedido hoy", "si los pido hoy", "cuando me llegan"
+    )),
+    Intencion("faq_contraentrega", (
+        "pago contra entrega", "pago contraentrega", "contraentrega", "contra entrega", "pagan al recibir",
+        "puedo pagar al recibir", "tienen contra entrega"
+    )),
+    Intencion("faq_garantia", ("tienen garantia", "hay garantia", "garantia", "tienen garantia de fabrica")),
+    Intencion("faq_ubicacion", (
+        "donde estan ubicados", "donde queda", "ubicacion", "ubicación", "direccion", "tienda fisica",
+        "donde estan", "donde es la tienda", "estan ubicados", "ubicados en donde", "en que ciudad estan",
+        "en que parte estan"
+    )),
+    Intencion("faq_origen", (
+        "son nacionales", "son importados", "es nacional o importado", "nacionales o importados",
+        "hecho en colombia", "fabricados en colombia", "son de aqui", "es de colombia",
+        "fabricacion colombiana"
+    )),
+    Intencion("faq_originales", (
+        "son originales", "es original", "originales", "es copia", "son copia", "son replica", "réplica",
+        "imitacion"
+    )),
+    Intencion("faq_calidad", (
+        "que calidad son", "de que calidad son", "son buena calidad", "son de buena calidad",
+        "son de mala calidad", "que calidad manejan", "que calidad tienen", "calidad de las zapatillas"
+    )),
+    Intencion("faq_descuento_pares", (
+        "si compro 2 pares", "dos pares descuento", "descuento por 2 pares", "descuento por dos pares",
+        "me descuentan si compro dos", "descuento si compro dos", "hay descuento por dos",
+        "promocion dos pares", "descuento en 2 pares"
+    )),
+    Intencion("faq_mayorista", (
+        "precio mayorista", "precios para mayoristas", "mayorista", "quiero vender", "puedo venderlos",
+        "descuento para revender", "revender", "comprar para vender", "manejan precios para mayoristas",
+        "mayoreo", "venta al por mayor"
+    )),
+    Intencion("faq_horma", (
+        "las tallas son normales", "horma normal", "talla normal", "horma grande", "horma pequeña",
+        "tallas grandes", "tallas pequeñas", "las tallas son grandes", "las tallas son pequeñas",
+        "como son las tallas"
+    )),
+    Intencion("faq_talla_maxima", (
+        "talla mas grande", "talla más grande", "cual es la talla mas grande", "horma", "mayor talla",
+        "talla maxima", "talla máxima"
+    )),
+    Intencion("menciona_bucaramanga", ("bucaramanga",)),
+    Intencion("envio_bucaramanga", (
+        "envío", "envios", "envían", "enviar", "envian", "enviarme", "soy de", "estoy en", "pueden llevar",
+        "tienen envio a", "el envio a", "envío a", "envian a", "como es el envio", "hacen envíos",
+        "tienen envío"
+    )),
+    Intencion("demora_bucaramanga", (
+        "cuanto demora", "cuanto tarda", "cuanto se demora", "en cuanto llega", "me llega rapido",
+        "llegan rapido", "cuántos días", "días en llegar", "se demora en llegar"
+    )),
+    Intencion("menciona_envio", ("envio",)),
+    Intencion("envio_generico", (
+        "envían a", "envio a", "envíos a", "hacen envíos a", "tienen envío a", "pueden enviar a",
+        "enviarían a", "envian hasta", "envían hasta", "pueden enviar hasta", "envían por", "tienen envíos a"
+    )),
+    Intencion("metodos_pago", (
+        "método de pago", "metodos de pago", "formas de pago", "formas para pagar", "como pago",
+        "cómo puedo pagar", "qué medios de pago", "medios de pago", "aceptan nequi", "pago por daviplata",
+        "manejan bancolombia", "que pago manejan", "que pagos manejan"
+    )),
+    Intencion("saludo_wa", (
+        "/start", "start", "hola", "buenas", "buenos días", "buenos dias", "buenas tardes", "buenas noches",
+        "hey", "ey", "qué pasa", "que pasa", "buen día", "buen dia", "saludos", "holaaa", "ehhh", "epa",
+        "holi", "oe", "oe que más", "nose hola"
+    )),
+    Intencion("pedir_audio", (
+        "mandame un audio", "mándame un audio", "envíame un audio", "puede enviarme un audio",
+        "puedes enviarme un audio", "me puedes enviar un audio", "háblame", "hábleme", "háblame por voz",
+        "me puedes hablar", "leeme", "léeme", "no sé leer", "no se leer", "no puedo leer"
+    )),
+    Intencion("afirmativa", (
+        "si", "sí", "sii", "sis", "sisz", "siss", "de una", "dale", "hágale", "hagale", "hágale pues",
+        "me gusta", "quiero", "lo quiero", "vamos", "claro", "obvio", "eso es", "ese", "de ley", "de fijo",
+        "ok", "okay", "listo"
+    )),
+    Intencion("cancelar", ("cancel", "cancelar", "otra", "ver otro", "no gracias")),
+    # responder (sobre el texto normalizado)
+    Intencion("saludo", ("hola", "buenas", "buenos días", "buenas tardes", "buenas noches")),
+    Intencion("precio_modelos_mostrados", (
+        "cuánto valen", "qué precio tienen", "cuánto cuestan", "precio de esos", "valen los", "cuanto valen",
+        "cuanto cuesta", "cuánto cuesta", "cuánto tienen de precio", "valor de esos", "qué valor tienen",
+        "dígame el precio", "dígame el valor", "cual es el precio", "cual es el valor", "valor"
+    )),
+    Intencion("precio_modelo_actual", (
+        "cuánto vale", "cuanto vale", "precio", "cuánto cuesta", "cuanto cuesta", "vale los", "cuánto valen",
+        "cuanto valen"
+    )),
+    Intencion("eleccion_afirmativa", (
+        "si", "sí", "sii", "sisas", "de una", "dale", "hágale", "hagale", "me gustaron", "me llevo esos",
+        "quiero esos", "quiero esas", "me encantaron", "esos", "esas", "ese", "esa"
+    )),
+    Intencion("menciona_faq", (
+        "envio", "pago", "garantia", "talla", "tallas", "ubicacion", "donde", "horma", "precio", "costos"
+    )),
+    Intencion("desconfianza", (
+        "no confio", "desconfio", "me han robado", "PERO YO COMO SE QUE NO ME VAN A ROBAR", "ya me robaron",
+        "y si me roban", "me estafaron", "ya me estafaron", "me hicieron el robo",
+        "como se que no me van a robar", "no quiero pagar anticipado", "no quiero dar plata antes",
+        "no quiero enviar dinero sin ver", "me da desconfianza", "me da miedo pagar", "no me da confianza",
+        "me han tumbado", "me hicieron fraude", "tengo miedo de pagar", "no tengo seguridad",
+        "Como se que no me roban", "quiero pagar al recibir", "pago al recibir", "solo contraentrega",
+        "pago cuando llegue", "cuando me lleguen pago", "Como se que no me van a robar",
+        "pago cuando me llegue", "me tumbaron una vez", "me jodieron", "ya me tumbaron", "no vuelvo a caer",
+        "yo como se que no me roban", "eso me paso antes", "no me sale el mensaje", "no me abre el link",
+        "me han robado antes", "me da cosa pagar", "no puedo pagar sin saber", "no mando dinero asi",
+        "no conozco su tienda", "no estoy seguro", "como se que es real", "como se que es confiable",
+        "como saber si es real", "esto es confiable?", "no tengo pruebas", "es seguro esto?",
+        "no me siento comodo pagando", "mejor contraentrega", "yo solo pago al recibir", "yo no pago antes",
+        "a mi me han estafado", "me estafaron antes", "me robaron antes", "y si no me llega", "y si no llega",
+        "y si me estafan", "me robaron antes", "ya me tumbaron plata", "me hicieron perder plata",
+        "me quitaron la plata", "me da miedo que me estafen", "esto no parece seguro", "no se ve seguro",
+        "y si es mentira", "y si es estafa", "robo", "yo no pago sin ver", "yo no mando plata asi", "robado",
+        "esto parece raro", "y si no cumplen", "y si no es verdad", "parece una estafa", "se ve raro",
+        "esto huele a estafa", "muy sospechoso", "no quiero perder plata", "no me arriesgo",
+        "no voy a arriesgar mi dinero"
+    )),
+    Intencion("es_bucaramanga", ("bucaramanga", "bga", "b/manga")),
+    Intencion("pregunta_precio", (
+        "precio", "preció", "prezio", "que presio tienen", "valor", "que presio hay", "vale", "valen",
+        "que precio tienen", "vale esto", "valen esto", "costo", "kosto", "cuesto", "cuanto cuesta",
+        "cuanto vale", "cuanto esta", "cuanto es", "cuanto valen", "cuanto cuestan", "cuanto sale",
+        "que precio", "que vale", "kuanto cuesta", "kuanto bale", "cuanttto bale", "k vale", "q cuesta",
+        "q precio", "q vale", "cuanto me sale", "vale cuanto", "cuesta cuanto", "vale algo", "valen algo",
+        "cuanto cobras", "cuanto cobran", "balor", "cuanto baale", "k bale", "vale eso", "cuanto valdra"
+    )),
+    Intencion("afirmativa_compra", (
+        "si", "sí", "sii", "sis", "sisz", "de una", "dale", "hagale", "hágale", "hágale pues", "claro",
+        "claro que sí", "quiero comprar", "continuar", "vamos"
+    )),
+    Intencion("confirma_talla", ("sí", "si", "s", "dale", "claro", "continuar", "comprar", "vamos")),
+    Intencion("confirma_datos", (
+        "si", "sí", "correcto", "ok", "listo", "vale", "dale", "todo bien", "todo correcto", "está bien",
+        "esta bien"
+    )),
+    Intencion("clave_flujo", (
+        "catalogo", "catálogo", "ver catálogo", "ver catalogo", "imagen", "foto", "enviar imagen",
+        "ver tallas", "quiero comprar", "hacer pedido", "comprar", "zapatos", "tenis", "pago", "contraentrega",
+        "garantía", "garantia", "demora", "envío", "envio"
+    )),
+)
+
+motor_intenciones = MotorIntenciones(INTENCIONES)
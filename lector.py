@@ -1,62 +1,101 @@
 # ——— Librerías estándar de Python ———
+from __future__ import annotations          # anotaciones (telegram, PIL…) sin importar en tiempo de carga
+
 import os
 import io
 import re
 import json
+import hashlib
+import hmac
+import mimetypes
+from urllib.parse import quote
 import base64
 import logging
 import random
 import string
 import requests
 import asyncio
-import difflib
-import unicodedata
 import subprocess
 import time
+import functools
+import threading
+import importlib
 from datetime import datetime, timedelta
-from collections import defaultdict
+from collections import OrderedDict, defaultdict
+from concurrent.futures import ThreadPoolExecutor
 from types import SimpleNamespace
-from oauth2client.service_account import ServiceAccountCredentials
 # ——— Librerías externas ———
 import numpy as np               # ←  déjalo si realmente lo usas
-import torch
 import nest_asyncio
 from PIL import Image
 from dotenv import load_dotenv
-from transformers import CLIPModel, CLIPProcessor
-from torchvision import transforms
 from fastapi import FastAPI, Request, status
-from fastapi.responses import JSONResponse
-from openai import AsyncOpenAI
-import gspread
-from google.oauth2 import service_account     # ← alias de antes
-
-# ——— Google Cloud & Drive ———
-from google.cloud import vision
-from google.oauth2.service_account import Credentials   # forma única
-from googleapiclient.discovery import build
-from googleapiclient.http import MediaIoBaseDownload, MediaIoBaseUpload
-
-# ——— Telegram ———
-from telegram import (
-    Update,
-    ReplyKeyboardMarkup,
-    KeyboardButton,
-    ReplyKeyboardRemove,
-    InputMediaPhoto,
-)
-from telegram.constants import ChatAction
-from telegram.ext import (
-    ApplicationBuilder,
-    CommandHandler,
-    MessageHandler,
-    ContextTypes,
-    filters,
+from fastapi.responses import FileResponse, JSONResponse, Response, StreamingResponse
+from almacen_embeddings import META_NOMBRE, almacen_vigente, cargar_almacen, guardar_almacen, matriz_desde_dict
+from sincronizar_drive import ReglaSync, SincronizadorDrive, VigilanteCambiosDrive
+from clientes_google import ClientesGoogle
+from escritor_sheets import EscritorSheets
+from intenciones import motor_intenciones
+from difuso import VocabularioDifuso, vocabulario
+from normalizacion import normalize, palabras_normalizadas, sin_puntuacion
+from flujo import SIGUE, MaquinaFases
+
+# ——— Dependencias pesadas: se importan en el primer uso ———
+# torch/transformers, Google Cloud, gspread, OpenAI y telegram suman segundos de
+# import; el arranque (y cualquier `import lector`) no debe pagarlos.
+# Telegram, gspread, oauth2client y googleapiclient se importan dentro de las
+# funciones que los usan. Ver bench_importacion.py.
+class _ModuloDiferido:
+    """Proxy de un módulo que se importa en el primer acceso a un atributo."""
+
+    def __init__(self, nombre: str):
+        self._nombre = nombre
+        self._modulo = None
+
+    def __getattr__(self, attr):
+        if self._modulo is None:
+            self._modulo = importlib.import_module(self._nombre)
+        return getattr(self._modulo, attr)
+
+class _ClienteDiferido:
+    """Proxy de un cliente que se construye en el primer acceso a un atributo."""
+
+    def __init__(self, fabrica):
+        self._fabrica = fabrica
+        self._cliente = None
+        self._lock = threading.Lock()
+
+    def __getattr__(self, attr):
+        if self._cliente is None:
+            with self._lock:
+                if self._cliente is None:
+                    self._cliente = self._fabrica()
+        return getattr(self._cliente, attr)
+
+torch           = _ModuloDiferido("torch")
+vision          = _ModuloDiferido("google.cloud.vision")
+
+def _crear_cliente_openai():
+    from openai import AsyncOpenAI
+    return AsyncOpenAI(api_key=os.getenv("OPENAI_API_KEY"))
+
+client = _ClienteDiferido(_crear_cliente_openai)
+
+# Drive, Sheets y Vision: credenciales, discovery y conexiones compartidas (clientes_google.py)
+apis_google = ClientesGoogle()
+GOOGLE_REFRESCO_SEG = int(os.environ.get("GOOGLE_REFRESCO_SEG", 300))
+
+# Sheets: las filas van a un diario local y salen en lote cada SHEETS_LOTE_SEG (escritor_sheets.py)
+SHEETS_LIBRO    = "PEDIDOS"
+SHEETS_DIARIO   = "/var/data/sheets_pendientes.jsonl"
+SHEETS_LOTE_SEG = float(os.environ.get("SHEETS_LOTE_SEG", 3))
+escritor_sheets = EscritorSheets(
+    functools.partial(apis_google.hoja, SHEETS_LIBRO),
+    SHEETS_DIARIO,
+    olvidar_hoja=functools.partial(apis_google.olvidar_hoja, SHEETS_LIBRO),
 )
+
 # ─── Imports y logging ───────────────────────────────────────────────────
-import os, io, logging
-from fastapi import FastAPI
-from googleapiclient.http import MediaIoBaseDownload
 
 logging.basicConfig(level=logging.INFO,
                     format="%(levelname)s: %(message)s")
@@ -65,36 +104,80 @@ logging.basicConfig(level=logging.INFO,
 api = FastAPI(title="AYA Bot – WhatsApp")
 logging.basicConfig(level=logging.DEBUG)
 
+# ─── Capa async para I/O bloqueante (Sheets, Drive, Vision, HTTP) ────────
+# Cada backend tiene su propio límite de concurrencia y timeout; las llamadas
+# corren en un pool de hilos acotado y el event loop nunca espera la red.
+LIMITES_IO  = {"sheets": 4, "drive": 4, "vision": 4, "http": 4}
+TIMEOUTS_IO = {"sheets": 30.0, "drive": 60.0, "vision": 30.0, "http": 20.0}
+for _backend in LIMITES_IO:
+    LIMITES_IO[_backend]  = int(os.environ.get(f"IO_LIMITE_{_backend.upper()}", LIMITES_IO[_backend]))
+    TIMEOUTS_IO[_backend] = float(os.environ.get(f"IO_TIMEOUT_{_backend.upper()}", TIMEOUTS_IO[_backend]))
 
-# ─── (Ejemplo) servicio de Drive  ────────────────────────────────────────
-def get_drive_service():
+_pool_io = ThreadPoolExecutor(max_workers=sum(LIMITES_IO.values()), thread_name_prefix="io")
+_semaforos_io: dict[str, asyncio.Semaphore] = {}
+
+async def en_hilo(backend: str, fn, *args, **kwargs):
     """
-    Devuelve un objeto service autenticado para la API de Drive.
-    Ajusta según tu implementación real.
+    Ejecuta `fn(*args, **kwargs)` en el pool de I/O respetando el límite del backend.
+    Lanza asyncio.TimeoutError si supera TIMEOUTS_IO[backend]. Tras el timeout
+    solo se deja de esperar: el hilo sigue corriendo y conserva su cupo del
+    backend hasta terminar, así las llamadas colgadas no se acumulan por encima
+    del límite.
     """
-    from google.oauth2.service_account import Credentials
-    from googleapiclient.discovery import build
+    sem = _semaforos_io.get(backend)
+    if sem is None:
+        sem = _semaforos_io[backend] = asyncio.Semaphore(LIMITES_IO[backend])
 
-    creds = Credentials.from_service_account_file(
-        "service_account.json",
-        scopes=["https://www.googleapis.com/auth/drive.readonly"]
-    )
- 
-    return build("drive", "v3", credentials=creds)
-def registrar_o_actualizar_lead(data: dict) -> bool:
-    import gspread
-    from oauth2client.service_account import ServiceAccountCredentials
+    loop = asyncio.get_running_loop()
+    await sem.acquire()
+    try:
+        trabajo = _pool_io.submit(functools.partial(fn, *args, **kwargs))
+    except BaseException:
+        sem.release()
+        raise
+
+    def liberar(_):
+        try:
+            loop.call_soon_threadsafe(sem.release)
+        except RuntimeError:
+            pass                                        # el loop ya cerró (apagado)
+    trabajo.add_done_callback(liberar)
+
+    try:
+        return await asyncio.wait_for(asyncio.wrap_future(trabajo), TIMEOUTS_IO[backend])
+    except asyncio.TimeoutError:
+        logging.error(f"[IO] ⏱️ {backend}: {getattr(fn, '__name__', fn)} superó {TIMEOUTS_IO[backend]}s")
+        raise
+
+
+# ─── Servicio de Drive  ──────────────────────────────────────────────────
+def get_drive_service():
+    """Servicio de Drive del hilo actual (se construye una vez por hilo en apis_google)."""
+    return apis_google.drive()
 
+async def refrescar_tokens_google_periodicamente():
+    """Renueva los tokens de Google antes de que venzan, fuera del camino de los mensajes."""
+    while True:
+        await asyncio.sleep(GOOGLE_REFRESCO_SEG)
+        try:
+            await asyncio.to_thread(apis_google.refrescar_tokens)
+        except Exception as e:
+            logging.error(f"[GOOGLE] ❌ Error refrescando tokens: {e}")
+
+async def vaciar_sheets_periodicamente():
+    """Cada SHEETS_LOTE_SEG segundos envía en lote las filas encoladas (respeta el backoff por hoja)."""
+    while True:
+        await asyncio.sleep(SHEETS_LOTE_SEG)
+        try:
+            await asyncio.to_thread(escritor_sheets.vaciar)
+        except Exception as e:
+            logging.error(f"[SHEETS] ❌ Error vaciando la cola de Sheets: {e}")
+
+def registrar_o_actualizar_lead(data: dict) -> bool:
     try:
         logging.info("[LEADS] ⇢ Intentando registrar o actualizar lead...")
         logging.info(f"[LEADS] Datos recibidos:\n{json.dumps(data, indent=2, ensure_ascii=False)}")
 
-        creds_dict = json.loads(os.getenv("GOOGLE_CREDS_JSON"))
-        scope = ["https://spreadsheets.google.com/feeds", "https://www.googleapis.com/auth/drive"]
-        creds = ServiceAccountCredentials.from_json_keyfile_dict(creds_dict, scope)
-        client = gspread.authorize(creds)
-
-        sheet = client.open("PEDIDOS").worksheet("LEADS")
         telefono = data.get("Teléfono", "").strip()
         fecha = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
 
@@ -102,9 +185,6 @@ def registrar_o_actualizar_lead(data: dict) -> bool:
             logging.warning("[LEADS] ⚠️ Teléfono vacío. No se puede registrar.")
             return False
 
-        registros = sheet.col_values(1)  # Columna A: Teléfono
-        logging.info(f"[LEADS] 🔍 Total de registros existentes: {len(registros)}")
-
         fila_data = [
             telefono,
             data.get("Fecha Registro", fecha),
@@ -118,14 +198,9 @@ def registrar_o_actualizar_lead(data: dict) -> bool:
             data.get("Estado", "")
         ]
 
-        if telefono in registros:
-            fila_index = registros.index(telefono) + 1
-            sheet.update(f"A{fila_index}:J{fila_index}", [fila_data])
-            logging.info(f"[LEADS] 🔁 Lead actualizado (fila {fila_index})")
-        else:
-            sheet.append_row(fila_data)
-            logging.info("[LEADS] ✅ Lead registrado por primera vez")
-
+        # Columna A: Teléfono. Actualiza la fila si existe o la agrega (en el próximo lote)
+        escritor_sheets.actualizar("LEADS", telefono, fila_data)
+        logging.info("[LEADS] 📝 Lead encolado para escritura")
         return True
 
     except Exception as e:
@@ -133,472 +208,76 @@ def registrar_o_actualizar_lead(data: dict) -> bool:
         return False
 
 
-def descargar_imagen_lengueta():
-    """
-    Descarga la imagen de ejemplo de lengüeta desde Google Drive.
-    Guarda el archivo como /var/data/extra/lengueta_ejemplo.jpg
-    """
-    try:
-        print(">>> descargar_imagen_lengueta() – iniciando")
-        service = get_drive_service()
-        os.makedirs("/var/data/extra", exist_ok=True)
-
-        archivo = service.files().list(
-            q="'1GF3rdTM0t81KRIb6xbQ1uNV4uC4A7LvE' in parents and name = 'lengueta_ejemplo.jpg' and trashed = false",
-            fields="files(id, name)",
-            pageSize=1
-        ).execute().get("files", [])
-
-        if not archivo:
-            logging.warning("⚠️ No se encontró 'lengueta_ejemplo.jpg'")
-            return
-
-        file_id = archivo[0]["id"]
-        destino = "/var/data/extra/lengueta_ejemplo.jpg"
-
-        if os.path.exists(destino):
-            logging.info("📦 Imagen de lengüeta ya existe. Omitiendo descarga.")
-            return
-
-        logging.info("⬇️ Descargando imagen de lengüeta")
-        request = service.files().get_media(fileId=file_id)
-        buffer = io.BytesIO()
-        downloader = MediaIoBaseDownload(buffer, request)
-
-        done = False
-        while not done:
-            _, done = downloader.next_chunk()
-
-        with open(destino, "wb") as f:
-            f.write(buffer.getvalue())
-
-        logging.info(f"✅ Imagen guardada en: {destino}")
-
-    except Exception as e:
-        logging.error(f"❌ Error descargando imagen de lengüeta: {e}")
-def descargar_metodos_pago_drive():
-    """
-    Descarga la imagen 'metodosdepago.jpeg' desde Google Drive.
-    Guarda el archivo como /var/data/extra/metodosdepago.jpeg
-    """
-    try:
-        print(">>> descargar_metodos_pago_drive() – iniciando")
-        service = get_drive_service()
-        carpeta_id = "1GF3rdTM0t81KRIb6xbQ1uNV4uC4A7LvE"  # misma carpeta que lengüeta
-        destino = "/var/data/extra/metodosdepago.jpeg"
-
-        os.makedirs("/var/data/extra", exist_ok=True)
-
-        archivo = service.files().list(
-            q=f"'{carpeta_id}' in parents and name = 'metodosdepago.jpeg' and trashed = false",
-            fields="files(id, name)",
-            pageSize=1
-        ).execute().get("files", [])
-
-        if not archivo:
-            logging.warning("⚠️ No se encontró 'metodosdepago.jpeg'")
-            return
-
-        file_id = archivo[0]["id"]
-
-        if os.path.exists(destino):
-            logging.info("📦 Imagen de métodos de pago ya existe. Omitiendo descarga.")
-            return
-
-        logging.info("⬇️ Descargando imagen de métodos de pago")
-        request = service.files().get_media(fileId=file_id)
-        buffer = io.BytesIO()
-        downloader = MediaIoBaseDownload(buffer, request)
-
-        done = False
-        while not done:
-            _, done = downloader.next_chunk()
-
-        with open(destino, "wb") as f:
-            f.write(buffer.getvalue())
-
-        logging.info(f"✅ Imagen guardada en: {destino}")
-
-    except Exception as e:
-        logging.error(f"❌ Error descargando 'metodosdepago.jpeg': {e}")
-
-CARPETA_AUDIOS_DRIVE = "1-Htyzy4f8NgjkLJRv5hGZHdTXpRvz5mA"  # Carpeta raíz de 'Audios'
-
-from googleapiclient.http import MediaIoBaseDownload
-
-def descargar_audios_bienvenida_drive():
-    """
-    Descarga audios desde las subcarpetas 'BIENVENIDA', 'CONFIANZA' y 'CONTRAENTREGA'
-    dentro de la carpeta 'Audios' en Google Drive.
-    Guarda los archivos en:
-    - /var/data/audios/bienvenida/
-    - /var/data/audios/confianza/
-    - /var/data/audios/contraentrega/
-    """
-    try:
-        print(">>> descargar_audios_bienvenida_drive() – iniciando")
-        service = get_drive_service()
-
-        # Rutas de destino locales
-        carpeta_bienvenida     = "/var/data/audios/bienvenida"
-        carpeta_confianza      = "/var/data/audios/confianza"
-        carpeta_contraentrega  = "/var/data/audios/contraentrega"
-        os.makedirs(carpeta_bienvenida, exist_ok=True)
-        os.makedirs(carpeta_confianza, exist_ok=True)
-        os.makedirs(carpeta_contraentrega, exist_ok=True)
-
-        # 🧹 Limpiar bienvenida
-        for f in os.listdir(carpeta_bienvenida):
-            archivo = os.path.join(carpeta_bienvenida, f)
-            if os.path.isfile(archivo):
-                os.remove(archivo)
-
-        logging.info("📂 [Audios Bienvenida] Descargando desde subcarpeta 'BIENVENIDA'…")
-
-        bienvenida = service.files().list(
-            q=f"'{CARPETA_AUDIOS_DRIVE}' in parents and name = 'BIENVENIDA' and mimeType='application/vnd.google-apps.folder' and trashed = false",
-            fields="files(id, name)", pageSize=1
-        ).execute().get("files", [])
-
-        if bienvenida:
-            bienvenida_id = bienvenida[0]["id"]
-            audios = service.files().list(
-                q=f"'{bienvenida_id}' in parents and mimeType contains 'audio/' and trashed = false",
-                fields="files(id, name)"
-            ).execute().get("files", [])
-
-            for audio in audios:
-                nombre = audio["name"]
-                destino = os.path.join(carpeta_bienvenida, nombre)
-                request = service.files().get_media(fileId=audio["id"])
-                buffer = io.BytesIO()
-                downloader = MediaIoBaseDownload(buffer, request)
-                done = False
-                while not done:
-                    _, done = downloader.next_chunk()
-                with open(destino, "wb") as f:
-                    f.write(buffer.getvalue())
-                logging.info(f"✅ Guardado: {destino}")
-        else:
-            logging.warning("❌ No se encontró la subcarpeta 'BIENVENIDA'.")
-
-        # ─── CONFIANZA ───
-        logging.info("📂 [Audio Confianza] Buscando en carpeta 'CONFIANZA'…")
-
-        confianza = service.files().list(
-            q=f"'{CARPETA_AUDIOS_DRIVE}' in parents and name = 'CONFIANZA' and mimeType='application/vnd.google-apps.folder' and trashed = false",
-            fields="files(id, name)", pageSize=1
-        ).execute().get("files", [])
-
-        if confianza:
-            confianza_id = confianza[0]["id"]
-            archivo = service.files().list(
-                q=f"'{confianza_id}' in parents and name = 'Desconfianza.mp3' and mimeType contains 'audio/' and trashed = false",
-                fields="files(id, name)"
-            ).execute().get("files", [])
-
-            if archivo:
-                nombre = archivo[0]["name"]
-                destino = os.path.join(carpeta_confianza, nombre)
-                request = service.files().get_media(fileId=archivo[0]["id"])
-                buffer = io.BytesIO()
-                downloader = MediaIoBaseDownload(buffer, request)
-                done = False
-                while not done:
-                    _, done = downloader.next_chunk()
-                with open(destino, "wb") as f:
-                    f.write(buffer.getvalue())
-                logging.info(f"✅ Guardado: {destino}")
-            else:
-                logging.warning("❌ No se encontró 'Desconfianza.mp3' en CONFIANZA.")
-        else:
-            logging.warning("❌ No se encontró la carpeta 'CONFIANZA'.")
-
-        # ─── CONTRAENTREGA ───
-        logging.info("📂 [Audio Contraentrega] Buscando en carpeta 'CONTRAENTREGA'…")
-
-        contraentrega = service.files().list(
-            q=f"'{CARPETA_AUDIOS_DRIVE}' in parents and name = 'CONTRAENTREGA' and mimeType='application/vnd.google-apps.folder' and trashed = false",
-            fields="files(id, name)", pageSize=1
-        ).execute().get("files", [])
-
-        if contraentrega:
-            carpeta_id = contraentrega[0]["id"]
-            archivo = service.files().list(
-                q=f"'{carpeta_id}' in parents and name = 'CONTRAENTREGA.mp3' and mimeType contains 'audio/' and trashed = false",
-                fields="files(id, name)"
-            ).execute().get("files", [])
-
-            if archivo:
-                nombre = archivo[0]["name"]
-                destino = os.path.join(carpeta_contraentrega, nombre)
-                request = service.files().get_media(fileId=archivo[0]["id"])
-                buffer = io.BytesIO()
-                downloader = MediaIoBaseDownload(buffer, request)
-                done = False
-                while not done:
-                    _, done = downloader.next_chunk()
-                with open(destino, "wb") as f:
-                    f.write(buffer.getvalue())
-                logging.info(f"✅ Guardado: {destino}")
-            else:
-                logging.warning("❌ No se encontró 'CONTRAENTREGA.mp3' en CONTRAENTREGA.")
-        else:
-            logging.warning("❌ No se encontró la carpeta 'CONTRAENTREGA'.")
-
-        print(">>> descargar_audios_bienvenida_drive() – finalizado")
-
-    except Exception as e:
-        print(">>> EXCEPCIÓN en descargar_audios_bienvenida_drive:", e)
-        logging.error(f"❌ Error al descargar audios: {e}")
-
-
-
-
-# ─── Descarga del video de confianza desde Drive ─────────────────────────────
-CARPETA_VIDEO_CONFIANZA_DRIVE = "1uX0FXruTXLr2c5SHAc6thlIUMucN1hAA"  # Carpeta 'Video de confianza'
-
-def descargar_video_confianza():
-    """
-    Descarga el archivo .mp4 desde la carpeta 'Video de confianza' en Google Drive.
-    Guarda el archivo en /var/data/videos/video_confianza.mp4 si aún no existe.
-    """
-    try:
-        print(">>> descargar_video_confianza() – iniciando")
-        service = get_drive_service()
-        os.makedirs("/var/data/videos", exist_ok=True)
-
-        logging.info("📂 [Video Confianza] Iniciando descarga desde Drive…")
-        logging.info(f"🆔 Carpeta Drive: {CARPETA_VIDEO_CONFIANZA_DRIVE}")
-
-        # Buscar archivo .mp4 en la carpeta
-        archivos = service.files().list(
-            q=f"'{CARPETA_VIDEO_CONFIANZA_DRIVE}' in parents and mimeType='video/mp4' and trashed = false",
-            fields="files(id, name)",
-            pageSize=1
-        ).execute().get("files", [])
-
-        if not archivos:
-            logging.warning("⚠️ No se encontró ningún video .mp4 en la carpeta de confianza.")
-            return
-
-        archivo = archivos[0]
-        nombre_archivo = "video_confianza.mp4"
-        ruta_destino = os.path.join("/var/data/videos", nombre_archivo)
-
-        if os.path.exists(ruta_destino):
-            logging.info(f"📦 Ya existe: {nombre_archivo} — se omite descarga.")
-            return
-
-        logging.info(f"⬇️ Descargando video: {nombre_archivo}")
-        request = service.files().get_media(fileId=archivo["id"])
-        buffer = io.BytesIO()
-        downloader = MediaIoBaseDownload(buffer, request)
-
-        done = False
-        while not done:
-            _, done = downloader.next_chunk()
-
-        with open(ruta_destino, "wb") as f:
-            f.write(buffer.getvalue())
-
-        logging.info(f"✅ Video guardado: {ruta_destino}")
-        print(">>> descargar_video_confianza() – finalizado")
-
-    except Exception as e:
-        print(">>> EXCEPCIÓN en descargar_video_confianza:", e)
-        logging.error(f"❌ Error descargando video de confianza: {e}")
-
-def descargar_stickers_drive():
-    """
-    Descarga stickers desde subcarpetas de 'Stickers' en Google Drive.
-    Cada subcarpeta (ej: 'Sticker bienvenida') se guarda como prefijo del nombre del archivo.
-    Ejemplo: 'Sticker bienvenida/sticker1.webp' → /var/data/stickers/sticker_bienvenida_sticker1.webp
-    """
-    try:
-        print(">>> descargar_stickers_drive() – iniciando")
-        service = get_drive_service()
-        os.makedirs("/var/data/stickers", exist_ok=True)
-
-        logging.info("📂 [Stickers] Descargando desde subcarpetas temáticas…")
-        logging.info(f"🆔 Carpeta raíz: {CARPETA_STICKERS_DRIVE}")
-
-        # Buscar subcarpetas dentro de la carpeta 'Stickers'
-        subcarpetas = service.files().list(
-            q=f"'{CARPETA_STICKERS_DRIVE}' in parents and mimeType='application/vnd.google-apps.folder' and trashed = false",
-            fields="files(id, name)"
-        ).execute().get("files", [])
-
-        for sub in subcarpetas:
-            nombre_subcarpeta = sub["name"].lower().replace(" ", "_")  # Ej: 'Envio Gratis' → 'envio_gratis'
-            id_subcarpeta = sub["id"]
-
-            logging.info(f"🔎 Buscando en subcarpeta: {nombre_subcarpeta}")
-
-            archivos = service.files().list(
-                q=f"'{id_subcarpeta}' in parents and mimeType='image/webp' and trashed = false",
-                fields="files(id, name)"
-            ).execute().get("files", [])
-
-            for archivo in archivos:
-                nombre_archivo_original = archivo["name"]
-                nombre_archivo_local = f"{nombre_subcarpeta}_{nombre_archivo_original}"
-                ruta_destino = os.path.join("/var/data/stickers", nombre_archivo_local)
-
-                if os.path.exists(ruta_destino):
-                    logging.info(f"📦 Ya existe: {nombre_archivo_local} — omitiendo descarga.")
-                    continue
-
-                logging.info(f"⬇️ Descargando sticker: {nombre_archivo_local}")
-                request = service.files().get_media(fileId=archivo["id"])
-                buffer = io.BytesIO()
-                downloader = MediaIoBaseDownload(buffer, request)
-
-                done = False
-                while not done:
-                    _, done = downloader.next_chunk()
-
-                with open(ruta_destino, "wb") as f:
-                    f.write(buffer.getvalue())
-
-                logging.info(f"✅ Guardado: {ruta_destino}")
-
-        logging.info("🎉 Stickers descargados con éxito.")
-        print(">>> descargar_stickers_drive() – finalizado")
-
-    except Exception as e:
-        print(">>> EXCEPCIÓN en descargar_stickers_drive:", e)
-        logging.error(f"❌ Error al descargar stickers: {e}")
-
-
-
-# ─── Descarga de imágenes de catálogo desde Drive ───────────────────────
-CARPETA_CATALOGO_DRIVE = "1_liZvzlyNj2P8koFU4fgFp5X8icUh_ZA"  # Carpeta principal
-
-def descargar_imagenes_catalogo():
-    """
-    Descarga una imagen por subcarpeta de la carpeta 'Envio de Imagenes Catalogo'.
-    Guarda las imágenes en /var/data/modelos_video/. No repite si ya existen.
-    """
-    try:
-        print(">>> descargar_imagenes_catalogo() – iniciando")
-        service = get_drive_service()
-        os.makedirs("/var/data/modelos_video", exist_ok=True)
-
-        logging.info("📂 [Modelos Catálogo] Descargando imágenes desde Drive…")
-        logging.info(f"🆔 Carpeta raíz: {CARPETA_CATALOGO_DRIVE}")
-
-        # Obtener todas las subcarpetas (cada modelo-color)
-        subcarpetas = service.files().list(
-            q=f"'{CARPETA_CATALOGO_DRIVE}' in parents and mimeType='application/vnd.google-apps.folder' and trashed = false",
-            fields="files(id, name)"
-        ).execute().get("files", [])
-
-        for carpeta in subcarpetas:
-            nombre_carpeta = carpeta["name"]
-            id_carpeta = carpeta["id"]
-
-            logging.info(f"🔎 Buscando imagen en subcarpeta: {nombre_carpeta}")
-
-            # Buscar una imagen dentro de la subcarpeta
-            archivos = service.files().list(
-                q=f"'{id_carpeta}' in parents and mimeType contains 'image/' and trashed = false",
-                fields="files(id, name)",
-                pageSize=1
-            ).execute().get("files", [])
-
-            if not archivos:
-                logging.warning(f"⚠️ Sin imágenes en {nombre_carpeta}")
-                continue
-
-            imagen = archivos[0]
-            nombre_archivo = f"{nombre_carpeta}.jpg"
-            ruta_destino = os.path.join("/var/data/modelos_video", nombre_archivo)
-
-            if os.path.exists(ruta_destino):
-                logging.info(f"📦 Ya existe: {nombre_archivo} — omitiendo descarga.")
-                continue
-
-            logging.info(f"⬇️ Descargando imagen: {nombre_archivo}")
-            request = service.files().get_media(fileId=imagen["id"])
-            buffer = io.BytesIO()
-            downloader = MediaIoBaseDownload(buffer, request)
-
-            done = False
-            while not done:
-                _, done = downloader.next_chunk()
-
-            with open(ruta_destino, "wb") as f:
-                f.write(buffer.getvalue())
-
-            logging.info(f"✅ Imagen guardada: {ruta_destino}")
-
-        logging.info("🎉 Descarga de imágenes de catálogo completada.")
-        print(">>> descargar_imagenes_catalogo() – finalizado")
-
-    except Exception as e:
-        print(">>> EXCEPCIÓN en descargar_imagenes_catalogo:", e)
-        logging.error(f"❌ Error descargando imágenes de catálogo: {e}")
-
-# ─── Descarga de videos desde Drive ──────────────────────────────────────
-CARPETA_VIDEOS_DRIVE = "1bFJAuuW8JYWDMT74bGqQC6qBynZ_olBU"   # ⬅️ tu carpeta
-
-def descargar_videos_drive():
-    """
-    Descarga todos los .mp4 de la carpeta de Drive a /var/data/videos.
-    Solo baja los que aún no existan. Deja trazas en logs y prints.
-    """
-    try:
-        print(">>> descargar_videos_drive() – iniciando")
-        service = get_drive_service()
-        os.makedirs("/var/data/videos", exist_ok=True)
-
-        logging.info("📂 [Videos] Iniciando descarga desde Drive…")
-        logging.info(f"🆔 Carpeta Drive: {CARPETA_VIDEOS_DRIVE}")
-
-        resultados = service.files().list(
-            q=f"'{CARPETA_VIDEOS_DRIVE}' in parents and mimeType='video/mp4'",
-            fields="files(id, name, mimeType)"
-        ).execute()
-
-        archivos = resultados.get("files", [])
-        logging.info(f"🔎 {len(archivos)} archivo(s) .mp4 encontrados en la carpeta.")
-        print(">>> Encontrados en Drive:", [f['name'] for f in archivos])
-
-        for archivo in archivos:
-            nombre = archivo["name"]
-            id_video = archivo["id"]
-            ruta_destino = os.path.join("/var/data/videos", nombre)
-
-            if os.path.exists(ruta_destino):
-                logging.info(f"📦 Ya existe: {nombre} — se omite descarga.")
-                continue
-
-            logging.info(f"⬇️ Descargando {nombre}…")
-            request = service.files().get_media(fileId=id_video)
-            buffer = io.BytesIO()
-            downloader = MediaIoBaseDownload(buffer, request)
-
-            done = False
-            while not done:
-                _, done = downloader.next_chunk()
-
-            with open(ruta_destino, "wb") as f:
-                f.write(buffer.getvalue())
-
-            logging.info(f"✅ Guardado en {ruta_destino}")
-
-        logging.info("🎉 Descarga de videos completada.")
-        print(">>> descargar_videos_drive() – finalizado")
-
-    except Exception as e:
-        print(">>> EXCEPCIÓN en descargar_videos_drive:", e)
-        logging.error(f"❌ Error descargando videos desde Drive: {e}")
-
-# ─── Hook de arranque de FastAPI ─────────────────────────────────────────
-@api.on_event("startup")
-async def startup_download_videos():
-    descargar_videos_drive()
+# ─── Recursos de Drive que el bot necesita en /var/data ──────────────────
+CARPETA_EXTRA_DRIVE           = "1GF3rdTM0t81KRIb6xbQ1uNV4uC4A7LvE"   # lengüeta + métodos de pago
+CARPETA_AUDIOS_DRIVE          = "1-Htyzy4f8NgjkLJRv5hGZHdTXpRvz5mA"   # Carpeta raíz de 'Audios'
+CARPETA_VIDEO_CONFIANZA_DRIVE = "1uX0FXruTXLr2c5SHAc6thlIUMucN1hAA"   # Carpeta 'Video de confianza'
+CARPETA_CATALOGO_DRIVE        = "1_liZvzlyNj2P8koFU4fgFp5X8icUh_ZA"   # 'Envio de Imagenes Catalogo'
+CARPETA_VIDEOS_DRIVE          = "1bFJAuuW8JYWDMT74bGqQC6qBynZ_olBU"   # ⬅️ tu carpeta
+CARPETA_STICKERS_DRIVE        = os.environ.get("CARPETA_STICKERS_DRIVE", "")
+
+def _nombre_sticker(archivo: dict, subcarpeta: str | None) -> str:
+    # 'Sticker bienvenida/sticker1.webp' → sticker_bienvenida_sticker1.webp
+    return f"{subcarpeta.lower().replace(' ', '_')}_{archivo['name']}"
+
+def _nombre_modelo_catalogo(archivo: dict, subcarpeta: str | None) -> str:
+    return f"{subcarpeta}.jpg"
+
+REGLAS_DRIVE = [
+    ReglaSync("videos", CARPETA_VIDEOS_DRIVE, "/var/data/videos", "mimeType='video/mp4'"),
+    ReglaSync("catalogo", CARPETA_CATALOGO_DRIVE, "/var/data/modelos_video", "mimeType contains 'image/'",
+              por_subcarpeta=True, nombrar=_nombre_modelo_catalogo, max_por_carpeta=1),
+    ReglaSync("stickers", CARPETA_STICKERS_DRIVE, "/var/data/stickers", "mimeType='image/webp'",
+              por_subcarpeta=True, nombrar=_nombre_sticker),
+    ReglaSync("video_confianza", CARPETA_VIDEO_CONFIANZA_DRIVE, "/var/data/videos", "mimeType='video/mp4'",
+              nombrar=lambda a, s: "video_confianza.mp4", max_por_carpeta=1),
+    ReglaSync("audios_bienvenida", CARPETA_AUDIOS_DRIVE, "/var/data/audios/bienvenida", "mimeType contains 'audio/'",
+              subcarpeta="BIENVENIDA"),
+    ReglaSync("audio_confianza", CARPETA_AUDIOS_DRIVE, "/var/data/audios/confianza",
+              "name = 'Desconfianza.mp3' and mimeType contains 'audio/'", subcarpeta="CONFIANZA"),
+    ReglaSync("audio_contraentrega", CARPETA_AUDIOS_DRIVE, "/var/data/audios/contraentrega",
+              "name = 'CONTRAENTREGA.mp3' and mimeType contains 'audio/'", subcarpeta="CONTRAENTREGA"),
+    ReglaSync("lengueta", CARPETA_EXTRA_DRIVE, "/var/data/extra", "name = 'lengueta_ejemplo.jpg'", max_por_carpeta=1),
+    ReglaSync("metodos_pago", CARPETA_EXTRA_DRIVE, "/var/data/extra", "name = 'metodosdepago.jpeg'", max_por_carpeta=1),
+]
+
+DRIVE_CAMBIOS_SEG = float(os.environ.get("DRIVE_CAMBIOS_SEG", 60))
+
+def _reglas_drive_activas() -> list[ReglaSync]:
+    reglas = [r for r in REGLAS_DRIVE if r.carpeta]
+    if len(reglas) < len(REGLAS_DRIVE):
+        logging.warning("[SYNC] ⚠️ CARPETA_STICKERS_DRIVE no está configurada; se omiten los stickers")
+    return reglas
+
+def _al_cambiar_drive(resumen: dict):
+    """Tras bajar/borrar recursos: recalienta la caché de medios y revisa el índice de embeddings."""
+    medios.precargar(medios_para_precargar())
+    recargar_indice_catalogo()
+
+_vigilante_drive: VigilanteCambiosDrive | None = None
+
+def vigilante_drive() -> VigilanteCambiosDrive:
+    global _vigilante_drive
+    if _vigilante_drive is None:
+        _vigilante_drive = VigilanteCambiosDrive(
+            SincronizadorDrive(get_drive_service), _reglas_drive_activas(), al_cambiar=_al_cambiar_drive
+        )
+    return _vigilante_drive
+
+def sincronizar_recursos_drive() -> dict | None:
+    """Arranque: aplica los cambios desde el último cursor y baja completas las reglas que el cursor no cubre."""
+    return vigilante_drive().arrancar()
+
+async def vigilar_drive():
+    """Cada DRIVE_CAMBIOS_SEG segundos: una llamada a changes.list y, si hace falta, sync incremental."""
+    while True:
+        await asyncio.sleep(DRIVE_CAMBIOS_SEG)
+        if arranque.componentes["drive"] == "pendiente":
+            continue                                   # la sincronización de arranque sigue en curso
+        try:
+            await asyncio.to_thread(vigilante_drive().revisar)
+        except Exception as e:
+            logging.error(f"[SYNC] ❌ Error revisando cambios de Drive: {e}")
 
 # ─── Resto de tu código (rutas, responder(), etc.) ───────────────────────
 # …
@@ -610,13 +289,9 @@ ultimo_msg = {}
 CLIENTES_JSON_FILE_ID = "13euT2mtVwO4qWjhiWNAo-0DZFPTmjy0X"
 DURACION_MEMORIA_DIAS = 30
 
-def get_drive_service():
-    creds_json = os.getenv("GOOGLE_CREDS_JSON")
-    creds_dict = json.loads(creds_json)
-    creds = service_account.Credentials.from_service_account_info(creds_dict, scopes=["https://www.googleapis.com/auth/drive"])
-    return build("drive", "v3", credentials=creds)
-
 def descargar_memoria_clientes():
+    from googleapiclient.http import MediaIoBaseDownload
+
     service = get_drive_service()
     request = service.files().get_media(fileId=CLIENTES_JSON_FILE_ID)
     fh = io.BytesIO()
@@ -635,6 +310,8 @@ def descargar_memoria_clientes():
     return memoria
 
 def subir_memoria_clientes(memoria_dict):
+    from googleapiclient.http import MediaIoBaseUpload
+
     service = get_drive_service()
 
     # 🔁 Primero escribe el JSON como texto
@@ -663,21 +340,163 @@ def limpiar_memoria_vencida(memoria):
             nueva_memoria[numero] = datos
     return nueva_memoria
 
+def _cliente_vencido(datos: dict, ahora: datetime) -> bool:
+    try:
+        fecha = datetime.fromisoformat(datos.get("fecha", "2000-01-01"))
+    except (TypeError, ValueError):
+        return True
+    return ahora - fecha > timedelta(days=DURACION_MEMORIA_DIAS)
+
+# ─── Memoria de clientes en proceso (subida a Drive agrupada) ──────────
+CLIENTES_CACHE_LOCAL  = "/var/data/clientes_cache.json"
+CLIENTES_DEBOUNCE_SEG = float(os.environ.get("CLIENTES_DEBOUNCE_SEG", 15))   # silencio antes de subir
+CLIENTES_MAX_ESPERA_SEG = float(os.environ.get("CLIENTES_MAX_ESPERA_SEG", 120))
+CLIENTES_REINTENTO_SEG  = float(os.environ.get("CLIENTES_REINTENTO_SEG", 30))   # reintento de descarga si falló
+
+class MemoriaClientes:
+    """
+    clientes.json se descarga una sola vez; lecturas y escrituras van al dict
+    en memoria y los cambios se suben a Drive de forma agrupada (debounce).
+    Los registros vencidos se descartan al leerlos, no reescribiendo todo.
+
+    Si la descarga falla se trabaja con la copia local, pero no se sube nada
+    hasta que una descarga funcione (sería pisar clientes.json con una copia
+    vieja o vacía). La descarga se reintenta en los accesos siguientes y lo
+    que se escribió mientras tanto se aplica encima de lo descargado.
+    """
+
+    def __init__(self):
+        self._datos: dict | None = None
+        self._de_drive = False         # True cuando _datos salió de una descarga que funcionó
+        self._ultimo_intento = 0.0     # monotonic de la última descarga intentada
+        self._cambiados: set = set()   # números escritos antes de poder descargar
+        self._lock = threading.Lock()
+        self._primer_cambio = None     # monotonic del primer cambio sin subir
+        self._ultimo_cambio = None
+        self._version = 0              # sube con cada cambio; evita perder los que llegan durante la subida
+
+    def _asegurar_cargada(self, forzar: bool = False):
+        if self._de_drive:
+            return
+        with self._lock:
+            if self._de_drive:
+                return
+            ahora = time.monotonic()
+            if self._datos is not None and not forzar and ahora - self._ultimo_intento < CLIENTES_REINTENTO_SEG:
+                return
+            self._ultimo_intento = ahora
+            try:
+                descargados = descargar_memoria_clientes()
+            except Exception as e:
+                if self._datos is None:
+                    self._datos = self._leer_cache_local()
+                    logging.error(f"[CLIENTES] ❌ No pude descargar clientes.json: {e} — uso la copia local "
+                                  f"({len(self._datos)} clientes) y no subo nada hasta poder descargarlo")
+                else:
+                    logging.warning(f"[CLIENTES] ⚠️ Sigue fallando la descarga de clientes.json: {e}")
+                return
+            for numero in self._cambiados:              # lo escrito sin Drive va encima de lo descargado
+                if self._datos and numero in self._datos:
+                    descargados[numero] = self._datos[numero]
+            self._datos = descargados
+            self._cambiados.clear()
+            self._de_drive = True
+            logging.info(f"[CLIENTES] 🧠 Memoria cargada: {len(self._datos)} clientes")
+
+    @staticmethod
+    def _leer_cache_local() -> dict:
+        try:
+            with open(CLIENTES_CACHE_LOCAL, "r", encoding="utf-8") as f:
+                return json.load(f)
+        except (FileNotFoundError, json.JSONDecodeError):
+            return {}
+
+    def _marcar_cambio(self):
+        ahora = time.monotonic()
+        self._primer_cambio = self._primer_cambio or ahora
+        self._ultimo_cambio = ahora
+        self._version += 1
+
+    def obtener(self, numero):
+        self._asegurar_cargada()
+        with self._lock:
+            datos = self._datos.get(numero)
+            if datos is not None and _cliente_vencido(datos, datetime.now()):
+                del self._datos[numero]
+                self._marcar_cambio()
+                return None
+            return dict(datos) if datos is not None else None
+
+    def actualizar(self, numero, nuevos_datos: dict):
+        self._asegurar_cargada()
+        with self._lock:
+            cliente = self._datos.get(numero, {})
+            if cliente and _cliente_vencido(cliente, datetime.now()):
+                cliente = {}
+            cliente = {**cliente, **nuevos_datos, "fecha": datetime.now().isoformat()}
+            self._datos[numero] = cliente
+            if not self._de_drive:
+                self._cambiados.add(numero)
+            self._marcar_cambio()
+
+    def pendiente(self) -> bool:
+        return self._primer_cambio is not None
+
+    def sincronizar(self, forzar: bool = False) -> bool:
+        """Sube a Drive si hay cambios y ya pasó el debounce. Devuelve True si subió."""
+        if self._primer_cambio is None:
+            return False
+        if not self._de_drive:
+            self._asegurar_cargada(forzar=forzar)
+            if not self._de_drive:
+                logging.warning("[CLIENTES] ⚠️ clientes.json no se ha podido descargar; no subo para no pisarlo")
+                return False
+        with self._lock:
+            if self._primer_cambio is None:
+                return False
+            ahora = time.monotonic()
+            if not forzar and ahora - self._ultimo_cambio < CLIENTES_DEBOUNCE_SEG \
+                    and ahora - self._primer_cambio < CLIENTES_MAX_ESPERA_SEG:
+                return False
+            version = self._version
+            ahora_dt = datetime.now()
+            copia = {n: d for n, d in self._datos.items() if not _cliente_vencido(d, ahora_dt)}
+
+        try:
+            os.makedirs(os.path.dirname(CLIENTES_CACHE_LOCAL), exist_ok=True)
+            tmp = f"{CLIENTES_CACHE_LOCAL}.tmp"
+            with open(tmp, "w", encoding="utf-8") as f:
+                json.dump(copia, f, ensure_ascii=False)
+            os.replace(tmp, CLIENTES_CACHE_LOCAL)
+        except OSError as e:
+            logging.warning(f"[CLIENTES] ⚠️ No pude escribir la copia local: {e}")
+
+        subir_memoria_clientes(copia)
+
+        with self._lock:
+            if self._version == version:          # nada nuevo mientras subíamos
+                self._primer_cambio = self._ultimo_cambio = None
+        logging.info(f"[CLIENTES] ☁️ clientes.json subido ({len(copia)} clientes)")
+        return True
+
+memoria_clientes = MemoriaClientes()
+
+async def sincronizar_memoria_clientes_periodicamente():
+    while True:
+        await asyncio.sleep(min(CLIENTES_DEBOUNCE_SEG, 5))
+        if not memoria_clientes.pendiente():
+            continue
+        try:
+            await en_hilo("drive", memoria_clientes.sincronizar)
+        except Exception as e:
+            logging.error(f"[CLIENTES] ❌ Error subiendo clientes.json (se reintenta): {e}")
+
 def actualizar_cliente(numero, nuevos_datos):
-    memoria = descargar_memoria_clientes()
-    memoria = limpiar_memoria_vencida(memoria)
-    cliente = memoria.get(numero, {})
-    cliente.update(nuevos_datos)
-    cliente["fecha"] = datetime.now().isoformat()
-    memoria[numero] = cliente
-    subir_memoria_clientes(memoria)
+    memoria_clientes.actualizar(numero, nuevos_datos)
 
 def obtener_datos_cliente(numero):
-    memoria = descargar_memoria_clientes()
-    memoria = limpiar_memoria_vencida(memoria)
-    return memoria.get(numero)
+    return memoria_clientes.obtener(numero)
 
-client = AsyncOpenAI(api_key=os.getenv("OPENAI_API_KEY"))
 
 async def generar_audio_openai(texto: str,
                                nombre_archivo: str = "respuesta.mp3",
@@ -743,10 +562,21 @@ async def detectar_ciudad(texto: str, client) -> str:
 
 
 
-# CLIP: cargar modelo una sola vez
-clip_model = CLIPModel.from_pretrained("openai/clip-vit-base-patch32")
-clip_model.eval()
-clip_processor = CLIPProcessor.from_pretrained("openai/clip-vit-base-patch32")
+# CLIP: se carga una sola vez, en segundo plano durante el arranque (ver arranque_escalonado)
+clip_model = None
+clip_processor = None
+_lock_clip = threading.Lock()
+
+def cargar_clip():
+    global clip_model, clip_processor
+    with _lock_clip:
+        if clip_model is None:
+            from transformers import CLIPModel, CLIPProcessor
+            modelo = CLIPModel.from_pretrained("openai/clip-vit-base-patch32")
+            modelo.eval()
+            clip_processor = CLIPProcessor.from_pretrained("openai/clip-vit-base-patch32")
+            clip_model = modelo
+            logging.info("[CLIP] ✅ Modelo cargado")
 
 # Inicializa dotenv
 load_dotenv()
@@ -759,83 +589,131 @@ from fastapi.responses import JSONResponse
 @api.get("/ver_embeddings")
 async def ver_embeddings():
     try:
-        with open("var/data/embeddings.json", "r") as f:
-            data = json.load(f)
-
-        if not isinstance(data, dict):
-            return {"error": "Estructura inválida en embeddings.json"}
-
-        resumen = {
-            nombre: len(v) if isinstance(v, list) else 0
-            for nombre, v in data.items()
-        }
+        indice = await asyncio.to_thread(obtener_indice_catalogo)
+        conteos = np.bincount(indice.ids, minlength=len(indice.modelos)).tolist()
+        resumen = dict(zip(indice.modelos, conteos))
 
         return {
+            "version": indice.version,
+            "cargado_en": indice.cargado_en.isoformat() if indice.cargado_en else None,
             "total_modelos": len(resumen),
+            "total_vectores": len(indice),
             "modelos": resumen  # ejemplo: {"DS_277_NEGRO": 4, "SUPER_BLANCO": 3}
         }
 
     except Exception as e:
-        logging.error(f"[EMBEDDINGS] Error al leer embeddings.json: {e}")
+        logging.error(f"[EMBEDDINGS] Error al leer el índice de embeddings: {e}")
         return {"error": str(e)}
 
-# ✅ Desde el mismo JSON base
-creds_info = json.loads(os.environ["GOOGLE_CREDS_JSON"])
-
-# DRIVE → requiere scope explícito
-drive_creds = service_account.Credentials.from_service_account_info(
-    creds_info,
-    scopes=["https://www.googleapis.com/auth/drive.readonly"]
-)
-
-# VISION → no requiere scope personalizado
-vision_creds = service_account.Credentials.from_service_account_info(creds_info)
-
-# Servicios
-drive_service = build("drive", "v3", credentials=drive_creds)
-vision_client = vision.ImageAnnotatorClient(credentials=vision_creds)
+# VISION → un solo ImageAnnotatorClient, creado en el primer uso
+vision_client = _ClienteDiferido(apis_google.vision)
 # 🖼️ Convertir base64 a imagen PIL
 def decodificar_imagen_base64(base64_str: str) -> Image.Image:
     data = base64.b64decode(base64_str + "===")
     return Image.open(io.BytesIO(data)).convert("RGB")
 
 # 🧠 Embedding de imagen con CLIP (local, sin OpenAI)
+def generar_embeddings_lote_imagen(imgs: list[Image.Image]) -> np.ndarray:
+    if clip_model is None:
+        cargar_clip()
+    inputs = clip_processor(images=imgs, return_tensors="pt")
+    with torch.inference_mode():
+        vecs = clip_model.get_image_features(**inputs)
+    return vecs.cpu().numpy()  # → ndarray de shape (N, 512)
+
 def generar_embedding_imagen(img: Image.Image) -> np.ndarray:
-    inputs = clip_processor(images=img, return_tensors="pt")
-    with torch.no_grad():
-        vec = clip_model.get_image_features(**inputs)[0]
-    return vec.cpu().numpy()  # → ndarray de shape (512,)
-import torch
-import torch.nn.functional as F
+    return generar_embeddings_lote_imagen([img])[0]  # → ndarray de shape (512,)
 
-# 🔍 Comparar embedding de la imagen con los embeddings precargados
-def comparar_embeddings_clip(embedding_cliente: np.ndarray, embeddings_dict: dict):
-    import torch.nn.functional as F
-    embedding_cliente = torch.tensor(embedding_cliente)
-    embedding_cliente = F.normalize(embedding_cliente, dim=-1)
+# ⚡ Micro-lotes de CLIP: agrupa fotos que llegan casi juntas en una sola pasada
+CLIP_LOTE_MAX      = int(os.environ.get("CLIP_LOTE_MAX", 8))
+CLIP_ESPERA_MAX_MS = float(os.environ.get("CLIP_ESPERA_MAX_MS", 10))
+
+class ServidorCLIP:
+    """
+    Los handlers async llaman `await servidor_clip.embeber(img)`. Las solicitudes
+    se acumulan hasta `lote_max` o `espera_max_ms` y se procesan juntas en un
+    hilo dedicado, así el event loop nunca queda bloqueado por el forward de CLIP.
+    """
 
-    mejores = []
+    def __init__(self, lote_max: int = CLIP_LOTE_MAX, espera_max_ms: float = CLIP_ESPERA_MAX_MS):
+        self.lote_max   = max(1, lote_max)
+        self.espera_max = max(0.0, espera_max_ms) / 1000
+        self._pool  = ThreadPoolExecutor(max_workers=1, thread_name_prefix="clip")
+        self._cola: asyncio.Queue | None = None
+        self._tarea: asyncio.Task | None = None
+        self._loop  = None
+        self.metricas = {
+            "solicitudes": 0,
+            "lotes": 0,
+            "errores": 0,
+            "ultimo_lote": 0,
+            "lote_maximo": 0,
+            "tamanos_lote": defaultdict(int),   # {tamaño: cantidad de lotes}
+        }
 
-    for nombre_modelo, lista_vecs in embeddings_dict.items():
-        try:
-            max_sim = 0.0
-            for vec in lista_vecs:
-                emb_modelo = torch.tensor(vec)
-                emb_modelo = F.normalize(emb_modelo, dim=-1)
-                sim = torch.dot(embedding_cliente, emb_modelo).item()
-                if sim > max_sim:
-                    max_sim = sim
-            mejores.append((nombre_modelo, max_sim))
-        except Exception as e:
-            print(f"[ERROR EMBEDDING] {nombre_modelo}: {e}")
+    def _asegurar_tarea(self):
+        loop = asyncio.get_running_loop()
+        if self._loop is not loop or self._tarea is None or self._tarea.done():
+            self._loop  = loop
+            self._cola  = asyncio.Queue()
+            self._tarea = loop.create_task(self._bucle())
+
+    async def embeber(self, img: Image.Image) -> np.ndarray:
+        self._asegurar_tarea()
+        futuro = self._loop.create_future()
+        self.metricas["solicitudes"] += 1
+        self._cola.put_nowait((img, futuro))
+        return await futuro
+
+    async def _bucle(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            lote = [await self._cola.get()]
+            limite = loop.time() + self.espera_max
+            while len(lote) < self.lote_max:
+                while len(lote) < self.lote_max and not self._cola.empty():
+                    lote.append(self._cola.get_nowait())
+                restante = limite - loop.time()
+                if len(lote) >= self.lote_max or restante <= 0:
+                    break
+                await asyncio.sleep(min(restante, 0.002))
+
+            self.metricas["lotes"] += 1
+            self.metricas["ultimo_lote"] = len(lote)
+            self.metricas["lote_maximo"] = max(self.metricas["lote_maximo"], len(lote))
+            self.metricas["tamanos_lote"][len(lote)] += 1
+
+            try:
+                vecs = await loop.run_in_executor(
+                    self._pool, generar_embeddings_lote_imagen, [img for img, _ in lote]
+                )
+                for (_, futuro), vec in zip(lote, vecs):
+                    if not futuro.done():
+                        futuro.set_result(vec)
+            except Exception as e:
+                self.metricas["errores"] += 1
+                logging.error(f"[CLIP] ❌ Falló el lote de {len(lote)} imágenes: {e}")
+                for _, futuro in lote:
+                    if not futuro.done():
+                        futuro.set_exception(e)
 
-    if not mejores:
-        return None, 0.0
+    def estado(self) -> dict:
+        return {
+            "lote_max": self.lote_max,
+            "espera_max_ms": self.espera_max * 1000,
+            "profundidad_cola": self._cola.qsize() if self._cola else 0,
+            **{k: v for k, v in self.metricas.items() if k != "tamanos_lote"},
+            "tamanos_lote": dict(sorted(self.metricas["tamanos_lote"].items())),
+        }
 
-    mejores.sort(key=lambda x: x[1], reverse=True)
-    mejor_modelo, mejor_score = mejores[0]
+servidor_clip = ServidorCLIP()
 
-    return mejor_modelo, mejor_score
+@api.get("/metricas_clip")
+async def metricas_clip():
+    return servidor_clip.estado()
+# 🔍 Comparar embedding de la imagen con los embeddings precargados
+def comparar_embeddings_clip(embedding_cliente: np.ndarray, embeddings_dict: dict):
+    return CatalogIndex.desde_dict(embeddings_dict).buscar(embedding_cliente)
 
 # ————————————————————————————————————————————————————————————————
 # 🔍 Comparar imagen del cliente con base de modelos
@@ -853,81 +731,292 @@ def _a_unit(vec) -> np.ndarray:
     return arr / n
 
 # ──────────────────────────────────────────────────────────
-# 🔍  Detectar modelo con CLIP
-async def identificar_modelo_desde_imagen(base64_img: str) -> str:
-    logging.debug("🧠 [CLIP] Iniciando identificación de modelo...")
+# 📚  Índice vectorizado del catálogo (una sola matriz float32)
+class CatalogIndex:
+    """
+    Todas las referencias de embeddings.json en una matriz (N, 512) float32
+    ya normalizada. Las filas de un mismo modelo quedan contiguas y `ids`
+    guarda, por fila, la posición del modelo en `modelos`.
+    Una consulta = un producto matriz·vector + un máximo por segmento.
+    """
 
-    try:
-        # 1️⃣ Cargar y sanitizar embeddings
-        base = cargar_embeddings_desde_cache()
-        embeddings: dict[str, list[list[float]]] = {}
-        corruptos = []
-
-        for modelo, vecs in base.items():
-            if isinstance(vecs, list):
-                if len(vecs) == 512 and all(isinstance(x, (int, float)) for x in vecs):
-                    embeddings[modelo] = [vecs]
-                else:
-                    limpios = [v for v in vecs if isinstance(v, list) and len(v) == 512]
-                    if limpios:
-                        embeddings[modelo] = limpios
-                    else:
-                        corruptos.append((modelo, "sin_vectores_validos"))
-            else:
-                corruptos.append((modelo, "no_lista"))
+    def __init__(self, matriz: np.ndarray, ids: np.ndarray, modelos: list[str]):
+        self.matriz  = np.ascontiguousarray(matriz, dtype=np.float32)
+        self.ids     = np.asarray(ids, dtype=np.int32)
+        self.modelos = list(modelos)
+        self.version = None
+        self.cargado_en: datetime | None = None
+        # Primera fila de cada modelo → para np.maximum.reduceat
+        if self.ids.size:
+            cambios = np.flatnonzero(self.ids[1:] != self.ids[:-1]) + 1
+            self._inicios = np.concatenate(([0], cambios)).astype(np.intp)
+        else:
+            self._inicios = np.zeros(0, dtype=np.intp)
+
+    def __len__(self) -> int:
+        return int(self.matriz.shape[0])
 
+    @classmethod
+    def desde_dict(cls, base: dict) -> "CatalogIndex":
+        """Valida {modelo: [[512 floats], …]} (o un único vector) y arma la matriz."""
+        matriz, ids, modelos, corruptos = matriz_desde_dict(base)
         if corruptos:
             logging.warning(f"[CLIP] ⚠️ Embeddings corruptos filtrados: {corruptos[:5]} (total {len(corruptos)})")
-        logging.info(f"[CLIP] ✅ Embeddings listos: {len(embeddings)} modelos válidos")
+        logging.info(f"[CLIP] ✅ Índice listo: {len(modelos)} modelos, {matriz.shape[0]} vectores")
+        return cls(matriz, ids, modelos)
+
+    @classmethod
+    def desde_almacen(cls, directorio: str) -> "CatalogIndex":
+        """Abre el almacén binario con mmap (sin copiar la matriz a memoria propia)."""
+        matriz, ids, modelos, meta = cargar_almacen(directorio)
+        indice = cls(matriz, ids, modelos)
+        indice.version = meta["hash"]
+        logging.info(f"[CLIP] ✅ Almacén {meta['archivo']}: {len(modelos)} modelos, {meta['filas']} vectores")
+        return indice
+
+    def similitudes(self, emb) -> np.ndarray:
+        """Similitud coseno máxima por modelo (mismo orden que `modelos`)."""
+        if not len(self):
+            return np.zeros(0, dtype=np.float32)
+        q = _a_unit(emb).astype(np.float32)
+        return np.maximum.reduceat(self.matriz @ q, self._inicios)
+
+    def buscar(self, emb) -> tuple[str | None, float]:
+        """Devuelve (modelo, similitud) del mejor candidato o (None, 0.0)."""
+        sims = self.similitudes(emb)
+        if not sims.size:
+            return None, 0.0
+        k = int(np.argmax(sims))
+        if sims[k] <= 0:
+            return None, 0.0
+        return self.modelos[k], float(sims[k])
+
+
+_indice_catalogo: CatalogIndex | None = None
+_huella_embeddings = None
+_lock_indice = threading.Lock()
+EMBEDDINGS_RECARGA_SEG = float(os.environ.get("EMBEDDINGS_RECARGA_SEG", 30))
+
+def cargar_indice_catalogo() -> CatalogIndex:
+    """
+    Abre el almacén binario de embeddings. Si falta o es más viejo que
+    embeddings.json, lo regenera una vez desde el JSON (escritura atómica).
+    """
+    directorio = os.path.dirname(EMBEDDINGS_PATH)
+    if not almacen_vigente(directorio, EMBEDDINGS_PATH):
+        logging.info("[CLIP] 🔄 Convirtiendo embeddings.json al almacén binario…")
+        guardar_almacen(cargar_embeddings_desde_cache(), directorio)
+    return CatalogIndex.desde_almacen(directorio)
+
+def _huella_archivos_embeddings() -> tuple:
+    """(mtime, tamaño) de embeddings.json y del sidecar binario."""
+    huella = []
+    for ruta in (EMBEDDINGS_PATH, os.path.join(os.path.dirname(EMBEDDINGS_PATH), META_NOMBRE)):
+        try:
+            st = os.stat(ruta)
+            huella.append((st.st_mtime_ns, st.st_size))
+        except FileNotFoundError:
+            huella.append(None)
+    return tuple(huella)
 
-        # 2️⃣ Procesar imagen del cliente
-        img_pil = decodificar_imagen_base64(base64_img)
+def recargar_indice_catalogo(forzar: bool = False) -> bool:
+    """
+    Construye un índice nuevo si los archivos cambiaron y lo publica con una
+    sola asignación. Quien ya tomó el índice anterior sigue usándolo intacto.
+    Devuelve True si se publicó una versión nueva.
+    """
+    global _indice_catalogo, _huella_embeddings
+    with _lock_indice:
+        huella = _huella_archivos_embeddings()
+        if not forzar and _indice_catalogo is not None and huella == _huella_embeddings:
+            return False
 
-        # 🧪 INFO para verificar si la imagen está comprimida
-        logging.info(f"[IMG] Formato: {img_pil.format}")
-        logging.info(f"[IMG] Tamaño: {img_pil.size} px")
-        logging.info(f"[IMG] Modo de color: {img_pil.mode}")
-        logging.info(f"[IMG] Bytes base64 recibidos: {len(base64_img)}")
-        logging.info(f"[IMG] Tamaño estimado en bytes: {(len(base64_img) * 3) // 4} bytes aprox")
+        nuevo = cargar_indice_catalogo()
+        _huella_embeddings = _huella_archivos_embeddings()   # el JSON pudo generar un sidecar nuevo
 
-        emb_cliente = _a_unit(generar_embedding_imagen(img_pil))
+        actual = _indice_catalogo
+        if actual is not None and nuevo.version == actual.version:
+            return False
 
-        # 3️⃣ Buscar la mejor coincidencia
-        mejor_sim, mejor_modelo = 0.0, None
-        for modelo, lista in embeddings.items():
-            logging.debug(f"[CLIP] Comparando contra modelo: {modelo}")
-            for idx, emb_ref in enumerate(lista):
-                try:
-                    arr_ref = _a_unit(emb_ref)
-                    if arr_ref.shape != (512,):
-                        logging.warning(f"[CLIP] ⚠️ Shape inválido en {modelo}[{idx}]: {arr_ref.shape}")
-                        continue
+        nuevo.cargado_en = datetime.now()
+        _indice_catalogo = nuevo
+        logging.info(f"[CLIP] 🔁 Índice publicado — versión {str(nuevo.version)[:16]}")
+        return True
 
-                    sim = float((emb_cliente * arr_ref).sum())
-                    logging.debug(f"[CLIP] Similitud con {modelo}[{idx}]: {sim:.4f}")
+def obtener_indice_catalogo() -> CatalogIndex:
+    """Snapshot vigente del índice (se construye en el primer uso)."""
+    indice = _indice_catalogo
+    if indice is None:
+        recargar_indice_catalogo()
+        indice = _indice_catalogo
+    return indice
+
+async def vigilar_embeddings():
+    """Revisa cada EMBEDDINGS_RECARGA_SEG si embeddings.json / el almacén cambiaron."""
+    while True:
+        await asyncio.sleep(EMBEDDINGS_RECARGA_SEG)
+        try:
+            await asyncio.to_thread(recargar_indice_catalogo)
+            if _indice_catalogo is not None and not arranque.listo("indice"):
+                arranque.marcar("indice")
+        except FileNotFoundError:
+            logging.debug("[CLIP] Aún no hay embeddings para cargar")
+        except Exception:
+            logging.exception("[CLIP] ❌ Error recargando el índice de embeddings")
+
+# ─── Arranque escalonado: el puerto abre ya, lo pesado se calienta detrás ──
+class EstadoArranque:
+    """
+    Cada componente pasa de 'pendiente' a 'listo' o 'error'.
+      starting → todavía hay componentes calentándose
+      ready    → todos listos
+      degraded → terminó el arranque pero algún componente falló
+    Los textos se atienden desde el primer momento; fotos y medios se
+    habilitan a medida que sus dependencias quedan listas.
+    """
+    COMPONENTES = ("drive", "clip", "indice", "medios")
+
+    def __init__(self):
+        self.componentes = {c: "pendiente" for c in self.COMPONENTES}
+        self.errores: dict[str, str] = {}
+        self.inicio = time.monotonic()
+        self.tiempos: dict[str, float] = {}
+
+    def listo(self, *componentes: str) -> bool:
+        return all(self.componentes[c] == "listo" for c in componentes)
+
+    def marcar(self, componente: str, error: Exception | None = None):
+        self.componentes[componente] = "error" if error else "listo"
+        self.tiempos[componente] = round(time.monotonic() - self.inicio, 2)
+        if error:
+            self.errores[componente] = str(error)
+            logging.error(f"[ARRANQUE] ❌ {componente} falló: {error}")
+        else:
+            logging.info(f"[ARRANQUE] ✅ {componente} listo en {self.tiempos[componente]}s")
 
-                    if sim > mejor_sim:
-                        mejor_sim, mejor_modelo = sim, modelo
-                        logging.info(f"[CLIP] 🆕 Mejor modelo hasta ahora: {modelo} (sim={sim:.4f})")
+    @property
+    def estado(self) -> str:
+        valores = self.componentes.values()
+        if "pendiente" in valores:
+            return "starting"
+        return "ready" if all(v == "listo" for v in valores) else "degraded"
 
-                except Exception as err:
-                    logging.warning(f"[CLIP] ⚠️ Error comparando con {modelo}: {err}")
-                    continue
+    def resumen(self) -> dict:
+        return {"estado": self.estado, "componentes": dict(self.componentes),
+                "segundos": self.tiempos, "errores": self.errores}
 
-        logging.info(f"🎯 [CLIP] Coincidencia final: {mejor_modelo} (sim={mejor_sim:.4f})")
+arranque = EstadoArranque()
 
-        if mejor_modelo and mejor_sim >= 0.85:
-            return f"✅ La imagen coincide con *{mejor_modelo}*"
-        else:
-            return "❌ No pude identificar claramente el modelo. ¿Puedes enviar otra foto?"
+MENSAJE_IMAGENES_CALENTANDO = (
+    "🕐 Estoy terminando de preparar el reconocimiento de imágenes. "
+    "Envíame la foto de nuevo en un minuto o escríbeme el modelo que buscas 😊"
+)
 
-    except Exception as e:
-        logging.exception(f"[CLIP] ❌ Error general:")
-        return "⚠️ Ocurrió un problema analizando la imagen."
+def imagenes_listas() -> bool:
+    """CLIP cargado y un índice publicado (puede llegar después por vigilar_embeddings)."""
+    return clip_model is not None and _indice_catalogo is not None
 
+async def _calentar(componente: str, fn):
+    try:
+        await asyncio.to_thread(fn)
+        arranque.marcar(componente)
+    except Exception as e:
+        arranque.marcar(componente, e)
+
+async def _calentar_todo():
+    # Drive y CLIP en paralelo; los medios se codifican cuando Drive terminó de bajarlos
+    await asyncio.gather(
+        _calentar("drive", sincronizar_recursos_drive),
+        _calentar("clip", cargar_clip),
+        _calentar("indice", recargar_indice_catalogo),
+    )
+    await _calentar("medios", lambda: medios.precargar(medios_para_precargar()))
+    logging.info(f"[ARRANQUE] 🏁 Arranque terminado: {arranque.estado}")
+
+@api.on_event("startup")
+async def arranque_escalonado():
+    faltantes = [v for v in VARIABLES_REQUERIDAS if not os.environ.get(v)]
+    if faltantes:
+        logging.error(f"[ARRANQUE] ❌ Faltan variables de entorno: {', '.join(faltantes)}")
+    api.state.tarea_arranque   = asyncio.create_task(_calentar_todo())
+    api.state.tarea_embeddings = asyncio.create_task(vigilar_embeddings())
+    api.state.tarea_drive      = asyncio.create_task(vigilar_drive())
+    api.state.tarea_tokens     = asyncio.create_task(refrescar_tokens_google_periodicamente())
+    api.state.tarea_sheets     = asyncio.create_task(vaciar_sheets_periodicamente())
+
+@api.get("/healthz")
+async def healthz():
+    """Vivo: el proceso responde (no depende de que termine el arranque)."""
+    return {"ok": True, "estado": arranque.estado}
+
+@api.get("/readyz")
+async def readyz():
+    """503 mientras arranca; 200 en ready o degraded (se atiende, quizá sin fotos)."""
+    codigo = 503 if arranque.estado == "starting" else 200
+    return JSONResponse(arranque.resumen(), status_code=codigo)
+
+@api.on_event("startup")
+async def iniciar_sincronizacion_clientes():
+    api.state.tarea_clientes = asyncio.create_task(sincronizar_memoria_clientes_periodicamente())
+
+@api.on_event("shutdown")
+async def subir_clientes_al_apagar():
+    try:
+        await en_hilo("drive", memoria_clientes.sincronizar, forzar=True)
+    except Exception as e:
+        logging.error(f"[CLIENTES] ❌ No pude subir clientes.json al apagar: {e}")
+
+@api.on_event("shutdown")
+async def vaciar_sheets_al_apagar():
+    try:
+        await asyncio.to_thread(escritor_sheets.vaciar, forzar=True)
+    except Exception as e:
+        logging.error(f"[SHEETS] ❌ No pude vaciar la cola al apagar: {e}")
+    escritor_sheets.cerrar()                           # otro worker sigue enviando lo que quede
+    if escritor_sheets.pendientes():
+        logging.warning(f"[SHEETS] ⚠️ {escritor_sheets.pendientes()} filas quedan en {SHEETS_DIARIO} para el próximo arranque")
+
+# ──────────────────────────────────────────────────────────
+# 🔍  Detectar modelo con CLIP
+async def identificar_modelo_desde_imagen(base64_img: str) -> str:
+    logging.debug("🧠 [CLIP] Iniciando identificación de modelo...")
+
+    if not imagenes_listas():
+        return MENSAJE_IMAGENES_CALENTANDO
+
+    try:
+        # 1️⃣ Índice del catálogo (se valida y normaliza una sola vez)
+        indice = obtener_indice_catalogo()
+
+        # 2️⃣ Procesar imagen del cliente
+        img_pil = decodificar_imagen_base64(base64_img)
+
+        # 🧪 INFO para verificar si la imagen está comprimida
+        logging.info(f"[IMG] Formato: {img_pil.format}")
+        logging.info(f"[IMG] Tamaño: {img_pil.size} px")
+        logging.info(f"[IMG] Modo de color: {img_pil.mode}")
+        logging.info(f"[IMG] Bytes base64 recibidos: {len(base64_img)}")
+        logging.info(f"[IMG] Tamaño estimado en bytes: {(len(base64_img) * 3) // 4} bytes aprox")
+
+        emb_cliente = await servidor_clip.embeber(img_pil)
+
+        # 3️⃣ Buscar la mejor coincidencia (un solo producto matriz·vector)
+        mejor_modelo, mejor_sim = indice.buscar(emb_cliente)
+
+        logging.info(f"🎯 [CLIP] Coincidencia final: {mejor_modelo} (sim={mejor_sim:.4f})")
+
+        if mejor_modelo and mejor_sim >= 0.85:
+            return f"✅ La imagen coincide con *{mejor_modelo}*"
+        else:
+            return "❌ No pude identificar claramente el modelo. ¿Puedes enviar otra foto?"
+
+    except Exception as e:
+        logging.exception(f"[CLIP] ❌ Error general:")
+        return "⚠️ Ocurrió un problema analizando la imagen."
 
 
-DRIVE_FOLDER_ID = os.environ["DRIVE_FOLDER_ID"]
+
+DRIVE_FOLDER_ID = os.environ.get("DRIVE_FOLDER_ID", "")
 
 
 
@@ -955,74 +1044,299 @@ def convertir_palabras_a_numero(texto):
 
     return numero if numero else None
 
-import difflib
 import re
-import unicodedata
 
-def normalize(texto: str) -> str:
-    texto = texto.lower().strip()
-    texto = unicodedata.normalize("NFD", texto).encode("ascii", "ignore").decode("utf-8")
-    texto = re.sub(r'[^\w\s]', '', texto)  # quita signos de puntuación
-    return texto
+# Frases que deberían activar el catálogo
+FRASES_CATALOGO = [
+    "catalogo", "ver catalogo", "mostrar catalogo", "quiero ver",
+    "ver productos", "mostrar productos", "ver lo que tienes",
+    "ver tenis", "muestrame", "mostrar lo que tienes",
+    "que estilos tiene", "no tengo imagenes", "tienes imagenes",
+    "mandame el catalogo", "quiero ver modelos", "ver referencias",
+    "quiero referencias", "muestrame los modelos", "que modelos tienes",
+    "que modelos hay", "envielas", "mandame fotos", "mandame las imagenes",
+    "envielas usted", "quiero ver imagenes", "tenis que tienes",
+    "que hay", "quiero ver los pares", "muestra los tenis",
+    "cuales modelos tienes", "mande fotos", "muestrame los pares",
+    "ver opciones", "tienes fotos", "ver modelos disponibles",
+    "fotos de los modelos", "tienes mas fotos", "mostrar opciones",
+    "tienes modelos", "muestrame opciones"
+]
+
+# Variantes mal escritas o con errores frecuentes
+FRASES_CATALOGO_CON_ERRORES = [
+    "catlogo", "katalogo", "catalogoo", "ver katalago", "mostar catalogo",
+    "ber catalogo", "quiero bber", "mandame katalago", "quero ver modelos",
+    "quiero bel modelos", "kiero bel", "mandame modeloss", "ver referensias",
+    "enseñame loq tienes", "fotos modelos", "mandar catalogo", "ver modeloss",
+    "tenes imagenes", "imagenes de modelos", "enviar fotos", "mostrar pares"
+]
+
+# Índices difusos (difuso.py): mismas decisiones que difflib, sin un SequenceMatcher por frase
+VOCAB_CATALOGO = VocabularioDifuso(FRASES_CATALOGO + FRASES_CATALOGO_CON_ERRORES)
+VOCAB_PRECIO   = VocabularioDifuso(motor_intenciones.frases("pregunta_precio"))    # palabra por palabra, cutoff 0.8
 
 def menciona_catalogo(texto: str) -> bool:
     texto = normalize(texto)
 
-    # Frases que deberían activar el catálogo
-    claves_exactas = [
-        "catalogo", "ver catalogo", "mostrar catalogo", "quiero ver",
-        "ver productos", "mostrar productos", "ver lo que tienes",
-        "ver tenis", "muestrame", "mostrar lo que tienes",
-        "que estilos tiene", "no tengo imagenes", "tienes imagenes",
-        "mandame el catalogo", "quiero ver modelos", "ver referencias",
-        "quiero referencias", "muestrame los modelos", "que modelos tienes",
-        "que modelos hay", "envielas", "mandame fotos", "mandame las imagenes",
-        "envielas usted", "quiero ver imagenes", "tenis que tienes",
-        "que hay", "quiero ver los pares", "muestra los tenis",
-        "cuales modelos tienes", "mande fotos", "muestrame los pares",
-        "ver opciones", "tienes fotos", "ver modelos disponibles",
-        "fotos de los modelos", "tienes mas fotos", "mostrar opciones",
-        "tienes modelos", "muestrame opciones"
-    ]
-
-    # Variantes mal escritas o con errores frecuentes
-    claves_con_errores = [
-        "catlogo", "katalogo", "catalogoo", "ver katalago", "mostar catalogo",
-        "ber catalogo", "quiero bber", "mandame katalago", "quero ver modelos",
-        "quiero bel modelos", "kiero bel", "mandame modeloss", "ver referensias",
-        "enseñame loq tienes", "fotos modelos", "mandar catalogo", "ver modeloss",
-        "tenes imagenes", "imagenes de modelos", "enviar fotos", "mostrar pares"
-    ]
-
-    todas = claves_exactas + claves_con_errores
-
     # Coincidencia exacta en substrings normalizados
-    for fr in todas:
+    for fr in VOCAB_CATALOGO.frases:
         if fr in texto:
             return True
 
     # Coincidencias similares (difusas)
-    for frase in todas:
-        similares = difflib.get_close_matches(texto, [frase], n=1, cutoff=0.82)
-        if similares:
-            return True
-
-    return False
+    return VOCAB_CATALOGO.parecido(texto, cutoff=0.82)
 
 
 
 # ——— VARIABLES DE ENTORNO ——————————————————————————————————————————————
-OPENAI_API_KEY        = os.environ["OPENAI_API_KEY"]
+# Las obligatorias se validan al arrancar (arranque_escalonado), no al importar
+VARIABLES_REQUERIDAS  = ("OPENAI_API_KEY", "URL_SHEETS_INVENTARIO", "URL_SHEETS_PEDIDOS",
+                         "EMAIL_DEVOLUCIONES", "EMAIL_JEFE", "GOOGLE_CREDS_JSON", "DRIVE_FOLDER_ID")
+OPENAI_API_KEY        = os.environ.get("OPENAI_API_KEY", "")
 NOMBRE_NEGOCIO        = os.environ.get("NOMBRE_NEGOCIO", "X100🔥👟")
-URL_SHEETS_INVENTARIO = os.environ["URL_SHEETS_INVENTARIO"]
-URL_SHEETS_PEDIDOS    = os.environ["URL_SHEETS_PEDIDOS"]
-EMAIL_DEVOLUCIONES    = os.environ["EMAIL_DEVOLUCIONES"]
-EMAIL_JEFE            = os.environ["EMAIL_JEFE"]
+URL_SHEETS_INVENTARIO = os.environ.get("URL_SHEETS_INVENTARIO", "")
+URL_SHEETS_PEDIDOS    = os.environ.get("URL_SHEETS_PEDIDOS", "")
+EMAIL_DEVOLUCIONES    = os.environ.get("EMAIL_DEVOLUCIONES", "")
+EMAIL_JEFE            = os.environ.get("EMAIL_JEFE", "")
 SMTP_SERVER           = os.environ.get("SMTP_SERVER", "smtp.gmail.com")
 SMTP_PORT             = int(os.environ.get("SMTP_PORT", 587))
 EMAIL_REMITENTE       = os.environ.get("EMAIL_REMITENTE")
 EMAIL_PASSWORD        = os.environ.get("EMAIL_PASSWORD")
 
+# ─── Caché de medios codificados en base64 ─────────────────────────────
+MIB = 1024 * 1024
+MEDIOS_CACHE_MB = float(os.environ.get("MEDIOS_CACHE_MB", 256))   # MiB
+RESPUESTA_STREAMING = os.environ.get("VENOM_RESPUESTA_STREAMING", "1").lower() in ("1", "true", "si")
+TROZO_STREAMING = 3 * 64 * 1024          # múltiplo de 3: cada trozo se codifica sin relleno intermedio
+
+class MedioDiferido:
+    """
+    Marcador de un medio que se codifica al escribir la respuesta (ver
+    respuesta_venom), por trozos, en vez de vivir entero dentro del dict.
+    """
+    __slots__ = ("ruta", "prefijo")
+
+    def __init__(self, ruta: str, prefijo: str = ""):
+        self.ruta = ruta
+        self.prefijo = prefijo
+
+    def __repr__(self):
+        return f"MedioDiferido({self.ruta!r})"
+
+class CacheMedios:
+    """
+    Videos, audios, stickers e imágenes fijas codificados en base64 una sola vez.
+    Hay una entrada por archivo con el base64 limpio; el encabezado data URI
+    ("data:<mimetype>;base64,") se agrega al armar la respuesta, así el mismo
+    video pedido con y sin encabezado no se codifica ni se guarda dos veces.
+    Cada entrada guarda (mtime_ns, tamaño) del archivo: si el archivo cambia en
+    disco se vuelve a codificar. Las entradas menos usadas salen primero cuando
+    se supera el presupuesto de memoria (MEDIOS_CACHE_MB, en MiB).
+    """
+
+    def __init__(self, limite_bytes: int):
+        self.limite = limite_bytes
+        self.usado = 0
+        self._entradas: OrderedDict[str, tuple[tuple, str]] = OrderedDict()
+        self._lock = threading.Lock()
+        self.metricas = {"aciertos": 0, "fallos": 0, "expulsiones": 0}
+
+    def _en_cache(self, ruta: str, sello: tuple) -> str | None:
+        with self._lock:
+            entrada = self._entradas.get(ruta)
+            if entrada and entrada[0] == sello:
+                self._entradas.move_to_end(ruta)
+                self.metricas["aciertos"] += 1
+                return entrada[1]
+        return None
+
+    def _guardar(self, ruta: str, sello: tuple, texto: str):
+        with self._lock:
+            self.metricas["fallos"] += 1
+            viejo = self._entradas.pop(ruta, None)
+            if viejo:
+                self.usado -= len(viejo[1])
+            if len(texto) <= self.limite:
+                self._entradas[ruta] = (sello, texto)
+                self.usado += len(texto)
+                while self.usado > self.limite:
+                    _, (_, sacado) = self._entradas.popitem(last=False)
+                    self.usado -= len(sacado)
+                    self.metricas["expulsiones"] += 1
+
+    def _codificado(self, ruta: str) -> str:
+        st = os.stat(ruta)                       # FileNotFoundError igual que open()
+        sello = (st.st_mtime_ns, st.st_size)
+        texto = self._en_cache(ruta, sello)
+        if texto is not None:
+            return texto
+
+        with open(ruta, "rb") as f:
+            texto = base64.b64encode(f.read()).decode("utf-8")
+        self._guardar(ruta, sello, texto)
+        return texto
+
+    def trozos(self, medio: MedioDiferido, tam: int = TROZO_STREAMING):
+        """
+        Texto base64 de un medio diferido, por trozos. Si ya está en caché se
+        recorta la cadena guardada; si no, se lee y codifica el archivo por partes
+        y, si cabe en el presupuesto, los trozos quedan en caché al terminar
+        (`tam` es múltiplo de 3, así que unidos son el base64 del archivo entero).
+        Los que no caben no se guardan y la memoria por respuesta queda acotada por `tam`.
+        """
+        st = os.stat(medio.ruta)
+        sello = (st.st_mtime_ns, st.st_size)
+        texto = self._en_cache(medio.ruta, sello)
+
+        yield medio.prefijo
+        if texto is not None:
+            paso = tam * 4 // 3
+            for i in range(0, len(texto), paso):
+                yield texto[i:i + paso]
+            return
+
+        partes = [] if 4 * -(-st.st_size // 3) <= self.limite else None
+        with open(medio.ruta, "rb") as f:
+            while bloque := f.read(tam):
+                trozo = base64.b64encode(bloque).decode("ascii")
+                if partes is not None:
+                    partes.append(trozo)
+                yield trozo
+
+        st = os.stat(medio.ruta)
+        if partes is not None and (st.st_mtime_ns, st.st_size) == sello:     # no cambió mientras se leía
+            self._guardar(medio.ruta, sello, "".join(partes))
+        else:
+            with self._lock:
+                self.metricas["fallos"] += 1
+
+    def adjunto(self, ruta: str, mimetype: str, data_uri: bool = True) -> dict:
+        """
+        Campo de medio para un mensaje Venom: {"base64": …} o, con MEDIOS_POR_URL
+        activo y el archivo dentro de MEDIOS_RAIZ, {"url": …, "mimetype": …}
+        firmada para que Venom lo descargue por su cuenta.
+        El base64 va como MedioDiferido y solo respuesta_venom() lo sabe
+        serializar: sale por trozos() de la caché, con o sin streaming, sin
+        armar aparte una copia con el encabezado data URI.
+        """
+        url = url_firmada_medio(ruta) if MEDIOS_POR_URL else None
+        if url:
+            return {"url": url, "mimetype": mimetype}
+        os.stat(ruta)                        # falla aquí, no a mitad de la respuesta
+        return {"base64": MedioDiferido(ruta, f"data:{mimetype};base64," if data_uri else "")}
+
+    def precargar(self, rutas: list[str]):
+        """Codifica por adelantado los archivos de `rutas`."""
+        for ruta in rutas:
+            try:
+                self._codificado(ruta)
+            except FileNotFoundError:
+                continue
+            except Exception as e:
+                logging.warning(f"[MEDIOS] ⚠️ No pude precargar {ruta}: {e}")
+        logging.info(f"[MEDIOS] 📦 {len(self._entradas)} medios en caché ({self.usado / MIB:.1f} MiB)")
+
+    def estado(self) -> dict:
+        return {"entradas": len(self._entradas), "mib_usados": round(self.usado / MIB, 1),
+                "mib_limite": round(self.limite / MIB, 1), **self.metricas}
+
+medios = CacheMedios(int(MEDIOS_CACHE_MB * MIB))
+
+def medios_para_precargar() -> list[str]:
+    """Los medios fijos que se envían en el saludo, FAQs y cierre de compra."""
+    archivos = [
+        "/var/data/audios/bienvenida/bienvenida1.mp3",
+        "/var/data/audios/contraentrega/CONTRAENTREGA.mp3",
+        "/var/data/audios/confianza/Desconfianza.mp3",
+        "/var/data/videos/video_confianza.mp4",
+        "/var/data/stickers/catalogo_sticker_catalogo.webp",
+        "/var/data/stickers/sticker_fin_de_compra_sticker_final.webp",
+        "/var/data/extra/lengueta_ejemplo.jpg",
+        "/var/data/extra/metodosdepago.jpeg",
+    ]
+    carpeta = "/var/data/videos"
+    if os.path.isdir(carpeta):
+        for nombre in sorted(os.listdir(carpeta)):
+            if nombre.lower().endswith(".mp4") and "confianza" not in nombre.lower():
+                archivos.append(os.path.join(carpeta, nombre))
+    return archivos
+
+@api.get("/metricas_medios")
+async def metricas_medios():
+    return medios.estado()
+
+@api.get("/metricas_sheets")
+async def metricas_sheets():
+    return escritor_sheets.estado()
+
+# ─── Entrega de medios por URL firmada (opcional) ──────────────────────
+MEDIOS_RAIZ         = os.path.realpath("/var/data")
+MEDIOS_URL_BASE     = os.environ.get("MEDIOS_URL_BASE", "").rstrip("/")
+MEDIOS_URL_SECRETO  = os.environ.get("MEDIOS_URL_SECRETO", "")
+MEDIOS_URL_TTL_SEG  = int(os.environ.get("MEDIOS_URL_TTL_SEG", 600))
+MEDIOS_POR_URL      = os.environ.get("MEDIOS_POR_URL", "").lower() in ("1", "true", "si")
+MEDIOS_BLOQUE       = 256 * 1024
+
+if MEDIOS_POR_URL and not (MEDIOS_URL_BASE and MEDIOS_URL_SECRETO):
+    logging.warning("[MEDIOS] ⚠️ MEDIOS_POR_URL requiere MEDIOS_URL_BASE y MEDIOS_URL_SECRETO; se sigue enviando base64")
+    MEDIOS_POR_URL = False
+
+def _firma_medio(relativa: str, expira: int) -> str:
+    return hmac.new(MEDIOS_URL_SECRETO.encode(), f"{relativa}:{expira}".encode(), hashlib.sha256).hexdigest()
+
+def url_firmada_medio(ruta: str) -> str | None:
+    """URL de vida corta para un archivo bajo MEDIOS_RAIZ, o None si está fuera."""
+    real = os.path.realpath(ruta)
+    if not real.startswith(MEDIOS_RAIZ + os.sep):
+        return None
+    relativa = os.path.relpath(real, MEDIOS_RAIZ).replace(os.sep, "/")
+    expira = int(time.time()) + MEDIOS_URL_TTL_SEG
+    return f"{MEDIOS_URL_BASE}/medios/{quote(relativa)}?exp={expira}&firma={_firma_medio(relativa, expira)}"
+
+def _leer_rango(ruta: str, inicio: int, fin: int):
+    with open(ruta, "rb") as f:
+        f.seek(inicio)
+        restante = fin - inicio + 1
+        while restante > 0:
+            bloque = f.read(min(MEDIOS_BLOQUE, restante))
+            if not bloque:
+                break
+            restante -= len(bloque)
+            yield bloque
+
+@api.get("/medios/{relativa:path}")
+async def servir_medio(relativa: str, exp: int, firma: str, request: Request):
+    if exp < time.time() or not hmac.compare_digest(firma, _firma_medio(relativa, exp)):
+        return JSONResponse({"error": "firma inválida o vencida"}, status_code=403)
+
+    ruta = os.path.realpath(os.path.join(MEDIOS_RAIZ, relativa))
+    if not ruta.startswith(MEDIOS_RAIZ + os.sep) or not os.path.isfile(ruta):
+        return JSONResponse({"error": "no encontrado"}, status_code=404)
+
+    st = os.stat(ruta)
+    etag = f'"{st.st_mtime_ns:x}-{st.st_size:x}"'
+    tipo = mimetypes.guess_type(ruta)[0] or "application/octet-stream"
+    cabeceras = {"ETag": etag, "Accept-Ranges": "bytes", "Cache-Control": f"private, max-age={MEDIOS_URL_TTL_SEG}"}
+
+    if request.headers.get("if-none-match") == etag:
+        return Response(status_code=304, headers=cabeceras)
+
+    rango = re.fullmatch(r"bytes=(\d*)-(\d*)", request.headers.get("range", "").strip())
+    if not rango or rango.group(1) == rango.group(2) == "":
+        return FileResponse(ruta, media_type=tipo, headers=cabeceras)
+
+    if rango.group(1):
+        inicio = int(rango.group(1))
+        fin = min(int(rango.group(2)), st.st_size - 1) if rango.group(2) else st.st_size - 1
+    else:                                   # bytes=-N → últimos N bytes
+        inicio, fin = max(st.st_size - int(rango.group(2)), 0), st.st_size - 1
+    if inicio > fin or inicio >= st.st_size:
+        return Response(status_code=416, headers={**cabeceras, "Content-Range": f"bytes */{st.st_size}"})
+
+    cabeceras.update({"Content-Range": f"bytes {inicio}-{fin}/{st.st_size}", "Content-Length": str(fin - inicio + 1)})
+    return StreamingResponse(_leer_rango(ruta, inicio, fin), status_code=206, media_type=tipo, headers=cabeceras)
+
 async def enviar_welcome_venom(cid: str):
     try:
         audio_path = "/var/data/audios/bienvenida/bienvenida1.mp3"
@@ -1033,19 +1347,13 @@ async def enviar_welcome_venom(cid: str):
         if not existe:
             raise FileNotFoundError(f"❌ No se encontró el archivo: {audio_path}")
 
-        with open(audio_path, "rb") as f:
-            b64 = base64.b64encode(f.read()).decode("utf-8")
-            b64_final = f"data:audio/mpeg;base64,{b64}"  # ✅ encabezado MIME agregado
-
-        logging.info(f"🧪 Base64 generado correctamente — longitud: {len(b64)}")
-        logging.info(f"🧪 Base64 preview: {b64[:80]}...")
 
         return {
             "type": "multi",
             "messages": [
                 {
                     "type": "audio",
-                    "base64": b64_final,  # ✅ ahora con encabezado
+                    **medios.adjunto(audio_path, "audio/mpeg"),  # ✅ base64 con encabezado o URL firmada
                     "mimetype": "audio/mpeg",  # WhatsApp lo requiere así
                     "filename": "bienvenida1.mp3",
                     "text": "🎧 Escucha este audio de bienvenida."
@@ -1109,11 +1417,8 @@ def extraer_texto_comprobante(path: str) -> str:
             logging.error("[OCR] ❌ GOOGLE_CREDS_JSON no está definido en las variables de entorno.")
             return ""
 
-        credentials = service_account.Credentials.from_service_account_info(json.loads(creds_raw))
-        logging.info("[OCR] ✅ Credenciales cargadas correctamente")
-
-        # 2️⃣ Crear cliente
-        client = vision.ImageAnnotatorClient(credentials=credentials)
+        # 2️⃣ Cliente compartido (credenciales y canal gRPC ya abiertos)
+        client = apis_google.vision()
 
         # 3️⃣ Leer imagen
         with io.open(path, "rb") as image_file:
@@ -1176,10 +1481,8 @@ def es_comprobante_valido(texto: str) -> bool:
     for i, linea in enumerate(texto.splitlines()):
         logging.info(f"[OCR DEBUG] Línea {i}: {repr(linea)}")
 
-    # Normalizar texto
-    texto_normalizado = unicodedata.normalize("NFKD", texto).encode("ascii", "ignore").decode("utf-8")
-    texto_normalizado = texto_normalizado.lower()
-    texto_normalizado = re.sub(r"[^\w\s]", "", texto_normalizado)
+    # Normalizar texto (ASCII, minúsculas, sin puntuación)
+    texto_normalizado = sin_puntuacion(texto)
 
     logging.info("[OCR DEBUG] Texto normalizado:\n" + texto_normalizado)
 
@@ -1205,20 +1508,18 @@ def es_comprobante_valido(texto: str) -> bool:
 estado_usuario: dict[int, dict] = {}
 inventario_cache = None
 
+CLAVES_IMAGEN = (
+    "foto", "imagen", "pantallazo", "screenshot", "captura",
+    "tengo una foto", "te paso la imagen", "imagen del modelo",
+    "screen", "de instagram", "vi en insta", "historia de insta",
+    "la tengo guardada", "foto del tenis", "foto del zapato"
+)
+
 def menciona_imagen(texto: str) -> bool:
     texto = normalize(texto)
-    claves = [
-        "foto", "imagen", "pantallazo", "screenshot", "captura",
-        "tengo una foto", "te paso la imagen", "imagen del modelo",
-        "screen", "de instagram", "vi en insta", "historia de insta",
-        "la tengo guardada", "foto del tenis", "foto del zapato"
-    ]
-    return any(palabra in texto for palabra in claves)
+    return any(palabra in texto for palabra in CLAVES_IMAGEN)
 
-def normalize(text) -> str:
-    s = "" if text is None else str(text)
-    t = unicodedata.normalize('NFKD', s.strip().lower())
-    return "".join(ch for ch in t if not unicodedata.combining(ch))
+# normalize() vive en normalizacion.py (una sola versión, con caché)
 
 CONVERSION_TALLAS = {
     "usa": {
@@ -1299,42 +1600,194 @@ def reset_estado(cid: int):
     }
 
 def menu_botones(opts: list[str]):
+    from telegram import KeyboardButton, ReplyKeyboardMarkup
     return ReplyKeyboardMarkup([[KeyboardButton(o)] for o in opts], resize_keyboard=True)
 
-def obtener_inventario() -> list[dict]:
-    global inventario_cache
-    if inventario_cache is None:
+def disponible(item: dict) -> bool:
+    return normalize(item.get("stock","")) == "si"
+
+# ─── Inventario indexado (se arma una vez por descarga) ─────────────────
+class Inventario(list):
+    """
+    La lista de filas del Sheet, tal cual (se puede seguir iterando),
+    más índices hash con las claves ya normalizadas:
+      marca → modelos, modelo → colores, (modelo, color) → tallas
+      y (marca, modelo, color) → ítem.
+    """
+
+    def __init__(self, filas=()):
+        super().__init__(filas)
+        self._marcas: set[str] = set()
+        self._modelos_por_marca: dict[str, set[str]] = {}
+        self._colores_por_modelo: dict[str, set[str]] = {}
+        self._tallas: dict[tuple[str, str], set[str]] = {}
+        self._items: dict[tuple[str, str, str], dict] = {}
+        self._items_modelo_color: dict[tuple[str, str], dict] = {}
+
+        for i in self:
+            if not isinstance(i, dict):
+                continue
+            marca, modelo, color = (normalize(i.get(k, "")) for k in ("marca", "modelo", "color"))
+            # El primer ítem gana, igual que el next(...) que se usaba antes
+            self._items.setdefault((marca, modelo, color), i)
+            self._items_modelo_color.setdefault((modelo, color), i)
+            if not disponible(i):
+                continue
+            self._marcas.add(i.get("marca", "").strip())
+            self._modelos_por_marca.setdefault(marca, set()).add(i.get("modelo", "").strip())
+            self._colores_por_modelo.setdefault(modelo, set()).add(i.get("color", "").strip())
+            self._tallas.setdefault((modelo, color), set()).add(str(i.get("talla", "")).strip())
+
+    def marcas(self) -> list[str]:
+        return sorted(self._marcas)
+
+    def modelos(self, marca: str) -> list[str]:
+        return sorted(self._modelos_por_marca.get(normalize(marca), ()))
+
+    def colores(self, modelo: str) -> list[str]:
+        return sorted(self._colores_por_modelo.get(normalize(modelo), ()))
+
+    def tallas(self, modelo: str, color: str) -> list[str]:
+        return sorted(self._tallas.get((normalize(modelo), normalize(color)), ()))
+
+    def tallas_alias(self, modelo: str, colores_equivalentes: set[str]) -> list[str]:
+        """Tallas de los colores del modelo que contienen alguno de los equivalentes."""
+        modelo = normalize(modelo)
+        tallas = set()
+        for color in self._colores_por_modelo.get(modelo, ()):
+            color_n = normalize(color)
+            if any(eq in color_n for eq in colores_equivalentes):
+                tallas |= self._tallas.get((modelo, color_n), set())
+        return sorted(tallas)
+
+    def item(self, marca: str, modelo: str, color: str) -> dict | None:
+        return self._items.get((normalize(marca), normalize(modelo), normalize(color)))
+
+    def item_por_modelo_color(self, modelo: str, color: str) -> dict | None:
+        return self._items_modelo_color.get((normalize(modelo), normalize(color)))
+
+    def precio(self, marca: str, modelo: str, color: str, defecto=None):
+        item = self.item(marca, modelo, color)
+        return item["precio"] if item else defecto
+
+def como_inventario(inv) -> Inventario:
+    """Acepta un Inventario ya indexado o una lista cruda de filas."""
+    return inv if isinstance(inv, Inventario) else Inventario(inv or [])
+
+# ─── Caché del inventario: TTL + refresco en segundo plano ──────────────
+INVENTARIO_TTL_SEG       = float(os.environ.get("INVENTARIO_TTL_SEG", 300))
+INVENTARIO_REINTENTO_SEG = float(os.environ.get("INVENTARIO_REINTENTO_SEG", 30))
+INVENTARIO_SNAPSHOT      = "/var/data/inventario.json"     # última copia buena
+
+_inventario_hash = None
+_inventario_etag = None
+_inventario_vence = 0.0            # time.monotonic() a partir del cual está viejo
+_lock_inventario = threading.Lock()
+_tarea_inventario: asyncio.Task | None = None
+
+def _publicar_inventario(filas: list, firma: str):
+    global inventario_cache, _inventario_hash
+    inventario_cache = Inventario(filas)     # una sola asignación: los lectores ven el viejo o el nuevo
+    _inventario_hash = firma
+
+def _leer_snapshot_inventario() -> bool:
+    try:
+        with open(INVENTARIO_SNAPSHOT, "rb") as f:
+            crudo = f.read()
+        _publicar_inventario(json.loads(crudo), hashlib.sha256(crudo).hexdigest())
+    except (FileNotFoundError, json.JSONDecodeError):
+        return False
+    logging.info(f"[INVENTARIO] 💾 Copia local cargada: {len(inventario_cache)} filas")
+    return True
+
+def _guardar_snapshot_inventario(crudo: bytes):
+    try:
+        os.makedirs(os.path.dirname(INVENTARIO_SNAPSHOT), exist_ok=True)
+        tmp = f"{INVENTARIO_SNAPSHOT}.tmp"
+        with open(tmp, "wb") as f:
+            f.write(crudo)
+        os.replace(tmp, INVENTARIO_SNAPSHOT)
+    except OSError as e:
+        logging.warning(f"[INVENTARIO] ⚠️ No pude guardar la copia local: {e}")
+
+def refrescar_inventario() -> bool:
+    """
+    Descarga el inventario del Sheet. Solo reconstruye los índices si el
+    contenido cambió (ETag o sha256). Si falla, se queda con lo que había.
+    Devuelve True si se publicó una versión nueva.
+    """
+    global _inventario_etag, _inventario_vence
+    with _lock_inventario:
         try:
-            inventario_cache = requests.get(URL_SHEETS_INVENTARIO).json()
-        except:
-            inventario_cache = []
+            cabeceras = {"If-None-Match": _inventario_etag} if _inventario_etag and inventario_cache is not None else {}
+            r = requests.get(URL_SHEETS_INVENTARIO, headers=cabeceras, timeout=TIMEOUTS_IO["http"])
+            if r.status_code == 304:
+                _inventario_vence = time.monotonic() + INVENTARIO_TTL_SEG
+                return False
+            r.raise_for_status()
+            crudo = r.content
+            filas = json.loads(crudo)
+            if not isinstance(filas, list):
+                raise ValueError(f"respuesta inesperada: {type(filas).__name__}")
+        except Exception as e:
+            logging.error(f"[INVENTARIO] ❌ No pude refrescar el inventario: {e}")
+            if inventario_cache is None and not _leer_snapshot_inventario():
+                _publicar_inventario([], None)
+            _inventario_vence = time.monotonic() + INVENTARIO_REINTENTO_SEG
+            return False
+
+        _inventario_etag = r.headers.get("ETag")
+        _inventario_vence = time.monotonic() + INVENTARIO_TTL_SEG
+        firma = hashlib.sha256(crudo).hexdigest()
+        if firma == _inventario_hash and inventario_cache is not None:
+            return False
+
+        _publicar_inventario(filas, firma)
+        _guardar_snapshot_inventario(crudo)
+        logging.info(f"[INVENTARIO] 🔄 Inventario actualizado: {len(filas)} filas")
+        return True
+
+def obtener_inventario() -> Inventario:
+    """Versión bloqueante: arranque en frío desde la copia local o el Sheet; refresca si venció."""
+    if inventario_cache is None:
+        with _lock_inventario:
+            if inventario_cache is None:
+                _leer_snapshot_inventario()
+        if inventario_cache is None:
+            refrescar_inventario()
+    elif time.monotonic() >= _inventario_vence:
+        refrescar_inventario()
     return inventario_cache
 
-def disponible(item: dict) -> bool:
-    return normalize(item.get("stock","")) == "si"
+async def _refrescar_inventario_fondo():
+    try:
+        await en_hilo("http", refrescar_inventario)
+    except Exception as e:
+        logging.error(f"[INVENTARIO] ❌ Refresco en segundo plano falló: {e}")
+
+async def obtener_inventario_async() -> Inventario:
+    """
+    Devuelve el inventario en memoria sin esperar a Sheets (stale-while-revalidate):
+    si el TTL venció, dispara un único refresco en segundo plano.
+    """
+    global _tarea_inventario
+    if inventario_cache is None:
+        return await en_hilo("http", obtener_inventario)
+    if time.monotonic() >= _inventario_vence and (_tarea_inventario is None or _tarea_inventario.done()):
+        _tarea_inventario = asyncio.create_task(_refrescar_inventario_fondo())
+    return inventario_cache
 
 def obtener_marcas_unicas(inv: list[dict]) -> list[str]:
-    return sorted({i.get("marca","").strip() for i in inv if disponible(i)})
+    return como_inventario(inv).marcas()
 
 def obtener_modelos_por_marca(inv: list[dict], marca: str) -> list[str]:
-    return sorted({i.get("modelo","").strip()
-                   for i in inv
-                   if normalize(i.get("marca","")) == normalize(marca) and disponible(i)})
+    return como_inventario(inv).modelos(marca)
 
 def obtener_colores_por_modelo(inv: list[dict], modelo: str) -> list[str]:
-    return sorted({i.get("color", "").strip()
-                   for i in inv
-                   if normalize(i.get("modelo", "")) == normalize(modelo)
-                   and disponible(i)})
+    return como_inventario(inv).colores(modelo)
 
 def obtener_tallas_por_color(inv: list[dict], modelo: str, color: str) -> list[str]:
-    return sorted({
-        str(i.get("talla", "")).strip()
-        for i in inv
-        if normalize(i.get("modelo", "")) == normalize(modelo)
-        and normalize(i.get("color", "")) == normalize(color)
-        and disponible(i)
-    })
+    return como_inventario(inv).tallas(modelo, color)
 
 #  TRANSCRIPCIÓN DE AUDIO (WHISPER)
 # ───────────────────────────────────────────────────────────────
@@ -1342,7 +1795,6 @@ def obtener_tallas_por_color(inv: list[dict], modelo: str, color: str) -> list[s
 TEMP_AUDIO_DIR = "temp_audio"
 os.makedirs(TEMP_AUDIO_DIR, exist_ok=True)
 
-client = AsyncOpenAI(api_key=os.getenv("OPENAI_API_KEY"))
 
 async def transcribe_audio(file_path: str) -> str | None:
     """
@@ -1373,7 +1825,7 @@ async def transcribe_audio(file_path: str) -> str | None:
 
 # 🔥 Manejar preguntas frecuentes (FAQ)
 async def manejar_pqrs(update, ctx) -> bool:
-    txt = normalize(update.message.text or "")
+    txt = mensaje_de(update).normalizado
 
     faq_respuestas = {
         "garantia": "🛡️ Todos nuestros productos tienen *60 días de garantía* por defectos de fábrica.",
@@ -1406,7 +1858,7 @@ async def manejar_pqrs(update, ctx) -> bool:
 EMBEDDINGS_PATH = "/var/data/embeddings.json"
 
 def cargar_embeddings_desde_cache():
-    path = "/var/data/embeddings.json"
+    path = EMBEDDINGS_PATH
     if not os.path.exists(path):
         raise FileNotFoundError("No se encontró embeddings.json; ejecuta generar_embeddings.py primero.")
     with open(path, "r") as f:
@@ -1553,14 +2005,7 @@ async def manejar_imagen(update, ctx):
 # ─────────────────────────────────────────────────────────────
 def buscar_item(inv: list, marca: str, modelo: str, color: str):
     """Devuelve el dict del ítem que coincide 100 % o None."""
-    for i in inv:
-        if (
-            normalize(i["marca"])  == normalize(marca)  and
-            normalize(i["modelo"]) == normalize(modelo) and
-            normalize(i["color"])  == normalize(color)
-        ):
-            return i
-    return None
+    return como_inventario(inv).item(marca, modelo, color)
 
 
 # ─────────────────────────────────────────────────────────────
@@ -1634,23 +2079,10 @@ async def manejar_color_detectado(ctx, cid: str, color: str, inventario: list):
 # ───────────────────────────────────────────────────────────────
 
 def registrar_orden_unificada(data: dict, destino: str = "PEDIDOS") -> bool:
-    import gspread
-    from oauth2client.service_account import ServiceAccountCredentials
-
     try:
         logging.info(f"[SHEETS] ⇢ Intentando registrar en hoja: {destino}")
         logging.info(f"[SHEETS] Datos recibidos:\n{json.dumps(data, indent=2, ensure_ascii=False)}")
 
-        # Cargar credenciales desde variable de entorno
-        creds_dict = json.loads(os.getenv("GOOGLE_CREDS_JSON"))
-        scope = ["https://spreadsheets.google.com/feeds", "https://www.googleapis.com/auth/drive"]
-        creds = ServiceAccountCredentials.from_json_keyfile_dict(creds_dict, scope)
-        client = gspread.authorize(creds)
-
-        # Abrir archivo y hoja
-        sh = client.open("PEDIDOS")
-        sheet = sh.worksheet(destino)
-
         # Fecha actual
         fecha_actual = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
 
@@ -1691,12 +2123,13 @@ def registrar_orden_unificada(data: dict, destino: str = "PEDIDOS") -> bool:
             return False
 
         # Escribir
-        sheet.append_row(fila)
-        logging.info(f"[SHEETS] ✅ Fila escrita correctamente en hoja '{destino}'")
+        # Encolar: queda en el diario local y sale en el próximo lote
+        escritor_sheets.agregar(destino, fila)
+        logging.info(f"[SHEETS] 📝 Fila encolada para la hoja '{destino}'")
         return True
 
     except Exception as e:
-        logging.exception(f"[SHEETS] ❌ Error escribiendo en hoja '{destino}': {e}")
+        logging.exception(f"[SHEETS] ❌ Error encolando fila para la hoja '{destino}': {e}")
         return False
 
 
@@ -1750,12 +2183,9 @@ async def enviar_todos_los_videos(cid):
         for nombre in archivos:
             ruta = os.path.join(carpeta, nombre)
             try:
-                with open(ruta, "rb") as f:
-                    b64 = base64.b64encode(f.read()).decode("utf-8")
-
                 mensajes.append({
                     "type": "video",
-                    "base64": b64,
+                    **medios.adjunto(ruta, "video/mp4", data_uri=False),
                     "mimetype": "video/mp4",
                     "filename": nombre,
                     "text": f"🎥 Video: {nombre.replace('.mp4', '').replace('_', ' ').title()}"
@@ -1799,18 +2229,7 @@ def obtener_tallas_por_color_alias(inventario, modelo, color_usuario):
             colores_equivalentes.add(normalize(alias))
             colores_equivalentes.add(normalize(real))
 
-    tallas = set()
-    for item in inventario:
-        if normalize(item.get("modelo", "")) != normalize(modelo):
-            continue
-        if item.get("stock", "").lower() != "si":
-            continue
-
-        color_item = normalize(item.get("color", ""))
-        if any(color_equiv in color_item for color_equiv in colores_equivalentes):
-            tallas.add(str(item.get("talla", "")))
-
-    return sorted(tallas)
+    return como_inventario(inventario).tallas_alias(modelo, colores_equivalentes)
 
 def extraer_cm_y_convertir_talla(texto):
     import re
@@ -1882,54 +2301,177 @@ color_aliases = {
 for base_color in list(color_aliases.values()):
     color_aliases[base_color] = base_color
 
+COLORES_BASE = (
+    "negro", "blanco", "rojo", "azul", "amarillo", "verde",
+    "rosado", "gris", "morado", "naranja", "café", "beige",
+    "neón", "limón", "fucsia", "celeste", "aqua", "turquesa"
+)
+
 # 🧠 Detección especial para colores por video
+# (texto y alias se comparan sin tildes: "cafe" y "café" son el mismo color)
 def detectar_color_video(texto: str) -> str:
-    texto = texto.lower().strip()
+    texto = normalize(texto)
     for palabra, real_color in color_aliases.items():
-        if palabra in texto:
+        if normalize(palabra) in texto:
             return real_color
     for color in colores_video_modelos.get("referencias", {}):
-        if color in texto:
+        if normalize(color) in texto:
             return color
     return ""
 
 # 🎨 Detección general de colores
 def detectar_color(texto: str) -> str:
-    texto = texto.lower().strip()
+    texto = normalize(texto)
     for palabra, real_color in color_aliases.items():
-        if palabra in texto:
+        if normalize(palabra) in texto:
             return real_color
-    colores_base = [
-        "negro", "blanco", "rojo", "azul", "amarillo", "verde",
-        "rosado", "gris", "morado", "naranja", "café", "beige",
-        "neón", "limón", "fucsia", "celeste", "aqua", "turquesa"
-    ]
-    for c in colores_base:
-        if c in texto:
+    for c in COLORES_BASE:
+        if normalize(c) in texto:
             return c
     return ""
 
 
+# 🧾 Análisis de un mensaje entrante
+class MensajeAnalizado:
+    """
+    Lo que los handlers leen del texto de un mensaje, calculado una sola vez.
+    Cada atributo se calcula la primera vez que alguien lo pide y queda guardado.
+    procesar_wa lo crea y lo cuelga del update; responder y los manejar_* lo
+    toman con mensaje_de(update).
+    """
+
+    def __init__(self, crudo: str | None):
+        self.crudo = crudo or ""
+        self._tallas: dict[tuple, str | None] = {}
+
+    @functools.cached_property
+    def minusculas(self) -> str:
+        return self.crudo.lower()
+
+    @functools.cached_property
+    def normalizado(self) -> str:
+        return normalize(self.crudo)
+
+    @functools.cached_property
+    def palabras(self) -> tuple[str, ...]:
+        return palabras_normalizadas(self.crudo)
+
+    @functools.cached_property
+    def numeros(self) -> tuple[str, ...]:
+        return tuple(re.findall(r"\d+(?:\.\d+)?", self.normalizado))
+
+    @functools.cached_property
+    def intenciones(self) -> frozenset[str]:
+        """Intenciones sobre el texto normalizado (las que revisa responder)."""
+        return motor_intenciones.detectar(self.normalizado)
+
+    @functools.cached_property
+    def intenciones_minusculas(self) -> frozenset[str]:
+        """Intenciones sobre el texto solo en minúsculas, con tildes (las FAQ de procesar_wa)."""
+        return motor_intenciones.detectar(self.minusculas)
+
+    @functools.cached_property
+    def color(self) -> str:
+        return detectar_color(self.normalizado)
+
+    @functools.cached_property
+    def es_de_bucaramanga(self) -> bool:
+        return "es_bucaramanga" in self.intenciones
+
+    @functools.cached_property
+    def menciona_catalogo(self) -> bool:
+        return menciona_catalogo(self.normalizado)
+
+    def talla(self, tallas_disponibles) -> str | None:
+        clave = tuple(tallas_disponibles)
+        if clave not in self._tallas:
+            self._tallas[clave] = detectar_talla(self.crudo, list(clave))
+        return self._tallas[clave]
+
+def mensaje_de(update) -> MensajeAnalizado:
+    """El MensajeAnalizado del update (lo crea si el update no trae uno para este texto)."""
+    crudo = getattr(update.message, "text", None) or ""
+    analisis = getattr(update, "mensaje_analizado", None)
+    if analisis is None or analisis.crudo != crudo:
+        analisis = MensajeAnalizado(crudo)
+        try:
+            update.mensaje_analizado = analisis
+        except AttributeError:
+            pass                                       # telegram.Update no admite atributos nuevos
+    return analisis
+
+
+# 🔁 Un mensaje en curso dentro de responder
+class Turno:
+    """
+    Lo que comparten los pasos del flujo (flujo_responder) mientras atienden
+    un mensaje: el update, el estado del cliente, el inventario y el análisis
+    del texto. Si el mensaje era un audio, interrupcion_audio cambia el texto
+    por la transcripción con usar_texto() y los pasos siguientes ven esa.
+    """
+
+    def __init__(self, update, ctx, est: dict, inv):
+        self.update = update
+        self.ctx = ctx
+        self.cid = update.effective_chat.id
+        self.numero = str(self.cid)
+        self.est = est
+        self.inv = inv
+        self.usar_analisis(mensaje_de(update))          # texto, intenciones, color… calculados una vez
+        tallas = obtener_tallas_por_color_alias(inv, est.get("modelo", ""), est.get("color", ""))
+        if isinstance(tallas, (int, float, str)):
+            tallas = [str(tallas)]
+        self.tallas = tallas
+
+    def usar_analisis(self, analisis: MensajeAnalizado):
+        self.analisis = analisis
+        self.txt_raw = analisis.crudo
+        self.txt = analisis.normalizado
+        self.intenciones = analisis.intenciones
+
+    def usar_texto(self, crudo: str):
+        self.usar_analisis(MensajeAnalizado(crudo))
+
+
+# Fases en las que no se responde con IA (proteger cierre de venta)
+FASES_CRITICAS = (
+    "esperando_talla", "esperando_color", "esperando_nombre", "esperando_correo",
+    "esperando_telefono", "esperando_ciudad", "esperando_provincia", "esperando_direccion",
+    "esperando_pago", "esperando_comprobante", "imagen_detectada",
+    "esperando_video_referencia", "esperando_numero_rastreo",
+    "esperando_numero_devolucion", "esperando_motivo_devolucion",
+)
+
+# Pasos de responder, en el orden en que se revisan (flujo.py). Cada mensaje
+# recorre solo las interrupciones y los pasos de su fase. reset_estado() cambia
+# el dict de estado_usuario (turno.est queda viejo): la fase final se lee de ahí,
+# y si se borró el estado el próximo mensaje empieza en "inicio".
+flujo_responder = MaquinaFases(
+    fase_de=lambda turno: turno.est.get("fase", ""),
+    fase_final_de=lambda turno: estado_usuario.get(turno.cid, {"fase": "inicio"}).get("fase", ""),
+)
+
+
 # --------------------------------------------------------------------------------------------------
 
 async def responder(update: Update, ctx: ContextTypes.DEFAULT_TYPE):
     cid = update.effective_chat.id
-    numero = str(cid)
-    txt_raw = update.message.text or ""
-    txt = normalize(txt_raw)
    # Ya existe el usuario
     est = estado_usuario[cid]
-    inv = obtener_inventario()
-    tallas = obtener_tallas_por_color_alias(inv, est.get("modelo", ""), est.get("color", ""))
-    if isinstance(tallas, (int, float, str)):
-        tallas = [str(tallas)]
+    inv = await obtener_inventario_async()
+    turno = Turno(update, ctx, est, inv)
 
     print("🧠 FASE:", est.get("fase"))
-    print("🧠 TEXTO:", txt_raw, "|", repr(txt_raw))
+    print("🧠 TEXTO:", turno.txt_raw, "|", repr(turno.txt_raw))
     print("🧠 ESTADO:", est)
 
-    # 👋 Detectar saludo inicial y responder con bienvenida + videos
-    if any(p in txt for p in ("hola", "buenas", "buenos días", "buenas tardes", "buenas noches")):
+    return await flujo_responder.despachar(turno)
+
+# 👋 Detectar saludo inicial y responder con bienvenida + videos
+@flujo_responder.interrupcion(destinos=("esperando_modelo_elegido",))
+async def interrupcion_saludo(turno: Turno):
+    update, ctx, cid, txt_raw, intenciones, est = turno.update, turno.ctx, turno.cid, turno.txt_raw, turno.intenciones, turno.est
+    if "saludo" in intenciones:
         logging.info(f"👋 Saludo detectado: {txt_raw} — CID: {cid}")
 
         # 1. Mensaje de bienvenida
@@ -2002,14 +2544,14 @@ async def responder(update: Update, ctx: ContextTypes.DEFAULT_TYPE):
             await ctx.bot.send_message(cid, "❌ Hubo un error al cargar los videos.")
   
             return
+    return SIGUE
 
-    # 💬 Usuario pregunta por precios de modelos mostrados (uno o varios)
-    if est.get("modelos_enviados") and any(p in texto for p in (
-        "cuánto valen", "qué precio tienen", "cuánto cuestan", "precio de esos", "valen los",
-        "cuanto valen", "cuanto cuesta", "cuánto cuesta", "cuánto tienen de precio",
-        "valor de esos", "qué valor tienen", "dígame el precio", "dígame el valor",
-        "cual es el precio", "cual es el valor", "valor"
-    )):
+
+# 💬 Usuario pregunta por precios de modelos mostrados (uno o varios)
+@flujo_responder.interrupcion()
+async def interrupcion_precio_modelos_mostrados(turno: Turno):
+    cid, analisis, est, inv = turno.cid, turno.analisis, turno.est, turno.inv
+    if est.get("modelos_enviados") and "precio_modelos_mostrados" in analisis.intenciones_minusculas:
         modelos = est["modelos_enviados"]
         respuestas = []
 
@@ -2026,13 +2568,7 @@ async def responder(update: Update, ctx: ContextTypes.DEFAULT_TYPE):
                 est["color"] = color
                 estado_usuario[cid] = est
 
-                item = next(
-                    (i for i in inv if
-                     normalize(i["modelo"]) == normalize(modelo) and
-                     normalize(i["color"]) == normalize(color) and
-                     normalize(i["marca"]) == normalize(marca)),
-                    None
-                )
+                item = inv.item(marca, modelo, color)
 
                 if item and item.get("precio"):
                     precio = f"{int(item['precio']):,} COP"
@@ -2055,13 +2591,7 @@ async def responder(update: Update, ctx: ContextTypes.DEFAULT_TYPE):
             else:
                 continue
 
-            item = next(
-                (i for i in inv if
-                 normalize(i["modelo"]) == normalize(modelo) and
-                 normalize(i["color"]) == normalize(color) and
-                 normalize(i["marca"]) == normalize(marca)),
-                None
-            )
+            item = inv.item(marca, modelo, color)
 
             if item and item.get("precio"):
                 precio = f"{int(item['precio']):,} COP"
@@ -2079,25 +2609,20 @@ async def responder(update: Update, ctx: ContextTypes.DEFAULT_TYPE):
                 "text": "❌ No encontré los precios exactos de esos modelos. ¿Quieres que te los confirme manualmente?",
                 "parse_mode": "Markdown"
             }
+    return SIGUE
 
 
-
-    # 💰 Usuario pregunta por precio de modelo ya mostrado (sin repetir imagen)
+# 💰 Usuario pregunta por precio de modelo ya mostrado (sin repetir imagen)
+@flujo_responder.interrupcion()
+async def interrupcion_precio_modelo_actual(turno: Turno):
+    analisis, est, inv = turno.analisis, turno.est, turno.inv
     if est.get("modelo") and est.get("color"):
-        if any(palabra in texto for palabra in (
-            "cuánto vale", "cuanto vale", "precio", "cuánto cuesta", "cuanto cuesta", "vale los", "cuánto valen", "cuanto valen"
-        )):
+        if "precio_modelo_actual" in analisis.intenciones_minusculas:
             modelo = est["modelo"]
             color = est["color"]
             marca = est.get("marca", "DS")  # por defecto DS
 
-            item = next(
-                (i for i in inv if
-                 normalize(i["modelo"]) == normalize(modelo) and
-                 normalize(i["color"]) == normalize(color) and
-                 normalize(i["marca"]) == normalize(marca)),
-                None
-            )
+            item = inv.item(marca, modelo, color)
             if item and item.get("precio"):
                 precio = f"{int(item['precio']):,} COP"
                 return {
@@ -2113,263 +2638,238 @@ async def responder(update: Update, ctx: ContextTypes.DEFAULT_TYPE):
                     "type": "text",
                     "text": "❌ Aún no tengo registrado el precio exacto para ese modelo. ¿Te gustaría que lo consulte por ti?"
                 }
-
-    # ──────────────────────────────────────────────────────────────
-    # BLOQUE PRINCIPAL (§ Detecta color → muestra modelos → pregunta talla)
-    # ──────────────────────────────────────────────────────────────
-    # 🎨 1) El cliente menciona un color (p.e. “me gustaron los amarillos”)
-    if detectar_color(txt) and est.get("fase") not in {"esperando_modelo_elegido", "esperando_talla"}:
-        color = detectar_color(txt)
+    return SIGUE
+
+
+# ──────────────────────────────────────────────────────────────
+# BLOQUE PRINCIPAL (§ Detecta color → muestra modelos → pregunta talla)
+# ──────────────────────────────────────────────────────────────
+# 🎨 1) El cliente menciona un color (p.e. “me gustaron los amarillos”)
+@flujo_responder.interrupcion()
+async def interrupcion_color(turno: Turno):
+    ctx, cid, analisis, est, inv = turno.ctx, turno.cid, turno.analisis, turno.est, turno.inv
+    if analisis.color and est.get("fase") not in {"esperando_modelo_elegido", "esperando_talla"}:
+        color = analisis.color
         await manejar_color_detectado(ctx, cid, color, inv)
         return
+    return SIGUE
 
-    # ── 2) Cliente responde después de ver las imágenes ─────────
-    if est.get("fase") == "esperando_modelo_elegido":
-        modelos = est.get("modelos_enviados", [])
-        texto_normalizado = normalize(texto)
-
-        # 🚀 FLUJO DIRECTO: un solo modelo + “talla X” → pide lengüeta
-        if len(modelos) == 1 and (m := re.search(r"talla\s*(\d{1,2})", texto_normalizado)):
-            est["modelo"] = modelos[0]
-            est["talla"]  = m.group(1)
-
-            # Guardar precio inmediato
-            marca, modelo, color_archivo = (est["modelo"].split(maxsplit=2) + ["", "", ""])[:3]
-            est.update({"marca": marca, "color": color_archivo})
-            if (item := buscar_item(inv, marca, modelo, color_archivo)):
-                est["precio_total"] = int(item["precio"])
-
-            est["fase"] = "esperando_talla"  # fase que pide la foto de lengüeta
-            estado_usuario[cid] = est
-
-            ruta_ejemplo = "/var/data/extra/lengueta_ejemplo.jpg"
-            if os.path.exists(ruta_ejemplo):
-                with open(ruta_ejemplo, "rb") as f:
-                    b64 = base64.b64encode(f.read()).decode("utf-8")
-                return {
-                    "type": "multi",
-                    "messages": [
-                        {
-                            "type": "text",
-                            "text": (
-                                f"✅ ¡Claro que tenemos talla {est['talla']}! "
-                                "📸 Para confirmar la medida exacta, mándame una foto de la *lengüeta* "
-                                "del zapato que usas normalmente 👟."
-                            ),
-                            "parse_mode": "Markdown"
-                        },
-                        {
-                            "type": "photo",
-                            "base64": f"data:image/jpeg;base64,{b64}",
-                            "text": "Así debe verse la lengüeta. Envíame una foto parecida 📸"
-                        }
-                    ]
-                }
-            # Si no hay imagen de ejemplo
-            return {
-                "type": "text",
-                "text": (
-                    f"✅ ¡Claro que tenemos talla {est['talla']}! "
-                    "📸 Para confirmar la medida exacta, mándame una foto de la lengüeta del zapato que usas normalmente 👟."
-                ),
-                "parse_mode": "Markdown"
-            }
-
-
-        # ---------- Resto de tu lógica normal -------------------
-        faq_palabras = {
-            "envio", "pago", "garantia", "talla", "tallas",
-            "ubicacion", "donde", "horma", "precio", "costos"
-        }
-
-        # 1️⃣ Referencia numérica (ej. 305)
-        if (m := re.search(r"\b(\d{3})\b", texto)):
-            ref = m.group(1)
-            modelo_elegido = next((m for m in modelos if ref in m), None)
-            if not modelo_elegido:
-                await ctx.bot.send_message(
-                    cid,
-                    "❌ No encontré esa referencia entre las imágenes. "
-                    "Escríbela de nuevo o envíame la foto del modelo."
-                )
-                return
-            est["modelo"] = modelo_elegido
-
-        # 2️⃣ Una sola imagen + afirmación genérica
-        elif len(modelos) == 1:
-            afirmaciones = {
-                "si", "sí", "sii", "sisas", "de una", "dale", "hágale", "hagale",
-                "me gustaron", "me llevo esos", "quiero esos", "quiero esas",
-                "me encantaron", "esos", "esas", "ese", "esa"
-            }
-            if (
-                any(p in texto_normalizado for p in afirmaciones) and
-                not any(p in texto_normalizado for p in faq_palabras)
-            ):
-                est["modelo"] = modelos[0]
-
-        # 3️⃣ Pregunta directa por talla (una sola imagen) — ya cubierta arriba
-        # --------------------------------------------------------------
-
-        # 4️⃣ Si aún no sabemos qué modelo eligió
-        if "modelo" not in est:
-            await ctx.bot.send_message(
-                cid,
-                "❓ Dime cuál te gusto de las que te mande."
-            )
-            return
-
-        # ---------------- Manejo de talla cuando ya hay modelo -----------
-        match_talla_preg = re.search(
-            r"(tienen|hay|manejan|disponible).+talla\s+(\d{1,2})", texto_normalizado
-        )
-        match_talla = re.search(r"talla\s+(\d{1,2})", texto_normalizado)
 
-        if "talla" in est and est["talla"]:
-            talla = est["talla"]
-            mensaje_inicial = (
-                f"✅ Perfecto, tomaremos *{est['modelo']}* en talla *{talla}*.\n"
-            )
-        elif match_talla_preg:
-            talla = match_talla_preg.group(2)
-            est["talla"] = talla
-            mensaje_inicial = (
-                f"✅ ¡Claro que tenemos talla *{talla}* para el modelo *{est['modelo']}*!\n"
-            )
-        elif match_talla:
-            talla = match_talla.group(1)
-            est["talla"] = talla
-            mensaje_inicial = (
-                f"✅ Perfecto, tomaremos *{est['modelo']}* en talla *{talla}*.\n"
-            )
-        else:
-            mensaje_inicial = f"✅ Perfecto, tomaremos *{est['modelo']}*.\n"
+# ── 2) Cliente responde después de ver las imágenes ─────────
+@flujo_responder.fase("esperando_modelo_elegido", destinos=("esperando_talla",))
+async def fase_esperando_modelo_elegido(turno: Turno):
+    ctx, cid, analisis, est, inv = turno.ctx, turno.cid, turno.analisis, turno.est, turno.inv
+    modelos = est.get("modelos_enviados", [])
+    texto_normalizado = analisis.normalizado
 
-        # 🚨 Verifica el modelo
-        if not est.get("modelo"):
-            await ctx.bot.send_message(
-                cid,
-                "❓ Dime cuál referencias te gusto de las que te mande'."
-            )
-            return
+    # 🚀 FLUJO DIRECTO: un solo modelo + “talla X” → pide lengüeta
+    if len(modelos) == 1 and (m := re.search(r"talla\s*(\d{1,2})", texto_normalizado)):
+        est["modelo"] = modelos[0]
+        est["talla"]  = m.group(1)
 
-        # 📦 Guardar o actualizar precio
+        # Guardar precio inmediato
         marca, modelo, color_archivo = (est["modelo"].split(maxsplit=2) + ["", "", ""])[:3]
         est.update({"marca": marca, "color": color_archivo})
         if (item := buscar_item(inv, marca, modelo, color_archivo)):
             est["precio_total"] = int(item["precio"])
 
-        # Persistir y cambiar fase
-        est["fase"] = "esperando_talla"
+        est["fase"] = "esperando_talla"  # fase que pide la foto de lengüeta
         estado_usuario[cid] = est
 
-        # 🔁 Solicitar foto de lengüeta (si hay imagen ejemplo)
         ruta_ejemplo = "/var/data/extra/lengueta_ejemplo.jpg"
         if os.path.exists(ruta_ejemplo):
-            with open(ruta_ejemplo, "rb") as f:
-                b64 = base64.b64encode(f.read()).decode("utf-8")
             return {
                 "type": "multi",
                 "messages": [
                     {
                         "type": "text",
                         "text": (
-                            mensaje_inicial +
-                            "📸 Para confirmar la talla exacta, envíame una foto de la *lengüeta* "
+                            f"✅ ¡Claro que tenemos talla {est['talla']}! "
+                            "📸 Para confirmar la medida exacta, mándame una foto de la *lengüeta* "
                             "del zapato que usas normalmente 👟."
                         ),
                         "parse_mode": "Markdown"
                     },
                     {
                         "type": "photo",
-                        "base64": f"data:image/jpeg;base64,{b64}",
+                        **medios.adjunto(ruta_ejemplo, "image/jpeg"),
                         "text": "Así debe verse la lengüeta. Envíame una foto parecida 📸"
                     }
                 ]
             }
-
-        # Si no existe la imagen de ejemplo
+        # Si no hay imagen de ejemplo
         return {
             "type": "text",
             "text": (
-                mensaje_inicial +
-                "📸 Envíame la foto de la lengüeta de tu zapato para confirmar la medida 👟."
+                f"✅ ¡Claro que tenemos talla {est['talla']}! "
+                "📸 Para confirmar la medida exacta, mándame una foto de la lengüeta del zapato que usas normalmente 👟."
             ),
             "parse_mode": "Markdown"
         }
 
 
+    # ---------- Resto de tu lógica normal -------------------
+    # 1️⃣ Referencia numérica (ej. 305)
+    if (m := re.search(r"\b(\d{3})\b", analisis.minusculas)):
+        ref = m.group(1)
+        modelo_elegido = next((m for m in modelos if ref in m), None)
+        if not modelo_elegido:
+            await ctx.bot.send_message(
+                cid,
+                "❌ No encontré esa referencia entre las imágenes. "
+                "Escríbela de nuevo o envíame la foto del modelo."
+            )
+            return
+        est["modelo"] = modelo_elegido
 
-    # ─────────────────────────────────────────────
-    # 📦 RESPUESTA UNIVERSAL SI EL CLIENTE EXPRESA DESCONFIANZA
-    # ─────────────────────────────────────────────
-    texto_normalizado = normalize(txt)
-
-    frases_desconfianza = [
-        "no confio", "desconfio", "me han robado", "PERO YO COMO SE QUE NO ME VAN A ROBAR", "ya me robaron", "y si me roban",
-        "me estafaron", "ya me estafaron", "me hicieron el robo", "como se que no me van a robar",
-        "no quiero pagar anticipado", "no quiero dar plata antes", "no quiero enviar dinero sin ver",
-        "me da desconfianza", "me da miedo pagar", "no me da confianza", "me han tumbado",
-        "me hicieron fraude", "tengo miedo de pagar", "no tengo seguridad", "Como se que no me roban",
-        "quiero pagar al recibir", "pago al recibir", "solo contraentrega", "pago cuando llegue",
-        "cuando me lleguen pago", "Como se que no me van a robar", "pago cuando me llegue", "me tumbaron una vez",
-        "me jodieron", "ya me tumbaron", "no vuelvo a caer", "yo como se que no me roban", "eso me paso antes",
-        "no me sale el mensaje", "no me abre el link", "me han robado antes", "me da cosa pagar",
-        "no puedo pagar sin saber", "no mando dinero asi", "no conozco su tienda", "no estoy seguro",
-        "como se que es real", "como se que es confiable", "como saber si es real", "esto es confiable?",
-        "no tengo pruebas", "es seguro esto?", "no me siento comodo pagando", "mejor contraentrega",
-        "yo solo pago al recibir", "yo no pago antes", "a mi me han estafado", "me estafaron antes",
-        "me robaron antes", "y si no me llega", "y si no llega", "y si me estafan", "me robaron antes",
-        "ya me tumbaron plata", "me hicieron perder plata", "me quitaron la plata",
-        "me da miedo que me estafen", "esto no parece seguro", "no se ve seguro", "y si es mentira",
-        "y si es estafa", "robo", "yo no pago sin ver", "yo no mando plata asi", "robado",
-        "esto parece raro", "y si no cumplen", "y si no es verdad", "parece una estafa", "se ve raro",
-        "esto huele a estafa", "muy sospechoso", "no quiero perder plata", "no me arriesgo",
-        "no voy a arriesgar mi dinero"
-    ]
+    # 2️⃣ Una sola imagen + afirmación genérica
+    elif len(modelos) == 1:
+        detectadas = motor_intenciones.detectar(texto_normalizado)
+        if "eleccion_afirmativa" in detectadas and "menciona_faq" not in detectadas:
+            est["modelo"] = modelos[0]
 
-     # 🟥 Desconfianza: envía video + audio de confianza
-    if any(frase in texto_normalizado for frase in frases_desconfianza):
-        video_path = "/var/data/videos/video_confianza.mp4"
-        audio_path = "/var/data/audios/confianza/Desconfianza.mp3"
+    # 3️⃣ Pregunta directa por talla (una sola imagen) — ya cubierta arriba
+    # --------------------------------------------------------------
 
-        mensajes = [{
-            "type": "text",
-            "text": "🤝 Entendemos tu preocupación. Te compartimos este video para que veas que somos una tienda real y seria."
-        }]
+    # 4️⃣ Si aún no sabemos qué modelo eligió
+    if "modelo" not in est:
+        await ctx.bot.send_message(
+            cid,
+            "❓ Dime cuál te gusto de las que te mande."
+        )
+        return
 
-        if os.path.exists(video_path):
-            with open(video_path, "rb") as f:
-                mensajes.append({
-                    "type": "video",
-                    "base64": base64.b64encode(f.read()).decode("utf-8"),
-                    "mimetype": "video/mp4",
-                    "filename": "video_confianza.mp4",
-                    "text": "🎥 Mira este video corto de confianza:"
-                })
-        else:
-            mensajes.append({
-                "type": "text",
-                "text": "📹 No pudimos cargar el video en este momento, pero puedes confiar en nosotros. ¡Llevamos años vendiendo con éxito!"
-            })
+    # ---------------- Manejo de talla cuando ya hay modelo -----------
+    match_talla_preg = re.search(
+        r"(tienen|hay|manejan|disponible).+talla\s+(\d{1,2})", texto_normalizado
+    )
+    match_talla = re.search(r"talla\s+(\d{1,2})", texto_normalizado)
 
-        if os.path.exists(audio_path):
-            with open(audio_path, "rb") as f:
-                mensajes.append({
-                    "type": "audio",
-                    "base64": base64.b64encode(f.read()).decode("utf-8"),
-                    "mimetype": "audio/mpeg",
-                    "filename": "Desconfianza.mp3",
-                    "text": "🎧 Escucha este audio breve también:"
-                })
+    if "talla" in est and est["talla"]:
+        talla = est["talla"]
+        mensaje_inicial = (
+            f"✅ Perfecto, tomaremos *{est['modelo']}* en talla *{talla}*.\n"
+        )
+    elif match_talla_preg:
+        talla = match_talla_preg.group(2)
+        est["talla"] = talla
+        mensaje_inicial = (
+            f"✅ ¡Claro que tenemos talla *{talla}* para el modelo *{est['modelo']}*!\n"
+        )
+    elif match_talla:
+        talla = match_talla.group(1)
+        est["talla"] = talla
+        mensaje_inicial = (
+            f"✅ Perfecto, tomaremos *{est['modelo']}* en talla *{talla}*.\n"
+        )
+    else:
+        mensaje_inicial = f"✅ Perfecto, tomaremos *{est['modelo']}*.\n"
 
-        await reanudar_fase_actual(cid, ctx, est)
-        return {"type": "multi", "messages": mensajes}
+    # 🚨 Verifica el modelo
+    if not est.get("modelo"):
+        await ctx.bot.send_message(
+            cid,
+            "❓ Dime cuál referencias te gusto de las que te mande'."
+        )
+        return
 
-    # 🟨 Detección universal de color — funciona en cualquier fase
+    # 📦 Guardar o actualizar precio
+    marca, modelo, color_archivo = (est["modelo"].split(maxsplit=2) + ["", "", ""])[:3]
+    est.update({"marca": marca, "color": color_archivo})
+    if (item := buscar_item(inv, marca, modelo, color_archivo)):
+        est["precio_total"] = int(item["precio"])
+
+    # Persistir y cambiar fase
+    est["fase"] = "esperando_talla"
+    estado_usuario[cid] = est
+
+    # 🔁 Solicitar foto de lengüeta (si hay imagen ejemplo)
+    ruta_ejemplo = "/var/data/extra/lengueta_ejemplo.jpg"
+    if os.path.exists(ruta_ejemplo):
+        return {
+            "type": "multi",
+            "messages": [
+                {
+                    "type": "text",
+                    "text": (
+                        mensaje_inicial +
+                        "📸 Para confirmar la talla exacta, envíame una foto de la *lengüeta* "
+                        "del zapato que usas normalmente 👟."
+                    ),
+                    "parse_mode": "Markdown"
+                },
+                {
+                    "type": "photo",
+                    **medios.adjunto(ruta_ejemplo, "image/jpeg"),
+                    "text": "Así debe verse la lengüeta. Envíame una foto parecida 📸"
+                }
+            ]
+        }
+
+    # Si no existe la imagen de ejemplo
+    return {
+        "type": "text",
+        "text": (
+            mensaje_inicial +
+            "📸 Envíame la foto de la lengüeta de tu zapato para confirmar la medida 👟."
+        ),
+        "parse_mode": "Markdown"
+    }
+
+
+# ─────────────────────────────────────────────
+# 📦 RESPUESTA UNIVERSAL SI EL CLIENTE EXPRESA DESCONFIANZA
+# ─────────────────────────────────────────────
+@flujo_responder.interrupcion()
+async def interrupcion_desconfianza(turno: Turno):
+    ctx, cid, analisis, est = turno.ctx, turno.cid, turno.analisis, turno.est
+    texto_normalizado = analisis.normalizado
+
+     # 🟥 Desconfianza: envía video + audio de confianza
+    if "desconfianza" in motor_intenciones.detectar(texto_normalizado):
+        video_path = "/var/data/videos/video_confianza.mp4"
+        audio_path = "/var/data/audios/confianza/Desconfianza.mp3"
+
+        mensajes = [{
+            "type": "text",
+            "text": "🤝 Entendemos tu preocupación. Te compartimos este video para que veas que somos una tienda real y seria."
+        }]
+
+        if os.path.exists(video_path):
+            mensajes.append({
+                "type": "video",
+                **medios.adjunto(video_path, "video/mp4", data_uri=False),
+                "mimetype": "video/mp4",
+                "filename": "video_confianza.mp4",
+                "text": "🎥 Mira este video corto de confianza:"
+            })
+        else:
+            mensajes.append({
+                "type": "text",
+                "text": "📹 No pudimos cargar el video en este momento, pero puedes confiar en nosotros. ¡Llevamos años vendiendo con éxito!"
+            })
+
+        if os.path.exists(audio_path):
+            mensajes.append({
+                "type": "audio",
+                **medios.adjunto(audio_path, "audio/mpeg", data_uri=False),
+                "mimetype": "audio/mpeg",
+                "filename": "Desconfianza.mp3",
+                "text": "🎧 Escucha este audio breve también:"
+            })
+
+        await reanudar_fase_actual(cid, ctx, est)
+        return {"type": "multi", "messages": mensajes}
+    return SIGUE
+
+
+# 🟨 Detección universal de color — funciona en cualquier fase
+@flujo_responder.interrupcion(destinos=("esperando_modelo_elegido",))
+async def interrupcion_fotos_por_color(turno: Turno):
+    ctx, cid, analisis, txt, est, inv = turno.ctx, turno.cid, turno.analisis, turno.txt, turno.est, turno.inv
     try:
-        if detectar_color(txt):
-            color = detectar_color(txt)
+        if analisis.color:
+            color = analisis.color
             logging.info(f"[COLOR] Petición de color → {color} | CID: {cid}")
 
             ruta = "/var/data/modelos_video"
@@ -2407,12 +2907,7 @@ async def responder(update: Update, ctx: ContextTypes.DEFAULT_TYPE):
 
                 modelos_enviados.append(modelo_raw)
 
-                item = next(
-                    (i for i in inv if
-                     normalize(i["modelo"]) == normalize(modelo) and
-                     normalize(i["color"]) == normalize(color_archivo)),
-                    None
-                )
+                item = inv.item_por_modelo_color(modelo, color_archivo)
                 precio = f"{int(item['precio']):,} COP" if item else "Consultar"
 
                 try:
@@ -2463,11 +2958,15 @@ async def responder(update: Update, ctx: ContextTypes.DEFAULT_TYPE):
         logging.error(f"❌ Error en bloque de detección de color: {e}")
         await ctx.bot.send_message(cid, "❌ Ocurrió un problema al procesar el color. Intenta de nuevo.")
         return
- 
+    return SIGUE
 
-    # ──────────────────────────────────────────────────────
-    # 💬 DETECTOR UNIVERSAL — "me pagan el 30"
-    # ──────────────────────────────────────────────────────
+
+# ──────────────────────────────────────────────────────
+# 💬 DETECTOR UNIVERSAL — "me pagan el 30"
+# ──────────────────────────────────────────────────────
+@flujo_responder.interrupcion(destinos=("esperando_datos_pago_posterior",))
+async def interrupcion_pago_posterior(turno: Turno):
+    ctx, cid, txt, est = turno.ctx, turno.cid, turno.txt, turno.est
     if re.search(r"(me\s+pagan|me\s+consignan|me\s+depositan)(\s+el)?\s+\d{1,2}", txt, re.IGNORECASE):
         ctx.resp.append({
             "type": "text",
@@ -2483,82 +2982,88 @@ async def responder(update: Update, ctx: ContextTypes.DEFAULT_TYPE):
         est["fase"] = "esperando_datos_pago_posterior"
         estado_usuario[cid] = est
         return
+    return SIGUE
 
-    # ──────────────────────────────────────────────────────
-    # 📋 RECOLECCIÓN DE DATOS PARA LA HOJA "PENDIENTES"
-    # ──────────────────────────────────────────────────────
-    if est.get("fase") == "esperando_datos_pago_posterior":
-        try:
-            texto_limpio = txt_raw.replace("\n", " ").strip()
 
-            # 1️⃣ Modelo: primer número de 3-4 cifras
-            modelo_match = re.search(r"\b\d{3,4}\b", texto_limpio)
-            modelo = modelo_match.group(0) if modelo_match else ""
+# ──────────────────────────────────────────────────────
+# 📋 RECOLECCIÓN DE DATOS PARA LA HOJA "PENDIENTES"
+# ──────────────────────────────────────────────────────
+@flujo_responder.fase("esperando_datos_pago_posterior", destinos=("pausado_promesa",))
+async def fase_esperando_datos_pago_posterior(turno: Turno):
+    ctx, cid, txt_raw, est = turno.ctx, turno.cid, turno.txt_raw, turno.est
+    try:
+        texto_limpio = txt_raw.replace("\n", " ").strip()
 
-            # 2️⃣ Nombre: todo lo que va antes del modelo
-            nombre = texto_limpio.split(modelo)[0].strip() if modelo else ""
+        # 1️⃣ Modelo: primer número de 3-4 cifras
+        modelo_match = re.search(r"\b\d{3,4}\b", texto_limpio)
+        modelo = modelo_match.group(0) if modelo_match else ""
 
-            # 3️⃣ Día/hora: desde cualquier mención de fecha u hora en adelante
-            dia_hora_match = re.search(
-                r"(mañana|hoy|el\s+\d{1,2}\b|día\s+\d{1,2}\b|a\s+las\s+\d{1,2}(?:[:h]\d{2})?\s*(?:am|pm|a\.m\.|p\.m\.)?)",
-                texto_limpio, re.IGNORECASE
-            )
-            dia_hora = texto_limpio[dia_hora_match.start():].strip() if dia_hora_match else ""
-
-            if nombre and modelo and dia_hora:
-                datos_pendiente = {
-                    "Cliente":  nombre.title(),
-                    "Teléfono": cid,
-                    "Producto": modelo,
-                    "Pago":     dia_hora
-                }
+        # 2️⃣ Nombre: todo lo que va antes del modelo
+        nombre = texto_limpio.split(modelo)[0].strip() if modelo else ""
 
-                ok = registrar_orden_unificada(datos_pendiente, destino="PENDIENTES")
+        # 3️⃣ Día/hora: desde cualquier mención de fecha u hora en adelante
+        dia_hora_match = re.search(
+            r"(mañana|hoy|el\s+\d{1,2}\b|día\s+\d{1,2}\b|a\s+las\s+\d{1,2}(?:[:h]\d{2})?\s*(?:am|pm|a\.m\.|p\.m\.)?)",
+            texto_limpio, re.IGNORECASE
+        )
+        dia_hora = texto_limpio[dia_hora_match.start():].strip() if dia_hora_match else ""
+
+        if nombre and modelo and dia_hora:
+            datos_pendiente = {
+                "Cliente":  nombre.title(),
+                "Teléfono": cid,
+                "Producto": modelo,
+                "Pago":     dia_hora
+            }
 
-                if ok:
-                    ctx.resp.append({
-                        "type": "text",
-                        "text": (
-                            f"✅ ¡Listo {nombre.title()}! Te escribiremos {dia_hora} "
-                            f"para cerrar la compra del modelo {modelo.upper()} 🔥"
-                        )
-                    })
-                    est["fase"] = "pausado_promesa"
-                    est["pausa_hasta"] = (datetime.now() + timedelta(hours=48)).isoformat()
-                    estado_usuario[cid] = est
-                else:
-                    ctx.resp.append({
-                        "type": "text",
-                        "text": "⚠️ No pudimos registrar tu promesa de pago. Intenta nuevamente."
-                    })
-                return
+            ok = await en_hilo("sheets", registrar_orden_unificada, datos_pendiente, destino="PENDIENTES")
 
-            # ——— Datos incompletos ———
-            ctx.resp.append({
-                "type": "text",
-                "text": (
-                    "❌ Para agendar tu pago necesito 3 cosas:\n"
-                    "1️⃣ Tu *nombre*\n2️⃣ El *modelo* que te gustó\n3️⃣ *Día y hora* estimada para contactarte\n\n"
-                    "Ejemplo:\nJuan Pablo\nDS 298\nEl 30 a las 2 PM"
-                ),
-                "parse_mode": "Markdown"
-            })
+            if ok:
+                ctx.resp.append({
+                    "type": "text",
+                    "text": (
+                        f"✅ ¡Listo {nombre.title()}! Te escribiremos {dia_hora} "
+                        f"para cerrar la compra del modelo {modelo.upper()} 🔥"
+                    )
+                })
+                est["fase"] = "pausado_promesa"
+                est["pausa_hasta"] = (datetime.now() + timedelta(hours=48)).isoformat()
+                estado_usuario[cid] = est
+            else:
+                ctx.resp.append({
+                    "type": "text",
+                    "text": "⚠️ No pudimos registrar tu promesa de pago. Intenta nuevamente."
+                })
             return
 
-        except Exception as e:
-            logging.error(f"[PENDIENTES] ❌ Error registrando pago posterior: {e}")
-            ctx.resp.append({
-                "type": "text",
-                "text": "⚠️ Ocurrió un problema registrando tus datos. Intenta de nuevo más tarde."
-            })
-            return
+        # ——— Datos incompletos ———
+        ctx.resp.append({
+            "type": "text",
+            "text": (
+                "❌ Para agendar tu pago necesito 3 cosas:\n"
+                "1️⃣ Tu *nombre*\n2️⃣ El *modelo* que te gustó\n3️⃣ *Día y hora* estimada para contactarte\n\n"
+                "Ejemplo:\nJuan Pablo\nDS 298\nEl 30 a las 2 PM"
+            ),
+            "parse_mode": "Markdown"
+        })
+        return
 
+    except Exception as e:
+        logging.error(f"[PENDIENTES] ❌ Error registrando pago posterior: {e}")
+        ctx.resp.append({
+            "type": "text",
+            "text": "⚠️ Ocurrió un problema registrando tus datos. Intenta de nuevo más tarde."
+        })
+        return
 
 
-    # ─────────────────────────────────────────────
-    # 📍 DETECTAR SI ES DE BUCARAMANGA (GLOBAL)
-    # ─────────────────────────────────────────────
-    if not est.get("es_de_bucaramanga") and any(b in txt for b in ["bucaramanga", "bga", "b/manga"]):
+# ─────────────────────────────────────────────
+# 📍 DETECTAR SI ES DE BUCARAMANGA (GLOBAL)
+# ─────────────────────────────────────────────
+@flujo_responder.interrupcion()
+async def interrupcion_bucaramanga(turno: Turno):
+    ctx, cid, analisis, est = turno.ctx, turno.cid, turno.analisis, turno.est
+    if not est.get("es_de_bucaramanga") and analisis.es_de_bucaramanga:
         est["es_de_bucaramanga"] = True
         estado_usuario[cid] = est
         logging.info(f"📍 Cliente {cid} es de Bucaramanga")
@@ -2574,39 +3079,21 @@ async def responder(update: Update, ctx: ContextTypes.DEFAULT_TYPE):
                 parse_mode="Markdown"
             )
             return
+    return SIGUE
 
 
-    # 💬 Si el usuario pregunta el precio en cualquier parte del flujo
-    palabras_precio = (
-        "precio", "preció", "prezio", "que presio tienen",
-        "valor", "que presio hay", "vale", "valen", "que precio tienen",
-        "vale esto", "valen esto", "costo", "kosto", "cuesto",
-        "cuanto cuesta", "cuanto vale", "cuanto esta", "cuanto es",
-        "cuanto valen", "cuanto cuestan", "cuanto sale", "que precio", "que vale",
-        "kuanto cuesta", "kuanto bale", "cuanttto bale", "k vale", "q cuesta",
-        "q precio", "q vale", "cuanto me sale", "vale cuanto", "cuesta cuanto",
-        "vale algo", "valen algo", "cuanto cobras", "cuanto cobran",
-        "balor", "cuanto baale", "k bale", "vale eso", "cuanto valdra"
-    )
-
-    txt_norm = normalize(txt)
-
+# 💬 Si el usuario pregunta el precio en cualquier parte del flujo
+@flujo_responder.interrupcion()
+async def interrupcion_pregunta_precio(turno: Turno):
+    ctx, cid, analisis, intenciones, est, inv = turno.ctx, turno.cid, turno.analisis, turno.intenciones, turno.est, turno.inv
     pregunta_precio = (
-        any(p in txt_norm for p in palabras_precio) or
-        any(difflib.get_close_matches(w, palabras_precio, n=1, cutoff=0.8)
-            for w in txt_norm.split())
+        "pregunta_precio" in intenciones or
+        any(VOCAB_PRECIO.parecido(w, cutoff=0.8) for w in analisis.palabras)
     )
 
     if pregunta_precio:
         if est.get("modelo") and est.get("color"):
-            precio = next(
-                (i["precio"] for i in inv if
-                 normalize(i["marca"])  == normalize(est.get("marca", "")) and
-                 normalize(i["modelo"]) == normalize(est["modelo"]) and
-                 normalize(i["color"])  == normalize(est["color"])
-                ),
-                None
-            )
+            precio = inv.precio(est.get("marca", ""), est["modelo"], est["color"])
             if precio:
                 await ctx.bot.send_message(
                     chat_id=cid,
@@ -2626,9 +3113,13 @@ async def responder(update: Update, ctx: ContextTypes.DEFAULT_TYPE):
                       "¿Puedes decirme cuál estás mirando,")
             )
         return
+    return SIGUE
 
 
-    # 📷 Si el usuario envía una foto (detectamos modelo automáticamente)
+# 📷 Si el usuario envía una foto (detectamos modelo automáticamente)
+@flujo_responder.interrupcion(destinos=("imagen_detectada", "inicio"))
+async def interrupcion_foto(turno: Turno):
+    update, ctx, cid, est = turno.update, turno.ctx, turno.cid, turno.est
     if update.message.photo:
         f = await update.message.photo[-1].get_file()
         tmp = os.path.join("temp", f"{cid}.jpg")
@@ -2666,895 +3157,910 @@ async def responder(update: Update, ctx: ContextTypes.DEFAULT_TYPE):
                 parse_mode="Markdown"
             )
         return
+    return SIGUE
 
-    # 📸 Imagen detectada — responder con modelo, color y PRECIO
-    if est.get("fase", "") in ("", "inicio", "imagen_detectada") and 'path_local' in locals():
-        resultado = identificar_modelo_desde_clip(path_local)
-        if resultado:
-            modelo_detectado, color_detectado = resultado
-            est["modelo"] = modelo_detectado
-            est["color"] = color_detectado
-            est["fase"] = "imagen_detectada"
-
-            precio = next(
-                (i["precio"] for i in inv if
-                 normalize(i["marca"]) == normalize(est.get("marca", "")) and
-                 normalize(i["modelo"]) == normalize(modelo_detectado) and
-                 normalize(i["color"]) == normalize(color_detectado)),
-                None
-            )
-            est["precio_total"] = int(precio) if precio else None
-
-            mensaje = (
-                f"📸 La imagen coincide con *{modelo_detectado}* color *{color_detectado}*.\n"
-                f"✅ ¿Confirmas que es el modelo que deseas?"
-            )
-            if precio:
-                mensaje += f"\n💰 Ese modelo tiene un precio de *${precio}* COP."
-
-            mensaje += "\n\nResponde *sí* para continuar o *no* para elegir otro modelo."
 
-            await ctx.bot.send_message(chat_id=cid, text=mensaje, parse_mode="Markdown")
-            return
+# 📸 Imagen detectada — responder con modelo, color y PRECIO
+@flujo_responder.fase("", "inicio", "imagen_detectada", destinos=("imagen_detectada",))
+async def fase_imagen_por_clip(turno: Turno):
+    ctx, cid, est, inv = turno.ctx, turno.cid, turno.est, turno.inv
+    if 'path_local' not in locals():
+        return SIGUE
 
+    resultado = identificar_modelo_desde_clip(path_local)
+    if resultado:
+        modelo_detectado, color_detectado = resultado
+        est["modelo"] = modelo_detectado
+        est["color"] = color_detectado
+        est["fase"] = "imagen_detectada"
 
-    # 📷 Confirmación si la imagen detectada fue correcta
-    if est.get("fase") == "imagen_detectada":
+        precio = inv.precio(est.get("marca", ""), modelo_detectado, color_detectado)
+        est["precio_total"] = int(precio) if precio else None
 
-        # 🆕 Pregunta directa por disponibilidad de talla
-        consulta_talla = re.search(
-            r"(?:tienen|tiene|hay|maneja(?:n)?)\s+talla\s+(\d{1,2})",
-            txt
+        mensaje = (
+            f"📸 La imagen coincide con *{modelo_detectado}* color *{color_detectado}*.\n"
+            f"✅ ¿Confirmas que es el modelo que deseas?"
         )
-        if consulta_talla:
-            talla_pedida = consulta_talla.group(1)
-            est["fase"] = "esperando_talla"
-            estado_usuario[cid] = est
+        if precio:
+            mensaje += f"\n💰 Ese modelo tiene un precio de *${precio}* COP."
 
-            ruta = "/var/data/extra/lengueta_ejemplo.jpg"
-            if os.path.exists(ruta):
-                with open(ruta, "rb") as f:
-                    b64 = base64.b64encode(f.read()).decode("utf-8")
+        mensaje += "\n\nResponde *sí* para continuar o *no* para elegir otro modelo."
 
-                return {
-                    "type": "multi",
-                    "messages": [
-                        {
-                            "type": "text",
-                            "text": (
-                                f"✅ ¡Claro que tenemos talla {talla_pedida}! "
-                                "📸 Para confirmar la medida exacta, mándame una foto de la *lengüeta* "
-                                "del zapato que usas normalmente 👟."
-                            ),
-                            "parse_mode": "Markdown"
-                        },
-                        {
-                            "type": "photo",
-                            "base64": f"data:image/jpeg;base64,{b64}",
-                            "text": "Así debe verse la lengüeta. Envíame una foto parecida 📸"
-                        }
-                    ]
-                }
-            else:
-                return {
-                    "type": "text",
-                    "text": (
-                        f"✅ ¡Claro que tenemos talla {talla_pedida}! "
-                        "📸 Para darte tu talla ideal, mándame una foto de la lengüeta de tu zapato 👟."
-                    ),
-                    "parse_mode": "Markdown"
-                }
+        await ctx.bot.send_message(chat_id=cid, text=mensaje, parse_mode="Markdown")
+        return
+    return SIGUE
 
-        # ✔️ Respuesta afirmativa para avanzar en la compra
-        if any(frase in txt for frase in (
-            "si", "sí", "sii", "sis", "sisz",
-            "de una", "dale", "hagale", "hágale", "hágale pues",
-            "claro", "claro que sí", "quiero comprar", "continuar", "vamos"
-        )):
-            # ✅ Si ya hay talla (desde imagen de lengüeta), saltar a confirmar datos
-            if est.get("talla"):
-                est["fase"] = "esperando_talla"
-                estado_usuario[cid] = est
 
-                await ctx.bot.send_message(
-                    chat_id=cid,
-                    text=(
-                        f"📏 Según la etiqueta que me enviaste, la talla ideal para tus zapatos "
-                        f"es *{est['talla']}* en nuestra horma.\n"
-                        "¿Deseas que te lo enviemos hoy mismo?"
-                    ),
-                    parse_mode="Markdown"
-                )
-                return await procesar_wa(cid, "sí")
+# 📷 Confirmación si la imagen detectada fue correcta
+@flujo_responder.fase("imagen_detectada", destinos=("esperando_talla", "inicio"))
+async def fase_imagen_detectada(turno: Turno):
+    ctx, cid, txt, intenciones, est = turno.ctx, turno.cid, turno.txt, turno.intenciones, turno.est
+    # 🆕 Pregunta directa por disponibilidad de talla
+    consulta_talla = re.search(
+        r"(?:tienen|tiene|hay|maneja(?:n)?)\s+talla\s+(\d{1,2})",
+        txt
+    )
+    if consulta_talla:
+        talla_pedida = consulta_talla.group(1)
+        est["fase"] = "esperando_talla"
+        estado_usuario[cid] = est
 
-            # 🔁 Si aún no tiene talla, pedir foto de lengüeta sin mostrar tallas
-            est["fase"] = "esperando_talla"
-            estado_usuario[cid] = est
+        ruta = "/var/data/extra/lengueta_ejemplo.jpg"
+        if os.path.exists(ruta):
 
-            ruta = "/var/data/extra/lengueta_ejemplo.jpg"
-            if os.path.exists(ruta):
-                with open(ruta, "rb") as f:
-                    b64 = base64.b64encode(f.read()).decode("utf-8")
-                    return {
-                        "type": "multi",
-                        "messages": [
-                            {
-                                "type": "text",
-                                "text": (
-                                    "📸 Para darte tu talla ideal, mándame una foto de la *lengüeta* "
-                                    "del zapato que usas normalmente 👟."
-                                ),
-                                "parse_mode": "Markdown"
-                            },
-                            {
-                                "type": "photo",
-                                "base64": f"data:image/jpeg;base64,{b64}",
-                                "text": "Así debe verse la lengüeta. Envíame una foto parecida 📸"
-                            }
-                        ]
+            return {
+                "type": "multi",
+                "messages": [
+                    {
+                        "type": "text",
+                        "text": (
+                            f"✅ ¡Claro que tenemos talla {talla_pedida}! "
+                            "📸 Para confirmar la medida exacta, mándame una foto de la *lengüeta* "
+                            "del zapato que usas normalmente 👟."
+                        ),
+                        "parse_mode": "Markdown"
+                    },
+                    {
+                        "type": "photo",
+                        **medios.adjunto(ruta, "image/jpeg"),
+                        "text": "Así debe verse la lengüeta. Envíame una foto parecida 📸"
                     }
-            else:
-                return {
-                    "type": "text",
-                    "text": (
-                        "📸 Para darte tu talla ideal, mándame una foto de la lengüeta de tu zapato 👟."
-                    ),
-                    "parse_mode": "Markdown"
-                }
-
-        # ❓ Si no entendió nada útil
-        await ctx.bot.send_message(
-            chat_id=cid,
-            text="Entonces dime cómo te ayudo. Puedes enviar una imagen del producto que deseas 👍🏻",
-            parse_mode="Markdown"
-        )
-        reset_estado(cid)
-        return
-
-    # 🛒 Flujo manual si está buscando modelo
-    if est.get("fase") == "esperando_modelo":
-        modelos = obtener_modelos_por_marca(inv, est["marca"])
-        if txt in map(normalize, modelos):
-            est["modelo"] = next(m for m in modelos if normalize(m) == txt)
-            est["fase"] = "esperando_color"
-            colores = obtener_colores_por_modelo(inv, est["modelo"])
-            await ctx.bot.send_message(
-                chat_id=cid,
-                text="¿Qué color deseas?",
-                reply_markup=menu_botones(colores),
-            )
+                ]
+            }
         else:
-            await ctx.bot.send_message(
-                chat_id=cid,
-                text="Elige un modelo válido.",
-                reply_markup=menu_botones(modelos),
-            )
-        return
-
-    # 🎨 Elegir color del modelo
-    if est.get("fase") == "esperando_color":
-        colores = obtener_colores_por_modelo(inv, est["modelo"])
-        if isinstance(colores, (int, float, str)):
-            colores = [str(colores)]
-
-        # Normalizar entrada y colores
-        colores_normalizados = {normalize(c): c for c in colores}
-        entrada_normalizada = normalize(txt)
-        coincidencias = difflib.get_close_matches(entrada_normalizada, colores_normalizados.keys(), n=1, cutoff=0.6)
+            return {
+                "type": "text",
+                "text": (
+                    f"✅ ¡Claro que tenemos talla {talla_pedida}! "
+                    "📸 Para darte tu talla ideal, mándame una foto de la lengüeta de tu zapato 👟."
+                ),
+                "parse_mode": "Markdown"
+            }
 
-        if coincidencias:
-            color_seleccionado = colores_normalizados[coincidencias[0]]
-            est["color"] = color_seleccionado
+    # ✔️ Respuesta afirmativa para avanzar en la compra
+    if "afirmativa_compra" in intenciones:
+        # ✅ Si ya hay talla (desde imagen de lengüeta), saltar a confirmar datos
+        if est.get("talla"):
             est["fase"] = "esperando_talla"
-
-            tallas = obtener_tallas_por_color(inv, est["modelo"], est["color"])
-            if isinstance(tallas, (int, float, str)):
-                tallas = [str(tallas)]
+            estado_usuario[cid] = est
 
             await ctx.bot.send_message(
                 chat_id=cid,
                 text=(
-                    f"Tenemos las siguientes tallas disponibles para el modelo *{est['modelo']}* color *{est['color']}*?\n\n"
-                    f"👉 Tallas disponibles: {', '.join(tallas)}"
+                    f"📏 Según la etiqueta que me enviaste, la talla ideal para tus zapatos "
+                    f"es *{est['talla']}* en nuestra horma.\n"
+                    "¿Deseas que te lo enviemos hoy mismo?"
                 ),
                 parse_mode="Markdown"
             )
+            return await procesar_wa(cid, "sí")
+
+        # 🔁 Si aún no tiene talla, pedir foto de lengüeta sin mostrar tallas
+        est["fase"] = "esperando_talla"
+        estado_usuario[cid] = est
+
+        ruta = "/var/data/extra/lengueta_ejemplo.jpg"
+        if os.path.exists(ruta):
+            return {
+                "type": "multi",
+                "messages": [
+                    {
+                        "type": "text",
+                        "text": (
+                            "📸 Para darte tu talla ideal, mándame una foto de la *lengüeta* "
+                            "del zapato que usas normalmente 👟."
+                        ),
+                        "parse_mode": "Markdown"
+                    },
+                    {
+                        "type": "photo",
+                        **medios.adjunto(ruta, "image/jpeg"),
+                        "text": "Así debe verse la lengüeta. Envíame una foto parecida 📸"
+                    }
+                ]
+            }
         else:
-            colores_str = "\n".join(f"- {c}" for c in colores)
-            await ctx.bot.send_message(
-                chat_id=cid,
-                text=(
-                    f"⚠️ No entendí ese color.\n\n"
-                    f"🎨 Los colores disponibles para *{est['modelo']}* son:\n\n"
-                    f"{colores_str}\n\n"
-                    "¿Cuál color te interesa?"
+            return {
+                "type": "text",
+                "text": (
+                    "📸 Para darte tu talla ideal, mándame una foto de la lengüeta de tu zapato 👟."
                 ),
-                parse_mode="Markdown"
-            )
-        return
-
-    # 👟 Evitar repetir análisis de talla si ya tenemos la talla definida
-    if est.get("fase") == "esperando_talla" and est.get("talla"):
-        cliente = obtener_datos_cliente(numero)
+                "parse_mode": "Markdown"
+            }
 
-        # SOLO si existe memoria, mostrar resumen. Si no, pedir nombre
-        if not cliente:
-            est["fase"] = "esperando_nombre"
-            estado_usuario[cid] = est
-            await ctx.bot.send_message(
-                chat_id=cid,
-                text="¿Tu nombre completo para el pedido? 📝",
-                parse_mode="Markdown"
-            )
-            return
+    # ❓ Si no entendió nada útil
+    await ctx.bot.send_message(
+        chat_id=cid,
+        text="Entonces dime cómo te ayudo. Puedes enviar una imagen del producto que deseas 👍🏻",
+        parse_mode="Markdown"
+    )
+    reset_estado(cid)
+    return
 
-        nombre    = cliente.get("nombre", "cliente")
-        correo    = cliente.get("correo", "No registrado")
-        telefono  = cliente.get("telefono", numero)
-        cedula    = cliente.get("cedula", "No registrada")
-        ciudad    = cliente.get("ciudad", "No registrada")
-        provincia = cliente.get("provincia", "No registrada")
-        direccion = cliente.get("direccion", "No registrada")
-
-        est.update({
-            "nombre": nombre,
-            "correo": correo,
-            "telefono": telefono,
-            "cedula": cedula,
-            "ciudad": ciudad,
-            "provincia": provincia,
-            "direccion": direccion
-        })
 
-        precio = next(
-            (i["precio"] for i in inv
-             if normalize(i["marca"]) == normalize(est.get("marca", ""))
-             and normalize(i["modelo"]) == normalize(est.get("modelo", ""))
-             and normalize(i["color"])  == normalize(est.get("color", ""))),
-            None
+# 🛒 Flujo manual si está buscando modelo
+@flujo_responder.fase("esperando_modelo", destinos=("esperando_color",))
+async def fase_esperando_modelo(turno: Turno):
+    ctx, cid, txt, est, inv = turno.ctx, turno.cid, turno.txt, turno.est, turno.inv
+    modelos = obtener_modelos_por_marca(inv, est["marca"])
+    if txt in map(normalize, modelos):
+        est["modelo"] = next(m for m in modelos if normalize(m) == txt)
+        est["fase"] = "esperando_color"
+        colores = obtener_colores_por_modelo(inv, est["modelo"])
+        await ctx.bot.send_message(
+            chat_id=cid,
+            text="¿Qué color deseas?",
+            reply_markup=menu_botones(colores),
         )
-        est["precio_total"] = int(precio) if precio else 0
-        est["sale_id"] = generate_sale_id()
-
-        est["resumen"] = {
-            "Número Venta": est["sale_id"],
-            "Fecha Venta": datetime.now().isoformat(),
-            "Cliente": est.get("nombre", "cliente"),
-            "Teléfono": est.get("telefono"),
-            "Cédula": est.get("cedula"),
-            "Producto": est.get("modelo"),
-            "Color": est.get("color"),
-            "Talla": est.get("talla"),
-            "Correo": est.get("correo"),
-            "Pago": None,
-            "Estado": "PENDIENTE"
-        }
-
-        resumen_msg = (
-            f"✅ Pedido: {est['sale_id']}\n"
-            f"👤Nombre: {est.get('nombre')}\n"
-            f"📧Correo: {est.get('correo')}\n"
-            f"📱Celular: {est.get('telefono')}\n"
-            f"🪪Cédula: {est.get('cedula')}\n"
-            f"📍Dirección: {est.get('direccion')}, {est.get('ciudad')}, {est.get('provincia')}\n"
-            f"👟Producto: {est['modelo']} color {est['color']} talla {est['talla']}\n"
-            f"💲Valor a pagar: {est['precio_total']:,} COP\n\n"
-            "¿Estos datos siguen siendo correctos o deseas cambiar algo?\n"
-            "• Responde *sí* si todo está bien.\n"
-            "• O dime el campo a cambiar (nombre, correo, teléfono, etc.)."
+    else:
+        await ctx.bot.send_message(
+            chat_id=cid,
+            text="Elige un modelo válido.",
+            reply_markup=menu_botones(modelos),
         )
+    return
 
-        est["fase"] = "confirmar_datos_guardados"
-        est["confirmacion_pendiente"] = True
-        estado_usuario[cid] = est
-        await ctx.bot.send_message(chat_id=cid, text=resumen_msg, parse_mode="Markdown")
-        return
 
-    # 👟 Elegir talla escrita (y pedir lengüeta)
-    if est.get("fase") == "esperando_talla":
-        tallas_disponibles = obtener_tallas_por_color(inv, est.get("modelo", ""), est.get("color", ""))
-        if isinstance(tallas_disponibles, (int, float, str)):
-            tallas_disponibles = [str(tallas_disponibles)]
+# 🎨 Elegir color del modelo
+@flujo_responder.fase("esperando_color", destinos=("esperando_talla",))
+async def fase_esperando_color(turno: Turno):
+    ctx, cid, txt, est, inv = turno.ctx, turno.cid, turno.txt, turno.est, turno.inv
+    colores = obtener_colores_por_modelo(inv, est["modelo"])
+    if isinstance(colores, (int, float, str)):
+        colores = [str(colores)]
 
-        # Normalización y coincidencia difusa
-        tallas_normalizadas = {normalize(t): t for t in tallas_disponibles}
-        entrada_normalizada = normalize(txt)
+    # Normalizar entrada y colores
+    colores_normalizados = {normalize(c): c for c in colores}
+    entrada_normalizada = normalize(txt)
+    coincidencia = vocabulario(tuple(colores_normalizados)).mejor(entrada_normalizada, 0.6)
 
-        coincidencias = difflib.get_close_matches(entrada_normalizada, tallas_normalizadas.keys(), n=1, cutoff=0.6)
+    if coincidencia:
+        color_seleccionado = colores_normalizados[coincidencia]
+        est["color"] = color_seleccionado
+        est["fase"] = "esperando_talla"
 
-        if coincidencias:
-            talla_detectada = tallas_normalizadas[coincidencias[0]]
-            est["talla"] = talla_detectada
-            estado_usuario[cid] = est
+        tallas = obtener_tallas_por_color(inv, est["modelo"], est["color"])
+        if isinstance(tallas, (int, float, str)):
+            tallas = [str(tallas)]
 
-            ruta = "/var/data/extra/lengueta_ejemplo.jpg"
-            if os.path.exists(ruta):
-                with open(ruta, "rb") as f:
-                    b64 = base64.b64encode(f.read()).decode("utf-8")
-                return {
-                    "type": "multi",
-                    "messages": [
-                        {
-                            "type": "text",
-                            "text": (
-                                f"✅ ¡Claro que tenemos talla {talla_detectada}! "
-                                "📸 Para confirmar la medida exacta, mándame una foto de la *lengüeta* "
-                                "del zapato que usas normalmente 👟."
-                            ),
-                            "parse_mode": "Markdown"
-                        },
-                        {
-                            "type": "photo",
-                            "base64": f"data:image/jpeg;base64,{b64}",
-                            "text": "Así debe verse la lengüeta. Envíame una foto parecida 📸"
-                        }
-                    ]
-                }
-
-            return {
-                "type": "text",
-                "text": (
-                    f"✅ ¡Claro que tenemos talla {talla_detectada}! "
-                    "📸 Por favor mándame una foto de la lengüeta de tu zapato para asegurarnos de la talla correcta 👟."
-                ),
-                "parse_mode": "Markdown"
-            }
-
-        # ❌ No entendió ninguna talla, mostrar disponibles
-        tallas_str = "\n".join(f"- {t}" for t in tallas_disponibles)
         await ctx.bot.send_message(
             chat_id=cid,
             text=(
-                "Mandame tu lengüeta pa que confirmemos el pedido.\n\n"
+                f"Tenemos las siguientes tallas disponibles para el modelo *{est['modelo']}* color *{est['color']}*?\n\n"
+                f"👉 Tallas disponibles: {', '.join(tallas)}"
+            ),
+            parse_mode="Markdown"
+        )
+    else:
+        colores_str = "\n".join(f"- {c}" for c in colores)
+        await ctx.bot.send_message(
+            chat_id=cid,
+            text=(
+                f"⚠️ No entendí ese color.\n\n"
+                f"🎨 Los colores disponibles para *{est['modelo']}* son:\n\n"
+                f"{colores_str}\n\n"
+                "¿Cuál color te interesa?"
             ),
             parse_mode="Markdown"
         )
+    return
+
+
+# 👟 Evitar repetir análisis de talla si ya tenemos la talla definida
+@flujo_responder.fase("esperando_talla", destinos=("confirmar_datos_guardados", "esperando_nombre"))
+async def fase_esperando_talla_ya_definida(turno: Turno):
+    ctx, cid, numero, est, inv = turno.ctx, turno.cid, turno.numero, turno.est, turno.inv
+    if not est.get("talla"):
+        return SIGUE
+
+    cliente = await en_hilo("drive", obtener_datos_cliente, numero)
+
+    # SOLO si existe memoria, mostrar resumen. Si no, pedir nombre
+    if not cliente:
+        est["fase"] = "esperando_nombre"
+        estado_usuario[cid] = est
+        await ctx.bot.send_message(
+            chat_id=cid,
+            text="¿Tu nombre completo para el pedido? 📝",
+            parse_mode="Markdown"
+        )
         return
 
-    # 👟 Elegir talla (texto directo o confirmación de lengüeta)
-    if est.get("fase") == "esperando_talla":
-        tallas = obtener_tallas_por_color(inv, est["modelo"], est["color"])
-        if isinstance(tallas, (int, float, str)):
-            tallas = [str(tallas)]
+    nombre    = cliente.get("nombre", "cliente")
+    correo    = cliente.get("correo", "No registrado")
+    telefono  = cliente.get("telefono", numero)
+    cedula    = cliente.get("cedula", "No registrada")
+    ciudad    = cliente.get("ciudad", "No registrada")
+    provincia = cliente.get("provincia", "No registrada")
+    direccion = cliente.get("direccion", "No registrada")
+
+    est.update({
+        "nombre": nombre,
+        "correo": correo,
+        "telefono": telefono,
+        "cedula": cedula,
+        "ciudad": ciudad,
+        "provincia": provincia,
+        "direccion": direccion
+    })
 
-        # 🟢 1. Si ya hay una talla detectada (por imagen) y cliente confirma con "sí"
-        if est.get("talla") and any(p in txt for p in ("sí", "si", "s", "dale", "claro", "continuar", "comprar", "vamos")):
-            talla_detectada = est["talla"]
+    precio = inv.precio(est.get("marca", ""), est.get("modelo", ""), est.get("color", ""))
+    est["precio_total"] = int(precio) if precio else 0
+    est["sale_id"] = generate_sale_id()
+
+    est["resumen"] = {
+        "Número Venta": est["sale_id"],
+        "Fecha Venta": datetime.now().isoformat(),
+        "Cliente": est.get("nombre", "cliente"),
+        "Teléfono": est.get("telefono"),
+        "Cédula": est.get("cedula"),
+        "Producto": est.get("modelo"),
+        "Color": est.get("color"),
+        "Talla": est.get("talla"),
+        "Correo": est.get("correo"),
+        "Pago": None,
+        "Estado": "PENDIENTE"
+    }
 
-        # 🟡 2. Si escribió la talla manualmente
-        else:
-            talla_detectada = detectar_talla(txt_raw, tallas)
+    resumen_msg = (
+        f"✅ Pedido: {est['sale_id']}\n"
+        f"👤Nombre: {est.get('nombre')}\n"
+        f"📧Correo: {est.get('correo')}\n"
+        f"📱Celular: {est.get('telefono')}\n"
+        f"🪪Cédula: {est.get('cedula')}\n"
+        f"📍Dirección: {est.get('direccion')}, {est.get('ciudad')}, {est.get('provincia')}\n"
+        f"👟Producto: {est['modelo']} color {est['color']} talla {est['talla']}\n"
+        f"💲Valor a pagar: {est['precio_total']:,} COP\n\n"
+        "¿Estos datos siguen siendo correctos o deseas cambiar algo?\n"
+        "• Responde *sí* si todo está bien.\n"
+        "• O dime el campo a cambiar (nombre, correo, teléfono, etc.)."
+    )
 
-        if talla_detectada:
-            est["talla"] = talla_detectada
+    est["fase"] = "confirmar_datos_guardados"
+    est["confirmacion_pendiente"] = True
+    estado_usuario[cid] = est
+    await ctx.bot.send_message(chat_id=cid, text=resumen_msg, parse_mode="Markdown")
+    return
 
-            # 🔍 Ver si ya hay memoria del cliente
-            cliente = obtener_datos_cliente(numero)
 
-            if cliente:
-                nombre    = cliente.get("nombre", "cliente")
-                correo    = cliente.get("correo", "No registrado")
-                telefono  = cliente.get("telefono", numero)
-                cedula    = cliente.get("cedula", "No registrada")
-                ciudad    = cliente.get("ciudad", "No registrada")
-                provincia = cliente.get("provincia", "No registrada")
-                direccion = cliente.get("direccion", "No registrada")
+# 👟 Elegir talla escrita (y pedir lengüeta)
+@flujo_responder.fase("esperando_talla")
+async def fase_esperando_talla(turno: Turno):
+    ctx, cid, txt, est, inv = turno.ctx, turno.cid, turno.txt, turno.est, turno.inv
+    tallas_disponibles = obtener_tallas_por_color(inv, est.get("modelo", ""), est.get("color", ""))
+    if isinstance(tallas_disponibles, (int, float, str)):
+        tallas_disponibles = [str(tallas_disponibles)]
 
-                est.update({
-                    "nombre": nombre,
-                    "correo": correo,
-                    "telefono": telefono,
-                    "cedula": cedula,
-                    "ciudad": ciudad,
-                    "provincia": provincia,
-                    "direccion": direccion
-                })
+    # Normalización y coincidencia difusa
+    tallas_normalizadas = {normalize(t): t for t in tallas_disponibles}
+    entrada_normalizada = normalize(txt)
 
-                precio = next(
-                    (i["precio"] for i in inv
-                     if normalize(i["marca"]) == normalize(est["marca"])
-                     and normalize(i["modelo"]) == normalize(est["modelo"])
-                     and normalize(i["color"]) == normalize(est["color"])),
-                    None
-                )
-                est["precio_total"] = int(precio) if precio else 0
-                est["sale_id"] = generate_sale_id()
-
-                resumen = (
-                    f"✅ Pedido: {est['sale_id']}\n"
-                    f"👤Nombre: {nombre}\n"
-                    f"📧Correo: {correo}\n"
-                    f"📱Celular: {telefono}\n"
-                    f"🪪Cédula: {cedula}\n"
-                    f"📍Dirección: {direccion}, {ciudad}, {provincia}\n"
-                    f"👟Producto: {est['modelo']} color {est['color']} talla {est['talla']}\n"
-                    f"💲Valor a pagar: {est['precio_total']:,} COP\n\n"
-                    "¿Estos datos siguen siendo correctos o deseas cambiar algo?"
-                )
+    coincidencia = vocabulario(tuple(tallas_normalizadas)).mejor(entrada_normalizada, 0.6)
 
-                est["fase"] = "confirmar_datos_guardados"
-                estado_usuario[cid] = est
-                await ctx.bot.send_message(chat_id=cid, text=resumen, parse_mode="Markdown")
-                return
+    if coincidencia:
+        talla_detectada = tallas_normalizadas[coincidencia]
+        est["talla"] = talla_detectada
+        estado_usuario[cid] = est
 
-            # 🧾 No hay cliente guardado → continuar normal
-            est["fase"] = "esperando_nombre"
-            estado_usuario[cid] = est
-            await ctx.bot.send_message(
-                chat_id=cid,
-                text="¿Tu nombre completo para el pedido?",
-                parse_mode="Markdown"
-            )
-            return
+        ruta = "/var/data/extra/lengueta_ejemplo.jpg"
+        if os.path.exists(ruta):
+            return {
+                "type": "multi",
+                "messages": [
+                    {
+                        "type": "text",
+                        "text": (
+                            f"✅ ¡Claro que tenemos talla {talla_detectada}! "
+                            "📸 Para confirmar la medida exacta, mándame una foto de la *lengüeta* "
+                            "del zapato que usas normalmente 👟."
+                        ),
+                        "parse_mode": "Markdown"
+                    },
+                    {
+                        "type": "photo",
+                        **medios.adjunto(ruta, "image/jpeg"),
+                        "text": "Así debe verse la lengüeta. Envíame una foto parecida 📸"
+                    }
+                ]
+            }
 
-        # 🚫 No se detectó ninguna talla → mostrar tallas y pedir imagen
-        await ctx.bot.send_message(
-            chat_id=cid,
-            text=(
-                f"Tenemos las siguientes tallas disponibles para el modelo *{est['modelo']}* color *{est['color']}*:\n\n"
-                f"👉 Tallas disponibles: {', '.join(tallas)}\n\n"
-                "📸 Para darte tu *talla ideal*, mándame una foto de la *lengüeta de tu zapato* 👟 y la detectamos automáticamente."
+        return {
+            "type": "text",
+            "text": (
+                f"✅ ¡Claro que tenemos talla {talla_detectada}! "
+                "📸 Por favor mándame una foto de la lengüeta de tu zapato para asegurarnos de la talla correcta 👟."
             ),
-            parse_mode="Markdown"
-        )
-        return
+            "parse_mode": "Markdown"
+        }
 
-    # 👤 Confirmar o editar datos guardados
-    if est.get("fase") == "confirmar_datos_guardados":
-        if est.get("confirmacion_pendiente"):
-            if any(p in txt.lower() for p in (
-                "si", "sí", "correcto", "ok", "listo", "vale", "dale",
-                "todo bien", "todo correcto", "está bien", "esta bien"
-            )):
-                est["confirmacion_pendiente"] = False
-                est["fase"] = "esperando_pago"
-
-                # 🛠 Verificar datos antes de buscar precio
-                marca  = normalize(est.get("marca", ""))
-                modelo = normalize(est.get("modelo", ""))
-                color  = normalize(est.get("color", ""))
-
-                if marca and modelo and color:
-                    precio = next(
-                        (i["precio"] for i in inv
-                         if normalize(i["marca"]) == marca
-                         and normalize(i["modelo"]) == modelo
-                         and normalize(i["color"]) == color),
-                        0
-                    )
-                    est["precio_total"] = int(precio)
-                else:
-                    logging.warning(f"⚠️ No se pudo calcular el precio — Datos incompletos: marca={marca}, modelo={modelo}, color={color}")
-                    est["precio_total"] = 0
-
-                precio = est.get("precio_total", 0)
-                est["sale_id"] = est.get("sale_id") or generate_sale_id()
-
-                est["resumen"] = {
-                    "Número Venta": est["sale_id"],
-                    "Fecha Venta": datetime.now().isoformat(),
-                    "Cliente": est.get("nombre"),
-                    "Teléfono": est.get("telefono"),
-                    "Cédula": est.get("cedula"),
-                    "Producto": est.get("modelo"),
-                    "Color": est.get("color"),
-                    "Talla": est.get("talla"),
-                    "Correo": est.get("correo"),
-                    "Pago": None,
-                    "Estado": "PENDIENTE"
-                }
+    # ❌ No entendió ninguna talla, mostrar disponibles
+    tallas_str = "\n".join(f"- {t}" for t in tallas_disponibles)
+    await ctx.bot.send_message(
+        chat_id=cid,
+        text=(
+            "Mandame tu lengüeta pa que confirmemos el pedido.\n\n"
+        ),
+        parse_mode="Markdown"
+    )
+    return
 
-                msg = (
-                    f"✅ Pedido: {est['sale_id']}\n"
-                    f"👤Nombre: {est['nombre']}\n"
-                    f"📧Correo: {est['correo']}\n"
-                    f"📱Celular: {est['telefono']}\n"
-                    f"📍Dirección: {est['direccion']}, {est['ciudad']}, {est['provincia']}\n"
-                    f"👟Producto: {est['modelo']} color {est['color']} talla {est['talla']}\n"
-                    f"💲Valor a pagar: {precio:,} COP\n\n"
-                    "😊 Tenemos *4 formas de pago* 💰\n\n"
-                    "1. 💵 *Pago anticipado* (Nequi, Daviplata, Bancolombia):\n"
-                    "   Pagas el valor completo antes del envío y tu compra queda asegurada 🚀.\n\n"
-                    "2. ✈️ *Pago contra entrega*:\n"
-                    "   Haces un abono de *$30.000* y el restante lo pagas a la transportadora al recibir tu calzado.\n\n"
-                    "3. 💳 *Tarjeta de crédito*:\n"
-                    "   Paga online con tu tarjeta desde el enlace que te enviamos (Visa, MasterCard, etc.).\n\n"
-                    "4. 💙 *Crédito a cuotas por medio de Addi*:\n"
-                    "   Financia tu compra y paga en cuotas mensuales de forma fácil y rápida.\n\n"
-                    "🤩 ¿Por cuál medio te queda más fácil hacer el pago?\n"
-                    "Escribe: *Pago anticipado*, *Contraentrega*, *Tarjeta* o *Addi*."
-                )
-                await ctx.bot.send_message(chat_id=cid, text=msg, parse_mode="Markdown")
-                estado_usuario[cid] = est
-                return
-            else:
-                await ctx.bot.send_message(
-                    chat_id=cid,
-                    text="¿Si los datos están correctos? ✅\nDime que *sí* y continuamos con la compra o dime qué campo deseas actualizar (nombre, ciudad, etc.)",
-                    parse_mode="Markdown"
-                )
-                return
 
-        # B) Detectar qué campo desea cambiar
-        campos = {
-            "nombre": ["nombre"],
-            "correo": ["correo", "email", "mail"],
-            "telefono": ["telefono", "teléfono", "celular", "cel"],
-            "cedula": ["cedula", "cédula", "dni", "id"],
-            "ciudad": ["ciudad"],
-            "provincia": ["provincia", "departamento"],
-            "direccion": ["direccion", "dirección", "dir"]
-        }
-        for campo, alias in campos.items():
-            if any(a in txt for a in alias):
-                est["campo_a_editar"] = campo
-                est["fase"] = "editando_dato"
-                await ctx.bot.send_message(
-                    chat_id=cid,
-                    text=f"Por favor escribe el nuevo *{campo}* 📝",
-                    parse_mode="Markdown"
-                )
-                return
+# 👟 Elegir talla (texto directo o confirmación de lengüeta)
+@flujo_responder.fase("esperando_talla", destinos=("esperando_nombre", "confirmar_datos_guardados"))
+async def fase_esperando_talla_confirmacion(turno: Turno):
+    ctx, cid, numero, analisis, intenciones, est, inv, tallas = turno.ctx, turno.cid, turno.numero, turno.analisis, turno.intenciones, turno.est, turno.inv, turno.tallas
+    tallas = obtener_tallas_por_color(inv, est["modelo"], est["color"])
+    if isinstance(tallas, (int, float, str)):
+        tallas = [str(tallas)]
+
+    # 🟢 1. Si ya hay una talla detectada (por imagen) y cliente confirma con "sí"
+    if est.get("talla") and "confirma_talla" in intenciones:
+        talla_detectada = est["talla"]
+
+    # 🟡 2. Si escribió la talla manualmente
+    else:
+        talla_detectada = analisis.talla(tallas)
+
+    if talla_detectada:
+        est["talla"] = talla_detectada
+
+        # 🔍 Ver si ya hay memoria del cliente
+        cliente = await en_hilo("drive", obtener_datos_cliente, numero)
+
+        if cliente:
+            nombre    = cliente.get("nombre", "cliente")
+            correo    = cliente.get("correo", "No registrado")
+            telefono  = cliente.get("telefono", numero)
+            cedula    = cliente.get("cedula", "No registrada")
+            ciudad    = cliente.get("ciudad", "No registrada")
+            provincia = cliente.get("provincia", "No registrada")
+            direccion = cliente.get("direccion", "No registrada")
+
+            est.update({
+                "nombre": nombre,
+                "correo": correo,
+                "telefono": telefono,
+                "cedula": cedula,
+                "ciudad": ciudad,
+                "provincia": provincia,
+                "direccion": direccion
+            })
 
+            precio = inv.precio(est["marca"], est["modelo"], est["color"])
+            est["precio_total"] = int(precio) if precio else 0
+            est["sale_id"] = generate_sale_id()
+
+            resumen = (
+                f"✅ Pedido: {est['sale_id']}\n"
+                f"👤Nombre: {nombre}\n"
+                f"📧Correo: {correo}\n"
+                f"📱Celular: {telefono}\n"
+                f"🪪Cédula: {cedula}\n"
+                f"📍Dirección: {direccion}, {ciudad}, {provincia}\n"
+                f"👟Producto: {est['modelo']} color {est['color']} talla {est['talla']}\n"
+                f"💲Valor a pagar: {est['precio_total']:,} COP\n\n"
+                "¿Estos datos siguen siendo correctos o deseas cambiar algo?"
+            )
+
+            est["fase"] = "confirmar_datos_guardados"
+            estado_usuario[cid] = est
+            await ctx.bot.send_message(chat_id=cid, text=resumen, parse_mode="Markdown")
+            return
+
+        # 🧾 No hay cliente guardado → continuar normal
+        est["fase"] = "esperando_nombre"
+        estado_usuario[cid] = est
         await ctx.bot.send_message(
             chat_id=cid,
-            text="Indícame qué dato deseas cambiar (nombre, correo, teléfono, ciudad, etc.).",
+            text="¿Tu nombre completo para el pedido?",
             parse_mode="Markdown"
         )
         return
 
+    # 🚫 No se detectó ninguna talla → mostrar tallas y pedir imagen
+    await ctx.bot.send_message(
+        chat_id=cid,
+        text=(
+            f"Tenemos las siguientes tallas disponibles para el modelo *{est['modelo']}* color *{est['color']}*:\n\n"
+            f"👉 Tallas disponibles: {', '.join(tallas)}\n\n"
+            "📸 Para darte tu *talla ideal*, mándame una foto de la *lengüeta de tu zapato* 👟 y la detectamos automáticamente."
+        ),
+        parse_mode="Markdown"
+    )
+    return
 
 
+# 👤 Confirmar o editar datos guardados
+@flujo_responder.fase("confirmar_datos_guardados", destinos=("esperando_pago", "editando_dato"))
+async def fase_confirmar_datos_guardados(turno: Turno):
+    ctx, cid, txt, intenciones, est, inv = turno.ctx, turno.cid, turno.txt, turno.intenciones, turno.est, turno.inv
+    if est.get("confirmacion_pendiente"):
+        if "confirma_datos" in intenciones:
+            est["confirmacion_pendiente"] = False
+            est["fase"] = "esperando_pago"
 
-    # 💾 Guardar nuevo valor editado
-    if est.get("fase") == "editando_dato":
-        campo = est.get("campo_a_editar")
+            # 🛠 Verificar datos antes de buscar precio
+            marca  = normalize(est.get("marca", ""))
+            modelo = normalize(est.get("modelo", ""))
+            color  = normalize(est.get("color", ""))
 
-        if campo == "correo" and not re.match(r"[^@]+@[^@]+\.[^@]+", txt_raw):
+            if marca and modelo and color:
+                precio = inv.precio(marca, modelo, color, 0)
+                est["precio_total"] = int(precio)
+            else:
+                logging.warning(f"⚠️ No se pudo calcular el precio — Datos incompletos: marca={marca}, modelo={modelo}, color={color}")
+                est["precio_total"] = 0
+
+            precio = est.get("precio_total", 0)
+            est["sale_id"] = est.get("sale_id") or generate_sale_id()
+
+            est["resumen"] = {
+                "Número Venta": est["sale_id"],
+                "Fecha Venta": datetime.now().isoformat(),
+                "Cliente": est.get("nombre"),
+                "Teléfono": est.get("telefono"),
+                "Cédula": est.get("cedula"),
+                "Producto": est.get("modelo"),
+                "Color": est.get("color"),
+                "Talla": est.get("talla"),
+                "Correo": est.get("correo"),
+                "Pago": None,
+                "Estado": "PENDIENTE"
+            }
+
+            msg = (
+                f"✅ Pedido: {est['sale_id']}\n"
+                f"👤Nombre: {est['nombre']}\n"
+                f"📧Correo: {est['correo']}\n"
+                f"📱Celular: {est['telefono']}\n"
+                f"📍Dirección: {est['direccion']}, {est['ciudad']}, {est['provincia']}\n"
+                f"👟Producto: {est['modelo']} color {est['color']} talla {est['talla']}\n"
+                f"💲Valor a pagar: {precio:,} COP\n\n"
+                "😊 Tenemos *4 formas de pago* 💰\n\n"
+                "1. 💵 *Pago anticipado* (Nequi, Daviplata, Bancolombia):\n"
+                "   Pagas el valor completo antes del envío y tu compra queda asegurada 🚀.\n\n"
+                "2. ✈️ *Pago contra entrega*:\n"
+                "   Haces un abono de *$30.000* y el restante lo pagas a la transportadora al recibir tu calzado.\n\n"
+                "3. 💳 *Tarjeta de crédito*:\n"
+                "   Paga online con tu tarjeta desde el enlace que te enviamos (Visa, MasterCard, etc.).\n\n"
+                "4. 💙 *Crédito a cuotas por medio de Addi*:\n"
+                "   Financia tu compra y paga en cuotas mensuales de forma fácil y rápida.\n\n"
+                "🤩 ¿Por cuál medio te queda más fácil hacer el pago?\n"
+                "Escribe: *Pago anticipado*, *Contraentrega*, *Tarjeta* o *Addi*."
+            )
+            await ctx.bot.send_message(chat_id=cid, text=msg, parse_mode="Markdown")
+            estado_usuario[cid] = est
+            return
+        else:
             await ctx.bot.send_message(
                 chat_id=cid,
-                text="⚠️ Ese correo no parece válido. Intenta con nombre@dominio.com",
+                text="¿Si los datos están correctos? ✅\nDime que *sí* y continuamos con la compra o dime qué campo deseas actualizar (nombre, ciudad, etc.)",
                 parse_mode="Markdown"
             )
             return
-        if campo == "telefono" and not re.match(r"^\+?\d{7,15}$", txt_raw):
+
+    # B) Detectar qué campo desea cambiar
+    campos = {
+        "nombre": ["nombre"],
+        "correo": ["correo", "email", "mail"],
+        "telefono": ["telefono", "teléfono", "celular", "cel"],
+        "cedula": ["cedula", "cédula", "dni", "id"],
+        "ciudad": ["ciudad"],
+        "provincia": ["provincia", "departamento"],
+        "direccion": ["direccion", "dirección", "dir"]
+    }
+    for campo, alias in campos.items():
+        if any(a in txt for a in alias):
+            est["campo_a_editar"] = campo
+            est["fase"] = "editando_dato"
             await ctx.bot.send_message(
                 chat_id=cid,
-                text="⚠️ Ese teléfono no es válido. Incluye solo números y, opcional, el +57.",
+                text=f"Por favor escribe el nuevo *{campo}* 📝",
                 parse_mode="Markdown"
             )
             return
 
-        est[campo] = txt_raw.strip()
-        est.pop("campo_a_editar", None)
-        est["fase"] = "confirmar_datos_guardados"
-
-        resumen = (
-            f"🔄 *Datos actualizados:*\n\n"
-            f"👤Nombre: {est.get('nombre')}\n"
-            f"📧Correo: {est.get('correo')}\n"
-            f"📱Celular: {est.get('telefono')}\n"
-            f"🪪Cédula: {est.get('cedula')}\n"
-            f"📍Dirección: {est.get('direccion')}, {est.get('ciudad')}, {est.get('provincia')}\n"
-            f"👟Producto: {est['modelo']} color {est['color']} talla {est['talla']}\n"
-            f"💲Valor a pagar: {est['precio_total']:,} COP\n\n"
-            "¿Todo correcto o quieres cambiar otro dato?"
-        )
-        await ctx.bot.send_message(chat_id=cid, text=resumen, parse_mode="Markdown")
-        return
+    await ctx.bot.send_message(
+        chat_id=cid,
+        text="Indícame qué dato deseas cambiar (nombre, correo, teléfono, ciudad, etc.).",
+        parse_mode="Markdown"
+    )
+    return
+
 
+# 💾 Guardar nuevo valor editado
+@flujo_responder.fase("editando_dato", destinos=("confirmar_datos_guardados",))
+async def fase_editando_dato(turno: Turno):
+    ctx, cid, txt_raw, est = turno.ctx, turno.cid, turno.txt_raw, turno.est
+    campo = est.get("campo_a_editar")
 
-    # ✏️ Nombre del cliente
-    if est.get("fase") == "esperando_nombre":
-        est["nombre"] = txt_raw
-        est["fase"] = "esperando_correo"
+    if campo == "correo" and not re.match(r"[^@]+@[^@]+\.[^@]+", txt_raw):
         await ctx.bot.send_message(
             chat_id=cid,
-            text="¿Cuál es tu correo electrónico? 📧",
+            text="⚠️ Ese correo no parece válido. Intenta con nombre@dominio.com",
             parse_mode="Markdown"
         )
         return
-
-    # 📧 Correo del cliente
-    if est.get("fase") == "esperando_correo":
-        if re.match(r"[^@]+@[^@]+\.[^@]+", txt_raw):
-            est["correo"] = txt_raw
-            est["fase"] = "esperando_telefono"
-            await ctx.bot.send_message(
-                chat_id=cid,
-                text="¿Tu número de teléfono? 📱",
-                parse_mode="Markdown"
-            )
-        else:
-            await ctx.bot.send_message(
-                chat_id=cid,
-                text="Mandame tu correo pa que sigamos con la compra😊.",
-                parse_mode="Markdown"
-            )
+    if campo == "telefono" and not re.match(r"^\+?\d{7,15}$", txt_raw):
+        await ctx.bot.send_message(
+            chat_id=cid,
+            text="⚠️ Ese teléfono no es válido. Incluye solo números y, opcional, el +57.",
+            parse_mode="Markdown"
+        )
         return
 
-    # 📞 Teléfono del cliente
-    if est.get("fase") == "esperando_telefono":
-        if re.match(r"^\+?\d{7,15}$", txt_raw):
-            est["telefono"] = txt_raw
-            est["fase"] = "esperando_cedula"
-            await ctx.bot.send_message(
-                chat_id=cid,
-                text="¿Tu número de cédula? 🪪",
-                parse_mode="Markdown"
-            )
-        else:
-            await ctx.bot.send_message(
-                chat_id=cid,
-                text="Este no parece un telefono real manda el tuyo porfa.",
-                parse_mode="Markdown"
-            )
-        return
+    est[campo] = txt_raw.strip()
+    est.pop("campo_a_editar", None)
+    est["fase"] = "confirmar_datos_guardados"
+
+    resumen = (
+        f"🔄 *Datos actualizados:*\n\n"
+        f"👤Nombre: {est.get('nombre')}\n"
+        f"📧Correo: {est.get('correo')}\n"
+        f"📱Celular: {est.get('telefono')}\n"
+        f"🪪Cédula: {est.get('cedula')}\n"
+        f"📍Dirección: {est.get('direccion')}, {est.get('ciudad')}, {est.get('provincia')}\n"
+        f"👟Producto: {est['modelo']} color {est['color']} talla {est['talla']}\n"
+        f"💲Valor a pagar: {est['precio_total']:,} COP\n\n"
+        "¿Todo correcto o quieres cambiar otro dato?"
+    )
+    await ctx.bot.send_message(chat_id=cid, text=resumen, parse_mode="Markdown")
+    return
 
-    # 🪪 Cédula del cliente
-    if est.get("fase") == "esperando_cedula":
-        if re.match(r"^\d{5,15}$", txt_raw):
-            est["cedula"] = txt_raw
-            est["fase"] = "esperando_ciudad"
-            await ctx.bot.send_message(
-                chat_id=cid,
-                text="¿En qué ciudad estás? 🏙️",
-                parse_mode="Markdown"
-            )
-        else:
-            await ctx.bot.send_message(
-                chat_id=cid,
-                text="⚠️ Tu cedula real para el pedido porfavor.",
-                parse_mode="Markdown"
-            )
-        return
 
-    # 🌆 Ciudad del cliente
-    if est.get("fase") == "esperando_ciudad":
-        est["ciudad"] = txt_raw
-        est["fase"] = "esperando_provincia"
+# ✏️ Nombre del cliente
+@flujo_responder.fase("esperando_nombre", destinos=("esperando_correo",))
+async def fase_esperando_nombre(turno: Turno):
+    ctx, cid, txt_raw, est = turno.ctx, turno.cid, turno.txt_raw, turno.est
+    est["nombre"] = txt_raw
+    est["fase"] = "esperando_correo"
+    await ctx.bot.send_message(
+        chat_id=cid,
+        text="¿Cuál es tu correo electrónico? 📧",
+        parse_mode="Markdown"
+    )
+    return
+
+
+# 📧 Correo del cliente
+@flujo_responder.fase("esperando_correo", destinos=("esperando_telefono",))
+async def fase_esperando_correo(turno: Turno):
+    ctx, cid, txt_raw, est = turno.ctx, turno.cid, turno.txt_raw, turno.est
+    if re.match(r"[^@]+@[^@]+\.[^@]+", txt_raw):
+        est["correo"] = txt_raw
+        est["fase"] = "esperando_telefono"
         await ctx.bot.send_message(
             chat_id=cid,
-            text="¿En qué departamento o provincia estás? 🏞️",
+            text="¿Tu número de teléfono? 📱",
             parse_mode="Markdown"
         )
-        return
-
-    # 🏞️ Provincia del cliente
-    if est.get("fase") == "esperando_provincia":
-        est["provincia"] = txt_raw
-        est["fase"] = "esperando_direccion"
+    else:
         await ctx.bot.send_message(
             chat_id=cid,
-            text="¿Dirección exacta de envío? 🏡",
+            text="Mandame tu correo pa que sigamos con la compra😊.",
             parse_mode="Markdown"
         )
-        return
+    return
 
-    # 🏡 Dirección de envío
-    if est.get("fase") == "esperando_direccion":
-        est["direccion"] = txt_raw.strip()
-
-        # Guardar cliente
-        actualizar_cliente(numero, {
-            "nombre": est.get("nombre"),
-            "correo": est.get("correo"),
-            "telefono": est.get("telefono"),
-            "cedula": est.get("cedula"),
-            "ciudad": est.get("ciudad"),
-            "provincia": est.get("provincia"),
-            "direccion": est.get("direccion")
-        })
 
-        precio = next(
-            (
-                i["precio"] for i in inv
-                if normalize(i["marca"]) == normalize(est["marca"])
-                and normalize(i["modelo"]) == normalize(est["modelo"])
-                and normalize(i["color"]) == normalize(est["color"])
-            ),
-            None
+# 📞 Teléfono del cliente
+@flujo_responder.fase("esperando_telefono", destinos=("esperando_cedula",))
+async def fase_esperando_telefono(turno: Turno):
+    ctx, cid, txt_raw, est = turno.ctx, turno.cid, turno.txt_raw, turno.est
+    if re.match(r"^\+?\d{7,15}$", txt_raw):
+        est["telefono"] = txt_raw
+        est["fase"] = "esperando_cedula"
+        await ctx.bot.send_message(
+            chat_id=cid,
+            text="¿Tu número de cédula? 🪪",
+            parse_mode="Markdown"
         )
-        if precio is None:
-            await ctx.bot.send_message(
-                chat_id=cid,
-                text="No pude obtener el precio, intenta de nuevo."
-            )
-            return
+    else:
+        await ctx.bot.send_message(
+            chat_id=cid,
+            text="Este no parece un telefono real manda el tuyo porfa.",
+            parse_mode="Markdown"
+        )
+    return
 
-        est["precio_total"] = int(precio)
-        est.setdefault("talla", "—")
-        est["sale_id"] = est.get("sale_id") or generate_sale_id()
-
-        est["resumen"] = {
-            "Número Venta": est["sale_id"],
-            "Fecha Venta": datetime.now().isoformat(),
-            "Cliente": est["nombre"],
-            "Teléfono": est["telefono"],
-            "Cédula": est["cedula"],
-            "Producto": est["modelo"],
-            "Color": est["color"],
-            "Talla": est["talla"],
-            "Correo": est["correo"],
-            "Pago": None,
-            "Estado": "PENDIENTE"
-        }
 
-    # ────────────────────────────────────────────────
-    # 💳 MÉTODO DE PAGO – RESUMEN PERSONALIZADO
-    # ────────────────────────────────────────────────
-    if est.get("fase") == "resumen_compra":
-        msg = (
-            f"✅ Pedido: {est['sale_id']}\n"
-            f"👤Nombre: {est['nombre']}\n"
-            f"📧Correo: {est['correo']}\n"
-            f"📱Celular: {est['telefono']}\n"
-            f"📍Dirección: {est['direccion']}, {est['ciudad']}, {est['provincia']}\n"
-            f"👟Producto: {est['modelo']} color {est['color']} talla {est['talla']}\n"
-            f"💲Valor a pagar: {est['precio_total']:,} COP\n\n"
+# 🪪 Cédula del cliente
+@flujo_responder.fase("esperando_cedula", destinos=("esperando_ciudad",))
+async def fase_esperando_cedula(turno: Turno):
+    ctx, cid, txt_raw, est = turno.ctx, turno.cid, turno.txt_raw, turno.est
+    if re.match(r"^\d{5,15}$", txt_raw):
+        est["cedula"] = txt_raw
+        est["fase"] = "esperando_ciudad"
+        await ctx.bot.send_message(
+            chat_id=cid,
+            text="¿En qué ciudad estás? 🏙️",
+            parse_mode="Markdown"
+        )
+    else:
+        await ctx.bot.send_message(
+            chat_id=cid,
+            text="⚠️ Tu cedula real para el pedido porfavor.",
+            parse_mode="Markdown"
         )
+    return
 
-        if est.get("es_de_bucaramanga"):
-            msg += (
-                "📍 Como estás en *Bucaramanga*, puedes elegir:\n"
-                "• 🛵 *Domicilio*: te lo llevamos y pagas al recibir\n"
-                "• 🏪 *Tienda*: puedes pasar a recogerlo tú mismo\n\n"
-                "¿Qué prefieres? Escribe *domicilio* o *tienda*"
-            )
-            est["fase"] = "esperando_metodo_bucaramanga"
-        else:
-            msg += (
-                "😊 Tenemos *4 formas de pago* 💰\n\n"
-                "1. 💵 *Pago anticipado* (Nequi, Daviplata, Bancolombia):\n"
-                "   Pagas el valor completo antes del envío y tu compra queda asegurada 🚀.\n\n"
-                "2. ✈️ *Pago contra entrega*:\n"
-                "   Haces un abono de *$30.000* y el restante lo pagas a la transportadora al recibir tu calzado.\n\n"
-                "3. 💳 *Tarjeta de crédito*:\n"
-                "   Paga online con tu tarjeta desde el enlace que te enviamos (Visa, MasterCard, etc.).\n\n"
-                "4. 💙 *Crédito a cuotas por medio de Addi*:\n"
-                "   Financia tu compra y paga en cuotas mensuales de forma fácil y rápida.\n\n"
-                "🤩 ¿Por cuál medio te queda más fácil hacer el pago?\n"
-                "Escribe: *Pago anticipado*, *Contraentrega*, *Tarjeta* o *Addi*."
-            )
-            est["fase"] = "esperando_pago"
 
-        await ctx.bot.send_message(chat_id=cid, text=msg, parse_mode="Markdown")
-        estado_usuario[cid] = est
+# 🌆 Ciudad del cliente
+@flujo_responder.fase("esperando_ciudad", destinos=("esperando_provincia",))
+async def fase_esperando_ciudad(turno: Turno):
+    ctx, cid, txt_raw, est = turno.ctx, turno.cid, turno.txt_raw, turno.est
+    est["ciudad"] = txt_raw
+    est["fase"] = "esperando_provincia"
+    await ctx.bot.send_message(
+        chat_id=cid,
+        text="¿En qué departamento o provincia estás? 🏞️",
+        parse_mode="Markdown"
+    )
+    return
+
+
+# 🏞️ Provincia del cliente
+@flujo_responder.fase("esperando_provincia", destinos=("esperando_direccion",))
+async def fase_esperando_provincia(turno: Turno):
+    ctx, cid, txt_raw, est = turno.ctx, turno.cid, turno.txt_raw, turno.est
+    est["provincia"] = txt_raw
+    est["fase"] = "esperando_direccion"
+    await ctx.bot.send_message(
+        chat_id=cid,
+        text="¿Dirección exacta de envío? 🏡",
+        parse_mode="Markdown"
+    )
+    return
+
+
+# 🏡 Dirección de envío
+@flujo_responder.fase("esperando_direccion")
+async def fase_esperando_direccion(turno: Turno):
+    ctx, cid, numero, txt_raw, est, inv = turno.ctx, turno.cid, turno.numero, turno.txt_raw, turno.est, turno.inv
+    est["direccion"] = txt_raw.strip()
+
+    # Guardar cliente
+    await en_hilo("drive", actualizar_cliente, numero, {
+        "nombre": est.get("nombre"),
+        "correo": est.get("correo"),
+        "telefono": est.get("telefono"),
+        "cedula": est.get("cedula"),
+        "ciudad": est.get("ciudad"),
+        "provincia": est.get("provincia"),
+        "direccion": est.get("direccion")
+    })
+
+    precio = inv.precio(est["marca"], est["modelo"], est["color"])
+    if precio is None:
+        await ctx.bot.send_message(
+            chat_id=cid,
+            text="No pude obtener el precio, intenta de nuevo."
+        )
         return
 
+    est["precio_total"] = int(precio)
+    est.setdefault("talla", "—")
+    est["sale_id"] = est.get("sale_id") or generate_sale_id()
+
+    est["resumen"] = {
+        "Número Venta": est["sale_id"],
+        "Fecha Venta": datetime.now().isoformat(),
+        "Cliente": est["nombre"],
+        "Teléfono": est["telefono"],
+        "Cédula": est["cedula"],
+        "Producto": est["modelo"],
+        "Color": est["color"],
+        "Talla": est["talla"],
+        "Correo": est["correo"],
+        "Pago": None,
+        "Estado": "PENDIENTE"
+    }
+    return SIGUE
+
+
+# ────────────────────────────────────────────────
+# 💳 MÉTODO DE PAGO – RESUMEN PERSONALIZADO
+# ────────────────────────────────────────────────
+@flujo_responder.fase("resumen_compra", destinos=("esperando_metodo_bucaramanga", "esperando_pago"))
+async def fase_resumen_compra(turno: Turno):
+    ctx, cid, est = turno.ctx, turno.cid, turno.est
+    msg = (
+        f"✅ Pedido: {est['sale_id']}\n"
+        f"👤Nombre: {est['nombre']}\n"
+        f"📧Correo: {est['correo']}\n"
+        f"📱Celular: {est['telefono']}\n"
+        f"📍Dirección: {est['direccion']}, {est['ciudad']}, {est['provincia']}\n"
+        f"👟Producto: {est['modelo']} color {est['color']} talla {est['talla']}\n"
+        f"💲Valor a pagar: {est['precio_total']:,} COP\n\n"
+    )
 
-    # ────────────────────────────────────────────────
-    # 💳 MÉTODO DE PAGO – ELECCIÓN
-    # ────────────────────────────────────────────────
-    if est.get("fase") == "esperando_pago":
-        opciones = {
-            "transferencia": [
-                "transferencia", "trasferencia", "transf", "trans", "pago inmediato", "qr",
-                "nequi", "davivienda", "daviplata", "bancolombia", "pse"
-            ],
-            "contraentrega": [
-                "contraentrega", "contra entrega", "contra", "contrapago"
-            ],
-            "addi": [
-                "addi", "pagar con addi", "credito", "crédito", "financiacion", "financiación"
-            ],
-            "tarjeta": [
-                "tarjeta", "tarjeta de credito", "tarjeta de crédito", "pago con tarjeta", "visa", "mastercard"
-            ]
-        }
-        txt_normalizado = normalize(txt_raw)
-        metodo_detectado = None
-        for metodo, alias in opciones.items():
-            if difflib.get_close_matches(txt_normalizado, alias, n=1, cutoff=0.6):
-                metodo_detectado = metodo
-                break
+    if est.get("es_de_bucaramanga"):
+        msg += (
+            "📍 Como estás en *Bucaramanga*, puedes elegir:\n"
+            "• 🛵 *Domicilio*: te lo llevamos y pagas al recibir\n"
+            "• 🏪 *Tienda*: puedes pasar a recogerlo tú mismo\n\n"
+            "¿Qué prefieres? Escribe *domicilio* o *tienda*"
+        )
+        est["fase"] = "esperando_metodo_bucaramanga"
+    else:
+        msg += (
+            "😊 Tenemos *4 formas de pago* 💰\n\n"
+            "1. 💵 *Pago anticipado* (Nequi, Daviplata, Bancolombia):\n"
+            "   Pagas el valor completo antes del envío y tu compra queda asegurada 🚀.\n\n"
+            "2. ✈️ *Pago contra entrega*:\n"
+            "   Haces un abono de *$30.000* y el restante lo pagas a la transportadora al recibir tu calzado.\n\n"
+            "3. 💳 *Tarjeta de crédito*:\n"
+            "   Paga online con tu tarjeta desde el enlace que te enviamos (Visa, MasterCard, etc.).\n\n"
+            "4. 💙 *Crédito a cuotas por medio de Addi*:\n"
+            "   Financia tu compra y paga en cuotas mensuales de forma fácil y rápida.\n\n"
+            "🤩 ¿Por cuál medio te queda más fácil hacer el pago?\n"
+            "Escribe: *Pago anticipado*, *Contraentrega*, *Tarjeta* o *Addi*."
+        )
+        est["fase"] = "esperando_pago"
 
-        if not metodo_detectado:
-            await ctx.bot.send_message(
-                chat_id=cid,
-                text="💳 Dime porfa cómo deseas pagar: *pago anticipado*, *transferencia*, *nequi*, *daviplata*, *bancolombia*, *tarjeta*, *contraentrega* o *Addi* 😊",
-                parse_mode="Markdown"
-            )
-            return
+    await ctx.bot.send_message(chat_id=cid, text=msg, parse_mode="Markdown")
+    estado_usuario[cid] = est
+    return
 
-        resumen = est["resumen"]
-        precio_original = est["precio_total"]
 
-        if metodo_detectado == "transferencia":
-            est["fase"] = "esperando_comprobante"
-            est["metodo_pago"] = "Transferencia"
-            descuento = round(precio_original * 0.05)
-            valor_final = precio_original - descuento
+# ────────────────────────────────────────────────
+# 💳 MÉTODO DE PAGO – ELECCIÓN
+# ────────────────────────────────────────────────
+@flujo_responder.fase("esperando_pago", destinos=("esperando_comprobante", "esperando_datos_addi"))
+async def fase_esperando_pago(turno: Turno):
+    ctx, cid, analisis, est = turno.ctx, turno.cid, turno.analisis, turno.est
+    opciones = {
+        "transferencia": [
+            "transferencia", "trasferencia", "transf", "trans", "pago inmediato", "qr",
+            "nequi", "davivienda", "daviplata", "bancolombia", "pse"
+        ],
+        "contraentrega": [
+            "contraentrega", "contra entrega", "contra", "contrapago"
+        ],
+        "addi": [
+            "addi", "pagar con addi", "credito", "crédito", "financiacion", "financiación"
+        ],
+        "tarjeta": [
+            "tarjeta", "tarjeta de credito", "tarjeta de crédito", "pago con tarjeta", "visa", "mastercard"
+        ]
+    }
+    txt_normalizado = analisis.normalizado
+    metodo_detectado = None
+    for metodo, alias in opciones.items():
+        if vocabulario(tuple(alias)).parecido(txt_normalizado, cutoff=0.6):
+            metodo_detectado = metodo
+            break
+
+    if not metodo_detectado:
+        await ctx.bot.send_message(
+            chat_id=cid,
+            text="💳 Dime porfa cómo deseas pagar: *pago anticipado*, *transferencia*, *nequi*, *daviplata*, *bancolombia*, *tarjeta*, *contraentrega* o *Addi* 😊",
+            parse_mode="Markdown"
+        )
+        return
 
-            resumen.update({
-                "Pago": "Transferencia",
-                "Descuento": f"-{descuento} COP",
-                "Valor Final": valor_final
-            })
+    resumen = est["resumen"]
+    precio_original = est["precio_total"]
 
-            estado_usuario[cid] = est
-            msg = (
-                "🟢 Elegiste *Pago anticipado* (Nequi, Daviplata, Bancolombia, Davivienda).\n\n"
-                f"💰 Valor original: {precio_original:,} COP\n"
-                f"🎉 Descuento 5 %: -{descuento:,} COP\n"
-                f"✅ Total a pagar: {valor_final:,} COP\n\n"
-                "💳 Cuentas:\n"
-                "- Bancolombia 30300002233 (X100 SAS)\n"
-                "- Nequi 317 717 1171\n"
-                "- Daviplata 300 414 1021\n"
-                "- Davivienda 0066000000 (ejemplo)\n\n"
-                "📸 Envía aquí la foto del comprobante."
-            )
-            await ctx.bot.send_message(chat_id=cid, text=msg, parse_mode="Markdown")
-            return
+    if metodo_detectado == "transferencia":
+        est["fase"] = "esperando_comprobante"
+        est["metodo_pago"] = "Transferencia"
+        descuento = round(precio_original * 0.05)
+        valor_final = precio_original - descuento
 
-        elif metodo_detectado == "contraentrega":
-            est["fase"] = "esperando_comprobante"
-            est["metodo_pago"] = "Contraentrega"
-            resumen.update({
-                "Pago": "Contra entrega",
-                "Valor Anticipo": 30000
-            })
+        resumen.update({
+            "Pago": "Transferencia",
+            "Descuento": f"-{descuento} COP",
+            "Valor Final": valor_final
+        })
 
-            estado_usuario[cid] = est
-            msg = (
-                "🟡 Elegiste *CONTRAENTREGA*.\n\n"
-                "Debes adelantar *30 000 COP* para el envío (se descuenta del total).\n\n"
-                "💳 Cuentas:\n"
-                "- Bancolombia 30300002233 (X100 SAS)\n"
-                "- Nequi 317 717 1171\n"
-                "- Daviplata 300 414 1021\n"
-                "- Davivienda 0066000000 (ejemplo)\n\n"
-                "📸 Envía aquí la foto del comprobante."
-            )
-            await ctx.bot.send_message(chat_id=cid, text=msg, parse_mode="Markdown")
-            return
+        estado_usuario[cid] = est
+        msg = (
+            "🟢 Elegiste *Pago anticipado* (Nequi, Daviplata, Bancolombia, Davivienda).\n\n"
+            f"💰 Valor original: {precio_original:,} COP\n"
+            f"🎉 Descuento 5 %: -{descuento:,} COP\n"
+            f"✅ Total a pagar: {valor_final:,} COP\n\n"
+            "💳 Cuentas:\n"
+            "- Bancolombia 30300002233 (X100 SAS)\n"
+            "- Nequi 317 717 1171\n"
+            "- Daviplata 300 414 1021\n"
+            "- Davivienda 0066000000 (ejemplo)\n\n"
+            "📸 Envía aquí la foto del comprobante."
+        )
+        await ctx.bot.send_message(chat_id=cid, text=msg, parse_mode="Markdown")
+        return
 
-        # ────────────────────────────────────────────────
-        # 💳 DETECTÓ MÉTODO "Addi"
-        # ────────────────────────────────────────────────
-        elif metodo_detectado == "addi":
-            est["fase"] = "esperando_datos_addi"
-            est["metodo_pago"] = "Addi"
-            estado_usuario[cid] = est
+    elif metodo_detectado == "contraentrega":
+        est["fase"] = "esperando_comprobante"
+        est["metodo_pago"] = "Contraentrega"
+        resumen.update({
+            "Pago": "Contra entrega",
+            "Valor Anticipo": 30000
+        })
 
-            await ctx.bot.send_message(
-                chat_id=cid,
-                text=(
-                    "🟦 Elegiste *Addi* para financiar tu compra.\n\n"
-                    "Por favor envíame los siguientes datos (cada uno en una línea):\n"
-                    "1️⃣ Nombre completo\n"
-                    "2️⃣ Número de cédula\n"
-                    "3️⃣ Correo electrónico\n"
-                    "4️⃣ Teléfono WhatsApp\n\n"
-                    "_La aprobación está sujeta a políticas de Addi y centrales de riesgo._"
-                ),
-                parse_mode="Markdown"
-            )
-            return   # ← nada más se procesa en esta vuelta
-
-        elif metodo_detectado == "tarjeta":
-            est["fase"] = "esperando_comprobante"
-            est["metodo_pago"] = "Tarjeta"
-            resumen.update({
-                "Pago": "Tarjeta de crédito",
-                "Valor": precio_original
-            })
+        estado_usuario[cid] = est
+        msg = (
+            "🟡 Elegiste *CONTRAENTREGA*.\n\n"
+            "Debes adelantar *30 000 COP* para el envío (se descuenta del total).\n\n"
+            "💳 Cuentas:\n"
+            "- Bancolombia 30300002233 (X100 SAS)\n"
+            "- Nequi 317 717 1171\n"
+            "- Daviplata 300 414 1021\n"
+            "- Davivienda 0066000000 (ejemplo)\n\n"
+            "📸 Envía aquí la foto del comprobante."
+        )
+        await ctx.bot.send_message(chat_id=cid, text=msg, parse_mode="Markdown")
+        return
 
-            estado_usuario[cid] = est
-            msg = (
-                "💳 Elegiste *tarjeta de crédito*.\n\n"
-                f"💰 Valor a pagar: {precio_original:,} COP\n\n"
-                "Te enviaré un enlace para pagar con tu tarjeta Visa, MasterCard o similar.\n"
-                "Avísame si tienes alguna preferencia o requieres ayuda con el proceso."
-            )
-            await ctx.bot.send_message(chat_id=cid, text=msg, parse_mode="Markdown")
-            return
+    # ────────────────────────────────────────────────
+    # 💳 DETECTÓ MÉTODO "Addi"
+    # ────────────────────────────────────────────────
+    elif metodo_detectado == "addi":
+        est["fase"] = "esperando_datos_addi"
+        est["metodo_pago"] = "Addi"
+        estado_usuario[cid] = est
 
+        await ctx.bot.send_message(
+            chat_id=cid,
+            text=(
+                "🟦 Elegiste *Addi* para financiar tu compra.\n\n"
+                "Por favor envíame los siguientes datos (cada uno en una línea):\n"
+                "1️⃣ Nombre completo\n"
+                "2️⃣ Número de cédula\n"
+                "3️⃣ Correo electrónico\n"
+                "4️⃣ Teléfono WhatsApp\n\n"
+                "_La aprobación está sujeta a políticas de Addi y centrales de riesgo._"
+            ),
+            parse_mode="Markdown"
+        )
+        return   # ← nada más se procesa en esta vuelta
+
+    elif metodo_detectado == "tarjeta":
+        est["fase"] = "esperando_comprobante"
+        est["metodo_pago"] = "Tarjeta"
+        resumen.update({
+            "Pago": "Tarjeta de crédito",
+            "Valor": precio_original
+        })
 
-    # ────────────────────────────────────────────────────────────────
-    # ⏸️  PAUSA GLOBAL DEL CHAT (si un humano debe continuar)
-    # ────────────────────────────────────────────────────────────────
+        estado_usuario[cid] = est
+        msg = (
+            "💳 Elegiste *tarjeta de crédito*.\n\n"
+            f"💰 Valor a pagar: {precio_original:,} COP\n\n"
+            "Te enviaré un enlace para pagar con tu tarjeta Visa, MasterCard o similar.\n"
+            "Avísame si tienes alguna preferencia o requieres ayuda con el proceso."
+        )
+        await ctx.bot.send_message(chat_id=cid, text=msg, parse_mode="Markdown")
+        return
+    return SIGUE
+
+
+# ────────────────────────────────────────────────────────────────
+# ⏸️  PAUSA GLOBAL DEL CHAT (si un humano debe continuar)
+# ────────────────────────────────────────────────────────────────
+@flujo_responder.interrupcion(destinos=("inicial",))
+async def interrupcion_pausa(turno: Turno):
+    cid, est = turno.cid, turno.est
     if est.get("pausa_hasta"):
         pausa_hasta = datetime.fromisoformat(est["pausa_hasta"])
         if datetime.now() < pausa_hasta:
@@ -3565,180 +4071,197 @@ async def responder(update: Update, ctx: ContextTypes.DEFAULT_TYPE):
             }
         else:
             # La pausa expiró → reiniciamos el flujo
-            est.pop("pausa_hasta", None)
-            if est.get("fase", "").startswith("pausado_"):
-                est["fase"] = "inicial"
-            estado_usuario[cid] = est
-
-    # ────────────────────────────────────────────────────────────────
-    # 📋 DATOS PARA ADDI – VERSIÓN TOLERANTE
-    # ────────────────────────────────────────────────────────────────
-    if est.get("fase") == "esperando_datos_addi":
-        try:
-            # 1. Separa en líneas no vacías
-            partes = [p.strip() for p in txt_raw.splitlines() if p.strip()]
-
-            # 2. Necesitamos exactamente 4 líneas con algún contenido
-            if len(partes) < 4:
-                await ctx.bot.send_message(
-                    chat_id=cid,
-                    text=(
-                        "❌ *Faltan datos.*\n\n"
-                        "Envíame 4 líneas así:\n"
-                        "1️⃣ Nombre completo\n2️⃣ Cédula\n3️⃣ Correo\n4️⃣ Teléfono WhatsApp"
-                    ),
-                    parse_mode="Markdown"
-                )
-                return  # sigue esperando
-
-            nombre, cedula, correo, telefono = partes[:4]
+            est.pop("pausa_hasta", None)
+            if est.get("fase", "").startswith("pausado_"):
+                est["fase"] = "inicial"
+            estado_usuario[cid] = est
+    return SIGUE
 
-            datos_addi = {
-                "Cliente":   nombre.title(),
-                "Cédula":    cedula,
-                "Teléfono":  telefono,
-                "Correo":    correo,
-                "Fecha":     datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-            }
 
-            if registrar_orden_unificada(datos_addi, destino="ADDI"):
-                await ctx.bot.send_message(
-                    chat_id=cid,
-                    text=(
-                        "✅ ¡Gracias! Tus datos fueron enviados a Addi.\n"
-                        "Enseguida me comunico para seguir el proceso. 💙"
-                    )
-                )
-                est["fase"] = "pausado_addi"
-                est["pausa_hasta"] = (datetime.now() + timedelta(hours=24)).isoformat()
-                estado_usuario[cid] = est
-            else:
-                await ctx.bot.send_message(
-                    chat_id=cid,
-                    text="⚠️ No pudimos registrar tus datos. Intenta nuevamente más tarde."
-                )
-            return
+# ────────────────────────────────────────────────────────────────
+# 📋 DATOS PARA ADDI – VERSIÓN TOLERANTE
+# ────────────────────────────────────────────────────────────────
+@flujo_responder.fase("esperando_datos_addi", destinos=("pausado_addi",))
+async def fase_esperando_datos_addi(turno: Turno):
+    ctx, cid, txt_raw, est = turno.ctx, turno.cid, turno.txt_raw, turno.est
+    try:
+        # 1. Separa en líneas no vacías
+        partes = [p.strip() for p in txt_raw.splitlines() if p.strip()]
 
-        except Exception as e:
-            logging.error(f"[ADDI] ❌ Error registrando datos: {e}")
+        # 2. Necesitamos exactamente 4 líneas con algún contenido
+        if len(partes) < 4:
             await ctx.bot.send_message(
                 chat_id=cid,
-                text="❌ Hubo un error procesando tus datos para Addi. Intenta de nuevo más tarde."
+                text=(
+                    "❌ *Faltan datos.*\n\n"
+                    "Envíame 4 líneas así:\n"
+                    "1️⃣ Nombre completo\n2️⃣ Cédula\n3️⃣ Correo\n4️⃣ Teléfono WhatsApp"
+                ),
+                parse_mode="Markdown"
             )
-            return
-
-
-    # 📸 Recibir comprobante de pago
-    if est.get("fase") == "esperando_comprobante" and update.message.photo:
-        try:
-            f = await update.message.photo[-1].get_file()
-            tmp = os.path.join("temp", f"{cid}_proof.jpg")
-            os.makedirs("temp", exist_ok=True)
-            await f.download_to_drive(tmp)
+            return  # sigue esperando
 
-            with io.open(tmp, "rb") as image_file:
-                content = image_file.read()
-            image = vision.Image(content=content)
-            response = vision_client.text_detection(image=image)
-            textos_detectados = response.text_annotations
+        nombre, cedula, correo, telefono = partes[:4]
 
-            texto_extraido = textos_detectados[0].description if textos_detectados else ""
-            print("🧾 TEXTO EXTRAÍDO:\n", texto_extraido)
+        datos_addi = {
+            "Cliente":   nombre.title(),
+            "Cédula":    cedula,
+            "Teléfono":  telefono,
+            "Correo":    correo,
+            "Fecha":     datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+        }
 
-            if not es_comprobante_valido(texto_extraido):
-                await ctx.bot.send_message(
-                    chat_id=cid,
-                    text="⚠️ El comprobante no parece válido. Asegúrate de que sea legible y que diga *Pago exitoso*.",
-                    parse_mode="Markdown"
+        if await en_hilo("sheets", registrar_orden_unificada, datos_addi, destino="ADDI"):
+            await ctx.bot.send_message(
+                chat_id=cid,
+                text=(
+                    "✅ ¡Gracias! Tus datos fueron enviados a Addi.\n"
+                    "Enseguida me comunico para seguir el proceso. 💙"
                 )
-                os.remove(tmp)
-                return
+            )
+            est["fase"] = "pausado_addi"
+            est["pausa_hasta"] = (datetime.now() + timedelta(hours=24)).isoformat()
+            estado_usuario[cid] = est
+        else:
+            await ctx.bot.send_message(
+                chat_id=cid,
+                text="⚠️ No pudimos registrar tus datos. Intenta nuevamente más tarde."
+            )
+        return
 
-            # Enviar correos (si aplica)
-            try:
-                enviar_correo(
-                    est["correo"],
-                    f"Pago recibido {est['resumen']['Número Venta']}",
-                    json.dumps(est["resumen"], indent=2)
-                )
-                enviar_correo_con_adjunto(
-                    EMAIL_JEFE,
-                    f"Comprobante {est['resumen']['Número Venta']}",
-                    json.dumps(est["resumen"], indent=2),
-                    tmp
-                )
-            except Exception as e:
-                logging.warning(f"📧 Error al enviar correos: {e}")
+    except Exception as e:
+        logging.error(f"[ADDI] ❌ Error registrando datos: {e}")
+        await ctx.bot.send_message(
+            chat_id=cid,
+            text="❌ Hubo un error procesando tus datos para Addi. Intenta de nuevo más tarde."
+        )
+        return
 
-            # ✅ Registrar en hoja PEDIDOS como completado
-            resumen_final = est.get("resumen", {})
-            resumen_final["fase_actual"] = "Finalizado"
-            resumen_final["Estado"] = "COMPLETADO"
-            registrar_orden_unificada(resumen_final, destino="PEDIDOS")
 
-            os.remove(tmp)
+# 📸 Recibir comprobante de pago
+@flujo_responder.fase("esperando_comprobante", destinos=("inicio",))
+async def fase_esperando_comprobante(turno: Turno):
+    update, ctx, cid, est = turno.update, turno.ctx, turno.cid, turno.est
+    if not update.message.photo:
+        return SIGUE
 
-            await ctx.bot.send_message(
-                chat_id=cid,
-                text="✅ ¡Pago registrado exitosamente! Tu pedido está en proceso. 🚚"
-            )
+    try:
+        f = await update.message.photo[-1].get_file()
+        tmp = os.path.join("temp", f"{cid}_proof.jpg")
+        os.makedirs("temp", exist_ok=True)
+        await f.download_to_drive(tmp)
 
-            await enviar_sticker(ctx, cid, "sticker_fin_de_compra_gracias.webp")
+        with io.open(tmp, "rb") as image_file:
+            content = image_file.read()
+        image = vision.Image(content=content)
+        response = await en_hilo("vision", vision_client.text_detection, image=image)
+        textos_detectados = response.text_annotations
 
-            reset_estado(cid)
-            estado_usuario.pop(cid, None)
-            return
+        texto_extraido = textos_detectados[0].description if textos_detectados else ""
+        print("🧾 TEXTO EXTRAÍDO:\n", texto_extraido)
 
-        except Exception as e:
-            logging.error(f"❌ Error al procesar comprobante: {e}")
+        if not es_comprobante_valido(texto_extraido):
             await ctx.bot.send_message(
                 chat_id=cid,
-                text="❌ No pude procesar el comprobante. Intenta con otra imagen.",
+                text="⚠️ El comprobante no parece válido. Asegúrate de que sea legible y que diga *Pago exitoso*.",
                 parse_mode="Markdown"
             )
+            os.remove(tmp)
             return
 
+        # Enviar correos (si aplica)
+        try:
+            enviar_correo(
+                est["correo"],
+                f"Pago recibido {est['resumen']['Número Venta']}",
+                json.dumps(est["resumen"], indent=2)
+            )
+            enviar_correo_con_adjunto(
+                EMAIL_JEFE,
+                f"Comprobante {est['resumen']['Número Venta']}",
+                json.dumps(est["resumen"], indent=2),
+                tmp
+            )
+        except Exception as e:
+            logging.warning(f"📧 Error al enviar correos: {e}")
 
+        # ✅ Registrar en hoja PEDIDOS como completado
+        resumen_final = est.get("resumen", {})
+        resumen_final["fase_actual"] = "Finalizado"
+        resumen_final["Estado"] = "COMPLETADO"
+        await en_hilo("sheets", registrar_orden_unificada, resumen_final, destino="PEDIDOS")
 
+        os.remove(tmp)
 
-
-
-    # 🚚 Rastrear pedido
-    if est.get("fase") == "esperando_numero_rastreo":
         await ctx.bot.send_message(
             chat_id=cid,
-            text="📦 Puedes rastrear tu pedido aquí:\nhttps://www.instagram.com/juanp_ocampo/",
-            parse_mode="Markdown"
+            text="✅ ¡Pago registrado exitosamente! Tu pedido está en proceso. 🚚"
         )
+
+        await enviar_sticker(ctx, cid, "sticker_fin_de_compra_gracias.webp")
+
         reset_estado(cid)
+        estado_usuario.pop(cid, None)
         return
 
-    # 🔄 Solicitud de devolución
-    if est.get("fase") == "esperando_numero_devolucion":
-        est["referencia"] = txt_raw.strip()
-        est["fase"] = "esperando_motivo_devolucion"
+    except Exception as e:
+        logging.error(f"❌ Error al procesar comprobante: {e}")
         await ctx.bot.send_message(
             chat_id=cid,
-            text="📝 ¿Cuál es el motivo de la devolución?",
+            text="❌ No pude procesar el comprobante. Intenta con otra imagen.",
             parse_mode="Markdown"
         )
         return
 
-    if est.get("fase") == "esperando_motivo_devolucion":
-        enviar_correo(
-            EMAIL_DEVOLUCIONES,
-            f"Solicitud de Devolución {NOMBRE_NEGOCIO}",
-            f"Venta: {est['referencia']}\nMotivo: {txt_raw}"
-        )
-        await ctx.bot.send_message(
-            chat_id=cid,
-            text="✅ Solicitud de devolución enviada exitosamente.",
-            parse_mode="Markdown"
-        )
-        reset_estado(cid)
-        return
 
-    # 🎙️ Procesar audio
+# 🚚 Rastrear pedido
+@flujo_responder.fase("esperando_numero_rastreo", destinos=("inicio",))
+async def fase_esperando_numero_rastreo(turno: Turno):
+    ctx, cid = turno.ctx, turno.cid
+    await ctx.bot.send_message(
+        chat_id=cid,
+        text="📦 Puedes rastrear tu pedido aquí:\nhttps://www.instagram.com/juanp_ocampo/",
+        parse_mode="Markdown"
+    )
+    reset_estado(cid)
+    return
+
+
+# 🔄 Solicitud de devolución
+@flujo_responder.fase("esperando_numero_devolucion", destinos=("esperando_motivo_devolucion",))
+async def fase_esperando_numero_devolucion(turno: Turno):
+    ctx, cid, txt_raw, est = turno.ctx, turno.cid, turno.txt_raw, turno.est
+    est["referencia"] = txt_raw.strip()
+    est["fase"] = "esperando_motivo_devolucion"
+    await ctx.bot.send_message(
+        chat_id=cid,
+        text="📝 ¿Cuál es el motivo de la devolución?",
+        parse_mode="Markdown"
+    )
+    return
+
+
+@flujo_responder.fase("esperando_motivo_devolucion", destinos=("inicio",))
+async def fase_esperando_motivo_devolucion(turno: Turno):
+    ctx, cid, txt_raw, est = turno.ctx, turno.cid, turno.txt_raw, turno.est
+    enviar_correo(
+        EMAIL_DEVOLUCIONES,
+        f"Solicitud de Devolución {NOMBRE_NEGOCIO}",
+        f"Venta: {est['referencia']}\nMotivo: {txt_raw}"
+    )
+    await ctx.bot.send_message(
+        chat_id=cid,
+        text="✅ Solicitud de devolución enviada exitosamente.",
+        parse_mode="Markdown"
+    )
+    reset_estado(cid)
+    return
+
+
+# 🎙️ Procesar audio
+@flujo_responder.interrupcion()
+async def interrupcion_audio(turno: Turno):
+    update, cid = turno.update, turno.cid
     if update.message.voice or update.message.audio:
         fobj = update.message.voice or update.message.audio
         tg_file = await fobj.get_file()
@@ -3748,75 +4271,88 @@ async def responder(update: Update, ctx: ContextTypes.DEFAULT_TYPE):
         os.remove(local_path)
 
         if not txt_raw:
+            from telegram import ReplyKeyboardRemove
             await update.message.reply_text(
                 "Ese audio se escucha muy mal 😕. ¿Podrías enviarlo de nuevo o escribir tu mensaje?",
                 reply_markup=ReplyKeyboardRemove()
             )
             return
-        txt = normalize(txt_raw)
+        turno.usar_texto(txt_raw)
+    return SIGUE
+
 
-    # 💬 Manejar precio por referencia
+# 💬 Manejar precio por referencia
+@flujo_responder.interrupcion()
+async def interrupcion_precio_por_referencia(turno: Turno):
+    update, ctx, inv = turno.update, turno.ctx, turno.inv
     if await manejar_precio(update, ctx, inv):
         return
+    return SIGUE
 
-    # 🛒 Confirmación para continuar con compra después de ver precios
-    if est.get("fase") == "confirmar_compra":
-        if txt in ("si", "sí", "si quiero comprar", "sí quiero comprar", "quiero comprar", "comprar", "dale", "SI", "De una", "claro"):
-            modelo = est.get("modelo_confirmado")
-            color_confirmado = est.get("color_confirmado")
-
-            if not modelo:
-                await ctx.bot.send_message(
-                    chat_id=cid,
-                    text="❌ No encontré el modelo que seleccionaste. Vuelve a escribirlo o envíame una imagen.",
-                    parse_mode="Markdown"
-                )
-                est["fase"] = "inicio"
-                estado_usuario[cid] = est
-                return
 
-            est["modelo"] = modelo
+# 🛒 Confirmación para continuar con compra después de ver precios
+@flujo_responder.fase("confirmar_compra", destinos=("inicio", "esperando_talla", "esperando_color"))
+async def fase_confirmar_compra(turno: Turno):
+    ctx, cid, txt, est, inv = turno.ctx, turno.cid, turno.txt, turno.est, turno.inv
+    if txt in ("si", "sí", "si quiero comprar", "sí quiero comprar", "quiero comprar", "comprar", "dale", "SI", "De una", "claro"):
+        modelo = est.get("modelo_confirmado")
+        color_confirmado = est.get("color_confirmado")
 
-            colores = obtener_colores_por_modelo(inv, modelo)
-            if isinstance(colores, (int, float, str)):
-                colores = [str(colores)]
+        if not modelo:
+            await ctx.bot.send_message(
+                chat_id=cid,
+                text="❌ No encontré el modelo que seleccionaste. Vuelve a escribirlo o envíame una imagen.",
+                parse_mode="Markdown"
+            )
+            est["fase"] = "inicio"
+            estado_usuario[cid] = est
+            return
 
-            if len(colores) == 1:
-                est["color"] = colores[0]
-                est["fase"] = "esperando_talla"
-                tallas = obtener_tallas_por_color(inv, modelo, colores[0])
-                if isinstance(tallas, (int, float, str)):
-                    tallas = [str(tallas)]
+        est["modelo"] = modelo
 
-                await ctx.bot.send_message(
-                    chat_id=cid,
-                    text=f"Tenemos las siguientes tallas disponibles para el modelo *{modelo}* color *{colores[0]}*?\n👉 Tallas disponibles: {', '.join(tallas)}",
-                    parse_mode="Markdown"
-                )
-            else:
-                est["fase"] = "esperando_color"
-                colores_str = "\n".join(f"- {c}" for c in colores)
-                await ctx.bot.send_message(
-                    chat_id=cid,
-                    text=f"🎨 El modelo *{modelo}* está disponible en varios colores:\n\n{colores_str}\n\n¿Cuál color te interesa?",
-                    parse_mode="Markdown"
-                )
+        colores = obtener_colores_por_modelo(inv, modelo)
+        if isinstance(colores, (int, float, str)):
+            colores = [str(colores)]
 
-            estado_usuario[cid] = est
-            return
+        if len(colores) == 1:
+            est["color"] = colores[0]
+            est["fase"] = "esperando_talla"
+            tallas = obtener_tallas_por_color(inv, modelo, colores[0])
+            if isinstance(tallas, (int, float, str)):
+                tallas = [str(tallas)]
 
+            await ctx.bot.send_message(
+                chat_id=cid,
+                text=f"Tenemos las siguientes tallas disponibles para el modelo *{modelo}* color *{colores[0]}*?\n👉 Tallas disponibles: {', '.join(tallas)}",
+                parse_mode="Markdown"
+            )
         else:
+            est["fase"] = "esperando_color"
+            colores_str = "\n".join(f"- {c}" for c in colores)
             await ctx.bot.send_message(
                 chat_id=cid,
-                text="No hay problema. Si deseas, puedes ver nuestro catálogo completo 📋.\n👉 https://wa.me/c/573246666652",
+                text=f"🎨 El modelo *{modelo}* está disponible en varios colores:\n\n{colores_str}\n\n¿Cuál color te interesa?",
                 parse_mode="Markdown"
             )
-            est["fase"] = "inicio"
-            estado_usuario[cid] = est
-            return
+
+        estado_usuario[cid] = est
+        return
+
+    else:
+        await ctx.bot.send_message(
+            chat_id=cid,
+            text="No hay problema. Si deseas, puedes ver nuestro catálogo completo 📋.\n👉 https://wa.me/c/573246666652",
+            parse_mode="Markdown"
+        )
+        est["fase"] = "inicio"
+        estado_usuario[cid] = est
+        return
 
 
-    # 🔄 Si el usuario dice “sí” antes de confirmar compra (por fuera del flujo)
+# 🔄 Si el usuario dice “sí” antes de confirmar compra (por fuera del flujo)
+@flujo_responder.interrupcion(destinos=("esperando_color", "inicio", "esperando_talla"))
+async def interrupcion_afirmacion(turno: Turno):
+    ctx, cid, txt_raw, est = turno.ctx, turno.cid, turno.txt_raw, turno.est
     if "sí" in txt_raw or "claro" in txt_raw or "dale" in txt_raw or "quiero" in txt_raw:
         modelo = est.get("modelo_confirmado")
         if not modelo:
@@ -3856,54 +4392,65 @@ async def responder(update: Update, ctx: ContextTypes.DEFAULT_TYPE):
             reply_markup=menu_botones(colores),
         )
         return
+    return SIGUE
 
-    # 🖼️ Procesar imagen subida si estaba esperando
-    if est.get("fase") == "esperando_imagen" and update.message.photo:
-        f = await update.message.photo[-1].get_file()
-        tmp = os.path.join("temp", f"{cid}.jpg")
-        os.makedirs("temp", exist_ok=True)
-        await f.download_to_drive(tmp)
 
-        with open(tmp, "rb") as f_img:
-            base64_img = base64.b64encode(f_img.read()).decode("utf-8")
-        os.remove(tmp)
+# 🖼️ Procesar imagen subida si estaba esperando
+@flujo_responder.fase("esperando_imagen", destinos=("imagen_detectada", "inicio"))
+async def fase_esperando_imagen(turno: Turno):
+    update, ctx, cid, est = turno.update, turno.ctx, turno.cid, turno.est
+    if not update.message.photo:
+        return SIGUE
 
-        mensaje = await identificar_modelo_desde_imagen(base64_img)
+    f = await update.message.photo[-1].get_file()
+    tmp = os.path.join("temp", f"{cid}.jpg")
+    os.makedirs("temp", exist_ok=True)
+    await f.download_to_drive(tmp)
+
+    with open(tmp, "rb") as f_img:
+        base64_img = base64.b64encode(f_img.read()).decode("utf-8")
+    os.remove(tmp)
+
+    mensaje = await identificar_modelo_desde_imagen(base64_img)
+
+    if "coincide con *" in mensaje.lower():
+        modelo_detectado = re.findall(r"\*(.*?)\*", mensaje)
+        if modelo_detectado:
+            p = modelo_detectado[0].split("_")
+            est.update({
+                "marca":  p[0] if len(p) > 0 else "Desconocida",
+                "modelo": p[1] if len(p) > 1 else "Desconocido",
+                "color":  p[2] if len(p) > 2 else "Desconocido",
+                "fase":   "imagen_detectada",
+            })
+        await ctx.bot.send_message(
+            chat_id=cid,
+            text=mensaje + "\n¿Continuamos? (SI/NO)",
+            reply_markup=menu_botones(["SI", "NO"]),
+            parse_mode="Markdown"
+        )
+    else:
+        reset_estado(cid)
+        await ctx.bot.send_message(
+            chat_id=cid,
+            text="😕 No reconocí el modelo en la imagen. Intenta con otra o escribe /start.",
+            parse_mode="Markdown"
+        )
+    return
 
-        if "coincide con *" in mensaje.lower():
-            modelo_detectado = re.findall(r"\*(.*?)\*", mensaje)
-            if modelo_detectado:
-                p = modelo_detectado[0].split("_")
-                est.update({
-                    "marca":  p[0] if len(p) > 0 else "Desconocida",
-                    "modelo": p[1] if len(p) > 1 else "Desconocido",
-                    "color":  p[2] if len(p) > 2 else "Desconocido",
-                    "fase":   "imagen_detectada",
-                })
-            await ctx.bot.send_message(
-                chat_id=cid,
-                text=mensaje + "\n¿Continuamos? (SI/NO)",
-                reply_markup=menu_botones(["SI", "NO"]),
-                parse_mode="Markdown"
-            )
-        else:
-            reset_estado(cid)
-            await ctx.bot.send_message(
-                chat_id=cid,
-                text="😕 No reconocí el modelo en la imagen. Intenta con otra o escribe /start.",
-                parse_mode="Markdown"
-            )
-        return
 
-    # 🛍️ Detectar marca escrita
+# 🛍️ Detectar marca escrita
+@flujo_responder.interrupcion(destinos=("esperando_modelo",))
+async def interrupcion_marca(turno: Turno):
+    ctx, cid, txt, est, inv = turno.ctx, turno.cid, turno.txt, turno.est, turno.inv
     marcas = obtener_marcas_unicas(inv)
-    elegida = next((m for m in marcas if any(t in txt for t in normalize(m).split())), None)
+    elegida = next((m for m in marcas if any(t in txt for t in palabras_normalizadas(m))), None)
 
     if not elegida:
-        tokens = txt.split()
+        tokens = VocabularioDifuso(txt.split())          # índice de las palabras del mensaje, una vez
         for m in marcas:
-            for tok in normalize(m).split():
-                if difflib.get_close_matches(tok, tokens, n=1, cutoff=0.6):
+            for tok in palabras_normalizadas(m):
+                if tokens.parecido(tok, cutoff=0.6):
                     elegida = m
                     break
             if elegida:
@@ -3918,54 +4465,53 @@ async def responder(update: Update, ctx: ContextTypes.DEFAULT_TYPE):
             reply_markup=menu_botones(obtener_modelos_por_marca(inv, elegida)),
         )
         return
+    return SIGUE
 
 
+# ——— Hasta aquí llega todo el flujo normal del bot ———
 
+# 🔥 Fallback inteligente CORREGIDO con 4 espacios
 
-     # ——— Hasta aquí llega todo el flujo normal del bot ———
-
-    # 🔥 Fallback inteligente CORREGIDO con 4 espacios
-
-    # 🛑 Si ya se enviaron modelos, evitar fallback (cliente está en flujo activo)
+# 🛑 Si ya se enviaron modelos, evitar fallback (cliente está en flujo activo)
+@flujo_responder.interrupcion()
+async def interrupcion_modelos_enviados(turno: Turno):
+    est = turno.est
     if est.get("fase") == "esperando_modelo_elegido" or est.get("modelos_enviados"):
         print("[🧠] Ignorando fallback porque ya hay modelos enviados.")
         return
+    return SIGUE
 
-    # 1) Detectar palabras típicas primero (antes que IA)
-    palabras_clave_flujo = [
-        "catalogo", "catálogo", "ver catálogo", "ver catalogo",
-        "imagen", "foto", "enviar imagen", "ver tallas",
-        "quiero comprar", "hacer pedido", "comprar", "zapatos", "tenis",
-        "pago", "contraentrega", "garantía", "garantia",
-        "demora", "envío", "envio"
-    ]
 
-    if any(p in txt for p in palabras_clave_flujo):
+# 1) Detectar palabras típicas primero (antes que IA)
+@flujo_responder.interrupcion()
+async def interrupcion_clave_flujo(turno: Turno):
+    ctx, cid, intenciones = turno.ctx, turno.cid, turno.intenciones
+    if "clave_flujo" in intenciones:
         await ctx.bot.send_message(
             chat_id=cid,
             text="📋 Parece que quieres hacer un pedido o consultar el catálogo. Usa las opciones disponibles 😉",
             reply_markup=menu_botones(["Hacer pedido", "Ver catálogo", "Enviar imagen"])
         )
         return
+    return SIGUE
 
-    # 2) NO usar IA si estamos en una fase crítica (proteger cierre de venta)
-    fases_criticas = [
-        "esperando_talla", "esperando_color", "esperando_nombre", "esperando_correo",
-        "esperando_telefono", "esperando_ciudad", "esperando_provincia", "esperando_direccion",
-        "esperando_pago", "esperando_comprobante", "imagen_detectada",
-        "esperando_video_referencia", "esperando_numero_rastreo",
-        "esperando_numero_devolucion", "esperando_motivo_devolucion"
-    ]
 
-    if est.get("fase") in fases_criticas:
-        await ctx.bot.send_message(
-            chat_id=cid,
-            text="✏️ Por favor completa primero el proceso en el que estás. ¿Te ayudo a terminarlo?",
-            reply_markup=menu_botones(["Volver al menú"])
-        )
-        return
+# 2) NO usar IA si estamos en una fase crítica (proteger cierre de venta)
+@flujo_responder.fase(*FASES_CRITICAS)
+async def fase_critica(turno: Turno):
+    ctx, cid = turno.ctx, turno.cid
+    await ctx.bot.send_message(
+        chat_id=cid,
+        text="✏️ Por favor completa primero el proceso en el que estás. ¿Te ayudo a terminarlo?",
+        reply_markup=menu_botones(["Volver al menú"])
+    )
+    return
+
 
-    # 3) Ahora sí, usar IA si no entendimos nada
+# 3) Ahora sí, usar IA si no entendimos nada
+@flujo_responder.interrupcion()
+async def respuesta_openai(turno: Turno):
+    ctx, cid, txt_raw = turno.ctx, turno.cid, turno.txt_raw
     respuesta_fallback = await responder_con_openai(txt_raw)
     if respuesta_fallback:
         await ctx.bot.send_message(
@@ -3981,6 +4527,17 @@ async def responder(update: Update, ctx: ContextTypes.DEFAULT_TYPE):
         )
     return
 
+
+@api.get("/metricas_flujo")
+async def metricas_flujo():
+    return {
+        "interrupciones": flujo_responder.interrupciones(),
+        "fases": flujo_responder.tabla(),
+        "transiciones": flujo_responder.transiciones(),
+        **flujo_responder.estado(),
+    }
+
+
 # ─────────────────────────────────────────
 # FUNCIÓN AUXILIAR – REANUDAR FASE ACTUAL
 # ─────────────────────────────────────────
@@ -4055,8 +4612,9 @@ PALABRAS_PRECIO = ['precio', 'vale', 'cuesta', 'valor', 'coste', 'precios', 'cu
 
 async def manejar_precio(update, ctx, inventario):
     cid = update.effective_chat.id
-    mensaje = (update.message.text or "").lower()
-    txt = normalize(mensaje)
+    analisis = mensaje_de(update)
+    mensaje = analisis.minusculas
+    txt = analisis.normalizado
     logging.debug(f"[manejar_precio] Mensaje recibido: {mensaje}")
 
     # ✅ PROTECCIÓN — Solo ejecutarse si no está en fases de video
@@ -4072,6 +4630,8 @@ async def manejar_precio(update, ctx, inventario):
         return False
 
     # Detectar referencia de 3 o 4 dígitos
+    if not analisis.numeros:
+        return False
     m_ref = re.search(r"(?:referencia|modelo)?\s*(\d{3,4})", txt)
     if not m_ref:
         logging.debug("[manejar_precio] No se detectó referencia en el mensaje.")
@@ -4169,7 +4729,6 @@ nest_asyncio.apply()
 def wa_chat_id(wa_from: str) -> str:
     return re.sub(r"\D", "", wa_from)
 
-client = AsyncOpenAI(api_key=os.getenv("OPENAI_API_KEY"))
 
 async def responder_con_openai(mensaje_usuario):
     try:
@@ -4225,9 +4784,7 @@ async def responder_con_openai(mensaje_usuario):
 # 🧭 Manejo del catálogo si el usuario lo menciona
 async def manejar_catalogo(update, ctx):
     cid = getattr(update, "from", None) or getattr(update.effective_chat, "id", "")
-    txt = getattr(update.message, "text", "").lower()
-
-    if menciona_catalogo(txt):
+    if mensaje_de(update).menciona_catalogo:
         # 📝 Primero el mensaje con el link
         mensaje = (
             f"👇🏻AQUÍ ESTA EL CATÁLOGO 🆕\n"
@@ -4240,12 +4797,9 @@ async def manejar_catalogo(update, ctx):
         try:
             sticker_path = "/var/data/stickers/catalogo_sticker_catalogo.webp"
             if os.path.exists(sticker_path):
-                with open(sticker_path, "rb") as f:
-                    b64 = base64.b64encode(f.read()).decode("utf-8")
-
                 ctx.resp.append({
                     "type": "sticker",
-                    "base64": f"data:image/webp;base64,{b64}"
+                    **medios.adjunto(sticker_path, "image/webp")
                 })
         except Exception as e:
             logging.error(f"❌ Error cargando sticker catálogo en manejar_catalogo: {e}")
@@ -4258,10 +4812,10 @@ async def manejar_catalogo(update, ctx):
 # 4. Procesar mensaje de WhatsApp
 # ─────────────────────────────────────────────────────────────
 async def procesar_wa(cid: str, body: str, msg_id: str = "") -> dict:
-    cid   = str(cid)
-    texto = (body or "").lower()   # 1) siempre existe
-    txt   = texto                  # 2) alias que muchos bloques ya usan
-    globals()["texto"] = texto     # 3) si algún bloque viejo menciona `texto`, ya lo tiene
+    cid      = str(cid)
+    analisis = MensajeAnalizado(body)   # se analiza una vez; responder y los handlers lo reciben en el update
+    texto    = analisis.minusculas
+    txt      = texto                    # alias que muchos bloques ya usan
 
 
     # 🧠 Inicializa estado si no existe  ←  <<— NUEVA POSICIÓN
@@ -4291,22 +4845,14 @@ async def procesar_wa(cid: str, body: str, msg_id: str = "") -> dict:
     if msg_id:
         ultimo_msg[cid] = {"id": msg_id, "t": now}
 
-    # Función auxiliar para codificar imagen como base64
-    def codificar_base64(path, tipo='image/jpeg'):
-        with open(path, "rb") as f:
-            b64 = base64.b64encode(f.read()).decode("utf-8")
-        return f"data:{tipo};base64,{b64}"
+    # Intenciones del mensaje: una sola pasada sobre todas las frases clave (intenciones.py)
+    intenciones = analisis.intenciones_minusculas
 
     # ─────────── Preguntas frecuentes (FAQ) ───────────
     if est.get("fase") not in ("esperando_pago", "esperando_comprobante"):
 
         # FAQ 1: ¿Cuánto demora el envío?
-        if any(p in texto for p in (
-                "cuanto demora", "cuanto tarda", "cuanto se demora",
-                "en cuanto llega", "me llega rapido", "llegan rapido",
-                "cuántos días", "cuanto se demoran", "días en llegar",
-                "si lo pido hoy", "si hago el pedido hoy", "si los pido hoy", "cuando me llegan"
-        )):
+        if "faq_demora_envio" in intenciones:
             return {
                 "type": "text",
                 "text": (
@@ -4320,21 +4866,15 @@ async def procesar_wa(cid: str, body: str, msg_id: str = "") -> dict:
 
 
         # FAQ 2: ¿Pago contra entrega?
-        if any(p in texto for p in (
-            "pago contra entrega", "pago contraentrega", "contraentrega", "contra entrega",
-            "pagan al recibir", "puedo pagar al recibir", "tienen contra entrega"
-        )):
+        if "faq_contraentrega" in intenciones:
             try:
                 ruta_audio = "/var/data/audios/contraentrega/CONTRAENTREGA.mp3"
                 if not os.path.exists(ruta_audio):
                     raise FileNotFoundError("❌ No se encontró el audio CONTRAENTREGA.mp3")
 
-                with open(ruta_audio, "rb") as f:
-                    b64 = base64.b64encode(f.read()).decode("utf-8")
-
                 return {
                     "type": "audio",
-                    "base64": b64,
+                    **medios.adjunto(ruta_audio, "audio/mpeg", data_uri=False),
                     "mimetype": "audio/mpeg",
                     "filename": "CONTRAENTREGA.mp3",
                     "text": "🎧 Aquí tienes la explicación del pago contra entrega:"
@@ -4348,9 +4888,7 @@ async def procesar_wa(cid: str, body: str, msg_id: str = "") -> dict:
                 }
 
         # FAQ 3: ¿Tienen garantía?
-        if any(p in texto for p in (
-            "tienen garantia", "hay garantia", "garantia", "tienen garantia de fabrica"
-        )):
+        if "faq_garantia" in intenciones:
             return {
                 "type": "text",
                 "text": (
@@ -4362,11 +4900,7 @@ async def procesar_wa(cid: str, body: str, msg_id: str = "") -> dict:
             }
 
         # FAQ 5: ¿Dónde están ubicados?
-        if any(p in texto for p in (
-            "donde estan ubicados", "donde queda", "ubicacion", "ubicación",
-            "direccion", "tienda fisica", "donde estan", "donde es la tienda",
-            "estan ubicados", "ubicados en donde", "en que ciudad estan", "en que parte estan"
-        )):
+        if "faq_ubicacion" in intenciones:
             return {
                 "type": "text",
                 "text": (
@@ -4379,11 +4913,7 @@ async def procesar_wa(cid: str, body: str, msg_id: str = "") -> dict:
             }
 
         # FAQ 6: ¿Son nacionales o importados?
-        if any(p in texto for p in (
-            "son nacionales", "son importados", "es nacional o importado",
-            "nacionales o importados", "hecho en colombia", "fabricados en colombia",
-            "son de aqui", "es de colombia", "fabricacion colombiana"
-        )):
+        if "faq_origen" in intenciones:
             return {
                 "type": "text",
                 "text": (
@@ -4394,10 +4924,7 @@ async def procesar_wa(cid: str, body: str, msg_id: str = "") -> dict:
             }
 
         # FAQ 7: ¿Son originales?
-        if any(p in texto for p in (
-            "son originales", "es original", "originales",
-            "es copia", "son copia", "son replica", "réplica", "imitacion"
-        )):
+        if "faq_originales" in intenciones:
             return {
                 "type": "text",
                 "text": (
@@ -4407,10 +4934,7 @@ async def procesar_wa(cid: str, body: str, msg_id: str = "") -> dict:
             }
 
         # FAQ 8: ¿De qué calidad son?
-        if any(p in texto for p in (
-            "que calidad son", "de que calidad son", "son buena calidad", "son de buena calidad",
-            "son de mala calidad", "que calidad manejan", "que calidad tienen", "calidad de las zapatillas"
-        )):
+        if "faq_calidad" in intenciones:
             return {
                 "type": "text",
                 "text": (
@@ -4422,11 +4946,7 @@ async def procesar_wa(cid: str, body: str, msg_id: str = "") -> dict:
             }
 
         # FAQ 9: ¿Hay descuento por 2 pares?
-        if any(p in texto for p in (
-            "si compro 2 pares", "dos pares descuento", "descuento por 2 pares",
-            "descuento por dos pares", "me descuentan si compro dos", "descuento si compro dos",
-            "hay descuento por dos", "promocion dos pares", "descuento en 2 pares"
-        )):
+        if "faq_descuento_pares" in intenciones:
             return {
                 "type": "text",
                 "text": (
@@ -4437,11 +4957,7 @@ async def procesar_wa(cid: str, body: str, msg_id: str = "") -> dict:
             }
 
         # FAQ 10: ¿Precios para mayoristas?
-        if any(p in texto for p in (
-            "precio mayorista", "precios para mayoristas", "mayorista", "quiero vender",
-            "puedo venderlos", "descuento para revender", "revender", "comprar para vender",
-            "manejan precios para mayoristas", "mayoreo", "venta al por mayor"
-        )):
+        if "faq_mayorista" in intenciones:
             return {
                 "type": "text",
                 "text": (
@@ -4453,11 +4969,7 @@ async def procesar_wa(cid: str, body: str, msg_id: str = "") -> dict:
             }
 
         # FAQ 11: ¿Las tallas son normales?
-        if any(p in texto for p in (
-            "las tallas son normales", "horma normal", "talla normal",
-            "horma grande", "horma pequeña", "tallas grandes", "tallas pequeñas",
-            "las tallas son grandes", "las tallas son pequeñas", "como son las tallas"
-        )):
+        if "faq_horma" in intenciones:
             return {
                 "type": "text",
                 "text": (
@@ -4468,10 +4980,7 @@ async def procesar_wa(cid: str, body: str, msg_id: str = "") -> dict:
             }
 
         # FAQ 12: ¿Talla más grande?
-        if any(p in texto for p in (
-            "talla mas grande", "talla más grande", "cual es la talla mas grande",
-            "horma", "mayor talla", "talla maxima", "talla máxima"
-        )):
+        if "faq_talla_maxima" in intenciones:
             return {
                 "type": "text",
                 "text": (
@@ -4487,11 +4996,7 @@ async def procesar_wa(cid: str, body: str, msg_id: str = "") -> dict:
     texto = texto.lower()
 
     # 1️⃣ 🏡 Bucaramanga — prioridad máxima si se menciona
-    if "bucaramanga" in texto and any(p in texto for p in {
-        "envío", "envios", "envían", "enviar", "envian", "enviarme", 
-        "soy de", "estoy en", "pueden llevar", "tienen envio a", "el envio a", 
-        "envío a", "envian a", "como es el envio", "hacen envíos", "tienen envío"
-    }):
+    if "menciona_bucaramanga" in intenciones and "envio_bucaramanga" in intenciones:
         return {
             "type": "text",
             "text": (
@@ -4504,11 +5009,7 @@ async def procesar_wa(cid: str, body: str, msg_id: str = "") -> dict:
             "parse_mode": "Markdown"
         }
     # 2️⃣ Bucaramanga — pero preguntan por demora
-    if "bucaramanga" in texto and any(p in texto for p in (
-        "cuanto demora", "cuanto tarda", "cuanto se demora",
-        "en cuanto llega", "me llega rapido", "llegan rapido", 
-        "cuántos días", "días en llegar", "se demora en llegar"
-    )):
+    if "menciona_bucaramanga" in intenciones and "demora_bucaramanga" in intenciones:
         return {
             "type": "text",
             "text": (
@@ -4518,7 +5019,7 @@ async def procesar_wa(cid: str, body: str, msg_id: str = "") -> dict:
             "parse_mode": "Markdown"
         }
     # 2️⃣ 🚚 Cuánto cuesta el envío a... o ¿es gratis?
-    if "envio" in texto:
+    if "menciona_envio" in intenciones:
         # 2A: ¿Cuánto cuesta el envío a...?
         envio_match = re.search(
             r"(cu[aá]nto(?: cuesta| vale| cobran)?(?: el)? env[ií]o(?: a)?\s*([a-záéíóúñ\s]+)?)",
@@ -4541,11 +5042,7 @@ async def procesar_wa(cid: str, body: str, msg_id: str = "") -> dict:
             }
 
     # 3️⃣ 🌍 Preguntas genéricas sobre envío sin ciudad clara
-    if any(p in texto for p in {
-        "envían a", "envio a", "envíos a", "hacen envíos a", "tienen envío a", 
-        "pueden enviar a", "enviarían a", "envian hasta", "envían hasta", 
-        "pueden enviar hasta", "envían por", "tienen envíos a"
-    }):
+    if "envio_generico" in intenciones:
         return {
             "type": "text",
             "text": (
@@ -4557,30 +5054,24 @@ async def procesar_wa(cid: str, body: str, msg_id: str = "") -> dict:
         }
 
     # 4️⃣ 💳 Métodos de pago
-    if any(p in texto for p in (
-        "método de pago", "metodos de pago", "formas de pago", "formas para pagar",
-        "como pago", "cómo puedo pagar", "qué medios de pago", "medios de pago", "aceptan nequi",
-        "pago por daviplata", "manejan bancolombia", "que pago manejan", "que pagos manejan"
-    )):
+    if "metodos_pago" in intenciones:
         ruta_metodo = "/var/data/extra/metodosdepago.jpeg"
         if os.path.exists(ruta_metodo):
-            with open(ruta_metodo, "rb") as f:
-                b64 = base64.b64encode(f.read()).decode("utf-8")
-                return {
-                    "type": "multi",
-                    "messages": [
-                        {
-                            "type": "text",
-                            "text": "💳 Estos son los *métodos de pago* que manejamos actualmente:",
-                            "parse_mode": "Markdown"
-                        },
-                        {
-                            "type": "photo",
-                            "base64": f"data:image/jpeg;base64,{b64}",
-                            "text": "📷 Métodos de pago disponibles"
-                        }
-                    ]
-                }
+            return {
+                "type": "multi",
+                "messages": [
+                    {
+                        "type": "text",
+                        "text": "💳 Estos son los *métodos de pago* que manejamos actualmente:",
+                        "parse_mode": "Markdown"
+                    },
+                    {
+                        "type": "photo",
+                        **medios.adjunto(ruta_metodo, "image/jpeg"),
+                        "text": "📷 Métodos de pago disponibles"
+                    }
+                ]
+            }
         else:
             return {
                 "type": "text",
@@ -4588,13 +5079,6 @@ async def procesar_wa(cid: str, body: str, msg_id: str = "") -> dict:
             }
 
 
-    # Lista de palabras afirmativas comunes
-    AFIRMATIVAS = [
-        "si", "sí", "sii", "sis", "sisz", "siss", "de una", "dale", "hágale", "hagale", 
-        "hágale pues", "me gusta", "quiero", "lo quiero", "vamos", "claro", 
-        "obvio", "eso es", "ese", "de ley", "de fijo", "ok", "okay", "listo"
-    ]
-
     # ───────────────────────────────────────────
     # ───────────────────────────────────────────
     class DummyCtx(SimpleNamespace):
@@ -4613,10 +5097,9 @@ async def procesar_wa(cid: str, body: str, msg_id: str = "") -> dict:
 
         async def bot_send_photo(self, chat_id, photo, caption=None, **kw):
             try:
-                base64_img = codificar_base64(photo.name)
                 self.resp.append({
                     "type": "photo",
-                    "base64": base64_img,
+                    **medios.adjunto(photo.name, "image/jpeg"),
                     "text": caption or ""
                 })
             except Exception as e:
@@ -4649,7 +5132,8 @@ async def procesar_wa(cid: str, body: str, msg_id: str = "") -> dict:
     dummy_msg = DummyMsg(text=body, ctx=ctx)
     dummy_update = SimpleNamespace(
         message=dummy_msg,
-        effective_chat=SimpleNamespace(id=cid)
+        effective_chat=SimpleNamespace(id=cid),
+        mensaje_analizado=analisis,
     )
 
     # 👤 Solo aceptar nombre/ciudad si se pidió explícitamente luego del welcome
@@ -4740,11 +5224,7 @@ async def procesar_wa(cid: str, body: str, msg_id: str = "") -> dict:
         estado_usuario[cid] = est
 
 
-    if any(p in txt for p in (
-        "/start", "start", "hola", "buenas", "buenos días", "buenos dias", "buenas tardes",
-        "buenas noches", "hey", "ey", "qué pasa", "que pasa", "buen día", "buen dia",
-        "saludos", "holaaa", "ehhh", "epa", "holi", "oe", "oe que más", "nose hola"
-    )):
+    if "saludo_wa" in intenciones:
         reset_estado(cid)
 
         # 1. Obtener welcome con audio + textos
@@ -4774,17 +5254,15 @@ async def procesar_wa(cid: str, body: str, msg_id: str = "") -> dict:
             videos = []
             for nombre in archivos:
                 path = os.path.join(carpeta, nombre)
-                with open(path, "rb") as f:
-                    b64 = base64.b64encode(f.read()).decode()
-                    texto = nombres_con_emojis.get(
-                        nombre,
-                        f"🎥 {nombre.replace('.mp4', '').replace('_', ' ').title()}"
-                    )
-                    videos.append({
-                        "type": "video",
-                        "base64": f"data:video/mp4;base64,{b64}",
-                        "text": texto
-                    })
+                texto = nombres_con_emojis.get(
+                    nombre,
+                    f"🎥 {nombre.replace('.mp4', '').replace('_', ' ').title()}"
+                )
+                videos.append({
+                    "type": "video",
+                    **medios.adjunto(path, "video/mp4"),
+                    "text": texto
+                })
 
             if videos:
                 videos.insert(0, {
@@ -4815,12 +5293,7 @@ async def procesar_wa(cid: str, body: str, msg_id: str = "") -> dict:
 
 
     # 🔊 Petición de audio
-    if any(f in txt for f in (
-        "mandame un audio", "mándame un audio", "envíame un audio",
-        "puede enviarme un audio", "puedes enviarme un audio", "me puedes enviar un audio",
-        "háblame", "hábleme", "háblame por voz", "me puedes hablar",
-        "leeme", "léeme", "no sé leer", "no se leer", "no puedo leer"
-    )):
+    if "pedir_audio" in intenciones:
         texto_respuesta = (
             "Hola 👋 soy tu asistente. "
             "Cuéntame qué modelo deseas adquirir hoy."
@@ -4879,10 +5352,10 @@ async def procesar_wa(cid: str, body: str, msg_id: str = "") -> dict:
         # ✅ Confirmar compra si usuario responde con afirmación
         est = estado_usuario.get(cid, {})
         if est.get("fase") == "confirmar_compra":
-            if any(pal in txt for pal in AFIRMATIVAS):
+            if "afirmativa" in intenciones:
                 estado_usuario[cid]["fase"] = "esperando_direccion"
                 return {"type": "text", "text": "Perfecto 💥 ¿A qué dirección quieres que enviemos el pedido?"}
-            elif any(x in txt for x in ["cancel", "cancelar", "otra", "ver otro", "no gracias"]):
+            elif "cancelar" in intenciones:
                 estado_usuario.pop(cid, None)
                 return {"type": "text", "text": "❌ Cancelado. Escribe /start para reiniciar o dime si deseas ver otra referencia 📦."}
             else:
@@ -4907,10 +5380,68 @@ async def procesar_wa(cid: str, body: str, msg_id: str = "") -> dict:
             logging.error(f"[FALLBACK] También falló responder_con_openai: {fallback_error}")
             return {"type": "text", "text": "⚠️ Error inesperado. Por favor intenta más tarde."}
 
+# ─── Respuesta JSON de /venom escrita por partes ───────────────────────
+def _tiene_diferidos(obj) -> bool:
+    if isinstance(obj, MedioDiferido):
+        return True
+    if isinstance(obj, dict):
+        return any(_tiene_diferidos(v) for v in obj.values())
+    if isinstance(obj, list):
+        return any(_tiene_diferidos(v) for v in obj)
+    return False
+
+def _json_por_partes(obj):
+    if isinstance(obj, MedioDiferido):
+        yield '"'                            # el alfabeto base64 no necesita escapes
+        yield from medios.trozos(obj)
+        yield '"'
+    elif isinstance(obj, dict):
+        yield "{"
+        for n, (k, v) in enumerate(obj.items()):
+            yield ("," if n else "") + json.dumps(str(k), ensure_ascii=False) + ":"
+            yield from _json_por_partes(v)
+        yield "}"
+    elif isinstance(obj, list):
+        yield "["
+        for n, v in enumerate(obj):
+            if n:
+                yield ","
+            yield from _json_por_partes(v)
+        yield "]"
+    else:
+        yield json.dumps(obj, ensure_ascii=False, separators=(",", ":"))
+
+def _json_en_bloques(obj, tam: int = TROZO_STREAMING):
+    """Junta las piezas pequeñas para no mandar un write por cada llave o coma."""
+    buffer, largo = [], 0
+    for pieza in _json_por_partes(obj):
+        buffer.append(pieza)
+        largo += len(pieza)
+        if largo >= tam:
+            yield "".join(buffer).encode("utf-8")
+            buffer, largo = [], 0
+    if buffer:
+        yield "".join(buffer).encode("utf-8")
+
+def respuesta_venom(contenido, status_code: int = 200):
+    """
+    JSONResponse normal si no hay medios diferidos. Si los hay, el sobre
+    {"type": "multi", "messages": […]} se escribe en streaming y cada video o
+    audio se codifica por trozos mientras sale. Sin RESPUESTA_STREAMING los
+    mismos trozos se juntan en un solo cuerpo con Content-Length.
+    """
+    if not _tiene_diferidos(contenido):
+        return JSONResponse(contenido, status_code=status_code)
+    if not RESPUESTA_STREAMING:
+        return Response(b"".join(_json_en_bloques(contenido)), status_code=status_code,
+                        media_type="application/json")
+    return StreamingResponse(_json_en_bloques(contenido), status_code=status_code,
+                             media_type="application/json")
+
 @api.post("/venom")
 async def venom_webhook(req: Request):
     """Webhook principal que recibe los mensajes de Venom y procesa imagen, audio o texto."""
-    inv = obtener_inventario()
+    inv = await obtener_inventario_async()
 
     try:
         data     = await req.json()
@@ -4939,7 +5470,7 @@ async def venom_webhook(req: Request):
                 logging.info("🖼️ [IMG] Recibida imagen, iniciando decodificación…")
 
                 if len(body_raw) < 200:
-                    return JSONResponse({
+                    return respuesta_venom({
                         "type": "text",
                         "text": "❌ La imagen llegó incompleta. Intenta enviarla otra vez."
                     })
@@ -4956,7 +5487,7 @@ async def venom_webhook(req: Request):
 
             except Exception as e:
                 logging.error(f"❌ [IMG] No pude leer la imagen: {e}")
-                return JSONResponse({
+                return respuesta_venom({
                     "type": "text",
                     "text": "❌ No pude leer la imagen 😕. Prueba con otra foto."
                 })
@@ -4973,7 +5504,7 @@ async def venom_webhook(req: Request):
                     with open(temp_path, "wb") as f:
                         f.write(img_bytes)
 
-                    texto = extraer_texto_comprobante(temp_path)
+                    texto = await en_hilo("vision", extraer_texto_comprobante, temp_path)
                     logging.info(f"[OCR] Texto extraído (500 chars):\n{texto[:500]}")
 
                     if es_comprobante_valido(texto):
@@ -4993,7 +5524,7 @@ async def venom_webhook(req: Request):
                         resumen["fase_actual"] = "Finalizado"
                         resumen["Estado"] = "COMPLETADO"
 
-                        registrar_orden_unificada(resumen, destino="PEDIDOS")
+                        await en_hilo("sheets", registrar_orden_unificada, resumen, destino="PEDIDOS")
 
                         enviar_correo(
                             est["correo"],
@@ -5013,35 +5544,32 @@ async def venom_webhook(req: Request):
                         try:
                             sticker_path = "/var/data/stickers/sticker_fin_de_compra_sticker_final.webp"
                             if os.path.exists(sticker_path):
-                                with open(sticker_path, "rb") as f:
-                                    b64 = base64.b64encode(f.read()).decode("utf-8")
-
-                                return JSONResponse({
+                                return respuesta_venom({
                                     "type": "multi",
                                     "messages": [
                                         {"type": "text", "text": "✅ Comprobante verificado. Tu pedido está en proceso. 🚚"},
-                                        {"type": "sticker", "base64": f"data:image/webp;base64,{b64}"}
+                                        {"type": "sticker", **medios.adjunto(sticker_path, "image/webp")}
                                     ]
                                 })
                         except Exception as e:
                             logging.error(f"❌ Error al cargar el sticker de fin de compra: {e}")
 
                         # fallback si falla el sticker
-                        return JSONResponse({
+                        return respuesta_venom({
                             "type": "text",
                             "text": "✅ Comprobante verificado. Tu pedido está en proceso. 🚚"
                         })
 
                     else:
                         os.remove(temp_path)
-                        return JSONResponse({
+                        return respuesta_venom({
                             "type": "text",
                             "text": "⚠️ No pude verificar el comprobante. Asegúrate que diga 'Pago exitoso'."
                         })
 
                 except Exception as e:
                     logging.error(f"❌ Error al procesar comprobante: {e}")
-                    return JSONResponse({
+                    return respuesta_venom({
                         "type": "text",
                         "text": "❌ No pude procesar el comprobante. Intenta con otra imagen."
                     })
@@ -5055,7 +5583,7 @@ async def venom_webhook(req: Request):
                         f.write(img_bytes)
 
                     image = vision.Image(content=img_bytes)
-                    response = vision_client.text_detection(image=image)
+                    response = await en_hilo("vision", vision_client.text_detection, image=image)
                     textos_detectados = response.text_annotations
                     texto_extraido = textos_detectados[0].description if textos_detectados else ""
                     logging.info(f"[OCR LENGÜETA] Texto detectado:\n{texto_extraido}")
@@ -5064,61 +5592,39 @@ async def venom_webhook(req: Request):
                     if talla_detectada:
                         est["talla"] = talla_detectada
                         estado_usuario[cid] = est
-                        return JSONResponse({
+                        return respuesta_venom({
                             "type": "text",
                             "text": f"📏 Según la etiqueta que me envias, la talla ideal para tus zapatos es la *{talla_detectada}* en nuestra horma. ¿Deseas que te las enviemos hoy mismo?",
                             "parse_mode": "Markdown"
                         })
                     else:
-                        return JSONResponse({
+                        return respuesta_venom({
                             "type": "text",
                             "text": "❌ No logré identificar tu talla. ¿Podrías enviarme una foto más clara de la lengüeta del zapato?"
                         })
                 except Exception as e:
                     logging.error(f"[OCR LENGÜETA] ❌ Error al procesar la imagen: {e}")
-                    return JSONResponse({
+                    return respuesta_venom({
                         "type": "text",
                         "text": "❌ Hubo un error procesando la imagen. Intenta de nuevo con otra foto, por favor."
                     })
 
             # 🧠 CLIP - identificación de modelo
+            elif not imagenes_listas():
+                return respuesta_venom({"type": "text", "text": MENSAJE_IMAGENES_CALENTANDO})
             else:
                 try:
                     logging.info("[CLIP] 🚀 Iniciando identificación de modelo")
 
-                    embeddings_raw = cargar_embeddings_desde_cache()
-                    embeddings: dict[str, list[list[float]]] = {}
-                    for modelo, vecs in embeddings_raw.items():
-                        if isinstance(vecs, list):
-                            if len(vecs) == 512 and all(isinstance(x, (int, float)) for x in vecs):
-                                embeddings[modelo] = [vecs]
-                            else:
-                                limpios = [v for v in vecs if isinstance(v, list) and len(v) == 512]
-                                if limpios:
-                                    embeddings[modelo] = limpios
+                    indice = obtener_indice_catalogo()
 
                     os.makedirs("temp", exist_ok=True)
                     path_img = f"temp/{cid}_img.jpg"
                     with open(path_img, "wb") as f:
                         f.write(img_bytes)
 
-                    emb_u = generar_embedding_imagen(img)
-                    emb_u = torch.tensor(emb_u, dtype=torch.float32)
-                    emb_u = torch.nn.functional.normalize(emb_u, dim=-1)
-                    if emb_u.shape[0] != 512:
-                        raise ValueError(f"Embedding cliente tamaño {emb_u.shape} ≠ 512")
-
-                    mejor_sim, mejor_modelo = 0.0, None
-                    for modelo, lista in embeddings.items():
-                        for i, emb_ref in enumerate(lista):
-                            try:
-                                arr_ref = torch.tensor(emb_ref, dtype=torch.float32)
-                                arr_ref = torch.nn.functional.normalize(arr_ref, dim=-1)
-                                sim = torch.dot(emb_u, arr_ref).item()
-                                if sim > mejor_sim:
-                                    mejor_sim, mejor_modelo = sim, modelo
-                            except Exception as e:
-                                logging.warning(f"[CLIP] Error en {modelo}[{i}]: {e}")
+                    emb_u = await servidor_clip.embeber(img)
+                    mejor_modelo, mejor_sim = indice.buscar(emb_u)
 
                     logging.info(f"[CLIP] Mejor modelo: {mejor_modelo} — Similitud: {mejor_sim:.4f}")
 
@@ -5135,16 +5641,10 @@ async def venom_webhook(req: Request):
                         modelo = estado_usuario[cid]["modelo"]
                         color = estado_usuario[cid]["color"]
                         marca = estado_usuario[cid]["marca"]
-                        precio = next(
-                            (i["precio"] for i in inv if
-                             normalize(i["modelo"]) == normalize(modelo) and
-                             normalize(i["color"]) == normalize(color) and
-                             normalize(i["marca"]) == normalize(marca)),
-                            None
-                        )
+                        precio = inv.precio(marca, modelo, color)
                         precio_str = f"{int(precio):,} COP" if precio else "No disponible"
 
-                        return JSONResponse({
+                        return respuesta_venom({
                             "type": "text",
                             "text": (
                                 f"🟢 ¡Qué buena elección! Los *{modelo}* de color *{color}* están brutales 😎.\n"
@@ -5156,7 +5656,7 @@ async def venom_webhook(req: Request):
                         })
                     else:
                         reset_estado(cid)
-                        return JSONResponse({
+                        return respuesta_venom({
                             "type": "text",
                             "text": (
                                 "❌ No logré identificar bien el modelo de la imagen.\n"
@@ -5166,7 +5666,7 @@ async def venom_webhook(req: Request):
 
                 except Exception:
                     logging.exception("[CLIP] Error en identificación:")
-                    return JSONResponse({
+                    return respuesta_venom({
                         "type": "text",
                         "text": "⚠️ Ocurrió un error analizando la imagen."
                     })
@@ -5179,18 +5679,18 @@ async def venom_webhook(req: Request):
 
                 # A) Dict directo válido
                 if isinstance(reply, dict) and reply.get("type") in ("video", "audio", "image", "photo", "multi", "text"):
-                        return JSONResponse(reply)
+                        return respuesta_venom(reply)
 
                 # B) Lista → convertir a multi
                 if isinstance(reply, list):
-                        return JSONResponse({"type": "multi", "messages": reply})
+                        return respuesta_venom({"type": "multi", "messages": reply})
 
                 # C) Texto plano (evita text anidado)
                 if isinstance(reply, str):
-                        return JSONResponse({"type": "text", "text": reply})
+                        return respuesta_venom({"type": "text", "text": reply})
 
                 # D) Seguridad: si vino algo raro
-                return JSONResponse({"type": "text", "text": "⚠️ Error inesperado. Intenta de nuevo."})
+                return respuesta_venom({"type": "text", "text": "⚠️ Error inesperado. Intenta de nuevo."})
 
 
 
@@ -5199,7 +5699,7 @@ async def venom_webhook(req: Request):
             try:
                 logging.info("🎙️ Audio recibido. Iniciando procesamiento...")
                 if not body:
-                    return JSONResponse({"type": "text", "text": "❌ No recibí un audio válido."})
+                    return respuesta_venom({"type": "text", "text": "❌ No recibí un audio válido."})
 
                 b64_str = body.split(",", 1)[1] if "," in body else body
                 audio_bytes = base64.b64decode(b64_str + "===")
@@ -5212,13 +5712,13 @@ async def venom_webhook(req: Request):
                 texto_transcrito = await transcribe_audio(audio_path)
                 if texto_transcrito:
                     reply = await procesar_wa(cid, texto_transcrito)
-                    return JSONResponse(reply)
+                    return respuesta_venom(reply)
                 else:
-                    return JSONResponse({"type": "text", "text": "⚠️ No pude entender bien el audio. ¿Podrías repetirlo?"})
+                    return respuesta_venom({"type": "text", "text": "⚠️ No pude entender bien el audio. ¿Podrías repetirlo?"})
 
             except Exception:
                 logging.exception("❌ Error durante el procesamiento del audio")
-                return JSONResponse({
+                return respuesta_venom({
                     "type": "text",
                     "text": "❌ Ocurrió un error al procesar tu audio. Intenta de nuevo."
                 })
@@ -5226,11 +5726,11 @@ async def venom_webhook(req: Request):
         # 🤷 TIPO NO MANEJADO
         else:
             logging.warning(f"🤷‍♂️ Tipo de mensaje no manejado: {mtype}")
-            return JSONResponse({"type": "text", "text": f"⚠️Disculpe que pena pero no manejamos {mtype} enviame una foto del zapato que deseas: "})
+            return respuesta_venom({"type": "text", "text": f"⚠️Disculpe que pena pero no manejamos {mtype} enviame una foto del zapato que deseas: "})
 
     except Exception:
         logging.exception("🔥 Error general en venom_webhook")
-        return JSONResponse(
+        return respuesta_venom(
             {"type": "text", "text": "⚠️ Error interno procesando el mensaje."},
             status_code=200
         )
@@ -5239,13 +5739,6 @@ async def venom_webhook(req: Request):
 # 5. Arranque del servidor
 # -------------------------------------------------------------------------
 if __name__ == "__main__":
-    descargar_videos_drive()              # ⬇️ Descarga los videos (si no existen)
-    descargar_imagenes_catalogo()         # ⬇️ Descarga 1 imagen por modelo del catálogo
-    descargar_stickers_drive()
-    descargar_video_confianza()
-    descargar_audios_bienvenida_drive()
-    descargar_imagen_lengueta()
-    descargar_metodos_pago_drive()
-    import uvicorn
+    import uvicorn                        # ⬇️ Los recursos de Drive se bajan en el hook de arranque
     port = int(os.environ.get("PORT", 8000))
     uvicorn.run("lector:api", host="0.0.0.0", port=port)
@@ -0,0 +1,75 @@
+"""
+Normalización de texto única para el bot, con caché.
+
+Variantes explícitas:
+- normalize(texto)       → minúsculas, sin espacios en los extremos y sin tildes
+                           (NFKD + quitar marcas combinantes: "Café Ñ" → "cafe n").
+                           Es la que usan las búsquedas de inventario, intenciones
+                           y colores; antes lector.py la definía dos veces.
+- sin_puntuacion(texto)  → además solo ASCII y sin signos de puntuación
+                           ("¡Pago exitoso!" → "pago exitoso"), para el OCR.
+- palabras_normalizadas(texto) → normalize(texto).split() como tupla.
+
+Los campos de inventario, alias y vocabularios se repiten miles de veces por
+pedido; las tres funciones pasan por un LRU (NORMALIZACION_CACHE entradas),
+así una cadena ya vista cuesta una búsqueda en un dict. El texto puramente
+ASCII se resuelve sin unicodedata.
+
+bench_normalizacion.py compara el costo con el de la normalización anterior.
+"""
+import os
+import re
+import functools
+import unicodedata
+
+TAM_CACHE = int(os.environ.get("NORMALIZACION_CACHE", 16384))
+
+_PUNTUACION = re.compile(r"[^\w\s]")
+
+
+@functools.lru_cache(maxsize=TAM_CACHE)
+def _plegar(texto: str) -> str:
+    texto = texto.strip().lower()
+    if texto.isascii():
+        return texto
+    texto = unicodedata.normalize("NFKD", texto)
+    return "".join(ch for ch in texto if not unicodedata.combining(ch))
+
+
+@functools.lru_cache(maxsize=TAM_CACHE)
+def _sin_puntuacion(texto: str) -> str:
+    if not texto.isascii():
+        texto = unicodedata.normalize("NFKD", texto).encode("ascii", "ignore").decode("ascii")
+    return _PUNTUACION.sub("", texto.lower())
+
+
+@functools.lru_cache(maxsize=TAM_CACHE)
+def _palabras(texto: str) -> tuple[str, ...]:
+    return tuple(_plegar(texto).split())
+
+
+def _como_texto(texto) -> str:
+    if texto is None:
+        return ""
+    return texto if isinstance(texto, str) else str(texto)
+
+
+def normalize(texto) -> str:
+    """Minúsculas, sin extremos en blanco y sin tildes. Acepta None y no-str (números del Sheet)."""
+    return _plegar(_como_texto(texto))
+
+
+def sin_puntuacion(texto) -> str:
+    """ASCII en minúsculas sin signos de puntuación (conserva espacios y saltos de línea)."""
+    return _sin_puntuacion(_como_texto(texto))
+
+
+def palabras_normalizadas(texto) -> tuple[str, ...]:
+    return _palabras(_como_texto(texto))
+
+
+def estado_cache() -> dict:
+    return {
+        nombre: fn.cache_info()._asdict()
+        for nombre, fn in (("normalize", _plegar), ("sin_puntuacion", _sin_puntuacion), ("palabras_normalizadas", _palabras))
+    }
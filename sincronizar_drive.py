@@ -0,0 +1,462 @@
+"""
+Sincronización declarativa de recursos de Google Drive a /var/data.
+
+Cada ReglaSync dice qué carpeta de Drive (o qué subcarpetas) mirar, qué
+archivos tomar y con qué nombre quedan en disco. sincronizar():
+1. lista todas las carpetas en paralelo,
+2. descarga los archivos pendientes con un pool acotado, escribiendo por
+   bloques en `<destino>.part` (nunca el archivo entero en memoria),
+3. renombra de forma atómica al terminar. Si quedó un .part de una corrida
+   anterior, la descarga continúa desde ese byte.
+
+VigilanteCambiosDrive mantiene un cursor de la Changes API y, en cada
+revisión, hace una sola llamada a changes.list; solo si algo tocó una carpeta
+vigilada vuelve a sincronizar las reglas afectadas. Junto al cursor guarda qué
+reglas cubre: una regla nueva o cambiada, o cuyo directorio se borró, se
+sincroniza completa al arrancar aunque haya cursor.
+
+Cada directorio destino guarda un manifiesto (.drive_manifest.json) con
+{drive_id: {archivo, regla, md5Checksum, size, modifiedTime}}. Solo se bajan
+los archivos cuyo md5 cambió, y se borran los que ya no están en Drive.
+
+El servicio de Drive (httplib2) no es seguro entre hilos: cada hilo crea el suyo.
+"""
+import os
+import glob
+import json
+import hashlib
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, NamedTuple
+
+CARPETA_MIME = "application/vnd.google-apps.folder"
+BLOQUE_DESCARGA = 8 * 1024 * 1024
+HILOS_SYNC = int(os.environ.get("DRIVE_SYNC_HILOS", 8))
+MANIFEST_NOMBRE = ".drive_manifest.json"
+TOKEN_CAMBIOS_PATH = "/var/data/.drive_changes_token"
+
+
+def nombre_original(archivo: dict, subcarpeta: str | None) -> str:
+    return archivo["name"]
+
+
+class ReglaSync(NamedTuple):
+    nombre: str                               # para los logs
+    carpeta: str                              # id de la carpeta raíz en Drive
+    destino: str                              # directorio local
+    consulta: str                             # filtro extra de files.list (mimeType, name…)
+    subcarpeta: str | None = None             # usar solo la subcarpeta con este nombre exacto
+    por_subcarpeta: bool = False              # recorrer todas las subcarpetas de `carpeta`
+    nombrar: Callable[[dict, str | None], str] = nombre_original
+    max_por_carpeta: int | None = None        # p. ej. 1 imagen por modelo
+
+
+class Descarga(NamedTuple):
+    regla: str
+    file_id: str
+    ruta: str
+    tamano: int | None
+    md5: str | None
+    modificado: str | None
+
+    def entrada(self) -> dict:
+        return {"archivo": os.path.basename(self.ruta), "regla": self.regla, "md5Checksum": self.md5,
+                "size": self.tamano, "modifiedTime": self.modificado}
+
+
+def leer_manifest(directorio: str) -> dict:
+    try:
+        with open(os.path.join(directorio, MANIFEST_NOMBRE), "r", encoding="utf-8") as f:
+            return json.load(f)
+    except (FileNotFoundError, json.JSONDecodeError):
+        return {}
+
+
+def guardar_manifest(directorio: str, manifest: dict):
+    ruta = os.path.join(directorio, MANIFEST_NOMBRE)
+    tmp = f"{ruta}.tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(manifest, f, ensure_ascii=False, indent=1)
+    os.replace(tmp, ruta)
+
+
+def md5_archivo(ruta: str) -> str:
+    h = hashlib.md5()
+    with open(ruta, "rb") as f:
+        while bloque := f.read(1024 * 1024):
+            h.update(bloque)
+    return h.hexdigest()
+
+
+def sin_cambios(d: Descarga, entrada: dict | None) -> bool:
+    """True si el manifiesto dice que la copia local ya es esta versión del archivo."""
+    if not entrada or entrada.get("archivo") != os.path.basename(d.ruta) or not os.path.exists(d.ruta):
+        return False
+    if d.md5 and entrada.get("md5Checksum"):
+        return d.md5 == entrada["md5Checksum"]
+    return (d.tamano, d.modificado) == (entrada.get("size"), entrada.get("modifiedTime"))
+
+
+class _Servicios(threading.local):
+    servicio = None
+
+
+def _listar(servicio, q: str, limite: int | None = None) -> list[dict]:
+    """files.list paginado. `limite` corta en cuanto hay suficientes."""
+    archivos, token = [], None
+    while True:
+        resp = servicio.files().list(
+            q=q,
+            fields="nextPageToken, files(id, name, size, md5Checksum, modifiedTime)",
+            pageSize=min(limite or 1000, 1000),
+            pageToken=token,
+        ).execute()
+        archivos.extend(resp.get("files", []))
+        token = resp.get("nextPageToken")
+        if not token or (limite and len(archivos) >= limite):
+            return archivos[:limite] if limite else archivos
+
+
+class SincronizadorDrive:
+    def __init__(self, crear_servicio: Callable, hilos: int = HILOS_SYNC):
+        self.crear_servicio = crear_servicio
+        self.hilos = hilos
+        self._local = _Servicios()
+        # id de carpeta de Drive → reglas que la usan (raíces y subcarpetas ya vistas);
+        # varias reglas pueden compartir carpeta (extra, audios)
+        self.carpetas_vistas: dict[str, set[str]] = {}
+
+    def _servicio(self):
+        if self._local.servicio is None:
+            self._local.servicio = self.crear_servicio()
+        return self._local.servicio
+
+    # ─── 1. Listado ───────────────────────────────────────────────────
+    def _carpetas(self, regla: ReglaSync) -> list[tuple[str, str | None]]:
+        """[(id_carpeta, nombre_subcarpeta)] de donde salen los archivos de la regla."""
+        self.carpetas_vistas.setdefault(regla.carpeta, set()).add(regla.nombre)
+        if not (regla.subcarpeta or regla.por_subcarpeta):
+            return [(regla.carpeta, None)]
+        q = f"'{regla.carpeta}' in parents and mimeType='{CARPETA_MIME}' and trashed = false"
+        if regla.subcarpeta:
+            q += f" and name = '{regla.subcarpeta}'"
+        subcarpetas = _listar(self._servicio(), q, 1 if regla.subcarpeta else None)
+        if not subcarpetas:
+            logging.warning(f"[SYNC] ❌ {regla.nombre}: no encontré subcarpetas en {regla.carpeta}")
+        for sub in subcarpetas:
+            self.carpetas_vistas.setdefault(sub["id"], set()).add(regla.nombre)
+        return [(s["id"], s["name"]) for s in subcarpetas]
+
+    def _archivos(self, regla: ReglaSync, carpeta_id: str, sub: str | None) -> list[Descarga]:
+        q = f"'{carpeta_id}' in parents and trashed = false"
+        if regla.consulta:
+            q += f" and {regla.consulta}"
+        archivos = _listar(self._servicio(), q, regla.max_por_carpeta)
+        if not archivos:
+            logging.warning(f"[SYNC] ⚠️ {regla.nombre}: sin archivos en {sub or carpeta_id}")
+        return [
+            Descarga(regla.nombre, a["id"], os.path.join(regla.destino, regla.nombrar(a, sub)),
+                     int(a["size"]) if a.get("size") else None, a.get("md5Checksum"), a.get("modifiedTime"))
+            for a in archivos
+        ]
+
+    def listar(self, reglas: list[ReglaSync], pool: ThreadPoolExecutor) -> tuple[dict[str, list[Descarga]], set[str]]:
+        """Devuelve ({regla: descargas}, {reglas cuyo listado falló y no se deben podar})."""
+        carpetas = {r.nombre: pool.submit(self._carpetas, r) for r in reglas}
+        trabajos, fallidas = [], set()
+        for regla in reglas:
+            try:
+                for carpeta_id, sub in carpetas[regla.nombre].result():
+                    trabajos.append((regla, pool.submit(self._archivos, regla, carpeta_id, sub)))
+            except Exception as e:
+                fallidas.add(regla.nombre)
+                logging.error(f"[SYNC] ❌ {regla.nombre}: error listando carpetas: {e}")
+
+        por_regla: dict[str, list[Descarga]] = {r.nombre: [] for r in reglas}
+        for regla, futuro in trabajos:
+            try:
+                por_regla[regla.nombre].extend(futuro.result())
+            except Exception as e:
+                fallidas.add(regla.nombre)
+                logging.error(f"[SYNC] ❌ {regla.nombre}: error listando archivos: {e}")
+        return por_regla, fallidas
+
+    # ─── 2. Descarga ──────────────────────────────────────────────────
+    def descargar(self, d: Descarga, entrada: dict | None) -> str:
+        """Devuelve 'omitido', 'adoptado' o 'descargado'. Lanza la excepción si falla."""
+        if sin_cambios(d, entrada):
+            return "omitido"
+        if entrada is None and d.md5 and os.path.exists(d.ruta) and md5_archivo(d.ruta) == d.md5:
+            return "adoptado"                            # bajado antes de existir el manifiesto
+
+        os.makedirs(os.path.dirname(d.ruta), exist_ok=True)
+        # El md5 va en el nombre: un .part de otra versión del archivo no se reanuda
+        parcial = f"{d.ruta}.{d.md5[:12]}.part" if d.md5 else f"{d.ruta}.part"
+        inicio = os.path.getsize(parcial) if os.path.exists(parcial) else 0
+        if d.tamano is not None and inicio > d.tamano:
+            inicio = 0
+        if d.tamano is not None and inicio == d.tamano and inicio:
+            os.replace(parcial, d.ruta)
+            return "descargado"
+
+        from googleapiclient.http import MediaIoBaseDownload   # import diferido: `import lector` no lo paga
+
+        request = self._servicio().files().get_media(fileId=d.file_id)
+        with open(parcial, "ab" if inicio else "wb") as fh:
+            downloader = MediaIoBaseDownload(fh, request, chunksize=BLOQUE_DESCARGA)
+            if inicio:
+                # MediaIoBaseDownload arma el header Range desde _progress
+                downloader._progress = inicio
+                logging.info(f"[SYNC] ⏯️ Reanudando {os.path.basename(d.ruta)} desde {inicio} bytes")
+            done = False
+            while not done:
+                _, done = downloader.next_chunk()
+
+        recibido = os.path.getsize(parcial)
+        if d.tamano is not None and recibido != d.tamano:
+            os.remove(parcial)
+            raise IOError(f"tamaño {recibido} ≠ {d.tamano}")
+        if inicio and d.md5 and md5_archivo(parcial) != d.md5:
+            os.remove(parcial)
+            raise IOError("md5 no coincide tras reanudar; se baja completo en la próxima corrida")
+        os.replace(parcial, d.ruta)
+        for viejo in glob.glob(f"{glob.escape(d.ruta)}.*part"):
+            os.remove(viejo)                             # .part de versiones anteriores
+        return "descargado"
+
+    def _podar(self, manifest: dict, directorio: str, vigentes: set[str], nombres: set[str],
+               sincronizadas: set[str], fallidas: set[str]) -> int:
+        """
+        Quita del disco y del manifiesto lo que ya no está en Drive (solo archivos que trajo el sync).
+        Solo mira entradas de las reglas de esta corrida: un directorio puede ser de varias reglas
+        y las que no se listaron no dicen nada sobre sus archivos.
+        """
+        eliminados = 0
+        for file_id in list(manifest):
+            entrada = manifest[file_id]
+            if file_id in vigentes or entrada.get("regla") not in sincronizadas or entrada.get("regla") in fallidas:
+                continue
+            del manifest[file_id]
+            if entrada.get("archivo") in nombres:            # otro archivo de Drive ocupa ahora ese nombre
+                continue
+            ruta = os.path.join(directorio, entrada.get("archivo", ""))
+            if os.path.isfile(ruta):
+                os.remove(ruta)
+                eliminados += 1
+                logging.info(f"[SYNC] 🧹 {entrada.get('regla')}: eliminado {entrada.get('archivo')} (ya no está en Drive)")
+        return eliminados
+
+    # ─── Orquestación ─────────────────────────────────────────────────
+    def sincronizar(self, reglas: list[ReglaSync]) -> dict:
+        resumen = {"descargado": 0, "omitido": 0, "adoptado": 0, "eliminado": 0, "error": 0}
+        directorios = {r.destino for r in reglas}
+        manifests = {dir_: leer_manifest(dir_) for dir_ in directorios}
+
+        with ThreadPoolExecutor(max_workers=self.hilos, thread_name_prefix="drive-sync") as pool:
+            por_regla, fallidas = self.listar(reglas, pool)
+            for dir_ in directorios:
+                os.makedirs(dir_, exist_ok=True)
+
+            descargas = [d for ds in por_regla.values() for d in ds]
+            futuros = {
+                pool.submit(self.descargar, d, manifests[os.path.dirname(d.ruta)].get(d.file_id)): d
+                for d in descargas
+            }
+            for futuro, d in futuros.items():
+                manifest = manifests[os.path.dirname(d.ruta)]
+                try:
+                    estado = futuro.result()
+                    resumen[estado] += 1
+                    manifest[d.file_id] = d.entrada()
+                    if estado == "descargado":
+                        logging.info(f"[SYNC] ✅ {d.regla}: {d.ruta}")
+                except Exception as e:
+                    resumen["error"] += 1
+                    logging.error(f"[SYNC] ❌ {d.regla}: {os.path.basename(d.ruta)}: {e}")
+
+        resumen["error"] += len(fallidas)                # sin listado no se sabe si la regla quedó al día
+        sincronizadas = {r.nombre for r in reglas}
+        for dir_, manifest in manifests.items():
+            vigentes = {d.file_id for d in descargas if os.path.dirname(d.ruta) == dir_}
+            nombres  = {os.path.basename(d.ruta) for d in descargas if os.path.dirname(d.ruta) == dir_}
+            resumen["eliminado"] += self._podar(manifest, dir_, vigentes, nombres, sincronizadas, fallidas)
+            guardar_manifest(dir_, manifest)
+
+        logging.info(f"[SYNC] 🎉 Drive sincronizado: {resumen}")
+        return resumen
+
+
+# ─── Cambios incrementales (Changes API) ─────────────────────────────────
+class VigilanteCambiosDrive:
+    """
+    Guarda el pageToken de changes.list en disco. revisar() pide los cambios
+    desde ese cursor y resincroniza solo las reglas cuyas carpetas (o archivos
+    ya descargados) aparecen en ellos.
+
+    El cursor solo sirve para las reglas que ya estaban al día cuando se pidió;
+    en `<ruta_token>.reglas.json` queda {nombre: [carpeta, consulta]} de esas reglas.
+    """
+
+    def __init__(self, sincronizador: SincronizadorDrive, reglas: list[ReglaSync],
+                 ruta_token: str = TOKEN_CAMBIOS_PATH, al_cambiar: Callable[[dict], None] | None = None):
+        self.sync = sincronizador
+        self.reglas = {r.nombre: r for r in reglas}
+        self.ruta_token = ruta_token
+        self.ruta_reglas = f"{ruta_token}.reglas.json"
+        self.al_cambiar = al_cambiar
+
+    def _leer_token(self) -> str | None:
+        try:
+            with open(self.ruta_token, "r", encoding="utf-8") as f:
+                return f.read().strip() or None
+        except FileNotFoundError:
+            return None
+
+    def _guardar_token(self, token: str):
+        tmp = f"{self.ruta_token}.tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            f.write(token)
+        os.replace(tmp, self.ruta_token)
+
+    def _descartar_token(self):
+        for ruta in (self.ruta_token, self.ruta_reglas):
+            try:
+                os.remove(ruta)
+            except FileNotFoundError:
+                pass
+
+    @staticmethod
+    def _firma(regla: ReglaSync) -> list[str]:
+        return [regla.carpeta, regla.consulta]
+
+    def _leer_reglas(self) -> dict:
+        try:
+            with open(self.ruta_reglas, "r", encoding="utf-8") as f:
+                return json.load(f)
+        except (FileNotFoundError, json.JSONDecodeError):
+            return {}
+
+    def _guardar_reglas(self):
+        tmp = f"{self.ruta_reglas}.tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump({n: self._firma(r) for n, r in self.reglas.items()}, f, ensure_ascii=False)
+        os.replace(tmp, self.ruta_reglas)
+
+    def _reglas_sin_cubrir(self) -> list[str]:
+        """Reglas que el cursor no cubre: nuevas o cambiadas, sin manifiesto en disco o con archivos borrados."""
+        cubiertas = self._leer_reglas()
+        pendientes = []
+        for nombre, r in self.reglas.items():
+            if cubiertas.get(nombre) != self._firma(r) or not os.path.exists(os.path.join(r.destino, MANIFEST_NOMBRE)):
+                pendientes.append(nombre)
+                continue
+            for entrada in leer_manifest(r.destino).values():
+                if entrada.get("regla") == nombre and not os.path.isfile(os.path.join(r.destino, entrada.get("archivo", ""))):
+                    pendientes.append(nombre)
+                    break
+        return pendientes
+
+    def _sincronizar(self, nombres: list[str]) -> dict:
+        resumen = self.sync.sincronizar([self.reglas[n] for n in nombres])
+        if self.al_cambiar and (resumen["descargado"] or resumen["eliminado"]):
+            try:
+                self.al_cambiar(resumen)
+            except Exception as e:
+                logging.error(f"[SYNC] ❌ Error en el aviso de cambios: {e}")
+        return resumen
+
+    def arrancar(self) -> dict | None:
+        """
+        Con cursor guardado aplica los cambios pendientes y sincroniza completas
+        solo las reglas que el cursor no cubre; sin cursor hace la sincronización
+        completa. El cursor nuevo se pide antes del listado para no perder
+        cambios que ocurran mientras se descarga.
+        """
+        if self._leer_token():
+            for r in self.reglas.values():
+                self.sync.carpetas_vistas.setdefault(r.carpeta, set()).add(r.nombre)
+            self._aprender_subcarpetas()
+            resumen = self.revisar()
+            pendientes = self._reglas_sin_cubrir()
+            if not pendientes:
+                return resumen
+            logging.info(f"[SYNC] 🆕 Reglas sin sincronización completa: {pendientes}")
+            completas = self._sincronizar(pendientes)
+            if not completas["error"]:
+                self._guardar_reglas()
+            if resumen is None:
+                return completas
+            return {k: resumen[k] + completas[k] for k in resumen}
+
+        token = self.sync._servicio().changes().getStartPageToken().execute()["startPageToken"]
+        resumen = self._sincronizar(list(self.reglas))
+        if not resumen["error"]:                  # con errores se repite completa la próxima vez
+            self._guardar_token(token)
+            self._guardar_reglas()
+        return resumen
+
+    def _aprender_subcarpetas(self):
+        """Sin listado completo, las subcarpetas se piden una vez (una llamada por regla con subcarpetas)."""
+        for r in self.reglas.values():
+            if r.subcarpeta or r.por_subcarpeta:
+                try:
+                    self.sync._carpetas(r)
+                except Exception as e:
+                    logging.warning(f"[SYNC] ⚠️ {r.nombre}: no pude listar subcarpetas: {e}")
+
+    def _reglas_afectadas(self, cambios: list[dict]) -> set[str]:
+        por_archivo = {}
+        for r in self.reglas.values():
+            for file_id, entrada in leer_manifest(r.destino).items():
+                por_archivo[file_id] = entrada.get("regla")
+
+        afectadas = set()
+        for c in cambios:
+            file_id = c.get("fileId")
+            if file_id in self.sync.carpetas_vistas:            # se movió/borró una carpeta vigilada
+                afectadas |= self.sync.carpetas_vistas[file_id]
+            if file_id in por_archivo:                          # cambió o se borró algo ya descargado
+                afectadas.add(por_archivo[file_id])
+            for padre in (c.get("file") or {}).get("parents", []):
+                if padre in self.sync.carpetas_vistas:
+                    afectadas |= self.sync.carpetas_vistas[padre]
+        return {n for n in afectadas if n in self.reglas}
+
+    def revisar(self) -> dict | None:
+        """Una llamada a changes.list (más páginas si hubo muchos cambios). None si no hubo nada relevante."""
+        token = self._leer_token()
+        if token is None:
+            return self.arrancar()
+
+        from googleapiclient.errors import HttpError
+
+        servicio = self.sync._servicio()
+        cambios = []
+        while True:
+            try:
+                resp = servicio.changes().list(
+                    pageToken=token,
+                    pageSize=1000,
+                    includeRemoved=True,
+                    fields="nextPageToken, newStartPageToken, changes(fileId, removed, file(parents, trashed))",
+                ).execute()
+            except HttpError as e:
+                # cursor vencido o inválido: repetirlo fallaría siempre
+                logging.warning(f"[SYNC] ⚠️ Drive rechazó el cursor de cambios ({e}); sincronización completa")
+                self._descartar_token()
+                return self.arrancar()
+            cambios.extend(resp.get("changes", []))
+            if "newStartPageToken" in resp:
+                nuevo_token = resp["newStartPageToken"]
+                break
+            token = resp["nextPageToken"]
+
+        afectadas = self._reglas_afectadas(cambios)
+        resumen = None
+        if afectadas:
+            logging.info(f"[SYNC] 🔔 {len(cambios)} cambio(s) en Drive → {sorted(afectadas)}")
+            resumen = self._sincronizar(sorted(afectadas))
+        if resumen is None or not resumen["error"]:    # con errores se vuelve a intentar desde el mismo cursor
+            self._guardar_token(nuevo_token)
+        return resumen
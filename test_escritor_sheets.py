@@ -0,0 +1,134 @@
+"""
+Pruebas de escritor_sheets.py con hojas falsas en memoria: diario recuperado
+tras reiniciar, varios workers sobre el mismo diario y backoff por hoja.
+
+    python -m pytest -q test_escritor_sheets.py
+"""
+import re
+from types import SimpleNamespace
+
+import pytest
+
+from escritor_sheets import EscritorSheets
+
+
+class ErrorApi(Exception):
+    def __init__(self, codigo: int):
+        super().__init__(f"HTTP {codigo}")
+        self.response = SimpleNamespace(status_code=codigo)
+
+
+class HojaFalsa:
+    def __init__(self, filas=None):
+        self.filas: list[list] = [list(f) for f in filas or []]
+        self.fallar_con: int | None = None
+        self.llamadas = 0
+        self.al_escribir = None                         # se llama dentro de append_rows
+
+    def _llamada(self):
+        self.llamadas += 1
+        if self.fallar_con:
+            raise ErrorApi(self.fallar_con)
+
+    def col_values(self, col: int) -> list:
+        self._llamada()
+        return [f[col - 1] if len(f) >= col else "" for f in self.filas]
+
+    def append_rows(self, filas: list[list]):
+        self._llamada()
+        self.filas.extend(list(f) for f in filas)
+        if self.al_escribir:
+            self.al_escribir()
+
+    def batch_update(self, cambios: list[dict]):
+        self._llamada()
+        for c in cambios:
+            n = int(re.match(r"A(\d+):", c["range"]).group(1))
+            self.filas[n - 1] = list(c["values"][0])
+
+
+@pytest.fixture
+def libro(tmp_path):
+    hojas = {"PEDIDOS": HojaFalsa(), "LEADS": HojaFalsa([["tel", "nombre"], ["300", "Ana"]])}
+    diario = str(tmp_path / "sheets_pendientes.jsonl")
+    escritores = []
+
+    def nuevo_worker() -> EscritorSheets:
+        escritor = EscritorSheets(hojas.__getitem__, diario)
+        escritores.append(escritor)
+        return escritor
+
+    yield hojas, nuevo_worker
+    for escritor in escritores:
+        escritor.cerrar()
+
+
+def test_upserts_y_appends_en_un_lote(libro):
+    hojas, nuevo_worker = libro
+    escritor = nuevo_worker()
+    escritor.actualizar("LEADS", "300", ["300", "Ana María"])
+    escritor.actualizar("LEADS", "311", ["311", "Luis"])
+    escritor.agregar("PEDIDOS", ["p1"])
+
+    assert escritor.vaciar() == 3
+    assert hojas["LEADS"].filas == [["tel", "nombre"], ["300", "Ana María"], ["311", "Luis"]]
+    assert hojas["PEDIDOS"].filas == [["p1"]]
+    assert escritor.pendientes() == 0
+
+
+def test_diario_se_reenvia_una_vez_al_reiniciar(libro):
+    hojas, nuevo_worker = libro
+    antes = nuevo_worker()
+    antes.agregar("PEDIDOS", ["p1"])
+    antes.agregar("PEDIDOS", ["p2"])
+    antes.cerrar()                                      # el proceso muere sin vaciar
+
+    despues = nuevo_worker()
+    assert despues.pendientes() == 2
+    assert despues.vaciar() == 2
+    assert despues.vaciar() == 0
+    assert hojas["PEDIDOS"].filas == [["p1"], ["p2"]]
+
+
+def test_un_solo_worker_envia_y_no_borra_filas_de_otro(libro):
+    hojas, nuevo_worker = libro
+    a, b = nuevo_worker(), nuevo_worker()
+    a.agregar("PEDIDOS", ["de a"])
+    assert a.vaciar() == 1
+    b.agregar("PEDIDOS", ["de b"])
+    assert b.vaciar() == 0                              # a tiene el envío
+    assert a.estado()["emisor"] and not b.estado()["emisor"]
+
+    # b escribe mientras a está enviando su lote: la reescritura del diario no la pierde
+    hojas["PEDIDOS"].al_escribir = lambda: b.agregar("PEDIDOS", ["de b, durante el envío"])
+    assert a.vaciar() == 1
+    hojas["PEDIDOS"].al_escribir = None
+    assert b.pendientes() == 1
+
+    a.cerrar()                                          # a se apaga: b toma el envío
+    assert b.vaciar() == 1
+    assert hojas["PEDIDOS"].filas == [["de a"], ["de b"], ["de b, durante el envío"]]
+    assert a.pendientes() == 0
+
+
+def test_backoff_de_una_hoja_no_frena_las_demas(libro):
+    hojas, nuevo_worker = libro
+    escritor = nuevo_worker()
+    hojas["PEDIDOS"].fallar_con = 429
+    escritor.agregar("PEDIDOS", ["p1"])
+    escritor.actualizar("LEADS", "322", ["322", "Eva"])
+
+    assert escritor.vaciar() == 1
+    assert hojas["LEADS"].filas[-1] == ["322", "Eva"]
+    estado = escritor.estado()
+    assert estado["pendientes"] == {"PEDIDOS": 1} and estado["backoff_seg"]["PEDIDOS"] > 0
+
+    llamadas = hojas["PEDIDOS"].llamadas
+    escritor.actualizar("LEADS", "333", ["333", "Leo"])
+    assert escritor.vaciar() == 1                       # PEDIDOS sigue esperando, LEADS no
+    assert hojas["PEDIDOS"].llamadas == llamadas
+
+    hojas["PEDIDOS"].fallar_con = None
+    assert escritor.vaciar(forzar=True) == 1
+    assert hojas["PEDIDOS"].filas == [["p1"]]
+    assert escritor.estado() == {"pendientes": {}, "backoff_seg": {}, "emisor": True}
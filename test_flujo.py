@@ -0,0 +1,97 @@
+"""
+Pruebas de flujo.py: planes por fase, tablas de introspección y el despacho
+cuando un paso cambia la fase y deja seguir.
+
+    python -m pytest -q test_flujo.py
+"""
+import asyncio
+from types import SimpleNamespace
+
+import pytest
+
+from flujo import SIGUE, MaquinaFases
+
+
+@pytest.fixture
+def maquina():
+    """
+    Registro (en orden):  0 saludo*   1 elegir_modelo[inicio]   2 talla_temprana[talla]
+                          3 foto*     4 modelo[modelo → talla]  5 talla[talla]   6 reinicio*
+    """
+    estados = {}
+    m = MaquinaFases(fase_de=lambda t: t.est.get("fase", ""),
+                     fase_final_de=lambda t: estados.get(t.cid, {}).get("fase", ""))
+    vistos = []
+
+    def paso(nombre, responde=lambda t: False, cambia=None):
+        async def fn(turno):
+            vistos.append(nombre)
+            if cambia:
+                cambia(turno)
+            return nombre if responde(turno) else SIGUE
+        fn.__name__ = nombre
+        return fn
+
+    def a_talla(turno):
+        turno.est["fase"] = "talla"
+
+    def reiniciar(turno):
+        estados[turno.cid] = {"fase": "inicio"}               # como reset_estado: dict nuevo
+
+    m.interrupcion()(paso("saludo", lambda t: t.texto == "hola"))
+    m.fase("inicio", destinos=("modelo",))(paso("elegir_modelo", lambda t: t.texto == "modelo"))
+    m.fase("talla")(paso("talla_temprana", lambda t: True))
+    m.interrupcion()(paso("foto"))
+    m.fase("modelo", destinos=("talla",))(paso("modelo", cambia=a_talla))
+    m.fase("talla")(paso("talla", lambda t: t.texto == "42"))
+    m.interrupcion(destinos=("inicio",))(paso("reinicio", lambda t: True, cambia=reiniciar))
+
+    def turno(fase, texto):
+        est = {"fase": fase}
+        estados[1] = est
+        return SimpleNamespace(cid=1, est=est, texto=texto)
+
+    return m, turno, vistos
+
+
+def test_plan_y_tabla_respetan_el_orden_de_registro(maquina):
+    m, _, _ = maquina
+    assert m.plan("talla") == (0, 2, 3, 5, 6)
+    assert m.plan("desconocida") == (0, 3, 6)
+    assert m.interrupciones() == ["saludo", "foto", "reinicio"]
+    assert m.tabla() == {
+        "inicio": ["saludo", "elegir_modelo", "foto", "reinicio"],
+        "modelo": ["saludo", "foto", "modelo", "reinicio"],
+        "talla": ["saludo", "talla_temprana", "foto", "talla", "reinicio"],
+    }
+    assert m.transiciones() == {"*": ["inicio"], "inicio": ["modelo"], "modelo": ["talla"], "talla": []}
+
+
+def test_plan_se_recalcula_al_registrar_otro_paso(maquina):
+    m, _, _ = maquina
+    assert m.plan("inicio") == (0, 1, 3, 6)
+
+    @m.fase("inicio")
+    async def tarde(turno):
+        return SIGUE
+
+    assert m.plan("inicio") == (0, 1, 3, 6, 7)
+
+
+def test_cambio_de_fase_sigue_desde_el_mismo_punto(maquina):
+    m, turno, vistos = maquina
+    t = turno("modelo", "42")
+
+    assert asyncio.run(m.despachar(t)) == "talla"
+    # talla_temprana (índice 2) quedó antes de `modelo` (4): no se revisa
+    assert vistos == ["saludo", "foto", "modelo", "talla"]
+    assert m.estado()["cambios_de_fase"] == {"modelo → talla": 1}
+
+
+def test_estado_cuenta_el_reinicio_aunque_el_paso_reemplace_el_estado(maquina):
+    m, turno, vistos = maquina
+    t = turno("modelo", "otra cosa")                    # modelo pasa a talla; talla no responde; reinicio sí
+
+    assert asyncio.run(m.despachar(t)) == "reinicio"
+    assert t.est["fase"] == "talla"                     # el dict del turno quedó viejo
+    assert m.estado() == {"respuestas": {"modelo → reinicio": 1}, "cambios_de_fase": {"modelo → inicio": 1}}
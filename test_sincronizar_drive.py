@@ -0,0 +1,245 @@
+"""
+Pruebas de sincronizar_drive.py contra un Drive falso en memoria
+(files().list / files().get_media y changes().list), sin red.
+
+    python -m pytest -q test_sincronizar_drive.py
+"""
+import os
+import re
+import shutil
+import hashlib
+from types import SimpleNamespace
+
+import pytest
+from googleapiclient.errors import HttpError
+
+from sincronizar_drive import (CARPETA_MIME, ReglaSync, SincronizadorDrive, VigilanteCambiosDrive,
+                               leer_manifest)
+
+
+# ─── Drive falso ──────────────────────────────────────────────────────
+class _Ejecutable:
+    def __init__(self, resultado):
+        self._resultado = resultado
+
+    def execute(self):
+        return self._resultado
+
+
+class _RespuestaHttp(dict):
+    def __init__(self, status: int, headers: dict, reason: str = ""):
+        super().__init__(headers)
+        self.status = status
+        self.reason = reason
+
+
+class _HttpFalso:
+    """Sirve los bytes de un archivo respetando el header Range (lo usa MediaIoBaseDownload)."""
+
+    def __init__(self, drive: "DriveFalso", file_id: str):
+        self.drive = drive
+        self.file_id = file_id
+
+    def request(self, uri, method="GET", headers=None, **_):
+        contenido = self.drive.contenidos[self.file_id]
+        inicio, fin = map(int, re.match(r"bytes=(\d+)-(\d+)", headers["range"]).groups())
+        trozo = contenido[inicio:fin + 1]
+        rango = f"bytes {inicio}-{inicio + len(trozo) - 1}/{len(contenido)}"
+        return _RespuestaHttp(206, {"content-range": rango}), trozo
+
+
+class DriveFalso:
+    def __init__(self):
+        self.archivos: dict[str, dict] = {}       # id → {id, name, mimeType, parents, size, md5Checksum, modifiedTime}
+        self.contenidos: dict[str, bytes] = {}
+        self.cambios: list[dict] = []
+        self.descargas: list[str] = []
+
+    # Armado del escenario
+    def carpeta(self, file_id: str, nombre: str, padre: str | None = None) -> str:
+        self.archivos[file_id] = {"id": file_id, "name": nombre, "mimeType": CARPETA_MIME,
+                                  "parents": [padre] if padre else []}
+        return file_id
+
+    def archivo(self, file_id: str, nombre: str, padre: str, mime: str, contenido: bytes):
+        self.archivos[file_id] = {"id": file_id, "name": nombre, "mimeType": mime, "parents": [padre],
+                                  "size": str(len(contenido)), "md5Checksum": hashlib.md5(contenido).hexdigest(),
+                                  "modifiedTime": "2024-01-01T00:00:00Z"}
+        self.contenidos[file_id] = contenido
+        self.cambios.append({"fileId": file_id, "removed": False, "file": {"parents": [padre]}})
+
+    def borrar(self, file_id: str):
+        padres = self.archivos.pop(file_id)["parents"]
+        self.contenidos.pop(file_id, None)
+        self.cambios.append({"fileId": file_id, "removed": True, "file": {"parents": padres}})
+
+    # API usada por sincronizar_drive
+    def files(self):
+        return self
+
+    def changes(self):
+        return _CambiosFalsos(self)
+
+    def list(self, q, fields=None, pageSize=1000, pageToken=None):
+        padre = re.search(r"'([^']+)' in parents", q).group(1)
+        encontrados = []
+        for a in self.archivos.values():
+            if padre not in a["parents"] or not self._cumple(a, q):
+                continue
+            encontrados.append({k: v for k, v in a.items() if k not in ("parents", "mimeType")})
+        return _Ejecutable({"files": encontrados[:pageSize]})
+
+    @staticmethod
+    def _cumple(a: dict, q: str) -> bool:
+        for valor in re.findall(r"mimeType\s*=\s*'([^']+)'", q):
+            if a["mimeType"] != valor:
+                return False
+        if "mimeType" not in q and a["mimeType"] == CARPETA_MIME:
+            return False
+        for valor in re.findall(r"mimeType contains '([^']+)'", q):
+            if valor not in a["mimeType"]:
+                return False
+        for valor in re.findall(r"name\s*=\s*'([^']+)'", q):
+            if a["name"] != valor:
+                return False
+        return True
+
+    def get_media(self, fileId):
+        self.descargas.append(fileId)
+        return SimpleNamespace(uri=f"https://drive.falso/{fileId}", headers={}, http=_HttpFalso(self, fileId))
+
+
+class _CambiosFalsos:
+    def __init__(self, drive: DriveFalso):
+        self.drive = drive
+
+    def getStartPageToken(self):
+        return _Ejecutable({"startPageToken": str(len(self.drive.cambios))})
+
+    def list(self, pageToken, **_):
+        if not pageToken.isdigit() or int(pageToken) > len(self.drive.cambios):
+            raise HttpError(_RespuestaHttp(404, {}, "Not Found"), b'{"error": {"message": "Invalid pageToken"}}')
+        desde = int(pageToken)
+        return _Ejecutable({"changes": self.drive.cambios[desde:], "newStartPageToken": str(len(self.drive.cambios))})
+
+
+# ─── Escenario: reglas que comparten directorio y carpeta ─────────────
+@pytest.fixture
+def escenario(tmp_path):
+    drive = DriveFalso()
+    videos, confianza, extra = drive.carpeta("c_videos", "VIDEOS"), drive.carpeta("c_conf", "CONFIANZA"), drive.carpeta("c_extra", "EXTRA")
+    drive.archivo("v1", "modelo_305.mp4", videos, "video/mp4", b"video-305" * 50)
+    drive.archivo("vc", "confianza_final.mp4", confianza, "video/mp4", b"confianza" * 50)
+    drive.archivo("len", "lengueta_ejemplo.jpg", extra, "image/jpeg", b"lengueta" * 20)
+    drive.archivo("mp", "metodosdepago.jpeg", extra, "image/jpeg", b"pagos" * 20)
+
+    dir_videos, dir_extra = str(tmp_path / "videos"), str(tmp_path / "extra")
+    reglas = [
+        ReglaSync("videos", videos, dir_videos, "mimeType='video/mp4'"),
+        ReglaSync("video_confianza", confianza, dir_videos, "mimeType='video/mp4'",
+                  nombrar=lambda a, s: "video_confianza.mp4", max_por_carpeta=1),
+        ReglaSync("lengueta", extra, dir_extra, "name = 'lengueta_ejemplo.jpg'", max_por_carpeta=1),
+        ReglaSync("metodos_pago", extra, dir_extra, "name = 'metodosdepago.jpeg'", max_por_carpeta=1),
+    ]
+    sync = SincronizadorDrive(lambda: drive, hilos=2)
+    vigilante = VigilanteCambiosDrive(sync, reglas, ruta_token=str(tmp_path / "token"))
+    return drive, sync, vigilante, reglas, dir_videos, dir_extra
+
+
+def test_sincronizacion_completa_descarga_todo(escenario):
+    drive, sync, vigilante, reglas, dir_videos, dir_extra = escenario
+    resumen = vigilante.arrancar()
+
+    assert resumen["descargado"] == 4 and resumen["error"] == 0
+    assert sorted(os.listdir(dir_videos)) == [".drive_manifest.json", "modelo_305.mp4", "video_confianza.mp4"]
+    with open(os.path.join(dir_extra, "lengueta_ejemplo.jpg"), "rb") as f:
+        assert f.read() == drive.contenidos["len"]
+
+    drive.descargas.clear()
+    assert sync.sincronizar(reglas)["omitido"] == 4
+    assert drive.descargas == []
+
+
+def test_sincronizacion_parcial_no_borra_archivos_de_otras_reglas(escenario):
+    drive, sync, vigilante, reglas, dir_videos, dir_extra = escenario
+    vigilante.arrancar()
+    por_nombre = {r.nombre: r for r in reglas}
+
+    sync.sincronizar([por_nombre["videos"]])
+    sync.sincronizar([por_nombre["metodos_pago"]])
+
+    assert os.path.exists(os.path.join(dir_videos, "video_confianza.mp4"))
+    assert os.path.exists(os.path.join(dir_extra, "lengueta_ejemplo.jpg"))
+    assert {e["regla"] for e in leer_manifest(dir_videos).values()} == {"videos", "video_confianza"}
+    assert {e["regla"] for e in leer_manifest(dir_extra).values()} == {"lengueta", "metodos_pago"}
+
+
+def test_sincronizacion_parcial_borra_lo_que_ya_no_esta_en_drive(escenario):
+    drive, sync, vigilante, reglas, dir_videos, dir_extra = escenario
+    vigilante.arrancar()
+
+    drive.borrar("v1")
+    resumen = sync.sincronizar([r for r in reglas if r.nombre == "videos"])
+
+    assert resumen["eliminado"] == 1
+    assert sorted(os.listdir(dir_videos)) == [".drive_manifest.json", "video_confianza.mp4"]
+
+
+def test_cambio_en_carpeta_compartida_resincroniza_todas_sus_reglas(escenario):
+    drive, sync, vigilante, reglas, dir_videos, dir_extra = escenario
+    vigilante.arrancar()
+
+    drive.borrar("len")
+    drive.archivo("len2", "lengueta_ejemplo.jpg", "c_extra", "image/jpeg", b"lengueta nueva")
+    # el archivo nuevo solo se reconoce por su carpeta, que es de las dos reglas
+    assert vigilante._reglas_afectadas(drive.cambios[-1:]) == {"lengueta", "metodos_pago"}
+
+    resumen = vigilante.revisar()
+    assert resumen["error"] == 0
+    with open(os.path.join(dir_extra, "lengueta_ejemplo.jpg"), "rb") as f:
+        assert f.read() == b"lengueta nueva"
+    assert os.path.exists(os.path.join(dir_extra, "metodosdepago.jpeg"))
+    assert vigilante.revisar() is None                  # el cursor avanzó: no hay cambios pendientes
+
+
+def test_regla_nueva_con_cursor_guardado_se_sincroniza_completa(escenario):
+    drive, sync, vigilante, reglas, dir_videos, dir_extra = escenario
+    sin_pagos = [r for r in reglas if r.nombre != "metodos_pago"]
+    VigilanteCambiosDrive(sync, sin_pagos, ruta_token=vigilante.ruta_token).arrancar()
+    assert not os.path.exists(os.path.join(dir_extra, "metodosdepago.jpeg"))
+
+    # se configura la carpeta de la regla después del primer despliegue: el cursor no la cubre
+    drive.descargas.clear()
+    resumen = vigilante.arrancar()
+    assert drive.descargas == ["mp"] and resumen["error"] == 0
+    assert os.path.exists(os.path.join(dir_extra, "metodosdepago.jpeg"))
+
+    drive.descargas.clear()
+    assert vigilante.arrancar() is None and drive.descargas == []
+
+
+def test_directorio_borrado_con_cursor_guardado_se_vuelve_a_bajar(escenario):
+    drive, sync, vigilante, reglas, dir_videos, dir_extra = escenario
+    vigilante.arrancar()
+
+    shutil.rmtree(dir_videos)
+    os.remove(os.path.join(dir_extra, "lengueta_ejemplo.jpg"))
+    drive.descargas.clear()
+    vigilante.arrancar()
+
+    assert sorted(drive.descargas) == ["len", "v1", "vc"]
+    assert sorted(os.listdir(dir_videos)) == [".drive_manifest.json", "modelo_305.mp4", "video_confianza.mp4"]
+    assert os.path.exists(os.path.join(dir_extra, "lengueta_ejemplo.jpg"))
+
+
+def test_cursor_rechazado_se_descarta_y_sincroniza_todo(escenario):
+    drive, sync, vigilante, reglas, dir_videos, dir_extra = escenario
+    vigilante.arrancar()
+    shutil.rmtree(dir_extra)
+    vigilante._guardar_token("vencido")
+
+    resumen = vigilante.revisar()
+    assert resumen["error"] == 0
+    assert os.path.exists(os.path.join(dir_extra, "metodosdepago.jpeg"))
+    assert vigilante._leer_token() == str(len(drive.cambios))
+    assert vigilante.revisar() is None